@@ -3,8 +3,9 @@ from sqlalchemy.orm import Session
 from typing import Optional
 import os
 
-from app.db.session import SessionLocal
+from app.db.session import SessionLocal, SessionLectura
 from app.db.models import Device, Mecanismos, Config
+from app.servicios.registro import registro
 
 # ---- Sesión
 def get_db():
@@ -14,6 +15,14 @@ def get_db():
     finally:
         db.close()
 
+# ---- Sesión de sólo lectura (pool aparte: no espera a la ingesta)
+def get_db_lectura():
+    db = SessionLectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # ---- Resolver esp_id centralizado
 def resolve_esp_id(
     db: Session = Depends(get_db),
@@ -26,7 +35,7 @@ def resolve_esp_id(
     if env_uid:
         return env_uid
 
-    count = db.query(Device).count()
+    count, unico = registro.esp_id_por_defecto(db)
 
     if count == 0:
         d = Device(esp_id="default-esp")
@@ -34,10 +43,11 @@ def resolve_esp_id(
         db.add(Mecanismos(device_id=d.id))
         db.add(Config(device_id=d.id))
         db.commit()
+        registro.invalidar(d.esp_id)
         return d.esp_id
 
     if count == 1:
-        return db.query(Device).first().esp_id
+        return unico
 
     raise HTTPException(
         status_code=422,
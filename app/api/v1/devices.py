@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_db
+from app.api.deps import get_db, get_db_lectura
 from app.schemas.device import DeviceIn, DeviceOut, DeviceUpdate
 from app.servicios.devices import (
     create_device, list_devices, get_device_by_esp_id, update_device, delete_device
@@ -20,11 +20,11 @@ def add_device(payload: DeviceIn, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"No se pudo crear el dispositivo: {e}")
 
 @router.get("", response_model=list[DeviceOut])
-def get_devices(db: Session = Depends(get_db)):
+def get_devices(db: Session = Depends(get_db_lectura)):
     return list_devices(db)
 
 @router.get("/{esp_id}", response_model=DeviceOut)
-def get_device(esp_id: str, db: Session = Depends(get_db)):
+def get_device(esp_id: str, db: Session = Depends(get_db_lectura)):
     d = get_device_by_esp_id(db, esp_id)
     if not d:
         raise HTTPException(status_code=404, detail="Dispositivo no encontrado")
@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.api.deps import get_db_lectura
+from app.schemas.eventos import EventoOut, EventosPagina, EventosResumen
+from app.schemas.fechas import a_utc
+from app.servicios.eventos import TIPOS, contar_eventos, listar_eventos
+from app.servicios.registro import registro
+
+router = APIRouter(prefix="/eventos", tags=["eventos"])
+
+
+def _device_id(db: Session, esp_id: Optional[str]) -> Optional[int]:
+    if not esp_id:
+        return None
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
+        raise HTTPException(status_code=404, detail="Dispositivo no encontrado")
+    return entrada.device_id
+
+
+@router.get("", response_model=EventosPagina)
+def get_eventos(
+    esp_id: Optional[str] = Query(None, description="Sin esp_id: todos los devices"),
+    tipo: Optional[str] = Query(None, description="Uno de: " + ", ".join(TIPOS)),
+    subtipo: Optional[str] = Query(None, description="p. ej. riego, luz, online, tanque_seco"),
+    desde: Optional[datetime] = Query(None, description="Inicio (ISO 8601, inclusive; sin zona = UTC)"),
+    hasta: Optional[datetime] = Query(None, description="Fin (ISO 8601, exclusivo; sin zona = UTC)"),
+    antes_de: Optional[int] = Query(None, ge=1, description="Cursor: sólo eventos con id < antes_de"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db_lectura),
+):
+    """
+    Diario de eventos (desc), paginado por cursor: la respuesta trae en
+    `siguiente` el valor de `antes_de` para la página siguiente. Cada página
+    es una consulta por rango de id, sin OFFSET.
+    """
+    filas = listar_eventos(db, _device_id(db, esp_id), tipo, subtipo, a_utc(desde), a_utc(hasta), antes_de, limit)
+    eventos = [
+        EventoOut(id=ev.id, esp_id=e, fecha_hora=ev.fecha_hora, tipo=ev.tipo, subtipo=ev.subtipo,
+                  detalle=ev.detalle, mensaje=ev.mensaje)
+        for ev, e in filas
+    ]
+    return EventosPagina(eventos=eventos, siguiente=eventos[-1].id if len(eventos) == limit else None)
+
+
+@router.get("/resumen", response_model=EventosResumen)
+def get_resumen(
+    esp_id: Optional[str] = Query(None, description="Sin esp_id: todos los devices"),
+    desde: Optional[datetime] = Query(None, description="ISO 8601; sin zona = UTC"),
+    hasta: Optional[datetime] = Query(None, description="ISO 8601; sin zona = UTC"),
+    db: Session = Depends(get_db_lectura),
+):
+    """Cantidad de eventos por tipo y subtipo (p. ej. cuántas veces se prendió la bomba)."""
+    por_tipo = contar_eventos(db, _device_id(db, esp_id), a_utc(desde), a_utc(hasta))
+    return EventosResumen(total=sum(n for subs in por_tipo.values() for n in subs.values()), por_tipo=por_tipo)
@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from app.api.deps import get_db_lectura
+from app.schemas.fleet import FlotaOut, PresenciaOut
+from app.servicios.flota import estado_flota, presencia_flota
+
+router = APIRouter(prefix="/fleet", tags=["fleet"])
+
+
+@router.get("/status", response_model=FlotaOut)
+def fleet_status(db: Session = Depends(get_db_lectura)):
+    """
+    Estado de todos los devices en una respuesta: presencia, última lectura,
+    actuadores, config y último contacto. Reemplaza las tres consultas por esp_id del
+    tablero (ultima, mecanismos, config); no lee la tabla de lecturas.
+    """
+    return {"generado": datetime.now(timezone.utc), "dispositivos": estado_flota(db)}
+
+
+@router.get("/presencia", response_model=list[PresenciaOut])
+def fleet_presencia(db: Session = Depends(get_db_lectura)):
+    """
+    Online / stale / offline de cada device, con el último contacto y desde
+    cuándo está en ese estado. Las transiciones quedan en /eventos (tipo "status").
+    """
+    return presencia_flota(db)
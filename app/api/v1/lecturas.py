@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Query, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional
 from fastapi.responses import StreamingResponse
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from tempfile import SpooledTemporaryFile
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_db, resolve_esp_id
-from app.schemas.lecturas import LecturaIn, LecturaOut
+from app.api.deps import get_db, get_db_lectura, resolve_esp_id
+from app.schemas.fechas import a_utc
+from app.schemas.lecturas import LecturaIn, LecturaOut, SerieOut, ImportacionOut
 from app.servicios.funciones import (
-    agregar_lectura, ultima_lectura, ultimas_lecturas_7d, csv_from_range
+    agregar_lectura, ultima_lectura, lecturas_desde, rango_ids_lectura, csv_stream, gzip_stream
+)
+from app.servicios.registro import registro
+from app.servicios.rollups import RESOLUCIONES, serie_lecturas
+from app.servicios.transferencia import (
+    FORMATOS, FormatoNoDisponible, exportar_lecturas, importar_lecturas, validar_formato
 )
 
 router = APIRouter(prefix="/lecturas", tags=["lecturas"])
@@ -21,34 +29,150 @@ def post_lectura(payload: LecturaIn, db: Session = Depends(get_db)) -> LecturaOu
         raise HTTPException(status_code=500, detail=f"Error al guardar Lectura: {e}")
 
 @router.get("/ultima", response_model=LecturaOut | None)
-def get_ultima(esp_id: str = Depends(resolve_esp_id), db: Session = Depends(get_db)):
+def get_ultima(esp_id: str = Depends(resolve_esp_id), db: Session = Depends(get_db_lectura)):
     """Última lectura registrada para esp_id."""
     return ultima_lectura(db, esp_id)
 
 @router.get("", response_model=List[LecturaOut])
-def get_ultimas(esp_id: str = Depends(resolve_esp_id), db: Session = Depends(get_db)) -> List[LecturaOut]:
-    """Lecturas de los últimos 7 días (desc) para esp_id."""
-    return ultimas_lecturas_7d(db, esp_id)
+def get_ultimas(
+    request: Request,
+    response: Response,
+    esp_id: str = Depends(resolve_esp_id),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Máximo de filas (con since_id, las siguientes al cursor; si no, las más recientes)"),
+    since_id: Optional[int] = Query(None, ge=0, description="Sólo lecturas con id > since_id"),
+    since_ts: Optional[datetime] = Query(None, description="Sólo lecturas posteriores a esta fecha (ISO 8601; sin zona = UTC)"),
+    db: Session = Depends(get_db_lectura),
+):
+    """
+    Lecturas (desc) para esp_id. Sin cursor: últimos 7 días.
+    Con `since_id`/`since_ts` devuelve sólo lo nuevo; responde 304 si el
+    `If-None-Match` coincide con el ETag (no hay lecturas nuevas). Con
+    `since_id` van asc por id y `limit` pagina: se repite desde el último id
+    hasta recibir menos de `limit`.
+    """
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
+        return []
+
+    # con la más vieja: la retención (o un borrado) cambia la respuesta sin lecturas nuevas
+    primero, ultimo = rango_ids_lectura(db, entrada.device_id)
+    cursor = since_id if since_id is not None else (since_ts.isoformat() if since_ts else "7d")
+    etag = f'W/"{entrada.device_id}-{primero}-{ultimo}-{cursor}-{limit or 0}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    if since_id is not None and since_id >= ultimo:
+        return []
+    return lecturas_desde(db, entrada.device_id, since_id=since_id, since_ts=since_ts, limit=limit)
+
+@router.get("/series", response_model=SerieOut)
+def get_series(
+    esp_id: str = Depends(resolve_esp_id),
+    desde: Optional[datetime] = Query(None, description="Inicio (ISO 8601; sin zona = UTC). Por defecto: hasta - 24 h"),
+    hasta: Optional[datetime] = Query(None, description="Fin (ISO 8601; sin zona = UTC). Por defecto: ahora"),
+    resolution: str = Query("auto", description="auto | raw | " + " | ".join(RESOLUCIONES)),
+    width: int = Query(360, ge=10, le=10000, description="Ancho en píxeles del gráfico"),
+    db: Session = Depends(get_db_lectura),
+):
+    """
+    Serie submuestreada para graficar: con `resolution=auto` usa la resolución
+    más gruesa (1d/1h/1m) que todavía llena `width` puntos, si no, lecturas crudas.
+    Las crudas tienen tope (`SERIE_MAX_CRUDAS`): con más, `auto` usa 1m y
+    `raw` responde 400.
+    """
+    if resolution != "auto" and resolution != "raw" and resolution not in RESOLUCIONES:
+        raise HTTPException(status_code=400, detail=f"Resolución inválida: {resolution}")
+    hasta = hasta or datetime.now(timezone.utc)
+    desde = desde or hasta - timedelta(hours=24)
+    desde, hasta = a_utc(desde), a_utc(hasta)
+    if desde >= hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'.")
+
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
+        return SerieOut(resolucion=resolution, desde=desde, hasta=hasta, puntos=[])
+    try:
+        res, puntos = serie_lecturas(db, entrada.device_id, desde, hasta, resolution, width)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SerieOut(resolucion=res, desde=desde, hasta=hasta, puntos=puntos)
 
 @router.get("/csv")
 def get_csv(
-    desde: str = Query(..., description="YYYY-MM-DD"),
-    hasta: str = Query(..., description="YYYY-MM-DD"),
+    desde: str = Query(..., description="YYYY-MM-DD (día local)"),
+    hasta: str = Query(..., description="YYYY-MM-DD (día local)"),
     esp_id: str = Query(..., description="ID del dispositivo"),
-    db: Session = Depends(get_db),
+    gzip: bool = Query(False, description="Comprimir la respuesta con gzip al vuelo"),
 ):
-    """Genera CSV de lecturas para esp_id entre fechas [desde, hasta] (hora local)."""
+    """
+    Genera CSV de lecturas para esp_id entre fechas [desde, hasta] (hora local).
+    Se envía en streaming a medida que se lee la DB, sin armarlo en memoria.
+    """
     try:
-        csv_text = csv_from_range(db, esp_id, desde, hasta)
-
-        filename = f"{esp_id}_{desde}_a_{hasta}.csv"
-        return StreamingResponse(
-            iter([csv_text]),
-            media_type="text/csv",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-        )
+        trozos = csv_stream(esp_id, desde, hasta)
     except ValueError as e:
         # fechas inválidas, rango al revés, etc → 400
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"No se pudo generar el CSV: {e}")
\ No newline at end of file
+
+    filename = f"{esp_id}_{desde}_a_{hasta}.csv"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        # con Content-Encoding propio el GZipMiddleware no la vuelve a comprimir
+        headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(gzip_stream(trozos), media_type="text/csv", headers=headers)
+    return StreamingResponse(trozos, media_type="text/csv", headers=headers)
+
+@router.get("/export")
+def get_export(
+    desde: str = Query(..., description="YYYY-MM-DD (día local)"),
+    hasta: str = Query(..., description="YYYY-MM-DD (día local)"),
+    esp_id: str = Query(..., description="ID del dispositivo"),
+    format: str = Query("parquet", description=" | ".join(FORMATOS)),
+):
+    """
+    Exporta lecturas de esp_id entre fechas [desde, hasta] (hora local) con
+    columnas tipadas: métricas float64 y `fecha_hora` en UTC. Se envía en
+    streaming de a record batches.
+    """
+    try:
+        trozos = exportar_lecturas(esp_id, desde, hasta, format)
+    except FormatoNoDisponible as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    media_type, ext = FORMATOS[format]
+    headers = {"Content-Disposition": f'attachment; filename="{esp_id}_{desde}_a_{hasta}.{ext}"'}
+    if format == "parquet":
+        headers["Content-Encoding"] = "identity"  # ya viene comprimido, que no lo toque GZip
+    return StreamingResponse(trozos, media_type=media_type, headers=headers)
+
+@router.post("/import", response_model=ImportacionOut, status_code=201)
+async def post_import(
+    request: Request,
+    esp_id: str = Query(..., description="ID del dispositivo"),
+    format: str = Query("ndjson", description=" | ".join(FORMATOS)),
+):
+    """
+    Carga lecturas históricas (mismo formato que /export) para esp_id.
+    El cuerpo se recibe en streaming a un archivo temporal (en memoria hasta
+    8 MB, después a disco) y se inserta de a lotes.
+    """
+    try:
+        validar_formato(format)
+    except FormatoNoDisponible as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+        async for trozo in request.stream():
+            f.write(trozo)
+        f.seek(0)
+        try:
+            return await run_in_threadpool(importar_lecturas, f, esp_id, format)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
@@ -1,25 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional
 import asyncio
+import logging
 
 from app.api.deps import get_db, resolve_esp_id
+from app.core.config import config
+from app.db.session import SessionLocal
 from app.schemas.mecanismos import MecanismosIn, MecanismosOut
-from app.db.models import Mecanismos, Device
 from app.servicios.funciones import set_mecanismo
+from app.servicios.mqtt_funciones import enviar_cmd
+from app.servicios.registro import registro, EstadoMecanismos
 
 router = APIRouter(prefix="/mecanismos", tags=["mecanismos"])
+log = logging.getLogger("mecanismos")
 
-def _get_status_pure_db(db: Session, esp_id: str) -> Mecanismos:
-    device = db.query(Device).filter(Device.esp_id == esp_id).first()
-    if not device:
+def _get_status_pure_db(db: Session, esp_id: str) -> EstadoMecanismos:
+    # El registro se mantiene al día con la sincronización de la telemetría.
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
          raise HTTPException(status_code=404, detail=f"Device con esp_id {esp_id} no encontrado")
 
-    mech = db.query(Mecanismos).filter(Mecanismos.device_id == device.id).first()
-    
+    mech = entrada.mecanismos
     if not mech:
-         raise HTTPException(status_code=404, detail=f"Mecanismos no encontrados para el device_id {device.id}")
-    
+         raise HTTPException(status_code=404, detail=f"Mecanismos no encontrados para el device_id {entrada.device_id}")
+
     return mech
 
 @router.get("", response_model=MecanismosOut)
@@ -27,27 +33,59 @@ def get_stat(esp_id: str = Depends(resolve_esp_id), db: Session = Depends(get_db
     """Obtiene el estado actual de los mecanismos (leído desde la DB)."""
     return _get_status_pure_db(db, esp_id)
 
+def _enviar_cambios(cambios: dict) -> tuple[str, list]:
+    """Resuelve el esp_id y publica los SET (en un worker, con su propia sesión)."""
+    with SessionLocal() as db:
+        esp_id = resolve_esp_id(db=db, esp_id=cambios.pop("esp_id", None))
+        mech = set_mecanismo(db, esp_id, **cambios)
+        db.commit()
+    if mech._warning:
+        raise HTTPException(status_code=503, detail="ESP32 no disponible (MQTT no pudo publicar el comando)")
+    if mech._comandos:
+        # pide telemetría ya: confirma los SET aunque el firmware no mande ack
+        enviar_cmd({"cmd": "STATUS"}, esp_id=esp_id)
+    return esp_id, mech._comandos
+
+
+def _estado_actual(esp_id: str) -> EstadoMecanismos:
+    with SessionLocal() as db:
+        return _get_status_pure_db(db, esp_id)
+
+
 @router.put("", response_model=MecanismosOut)
-async def put_mech(payload: MecanismosIn, db: Session = Depends(get_db)): 
+async def put_mech(payload: MecanismosIn, response: Response):
     """
     Establece el estado de uno o más mecanismos.
-    Envía comandos SET por MQTT y persiste el estado en la DB.
+    Envía comandos SET por MQTT y espera (hasta COMANDO_TIMEOUT_S) a que el
+    ESP32 los confirme, por ack o por telemetría con el nuevo estado. El
+    listener es quien persiste el estado; si no llega a tiempo se devuelve el
+    último conocido. El header X-Comandos-Confirmados dice cuántos se confirmaron.
+
+    Sin broker los comandos quedan en la bandeja de salida y se responde 202
+    en el momento, con el último estado conocido (se envían al reconectar).
     """
     cambios = payload.model_dump(exclude_none=True)
-    
-    esp_id = resolve_esp_id(db=db, esp_id=cambios.pop("esp_id", None))
-
-    mech_intermedio = set_mecanismo(db, esp_id, **cambios)
 
-    if getattr(mech_intermedio, "_serial_ok", True) is False:
-        raise HTTPException(status_code=503, detail="ESP32 no disponible (serial/MQTT no disponible)")
+    # La DB y el publish son sincrónicos: van al threadpool para no frenar el event loop.
+    esp_id, pendientes = await run_in_threadpool(_enviar_cambios, cambios)
 
-    db.commit()
+    diferidos = sum(p.diferido for p in pendientes)
+    if diferidos:
+        # sin broker no hay confirmación que esperar
+        response.status_code = 202
+        response.headers["X-Comandos-Diferidos"] = f"{diferidos}/{len(pendientes)}"
+        return await run_in_threadpool(_estado_actual, esp_id)
 
-    await asyncio.sleep(1.0) 
-    
-    db.expire_all()
-    
-    mech_final = _get_status_pure_db(db, esp_id) 
+    confirmados = 0
+    if pendientes:
+        # asyncio.wait no cancela lo que queda pendiente: el rastreador lo resuelve o lo vence
+        hechos, _ = await asyncio.wait(
+            [asyncio.wrap_future(p.futuro) for p in pendientes], timeout=config.comando_timeout_s
+        )
+        confirmados = sum(f.result() in ("ack", "telemetria") for f in hechos if not f.cancelled())
+        if len(hechos) < len(pendientes):
+            log.warning("PUT /mecanismos %s: %d/%d comandos confirmados en %.1f s.",
+                        esp_id, confirmados, len(pendientes), config.comando_timeout_s)
+    response.headers["X-Comandos-Confirmados"] = f"{confirmados}/{len(pendientes)}"
 
-    return mech_final
+    return await run_in_threadpool(_estado_actual, esp_id)
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from app.servicios.stream import hub
+
+router = APIRouter(prefix="/stream", tags=["stream"])
+
+KEEPALIVE_S = 15  # comentario SSE para que proxies y navegador no corten la conexión
+
+
+@router.get("")
+async def stream(request: Request, esp_id: Optional[str] = Query(None, description="Sin esp_id: todos los devices")):
+    """
+    Server-Sent Events con las lecturas (`event: lectura`) y los cambios de
+    mecanismos (`event: mecanismos`) a medida que el listener MQTT los persiste.
+    """
+    sus = hub.suscribir(esp_id)
+
+    async def eventos():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                pendientes = await sus.siguiente(timeout=KEEPALIVE_S)
+                if not pendientes:
+                    yield ": ping\n\n"
+                    continue
+                yield "".join(f"event: {tipo}\ndata: {data}\n\n" for tipo, data in pendientes)
+        finally:
+            hub.desuscribir(sus)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            # evita que GZipMiddleware bufferice el stream
+            "Content-Encoding": "identity",
+        },
+    )
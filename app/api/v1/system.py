@@ -1,13 +1,48 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status, BackgroundTasks
 from app.api.deps import resolve_esp_id
-from app.servicios.mqtt_funciones import enviar_cmd_mqtt
+from app.servicios.mqtt_funciones import enviar_cmd, cola_comandos, bandeja
+from app.servicios.ingesta import get_ingesta
+from app.servicios.registro import registro
+from app.servicios.stream import hub
+from app.servicios.retencion import motor_retencion
+from app.servicios.cooldown import cooldowns
+from app.servicios.control_vectorizado import motor_control
+from app.servicios.comandos import rastreador
+from app.servicios.coordinacion import coordinador
+from app.servicios.checkpoint import checkpoint_wal
+from app.servicios.analitica import analitica
+from app.servicios.eventos import diario, ACTUADORES
+from app.servicios.presencia import presencia
+from app.db.session import engine, engine_lectura
 
 router = APIRouter(prefix="/system", tags=["system"])
 
+def _enviar(cmd: dict, esp_id: str, response: Response) -> str | None:
+    """
+    Envía el comando; 503 si se perdió. Si no salió ya (quedó en la bandeja de
+    salida, o el líder no contestó a tiempo y puede haber salido) responde 202
+    y devuelve el motivo; None si salió.
+    """
+    p = enviar_cmd(cmd, esp_id=esp_id)
+    if p is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ESP32 no disponible (MQTT no pudo publicar el comando)")
+    if not (p.diferido or p.incierto):
+        return None
+    response.status_code = status.HTTP_202_ACCEPTED
+    if p.incierto:
+        response.headers["X-Comando-Id"] = p.cid
+        return _INCIERTO.format(cid=p.cid)
+    return _EN_BANDEJA
+
+_EN_BANDEJA = "quedó en la bandeja de salida: se envía cuando vuelva el broker"
+_INCIERTO = "el proceso líder no confirmó a tiempo si lo publicó (id {cid}); no hace falta reintentar"
+
 @router.put("/mecanismos/{target}/{value}")
 def set_mechanism_direct(
     target: str,
     value: str,
+    response: Response,
     esp_id: str = Depends(resolve_esp_id)
 ):
     """
@@ -23,30 +58,148 @@ def set_mechanism_direct(
         raise HTTPException(status_code=400, detail="Value inválido (debe ser ON o OFF).")
 
     cmd = {"cmd": "SET", "target": target, "value": value}
-    
-    if not enviar_cmd_mqtt(cmd, esp_id=esp_id):
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ESP32 no disponible (MQTT no pudo publicar el comando)")
-    
+    demora = _enviar(cmd, esp_id, response)
+
+    diario.registrar(esp_id, "manual", ACTUADORES[target], value, f"PUT /system/mecanismos: {target} {value}")
+    if demora:
+        return {"message": f"Comando SET {target}={value} para {esp_id}: {demora}."}
     return {"message": f"Comando SET {target}={value} enviado a {esp_id} por MQTT."}
 
 @router.post("/status")
-def request_status_update(esp_id: str = Depends(resolve_esp_id)):
+def request_status_update(response: Response, esp_id: str = Depends(resolve_esp_id)):
     """
     Solicita al ESP32 que envíe su estado (telemetría) inmediatamente.
     """
     cmd = {"cmd": "STATUS"}
-    if not enviar_cmd_mqtt(cmd, esp_id=esp_id):
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ESP32 no disponible (MQTT no pudo publicar el comando)")
-    
+    demora = _enviar(cmd, esp_id, response)
+
+    diario.registrar(esp_id, "manual", "status", "", "POST /system/status: pedido de telemetría")
+    if demora:
+        return {"message": f"Comando STATUS para {esp_id}: {demora}."}
     return {"message": f"Comando STATUS enviado a {esp_id} por MQTT. Esperando telemetría..."}
 
 @router.post("/reboot")
-def reboot_esp32(esp_id: str = Depends(resolve_esp_id)):
+def reboot_esp32(response: Response, esp_id: str = Depends(resolve_esp_id)):
     """
     Envía el comando de reinicio al ESP32.
     """
     cmd = {"cmd": "REBOOT"}
-    if not enviar_cmd_mqtt(cmd, esp_id=esp_id):
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ESP32 no disponible (MQTT no pudo publicar el comando)")
-    
-    return {"message": f"Comando REBOOT enviado a {esp_id} por MQTT."}
\ No newline at end of file
+    demora = _enviar(cmd, esp_id, response)
+
+    diario.registrar(esp_id, "reinicio", "comando", "", "POST /system/reboot")
+    if demora:
+        return {"message": f"Comando REBOOT para {esp_id}: {demora}."}
+    return {"message": f"Comando REBOOT enviado a {esp_id} por MQTT."}
+
+@router.get("/ingesta")
+def ingesta_metrics():
+    """
+    Métricas de la cola de ingesta MQTT (profundidad, descartes, tamaño de lote).
+    """
+    return get_ingesta().metricas()
+
+
+@router.get("/registro")
+def registro_metrics():
+    """
+    Hits/misses del registro en memoria de devices (config + mecanismos).
+    """
+    return registro.metricas()
+
+
+@router.get("/stream")
+def stream_metrics():
+    """
+    Clientes SSE conectados y eventos publicados/entregados/descartados.
+    """
+    return hub.metricas()
+
+
+@router.get("/retencion")
+def retencion_metrics():
+    """
+    Política de retención, filas borradas y duración de la última pasada.
+    """
+    return motor_retencion.metricas()
+
+@router.post("/retencion", status_code=status.HTTP_202_ACCEPTED)
+def retencion_run(background: BackgroundTasks):
+    """
+    Lanza una pasada de retención ahora (en segundo plano).
+    """
+    background.add_task(motor_retencion.ejecutar)
+    return {"message": "Pasada de retención iniciada."}
+
+@router.get("/control")
+def control_metrics():
+    """
+    Autocontrol: tabla de reglas del motor vectorizado y cooldowns por actuador.
+    """
+    return {
+        "vectorizado": motor_control.metricas() if motor_control else None,
+        "cooldowns": cooldowns.metricas(),
+    }
+
+@router.get("/comandos")
+def comandos_metrics(esp_id: Optional[str] = None):
+    """
+    Comandos MQTT: enviados, cómo se confirmaron (ack / telemetría), rechazados,
+    reemplazados, vencidos, pendientes y latencia de confirmación. En "cola":
+    pedidos vs. publicaciones reales (coalescencia), totales y por device
+    (con ?esp_id=... sólo ese device). En "bandeja": comandos esperando al
+    broker en la bandeja de salida (null si está desactivada).
+    """
+    return {**rastreador.metricas(), "cola": cola_comandos.metricas(esp_id),
+            "bandeja": bandeja.metricas() if bandeja else None}
+
+@router.get("/analitica")
+def analitica_metrics(esp_id: Optional[str] = None):
+    """
+    Analítica en vivo: lecturas analizadas, alertas por subtipo y condiciones
+    en curso. Con ?esp_id=... también las ventanas de ese device (EWMA,
+    mín/máx, varianza y pendiente del nivel de agua).
+    """
+    if analitica is None:
+        return {"activa": False}
+    out = {"activa": True, **analitica.metricas()}
+    if esp_id:
+        out["estado"] = analitica.estado(esp_id)
+    return out
+
+@router.get("/eventos")
+def eventos_metrics():
+    """
+    Diario de eventos de este proceso: encolados, escritos, descartados por
+    cola llena, lotes y profundidad de la cola.
+    """
+    return diario.metricas()
+
+@router.get("/presencia")
+def presencia_metrics():
+    """
+    Presencia en este proceso: contactos, escrituras de ultimo_contacto
+    (las que se ahorran son contactos - escrituras), transiciones y devices
+    por estado.
+    """
+    return presencia.metricas()
+
+@router.get("/coordinacion")
+def coordinacion_metrics():
+    """
+    Rol de este worker (líder con MQTT o seguidor) y tráfico entre procesos.
+    Las métricas de ingesta, comandos y retención son las del líder.
+    """
+    return coordinador.metricas()
+
+@router.get("/db")
+def db_metrics():
+    """
+    Motor de base de datos, uso de los pools de escritura y de lectura y, en
+    SQLite, los checkpoints programados del WAL (los del líder).
+    """
+    return {
+        "motor": engine.dialect.name,
+        "pool_escritura": engine.pool.status(),
+        "pool_lectura": engine_lectura.pool.status() if engine_lectura is not engine else None,
+        "checkpoint": checkpoint_wal.metricas() if checkpoint_wal else None,
+    }
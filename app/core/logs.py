@@ -0,0 +1,180 @@
+"""
+Logging de la app: cola en memoria + hilo escritor, muestreo de las líneas
+"sin acción" del autocontrol y salida en texto o JSON.
+
+El hilo que loguea (paho, el escritor de ingesta, el event loop) sólo
+interpola el mensaje y lo encola; el formato (fecha, JSON) y la escritura en
+la SD los hace un QueueListener. Si la cola se llena, las líneas se
+descartan y se cuentan: el log nunca frena a la ingesta.
+
+Las decisiones que no cambian nada (se repiten en cada telemetría) se
+loguean con `sin_accion(logger, esp_id, msg, *args)`: pasan a lo sumo una vez
+cada `log_sin_accion_s` por device y mensaje, y la siguiente que pasa lleva
+cuántas se omitieron (`suprimidas`). El muestreo se decide antes de crear el
+LogRecord, que es lo más caro de una línea que no se va a escribir. Las
+líneas con `extra={"esp_id": ..., "sin_accion": True}` de otros módulos se
+muestrean igual, en el handler.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.core.config import config
+
+FORMATO_TEXTO = "%(asctime)s - %(levelname)s - %(message)s"
+
+# atributos propios de LogRecord: lo demás vino por `extra` y va como campo en JSON
+_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class MuestreoSinAccion(logging.Filter):
+    """Deja pasar una línea "sin acción" por (esp_id, mensaje) cada `intervalo_s`."""
+
+    def __init__(self, intervalo_s: float, reloj=time.monotonic):
+        super().__init__()
+        self._intervalo_s = intervalo_s
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._ultimo: dict[tuple, list] = {}   # clave -> [último emitido, suprimidas desde entonces]
+        self.suprimidas = 0
+
+    def pasar(self, esp_id: str | None, msg: str) -> int | None:
+        """None si la línea se omite; si pasa, cuántas se omitieron desde la anterior."""
+        if self._intervalo_s <= 0:
+            return 0
+        clave = (esp_id, msg)
+        ahora = self._reloj()
+        with self._lock:
+            estado = self._ultimo.get(clave)
+            if estado is not None and ahora - estado[0] < self._intervalo_s:
+                estado[1] += 1
+                self.suprimidas += 1
+                return None
+            self._ultimo[clave] = [ahora, 0]
+            return estado[1] if estado is not None else 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sin_accion", False) or hasattr(record, "suprimidas"):
+            return True     # no es "sin acción", o ya lo muestreó sin_accion()
+        suprimidas = self.pasar(getattr(record, "esp_id", None), record.msg)
+        if suprimidas is None:
+            return False
+        record.suprimidas = suprimidas
+        return True
+
+
+class ColaLogs(logging.handlers.QueueHandler):
+    """QueueHandler con cola acotada: si se llena, descarta en vez de bloquear."""
+
+    def __init__(self, cola: queue.Queue):
+        super().__init__(cola)
+        self.descartadas = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Sólo la interpolación (los args pueden cambiar después); el formato lo hace el listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartadas += 1
+
+
+class FormatoTexto(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        texto = super().format(record)
+        n = getattr(record, "suprimidas", 0)
+        return f"{texto} (+{n} similares omitidas)" if n else texto
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra` al mismo nivel."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        d = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in vars(record).items():
+            if k not in _ESTANDAR and k not in d:
+                d[k] = v
+        if record.exc_text or record.exc_info:
+            d["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(d, ensure_ascii=False, default=str)
+
+
+_listener: logging.handlers.QueueListener | None = None
+_cola_handler: ColaLogs | None = None
+muestreo: MuestreoSinAccion | None = None
+
+
+def configurar_logging(
+    nivel: str = config.log_level,
+    formato: str = config.log_formato,
+    archivo: str = config.log_archivo,
+    cola_max: int = config.log_cola_max,
+    sin_accion_s: float = config.log_sin_accion_s,
+):
+    """Instala la cola en el logger raíz (idempotente: la segunda llamada no hace nada)."""
+    global _listener, _cola_handler, muestreo
+    if _listener is not None:
+        return
+    destino = logging.FileHandler(archivo, encoding="utf-8") if archivo else logging.StreamHandler(sys.stderr)
+    destino.setFormatter(FormatoJSON() if formato == "json" else FormatoTexto(FORMATO_TEXTO))
+
+    cola: queue.Queue = queue.Queue(maxsize=cola_max)
+    _cola_handler = ColaLogs(cola)
+    muestreo = MuestreoSinAccion(sin_accion_s)
+    _cola_handler.addFilter(muestreo)
+
+    raiz = logging.getLogger()
+    for h in list(raiz.handlers):
+        raiz.removeHandler(h)
+    raiz.addHandler(_cola_handler)
+    raiz.setLevel(nivel.upper())
+
+    _listener = logging.handlers.QueueListener(cola, destino, respect_handler_level=True)
+    _listener.start()
+    atexit.register(detener_logging)
+
+
+def sin_accion(logger: logging.Logger, esp_id: str, msg: str, *args):
+    """`logger.info` de una decisión sin cambios, muestreada por (esp_id, msg)."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    suprimidas = muestreo.pasar(esp_id, msg) if muestreo is not None else 0
+    if suprimidas is None:
+        return
+    logger.info(msg, *args, extra={"esp_id": esp_id, "sin_accion": True, "suprimidas": suprimidas}, stacklevel=2)
+
+
+def detener_logging():
+    """Vacía la cola y detiene el hilo escritor."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def metricas() -> dict:
+    return {
+        "en_cola": _cola_handler.queue.qsize() if _cola_handler else 0,
+        "descartadas": _cola_handler.descartadas if _cola_handler else 0,
+        "suprimidas": muestreo.suprimidas if muestreo else 0,
+    }
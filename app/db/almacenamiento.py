@@ -0,0 +1,236 @@
+"""
+Lo que depende del motor de base de datos, en un solo lugar.
+
+SQLite (por defecto) y PostgreSQL (con TimescaleDB si está instalado) tienen
+cada uno su clase con el mismo contrato: cómo crear el engine, cómo preparar
+el esquema después del create_all, upserts, inserción en bloque de lecturas y
+descarte de datos vencidos. Los servicios piden el suyo con
+`almacen_de(db)` según el dialecto de la sesión, así las sesiones de los
+benchmarks (SQLite temporal) siguen funcionando aunque la app use PostgreSQL.
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, func, insert, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.models import Lectura
+
+log = logging.getLogger("almacenamiento")
+
+# Columnas de `lecturas` en el orden del COPY.
+_COLUMNAS_LECTURA = ("id", "device_id", "fecha_hora", "temperatura", "humedad", "humedad_suelo", "nivel_de_agua")
+
+
+def _pragmas_rendimiento(dbapi_connection):
+    # caché de páginas en KiB (negativo) y lecturas por mmap: menos read() sobre la SD
+    dbapi_connection.execute(f"PRAGMA cache_size=-{config.sqlite_cache_mb * 1024}")
+    dbapi_connection.execute(f"PRAGMA mmap_size={config.sqlite_mmap_mb * 1024 * 1024}")
+    dbapi_connection.execute("PRAGMA temp_store=MEMORY")
+
+
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # Sólo tiene efecto al crear la DB: permite liberar páginas con incremental_vacuum.
+        # Con la DB ya creada no se repite: pide el lock de escritura y una conexión
+        # nueva fallaría mientras otra tiene una transacción abierta.
+        if dbapi_connection.execute("PRAGMA page_count").fetchone()[0] == 0:
+            dbapi_connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+        # El checkpoint programado (CheckpointWAL) hace el trabajo; éste es el tope de seguridad.
+        dbapi_connection.execute(f"PRAGMA wal_autocheckpoint={config.sqlite_autocheckpoint_paginas}")
+        _pragmas_rendimiento(dbapi_connection)
+
+
+def set_sqlite_pragma_lectura(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        _pragmas_rendimiento(dbapi_connection)
+        dbapi_connection.execute("PRAGMA query_only=ON")
+
+
+class AlmacenSQLite:
+    """
+    Un archivo, un escritor a la vez (WAL): la opción para una Raspberry.
+
+    SQLite serializa las escrituras con el lock del archivo: el engine de
+    escritura usa el pool por defecto y cada conexión espera ese lock hasta
+    `sqlite_busy_timeout_ms`. (Achicar el pool a una conexión no sirve: una
+    sesión abierta dentro de otra esperaría una conexión que nunca se libera.)
+    Las consultas de la API y las exportaciones van a un pool aparte de
+    conexiones `query_only`, que en WAL leen sin esperar al escritor.
+    Sin `pool_pre_ping`: un archivo local no se "desconecta", y el ping era
+    un SELECT 1 más por cada checkout.
+    """
+
+    dialecto = "sqlite"
+
+    def _connect_args(self) -> dict:
+        # `timeout` es el busy_timeout de sqlite3 (esperar el lock en vez de fallar).
+        return {"check_same_thread": False, "timeout": config.sqlite_busy_timeout_ms / 1000}
+
+    def crear_engine(self, url: str) -> Engine:
+        engine = create_engine(
+            url,
+            echo=False,
+            connect_args=self._connect_args(),
+        )
+        event.listen(engine, "connect", set_sqlite_pragma)
+        return engine
+
+    def crear_engine_lectura(self, url: str, engine: Engine) -> Engine:
+        """Pool de sólo lectura (el mismo engine si la DB está en memoria)."""
+        if engine.url.database in (None, "", ":memory:"):
+            return engine
+        lectura = create_engine(
+            url,
+            echo=False,
+            connect_args=self._connect_args(),
+            pool_size=config.sqlite_lectores,
+            max_overflow=config.sqlite_lectores,
+            pool_timeout=config.sqlite_busy_timeout_ms / 1000,
+        )
+        event.listen(lectura, "connect", set_sqlite_pragma_lectura)
+        return lectura
+
+    def preparar_esquema(self, engine: Engine):
+        pass
+
+    def insert(self, tabla):
+        """INSERT con soporte de ON CONFLICT del dialecto."""
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(tabla)
+
+    def menor(self, a, b):
+        return func.min(a, b)
+
+    def mayor(self, a, b):
+        return func.max(a, b)
+
+    def insertar_lecturas(self, db: Session, lecturas: list[Lectura]):
+        """Agrega las lecturas a la transacción; al volver, cada una tiene su id."""
+        db.add_all(lecturas)
+        db.flush()
+
+    def descartar_vencidos(self, db: Session, tabla: str, cutoff: datetime) -> int:
+        """Descarte en bloque previo al borrado por chunks (0 = no aplica a este motor)."""
+        return 0
+
+
+class AlmacenPostgres(AlmacenSQLite):
+    """
+    Varios escritores concurrentes, pool de conexiones dimensionado por
+    configuración y COPY para las lecturas. Con TimescaleDB, `lecturas` y
+    `eventos` son hypertables particionadas por `fecha_hora` (chunks diarios)
+    y la retención descarta chunks enteros en vez de borrar fila por fila.
+    """
+
+    dialecto = "postgresql"
+    HYPERTABLES = ("lecturas", "eventos")
+
+    def __init__(self):
+        self._hypertables: set[str] = set()
+
+    def crear_engine(self, url: str) -> Engine:
+        return create_engine(
+            url,
+            echo=False,
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_recycle=config.db_pool_recycle_s,
+            pool_pre_ping=True,
+        )
+
+    def crear_engine_lectura(self, url: str, engine: Engine) -> Engine:
+        # Las lecturas no compiten con la ingesta por un lock: mismo pool.
+        return engine
+
+    def preparar_esquema(self, engine: Engine):
+        with engine.begin() as conn:
+            disponible = conn.execute(
+                text("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")
+            ).first()
+            if not disponible:
+                log.info("TimescaleDB no está instalado: lecturas y eventos quedan como tablas comunes.")
+                return
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+            for tabla in self.HYPERTABLES:
+                self._hypertable(conn, tabla)
+                self._hypertables.add(tabla)
+
+    def _hypertable(self, conn: Connection, tabla: str):
+        ya = conn.execute(
+            text("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = :t"), {"t": tabla}
+        ).first()
+        if ya:
+            return
+        # Timescale exige la columna de partición en toda clave única.
+        conn.execute(text(f"ALTER TABLE {tabla} DROP CONSTRAINT IF EXISTS {tabla}_pkey"))
+        conn.execute(text(f"ALTER TABLE {tabla} ADD PRIMARY KEY (id, fecha_hora)"))
+        conn.execute(text(
+            f"SELECT create_hypertable('{tabla}', 'fecha_hora', chunk_time_interval => INTERVAL '1 day', "
+            f"migrate_data => true, if_not_exists => true)"
+        ))
+        log.info("%s convertida en hypertable (chunks de 1 día).", tabla)
+
+    def insert(self, tabla):
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(tabla)
+
+    def menor(self, a, b):
+        return func.least(a, b)
+
+    def mayor(self, a, b):
+        return func.greatest(a, b)
+
+    def insertar_lecturas(self, db: Session, lecturas: list[Lectura]):
+        """
+        COPY dentro de la transacción de la sesión. Los ids se reservan antes
+        de la secuencia, porque el stream en vivo publica cada lectura con su id.
+        Sin psycopg 3 (otro driver) cae a un INSERT en bloque.
+        """
+        if not lecturas:
+            return
+        db.flush()  # devices nuevos del lote, antes que sus lecturas
+        ids = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('lecturas', 'id')) FROM generate_series(1, :n)"),
+            {"n": len(lecturas)},
+        ).scalars().all()
+        for lec, id_ in zip(lecturas, ids):
+            lec.id = id_
+        filas = [tuple(getattr(l, c) for c in _COLUMNAS_LECTURA) for l in lecturas]
+
+        crudo = db.connection().connection.driver_connection
+        if type(crudo).__module__.split(".")[0] == "psycopg":
+            with crudo.cursor() as cur:
+                with cur.copy(f"COPY lecturas ({', '.join(_COLUMNAS_LECTURA)}) FROM STDIN") as copy:
+                    for fila in filas:
+                        copy.write_row(fila)
+        else:
+            db.execute(insert(Lectura), [dict(zip(_COLUMNAS_LECTURA, f)) for f in filas])
+
+    def descartar_vencidos(self, db: Session, tabla: str, cutoff: datetime) -> int:
+        if tabla not in self._hypertables:
+            return 0
+        chunks = db.execute(text("SELECT drop_chunks(CAST(:t AS regclass), older_than => CAST(:c AS timestamptz))"), {"t": tabla, "c": cutoff}).all()
+        return len(chunks)
+
+
+_ALMACENES = {a.dialecto: a for a in (AlmacenSQLite(), AlmacenPostgres())}
+
+
+def almacen_para(url: str):
+    dialecto = url.split(":", 1)[0].split("+", 1)[0]
+    try:
+        return _ALMACENES[dialecto]
+    except KeyError:
+        raise ValueError(f"Motor de base de datos no soportado: {dialecto} (sqlite o postgresql)")
+
+
+def almacen_de(db: Session | Engine | Connection):
+    """El almacén que corresponde al motor de una sesión, engine o conexión."""
+    bind = db.get_bind() if isinstance(db, Session) else db
+    return _ALMACENES[bind.dialect.name]
@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, Float, DateTime, Boolean, String, func, text,
+    Column, Integer, Float, DateTime, Boolean, String, func, true, false,
     ForeignKey, CheckConstraint, Index, UniqueConstraint)
 from sqlalchemy.orm import validates, relationship
 from app.db.base import Base
@@ -12,7 +12,7 @@ class Device(Base):
     id              = Column(Integer, primary_key=True, index=True)
     esp_id          = Column(String(64), unique=True, nullable=False)  # Identificador unico real de la ESP o micro usado 
     nombre          = Column(String(50), nullable=True)
-    activo          = Column(Boolean, nullable=False, default=True, server_default=text("1"))
+    activo          = Column(Boolean, nullable=False, default=True, server_default=true())
     ultimo_contacto = Column(DateTime(timezone=True), nullable=True)
 
     # Relaciones
@@ -20,6 +20,8 @@ class Device(Base):
     mecanismos = relationship("Mecanismos", back_populates="device", uselist=False, cascade="all, delete-orphan")
     config     = relationship("Config", back_populates="device", uselist=False, cascade="all, delete-orphan")
     eventos    = relationship("Evento", back_populates="device", cascade="all, delete-orphan")
+    rollups    = relationship("LecturaRollup", cascade="all, delete-orphan")
+    ultima     = relationship("UltimaLectura", uselist=False, cascade="all, delete-orphan")
 
 
 class Lectura(Base):
@@ -40,14 +42,55 @@ class Lectura(Base):
 Index("idx_lecturas_device_time", Lectura.device_id, Lectura.fecha_hora)
 
 
+class UltimaLectura(Base):
+    """Copia de la lectura más reciente de cada device (la mantiene la ingesta)."""
+    __tablename__ = "ultimas_lecturas"
+
+    device_id      = Column(Integer, ForeignKey("device.id", ondelete="CASCADE"), primary_key=True)
+    lectura_id     = Column(Integer, nullable=False)
+    fecha_hora     = Column(DateTime(timezone=True), nullable=False)
+    temperatura    = Column(Float, nullable=False)
+    humedad        = Column(Float, nullable=False)
+    humedad_suelo  = Column(Float, nullable=False)
+    nivel_de_agua  = Column(Float, nullable=False)
+
+
+class LecturaRollup(Base):
+    """Agregados min/max/suma/cantidad de lecturas por device y bucket de tiempo."""
+    __tablename__ = "lecturas_rollup"
+
+    id          = Column(Integer, primary_key=True, index=True)
+    device_id   = Column(Integer, ForeignKey("device.id", ondelete="CASCADE"), nullable=False)
+    resolucion  = Column(Integer, nullable=False)                   # segundos del bucket: 60, 3600, 86400
+    bucket      = Column(DateTime(timezone=True), nullable=False)   # inicio del bucket (UTC)
+    n           = Column(Integer, nullable=False, default=0)
+
+    temp_min    = Column(Float, nullable=False)
+    temp_max    = Column(Float, nullable=False)
+    temp_sum    = Column(Float, nullable=False)
+    hum_min     = Column(Float, nullable=False)
+    hum_max     = Column(Float, nullable=False)
+    hum_sum     = Column(Float, nullable=False)
+    suelo_min   = Column(Float, nullable=False)
+    suelo_max   = Column(Float, nullable=False)
+    suelo_sum   = Column(Float, nullable=False)
+    agua_min    = Column(Float, nullable=False)
+    agua_max    = Column(Float, nullable=False)
+    agua_sum    = Column(Float, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("device_id", "resolucion", "bucket", name="uq_rollup_device_res_bucket"),
+    )
+
+
 class Mecanismos(Base):
     __tablename__ = "mecanismos"
 
     id          = Column(Integer, primary_key=True, index=True)
     device_id   = Column(Integer, ForeignKey("device.id", ondelete="CASCADE"), nullable=False, unique=True)
-    bomba       = Column(Boolean, nullable=False, default=False, server_default=text("0"))
-    luz         = Column(Boolean, nullable=False, default=False, server_default=text("0"))
-    ventilador  = Column(Boolean, nullable=False, default=False, server_default=text("0"))
+    bomba       = Column(Boolean, nullable=False, default=False, server_default=false())
+    luz         = Column(Boolean, nullable=False, default=False, server_default=false())
+    ventilador  = Column(Boolean, nullable=False, default=False, server_default=false())
 
     # Relación con Device
     device = relationship("Device", back_populates="mecanismos")
@@ -99,3 +142,34 @@ class Evento(Base):
 
 
 Index("idx_eventos_device_time", Evento.device_id, Evento.fecha_hora)
+
+
+class CooldownActuador(Base):
+    """Último cambio automático por actuador (snapshot del CooldownStore, sólo cooldowns vigentes)."""
+    __tablename__ = "cooldowns"
+
+    id            = Column(Integer, primary_key=True, index=True)
+    device_id     = Column(Integer, ForeignKey("device.id", ondelete="CASCADE"), nullable=False)
+    actuador      = Column(String(16), nullable=False)
+    ultimo_cambio = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("device_id", "actuador", name="uq_cooldown_device_actuador"),
+    )
+
+
+class ComandoSaliente(Base):
+    """Comando MQTT que no se pudo publicar: espera en la bandeja de salida a que vuelva el broker."""
+    __tablename__ = "comandos_salientes"
+
+    id              = Column(Integer, primary_key=True)             # orden de envío dentro de cada device
+    origen          = Column(String(32), nullable=False)             # proceso que lo reenvía ("api", "ingesta-0", ...)
+    esp_id          = Column(String(64), nullable=False)
+    cmd             = Column(String(16), nullable=False)
+    target          = Column(String(16), nullable=True)              # SET: uno más nuevo al mismo target lo reemplaza
+    payload         = Column(String(1024), nullable=False)           # JSON tal cual se publica (con su id)
+    creado          = Column(DateTime(timezone=True), nullable=False)
+    motivo          = Column(String(64), nullable=False)             # por qué no salió (desconectado, publish, en_orden)
+
+
+Index("idx_comandos_salientes_origen_esp", ComandoSaliente.origen, ComandoSaliente.esp_id, ComandoSaliente.id)
@@ -1,28 +1,26 @@
-from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-import sqlite3
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
+from app.core.config import config
+from app.db.almacenamiento import almacen_para, set_sqlite_pragma  # noqa: F401 (usado por bench/)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=False,
-    connect_args={
-        "check_same_thread": False,
-        "timeout": 30,
-    },
-    pool_pre_ping=True,
-)
+# SQLite por defecto; DATABASE_URL=postgresql+psycopg://... para PostgreSQL/TimescaleDB.
+SQLALCHEMY_DATABASE_URL = config.database_url
 
-@event.listens_for(engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    if isinstance(dbapi_connection, sqlite3.Connection):
-        dbapi_connection.execute("PRAGMA journal_mode=WAL")
-        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+almacen = almacen_para(SQLALCHEMY_DATABASE_URL)
+engine = almacen.crear_engine(SQLALCHEMY_DATABASE_URL)
+# Consultas que no escriben (listados, series, exportaciones): no hacen cola detrás de la ingesta.
+engine_lectura = almacen.crear_engine_lectura(SQLALCHEMY_DATABASE_URL, engine)
 
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=engine,
     expire_on_commit=False,
-)
\ No newline at end of file
+)
+
+SessionLectura = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine_lectura,
+    expire_on_commit=False,
+)
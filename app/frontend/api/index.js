@@ -47,7 +47,7 @@ async function req(path, opts = {}, attachEsp = true) {
 
 // ---- Lecturas
 export const getLatest  = () => req("/lecturas/ultima");
-export const getHistory = () => req("/lecturas");
+export const getHistory = (params = {}) => req("/lecturas" + q(params));
 
 // ---- Config
 export const getConfig  = () => req("/config");
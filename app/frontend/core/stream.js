@@ -0,0 +1,45 @@
+import { getActiveEsp } from "../store/devices.js";
+
+// Una sola conexión SSE por pestaña (para el esp activo), compartida por las vistas.
+const handlers = { lectura: new Set(), mecanismos: new Set() };
+let es = null;
+let live = false;
+
+function open() {
+  if (es || typeof EventSource === "undefined") return;
+  const esp_id = getActiveEsp();
+  const url = "/api/v1/stream" + (esp_id ? `?${new URLSearchParams({ esp_id })}` : "");
+  es = new EventSource(url);
+  es.onopen = () => { live = true; };
+  es.onerror = () => { live = false; };  // EventSource reintenta solo
+
+  for (const tipo of Object.keys(handlers)) {
+    es.addEventListener(tipo, (ev) => {
+      let data;
+      try { data = JSON.parse(ev.data); } catch { return; }
+      handlers[tipo].forEach((fn) => { try { fn(data); } catch (e) { console.warn(e); } });
+    });
+  }
+}
+
+function close() {
+  if (es) es.close();
+  es = null;
+  live = false;
+}
+
+export function subscribe(tipo, fn) {
+  handlers[tipo].add(fn);
+  open();
+  return () => {
+    handlers[tipo].delete(fn);
+    if (!Object.values(handlers).some((s) => s.size)) close();
+  };
+}
+
+// Mientras el stream está abierto las vistas no necesitan hacer polling.
+export const isLive = () => live;
+
+window.addEventListener("esp:changed", () => {
+  if (es) { close(); open(); }
+}, { passive: true });
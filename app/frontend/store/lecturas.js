@@ -0,0 +1,45 @@
+import { getHistory } from "../api/index.js";
+
+// Buffer incremental de lecturas: la primera vez pide las `max` más recientes
+// y después sólo las posteriores al último id recibido (since_id).
+export function createHistoryFeed(max) {
+  let rows = [];      // desc por fecha, como las devuelve la API sin cursor
+  let lastId = null;
+
+  async function poll() {
+    if (lastId == null) {
+      const res = await getHistory({ limit: max });
+      if (!Array.isArray(res)) return rows;
+      if (res.length) {
+        rows = res.slice(0, max);
+        lastId = Math.max(...res.map(r => r.id));
+      }
+      return rows;
+    }
+    // con since_id la API devuelve las siguientes `max` después del cursor (asc por id):
+    // se sigue pidiendo hasta una página corta para no saltear ninguna
+    for (;;) {
+      const res = await getHistory({ since_id: lastId, limit: max });
+      if (!Array.isArray(res) || !res.length) break;
+      rows = [...res.slice().reverse(), ...rows].slice(0, max);
+      lastId = Math.max(lastId, res[res.length - 1].id);
+      if (res.length < max) break;
+    }
+    return rows;
+  }
+
+  // Lectura recibida por el stream en vivo (evita el próximo fetch).
+  function push(row) {
+    if (!row || (lastId != null && row.id <= lastId)) return rows;
+    rows = [row, ...rows].slice(0, max);
+    lastId = row.id;
+    return rows;
+  }
+
+  function reset() {
+    rows = [];
+    lastId = null;
+  }
+
+  return { poll, push, reset };
+}
@@ -1,5 +1,6 @@
 import { mount } from "../core/dom.js";
 import { getMech, putMech, getLatest } from "../api/index.js";
+import { subscribe, isLive } from "../core/stream.js";
 
 function clampPct(v){
   const n = Number(v);
@@ -92,6 +93,7 @@ export default function ActuatorsView(container){
 
   async function refresh(){
     try{
+      if (isLive()) return;
       const [m, latest] = await Promise.all([ getMech(), getLatest() ]);
 
       if (!m?.__error && m) {
@@ -168,15 +170,32 @@ export default function ActuatorsView(container){
     else if (e.target.closest("#btn-stop"))   stopAll();
   });
 
+  const unsubs = [
+    subscribe("mecanismos", (m) => {
+      if (busy) return;  // no pisar la actualización optimista en curso
+      mech = { ...mech, ...m };
+      paintStates();
+    }),
+    subscribe("lectura", (row) => {
+      if (row?.nivel_de_agua != null) paintWater(row.nivel_de_agua);
+    }),
+  ];
+
   // al cambiar de dispositivo limpiar UI y refresca
-  window.addEventListener("esp:changed", () => {
+  const onEspChanged = () => {
     if (timer) clearTimeout(timer);
     mech = { luz:false, ventilador:false, bomba:false };
     paintStates();
     paintWater(0);
     refresh();
-  }, { passive:true });
+  };
+  window.addEventListener("esp:changed", onEspChanged, { passive:true });
 
   refresh();
-  return () => { running = false; if (timer) clearTimeout(timer); };
+  return () => {
+    running = false;
+    if (timer) clearTimeout(timer);
+    unsubs.forEach((u) => u());
+    window.removeEventListener("esp:changed", onEspChanged);
+  };
 }
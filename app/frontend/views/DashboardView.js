@@ -1,5 +1,7 @@
 import { mount } from "../core/dom.js";
-import { getLatest, getHistory } from "../api/index.js";
+import { getLatest } from "../api/index.js";
+import { createHistoryFeed } from "../store/lecturas.js";
+import { subscribe, isLive } from "../core/stream.js";
 import { drawLine } from "../ui/Chart.js";
 
 export default function DashboardView(container){
@@ -23,32 +25,44 @@ export default function DashboardView(container){
 
   let timer = null;
   let running = true;
+  const feed = createHistoryFeed(24);
+
+  function paintLatest(okLatest){
+    if (okLatest){
+      const tempTxt = fmt(okLatest.temperatura,"°C"); if (elTemp.textContent !== tempTxt) elTemp.textContent = tempTxt;
+      const humTxt  = fmt(okLatest.humedad,"%");       if (elHum.textContent  !== humTxt)  elHum.textContent  = humTxt;
+      const soilTxt = fmt(okLatest.humedad_suelo,"%"); if (elSoil.textContent !== soilTxt) elSoil.textContent = soilTxt;
+      const ts = okLatest.fecha_hora ? new Date(okLatest.fecha_hora).toLocaleTimeString() : "";
+      elTs.textContent = ts ? `Actualizado ${ts}` : "";
+    } else {
+      elTemp.textContent = "—"; elHum.textContent = "—"; elSoil.textContent = "—"; elTs.textContent = "";
+    }
+  }
+
+  function paintHistory(history){
+    const last24 = [...history].sort((a,b)=> new Date(a.fecha_hora)-new Date(b.fecha_hora));
+    drawLine(canvas, last24.map(r => r.temperatura ?? null));
+  }
 
   async function refresh(){
     try{
-      const [latest, historyRaw] = await Promise.all([ getLatest(), getHistory() ]);
-
-      const okLatest = latest && !latest.__error ? latest : null;
-      if (okLatest){
-        const tempTxt = fmt(okLatest.temperatura,"°C"); if (elTemp.textContent !== tempTxt) elTemp.textContent = tempTxt;
-        const humTxt  = fmt(okLatest.humedad,"%");       if (elHum.textContent  !== humTxt)  elHum.textContent  = humTxt;
-        const soilTxt = fmt(okLatest.humedad_suelo,"%"); if (elSoil.textContent !== soilTxt) elSoil.textContent = soilTxt;
-        const ts = okLatest.fecha_hora ? new Date(okLatest.fecha_hora).toLocaleTimeString() : "";
-        elTs.textContent = ts ? `Actualizado ${ts}` : "";
-      } else {
-        elTemp.textContent = "—"; elHum.textContent = "—"; elSoil.textContent = "—"; elTs.textContent = "";
-      }
-
-      const history = Array.isArray(historyRaw) ? historyRaw : [];
-      const last24 = history.slice(-24).sort((a,b)=> new Date(a.fecha_hora)-new Date(b.fecha_hora));
-      drawLine(canvas, last24.map(r => r.temperatura ?? null));
+      // Con el stream abierto los datos llegan solos; el timer sólo cubre caídas.
+      if (isLive()) return;
+      const [latest, historyRaw] = await Promise.all([ getLatest(), feed.poll() ]);
+      paintLatest(latest && !latest.__error ? latest : null);
+      paintHistory(Array.isArray(historyRaw) ? historyRaw : []);
     }catch(e){
     }finally{
       if (running) timer = setTimeout(refresh, 2000);
     }
   }
 
-  const onEspChanged = () => { if (timer) clearTimeout(timer); refresh(); };
+  const unsubscribe = subscribe("lectura", (row) => {
+    paintLatest(row);
+    paintHistory(feed.push(row));
+  });
+
+  const onEspChanged = () => { if (timer) clearTimeout(timer); feed.reset(); refresh(); };
   window.addEventListener("esp:changed", onEspChanged, { passive:true });
 
   refresh();
@@ -56,6 +70,7 @@ export default function DashboardView(container){
   return () => {
     running = false;
     if (timer) clearTimeout(timer);
+    unsubscribe();
     window.removeEventListener("esp:changed", onEspChanged);
   };
 }
@@ -1,5 +1,5 @@
 import { mount } from "../core/dom.js";
-import { getHistory } from "../api/index.js";
+import { createHistoryFeed } from "../store/lecturas.js";
 import { drawLine } from "../ui/Chart.js";
 
 export default function HistoryView(container) {
@@ -147,12 +147,12 @@ export default function HistoryView(container) {
 
   let timer = null;
   let running = true;
+  const feed = createHistoryFeed(24);
 
   async function refresh() {
     try {
-      const history = (await getHistory()) || [];
-      const last24 = history
-        .slice(-24)
+      const history = await feed.poll();
+      const last24 = [...history]
         .sort(
           (a, b) => new Date(a.fecha_hora) - new Date(b.fecha_hora)
         );
@@ -168,6 +168,7 @@ export default function HistoryView(container) {
 
   const onEspChanged = () => {
     if (timer) clearTimeout(timer);
+    feed.reset();
     refresh();
   };
   window.addEventListener("esp:changed", onEspChanged, { passive: true });
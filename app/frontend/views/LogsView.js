@@ -1,5 +1,6 @@
 import { mount } from "../core/dom.js";
-import { getHistory } from "../api/index.js";
+import { createHistoryFeed } from "../store/lecturas.js";
+import { subscribe, isLive } from "../core/stream.js";
 
 export default function LogsView(container){
   const wrap = document.createElement("div");
@@ -16,6 +17,7 @@ export default function LogsView(container){
   const cont = wrap.querySelector("#alert-container");
   let timer = null;
   let running = true;
+  const feed = createHistoryFeed(10);
 
   function renderAlerts(lecturas){
     const recientes = (lecturas || []).slice(0, 10);
@@ -45,7 +47,8 @@ export default function LogsView(container){
 
   async function refresh(){
     try{
-      const lecturas = await getHistory();
+      if (isLive()) return;
+      const lecturas = await feed.poll();
       renderAlerts(lecturas);
     }catch(e){
     }finally{
@@ -53,7 +56,9 @@ export default function LogsView(container){
     }
   }
 
-  const onEspChanged = () => { if (timer) clearTimeout(timer); refresh(); };
+  const unsubscribe = subscribe("lectura", (row) => renderAlerts(feed.push(row)));
+
+  const onEspChanged = () => { if (timer) clearTimeout(timer); feed.reset(); refresh(); };
   window.addEventListener("esp:changed", onEspChanged, { passive:true });
 
   refresh();
@@ -61,6 +66,7 @@ export default function LogsView(container){
   return () => {
     running = false;
     if (timer) clearTimeout(timer);
+    unsubscribe();
     window.removeEventListener("esp:changed", onEspChanged);
   };
 }
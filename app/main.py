@@ -11,6 +11,9 @@ from app.mqtt_client import start_mqtt_listener
 
 from app.api.deps import get_db
 from app.core.config import config  # noqa
+from app.core.logs import configurar_logging, metricas as metricas_logs
+
+configurar_logging()  # cola + hilo escritor: loguear no escribe en la SD desde el hilo que loguea
 
 APP_MODE = (os.getenv("APP_MODE", "NORMAL") or "NORMAL").upper()
 
@@ -61,7 +64,7 @@ network={{
 
 # ===== Imports sólo si estamos en NORMAL =====
 if APP_MODE == "NORMAL":
-    from app.db.session import engine  # noqa
+    from app.db.session import engine, almacen  # noqa
     from app.db.base import Base  # noqa
     from app.api.v1.lecturas import router as lecturas_router  # noqa
     from app.api.v1.config import router as config_router  # noqa
@@ -69,6 +72,38 @@ if APP_MODE == "NORMAL":
     from app.api.v1.system import router as system_router  # noqa
     from app.api.v1.devices import router as devices_router  # noqa
     from app.api.v1.gemini import router as gemini_router
+    from app.api.v1.stream import router as stream_router  # noqa
+    from app.api.v1.fleet import router as fleet_router  # noqa
+    from app.api.v1.eventos import router as eventos_router  # noqa
+    from app.servicios.rollups import iniciar_backfill  # noqa
+    from app.servicios.flota import iniciar_backfill as iniciar_backfill_flota  # noqa
+    from app.servicios.retencion import motor_retencion  # noqa
+    from app.servicios.cooldown import cooldowns  # noqa
+    from app.servicios.coordinacion import coordinador, bloqueo_exclusivo  # noqa
+    from app.servicios.checkpoint import checkpoint_wal  # noqa
+    from app.servicios.ingesta import get_ingesta  # noqa
+    from app.servicios.comandos import rastreador  # noqa
+    from app.servicios.mqtt_funciones import bandeja  # noqa
+    from app.servicios.stream import hub  # noqa
+    from app.servicios.eventos import diario  # noqa
+    from app.servicios.presencia import presencia  # noqa
+    from app.servicios.metricas import metricas, MedirPedidos  # noqa
+
+
+def _servicios_lider():
+    """Lo que corre en un solo proceso aunque haya varios workers."""
+    iniciar_backfill()                      # rollups de lecturas previas: se decide antes de la ingesta y se generan en segundo plano
+    iniciar_backfill_flota()                # última lectura de los devices que no la tienen (DB previa)
+    if not config.ingesta_compartida:       # si no, el autocontrol corre en los procesos de ingesta
+        cooldowns.restaurar()               # cooldowns vigentes antes del reinicio
+        cooldowns.iniciar()
+        presencia.restaurar()               # estado de cada device según ultimo_contacto
+
+    #inicia el mosquitto 
+    start_mqtt_listener()
+    motor_retencion.iniciar()               # borra datos vencidos en segundo plano
+    if checkpoint_wal:
+        checkpoint_wal.iniciar()            # checkpoint del WAL fuera del camino de la ingesta
 
 
 def create_app() -> FastAPI:
@@ -107,10 +142,32 @@ def create_app() -> FastAPI:
         return app
 
     # ---------- NORMAL: API + front principal ----------
-    Base.metadata.create_all(bind=engine)  # hasta agregar migraciones
-
-    #inicia el mosquitto 
-    start_mqtt_listener()
+    with bloqueo_exclusivo(coordinador.ruta_lock.with_suffix(".init")):
+        Base.metadata.create_all(bind=engine)  # hasta agregar migraciones
+        almacen.preparar_esquema(engine)        # hypertables en TimescaleDB; nada en SQLite
+    # Con WORKERS=N un solo proceso (el líder) consume MQTT; el resto le reenvía los comandos.
+    coordinador.iniciar(al_asumir=_servicios_lider)
+
+    app.add_middleware(MedirPedidos)          # latencia por ruta para /metrics
+    # Medidores de /metrics: se leen al momento del scrape, no en el camino caliente.
+    metricas.medidor("grow_ingesta_cola_profundidad", "Mensajes esperando al escritor de ingesta.",
+                     lambda: get_ingesta().metricas()["profundidad"])
+    metricas.medidor("grow_ingesta_cola_capacidad", "Capacidad de la cola de ingesta.",
+                     lambda: get_ingesta().metricas()["capacidad"])
+    metricas.medidor("grow_comandos_pendientes", "Comandos publicados sin confirmar por el ESP32.",
+                     lambda: rastreador.metricas()["pendientes"])
+    if bandeja is not None:
+        metricas.medidor("grow_comandos_en_bandeja", "Comandos en la bandeja de salida esperando al broker.",
+                         lambda: bandeja.metricas()["en_espera"])
+    metricas.medidor("grow_stream_clientes", "Conexiones SSE abiertas.", lambda: hub.metricas()["clientes"])
+    metricas.medidor("grow_eventos_descartados_total", "Eventos descartados con la cola del diario llena.",
+                     lambda: diario.metricas()["descartados"], tipo="counter")
+    metricas.medidor("grow_log_descartadas_total", "Líneas de log descartadas con la cola llena.",
+                     lambda: metricas_logs()["descartadas"], tipo="counter")
+    metricas.medidor("grow_log_suprimidas_total", "Líneas \"sin acción\" omitidas por el muestreo por device.",
+                     lambda: metricas_logs()["suprimidas"], tipo="counter")
+    metricas.medidor("grow_proceso_info", "Proceso que respondió el scrape (rol en la coordinación).",
+                     lambda: {(os.getpid(), coordinador.rol or "unico"): 1}, ("pid", "rol"))
 
     app.include_router(lecturas_router,   prefix="/api/v1")
     app.include_router(config_router,     prefix="/api/v1")
@@ -118,6 +175,9 @@ def create_app() -> FastAPI:
     app.include_router(system_router,     prefix="/api/v1")
     app.include_router(devices_router,    prefix="/api/v1")
     app.include_router(gemini_router,     prefix="/api/v1")
+    app.include_router(stream_router,     prefix="/api/v1")
+    app.include_router(fleet_router,      prefix="/api/v1")
+    app.include_router(eventos_router,    prefix="/api/v1")
 
     @app.get("/health")
     async def health(db: Session = Depends(get_db)):
@@ -127,6 +187,10 @@ def create_app() -> FastAPI:
         except Exception as e:
            raise HTTPException(status_code=503, detail=f"Database error: {e}")
 
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus():
+        return Response(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
     frontend_dir = Path(__file__).parent / "frontend"
     frontend_dir.mkdir(parents=True, exist_ok=True)
     app.mount("/", StaticFiles(directory=frontend_dir, html=True), name="frontend")
@@ -1,144 +1,68 @@
-import json
-import math
+import atexit
 import logging
-from datetime import datetime, timezone
+import time
 
 import paho.mqtt.client as mqtt
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
 
-from app.db.session import SessionLocal
-from app.db.models import Lectura, Device, Mecanismos
-from app.servicios.mqtt_funciones import setup_mqtt_client
-from app.servicios.devices import get_or_create_device
-from app.servicios.umbrales import procesar_umbrales
+from app.core.config import config
+from app.servicios.mqtt_funciones import setup_mqtt_client, bandeja
+from app.servicios.ingesta import get_ingesta
+from app.servicios.comandos import rastreador
+from app.servicios.metricas import mqtt_descartados, on_message_s, tipo_topico
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 log = logging.getLogger("mqtt-listener")
 
 MQTT_BASE_TOPIC = "invernaderos/+/telemetria"
 MQTT_STATUS_TOPIC = "invernaderos/+/status"
-
-
-def _update_mecanismos_from_telemetria(db: Session, esp_id: str, data: dict):
-    """Persiste el estado REAL de los mecanismos reportado por el ESP32 en la DB."""
-    d = db.query(Device).filter(Device.esp_id == esp_id).first()
-    if not d:
-        log.warning("DISPOSITIVO no encontrado para actualizar mecanismos: %s", esp_id)
-        return
-
-    mech = db.query(Mecanismos).filter(Mecanismos.device_id == d.id).first()
-    if not mech:
-        mech = Mecanismos(device_id=d.id)
-        db.add(mech)
-        db.flush() # Asegura que el objeto esté listo si es nuevo
-
-    new_bomba = (str(data.get("riego")).upper() == "ON")
-    new_vent = (str(data.get("vent")).upper() == "ON")
-    new_luz = (str(data.get("luz")).upper() == "ON")
-
-    if mech.bomba != new_bomba or mech.ventilador != new_vent or mech.luz != new_luz:
-        log.info("SINCRONIZANDO estado de Mecanismos para %s.", esp_id)
-        mech.bomba = new_bomba
-        mech.ventilador = new_vent
-        mech.luz = new_luz
-
-def _is_num(x):
-    """Verifica si el valor es un número válido."""
-    return isinstance(x, (int, float)) and not (isinstance(x, float) and math.isnan(x))
+MQTT_ACK_TOPIC = "invernaderos/+/ack"
 
 
 def on_message(client, userdata, msg):
-    """Maneja los mensajes MQTT entrantes."""
-    # Intentar obtener el esp_id y el payload antes de la sesión de DB
+    """
+    Maneja los mensajes MQTT entrantes.
+    Corre en el hilo de red de paho: sólo decodifica y encola; la escritura en
+    la DB la hace el escritor por lotes de `app.servicios.ingesta`.
+    """
+    t0 = time.perf_counter()
+    topico = tipo_topico(msg.topic)
     try:
-        payload_str = msg.payload.decode(errors="ignore").strip()
-        parts = msg.topic.split("/")
-        esp_id = parts[1] if len(parts) >= 2 else None
-        
-        if not esp_id:
-            log.error("No se pudo extraer esp_id del tópico: %s", msg.topic)
-            return
-            
-    except Exception as e:
-        log.error("Error al decodificar mensaje o parsear tópico: %s", e)
-        return
-
-    # Inicia la sesión de DB. Se cerrará automáticamente al salir del bloque 'with'.
-    with SessionLocal() as db:
         try:
-            # 1. ACTUALIZAR CONTACTO DEL DISPOSITIVO
-            d = get_or_create_device(db, esp_id) 
-            d.ultimo_contacto = datetime.now(timezone.utc)
-            db.commit() # Commit rápido de último contacto
-            
-            # Si el payload no es JSON, solo termina.
-            if not payload_str or not payload_str.startswith("{"):
-                if parts[-1] == "status":
-                    log.info("STATUS (simple) %s: %s", esp_id, payload_str)
+            payload_str = msg.payload.decode(errors="ignore").strip()
+            parts = msg.topic.split("/")
+            esp_id = parts[1] if len(parts) >= 2 else None
+
+            if not esp_id:
+                log.error("No se pudo extraer esp_id del tópico: %s", msg.topic)
+                mqtt_descartados.inc(topico)
                 return
 
-            # 2. PROCESAMIENTO DE JSON
-            data = json.loads(payload_str)
-            esp_id = data.get("esp_id") or esp_id 
-
-            # A. Actualizar Mecanismos (si los datos vienen en el payload)
-            if all(k in data for k in ("riego", "vent", "luz")):
-                _update_mecanismos_from_telemetria(db, esp_id, data)
-                db.commit() # Commit de la sincronización de mecanismos
-
-            # B. Guardar Lectura y Ejecutar Autocontrol (Solo para /telemetria)
-            if parts[-1] == "telemetria":
-                t, h, s, n = data.get("temp_c"), data.get("hum_amb"), data.get("suelo_pct"), data.get("nivel_pct")
-                valid_sensores = (_is_num(t) and _is_num(h) and _is_num(s) and _is_num(n))
-
-                if valid_sensores:
-                    try:
-                        nueva_lectura = Lectura(
-                            device_id=d.id,
-                            temperatura=float(t),
-                            humedad=float(h),
-                            humedad_suelo=float(s),
-                            nivel_de_agua=float(n),
-                            fecha_hora=datetime.now(timezone.utc)
-                        )
-                        db.add(nueva_lectura)
-                        
-                        log.info(f"Lectura válida ({t}°C/{s}%). Ejecutando Autocontrol...")
-                        
-                        # Ejecutar Autocontrol
-                        procesar_umbrales(db, esp_id, nueva_lectura)
-                        
-                        # COMMIT final de la lectura y umbrales.
-                        db.commit() 
-                        
-                    except Exception as e:
-                        log.error("CRÍTICO: Fallo al persistir lectura/autocontrol. Forzando ROLLBACK.")
-                        log.exception("Detalles del ERROR de DB/Umbrales:")
-                        db.rollback() 
-                        
-                else:
-                    log.info("Skip lectura %s: Datos de sensor inválidos.", esp_id)
-            
-            # La sesión se cerrará automáticamente y se liberará la conexión al salir del 'with'.
-
-        except json.JSONDecodeError:
-            log.error("JSON INVÁLIDO. Topic: %s", msg.topic)
-        except SQLAlchemyError:
-            # Captura errores de sesión/conexión
-            db.rollback() # Asegura rollback si falló antes del commit
-            log.error("FALLO CRÍTICO DE DB. Se realizó ROLLBACK.")
-            log.exception("Detalles del error:")
         except Exception as e:
-            log.exception("ERROR inesperado en on_message: %s", e)
+            log.error("Error al decodificar mensaje o parsear tópico: %s", e)
+            mqtt_descartados.inc(topico)
+            return
+
+        if msg.topic.endswith("/ack"):
+            # no toca la DB: se resuelve acá mismo, sin pasar por la cola de ingesta
+            rastreador.confirmar_ack(esp_id, payload_str)
+            return
+
+        if not get_ingesta().encolar(msg.topic, esp_id, payload_str):
+            mqtt_descartados.inc(topico)
+    finally:
+        on_message_s.observar(time.perf_counter() - t0, topico)
 
 
 def _on_connect(client, userdata, flags, rc):
     """Maneja el evento de conexión MQTT."""
     if rc == 0:
         log.info("Conectado a MQTT (rc=0). Suscripción a tópicos...")
-        client.subscribe(MQTT_BASE_TOPIC, qos=1)
-        client.subscribe(MQTT_STATUS_TOPIC, qos=1)
+        if not config.ingesta_compartida:
+            # con ingesta compartida la telemetría la consumen los procesos de run_ingesta.py
+            client.subscribe(MQTT_BASE_TOPIC, qos=1)
+            client.subscribe(MQTT_STATUS_TOPIC, qos=1)
+        client.subscribe(MQTT_ACK_TOPIC, qos=1)
+        if bandeja is not None:
+            bandeja.reanudar()   # lo que quedó sin publicar durante el corte sale ahora
     else:
         log.warning("Conexión MQTT fallida con rc=%s", rc)
 
@@ -151,10 +75,18 @@ def start_mqtt_listener():
 
     setup_mqtt_client(client) # Configuración adicional
 
+    # El escritor por lotes arranca antes de conectar para no perder mensajes.
+    ingesta = get_ingesta()
+    ingesta.iniciar()
+    atexit.register(ingesta.detener)
+    if bandeja is not None:
+        bandeja.iniciar()    # comandos que quedaron sin enviar en la ejecución anterior
+
     try:
         client.connect("localhost", 1883, keepalive=25)
     except ConnectionRefusedError:
-        log.warning("No se pudo conectar a Mosquitto en localhost:1883.")
-        return
+        # el hilo de paho sigue intentando; mientras tanto los comandos van a la bandeja
+        log.warning("No se pudo conectar a Mosquitto en localhost:1883; se reintenta en segundo plano.")
+        client.connect_async("localhost", 1883, keepalive=25)
 
     client.loop_start()
\ No newline at end of file
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, ConfigDict, field_serializer
 from typing import Optional
-from datetime import datetime
+
+from app.schemas.fechas import FechaUTC
 
 class DeviceIn(BaseModel):
     esp_id: str = Field(..., min_length=1, max_length=64)
@@ -15,6 +16,6 @@ class DeviceOut(BaseModel):
     esp_id: str
     nombre: Optional[str]
     activo: bool
-    ultimo_contacto: Optional[datetime] = None
+    ultimo_contacto: Optional[FechaUTC] = None
 
     model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from app.schemas.fechas import FechaUTC
+
+
+class EventoOut(BaseModel):
+    id: int
+    esp_id: str
+    fecha_hora: FechaUTC
+    tipo: str
+    subtipo: str
+    detalle: str
+    mensaje: str
+
+
+class EventosPagina(BaseModel):
+    eventos: list[EventoOut]
+    siguiente: Optional[int] = None   # valor de `antes_de` para la página siguiente (None = no hay más)
+
+
+class EventosResumen(BaseModel):
+    total: int
+    por_tipo: dict[str, dict[str, int]]   # tipo -> subtipo -> cantidad
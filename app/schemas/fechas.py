@@ -0,0 +1,27 @@
+"""
+Fechas de las respuestas de la API: siempre con zona (UTC).
+
+Todo se guarda en UTC, pero SQLite no conserva la zona de las columnas
+`DateTime(timezone=True)` y lo que se lee vuelve naive; sin la zona, un
+cliente (p. ej. `new Date()` en el frontend) lo toma como hora local.
+
+La convención de los parámetros es la misma: una fecha y hora sin zona
+(`desde`, `hasta`, `since_ts`) se interpreta en UTC, y una con otra zona se
+pasa a UTC antes de compararla con la DB (SQLite compara el texto sin la
+zona); sólo los días `YYYY-MM-DD` del CSV y la exportación son días
+locales (`CSV_TZ`).
+"""
+from datetime import datetime, timezone
+from typing import Annotated
+
+from pydantic import AfterValidator
+
+
+def a_utc(ts: datetime | None) -> datetime | None:
+    """Naive -> UTC; con otra zona, la misma hora en UTC."""
+    if ts is None:
+        return None
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+FechaUTC = Annotated[datetime, AfterValidator(a_utc)]
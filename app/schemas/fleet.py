@@ -0,0 +1,51 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from app.schemas.fechas import FechaUTC
+
+
+class UltimaLecturaOut(BaseModel):
+    id: int
+    fecha_hora: FechaUTC
+    temperatura: float
+    humedad: float
+    humedad_suelo: float
+    nivel_de_agua: float
+
+
+class MecanismosEstado(BaseModel):
+    bomba: bool
+    luz: bool
+    ventilador: bool
+
+
+class ConfigEstado(BaseModel):
+    temperatura: int
+    humedad_suelo: int
+    humedad_ambiente: int
+    margen: int
+
+
+class EstadoDispositivo(BaseModel):
+    esp_id: str
+    nombre: Optional[str] = None
+    activo: bool
+    ultimo_contacto: Optional[FechaUTC] = None
+    presencia: str                      # online / stale / offline
+    lectura: Optional[UltimaLecturaOut] = None
+    mecanismos: Optional[MecanismosEstado] = None
+    config: Optional[ConfigEstado] = None
+
+
+class PresenciaOut(BaseModel):
+    esp_id: str
+    estado: str                         # online / stale / offline
+    visto: Optional[FechaUTC] = None    # último contacto
+    desde: Optional[FechaUTC] = None    # desde cuándo está en `estado`
+    motivo: str                         # contacto, lwt, sin_contacto (o ultimo_contacto si es estimado)
+    estimado: bool                      # True: este proceso no lo vio; sale de ultimo_contacto en la DB
+
+
+class FlotaOut(BaseModel):
+    generado: FechaUTC
+    dispositivos: list[EstadoDispositivo]
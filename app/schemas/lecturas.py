@@ -1,7 +1,8 @@
 from pydantic import BaseModel, Field
-from datetime import datetime
 from typing import Optional
 
+from app.schemas.fechas import FechaUTC
+
 class LecturaIn(BaseModel):
     esp_id: str = Field(..., min_length=1, max_length=64)
     temperatura: float = Field(..., ge=-0, le=50)
@@ -13,7 +14,7 @@ class LecturaIn(BaseModel):
 class LecturaOut(BaseModel):
     id: int
     device_id: int
-    fecha_hora: datetime
+    fecha_hora: FechaUTC
     temperatura: float
     humedad: float
     humedad_suelo: float
@@ -23,3 +24,34 @@ class LecturaOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class SeriePunto(BaseModel):
+    t: FechaUTC
+    n: int
+    temperatura: float
+    temperatura_min: float
+    temperatura_max: float
+    humedad: float
+    humedad_min: float
+    humedad_max: float
+    humedad_suelo: float
+    humedad_suelo_min: float
+    humedad_suelo_max: float
+    nivel_de_agua: float
+    nivel_de_agua_min: float
+    nivel_de_agua_max: float
+
+
+class SerieOut(BaseModel):
+    resolucion: str
+    desde: FechaUTC
+    hasta: FechaUTC
+    puntos: list[SeriePunto]
+
+
+class ImportacionOut(BaseModel):
+    esp_id: str
+    filas: int
+    desde: Optional[FechaUTC] = None
+    hasta: Optional[FechaUTC] = None
@@ -0,0 +1,259 @@
+"""
+Analítica en vivo sobre la telemetría: ventanas deslizantes por device y
+alertas persistidas como `Evento`.
+
+Por device y por sensor se mantiene, sobre las últimas `analitica_ventana`
+lecturas, una EWMA, el mínimo y el máximo (colas monótonas) y la media y la
+varianza (Welford con reemplazo de la muestra que sale). Cada lectura cuesta
+O(1) sin importar el largo de la ventana (`python -m bench.analitica`). Del
+nivel de agua se calcula además la pendiente en %/min a lo largo de la ventana.
+
+Alertas (tipo "alerta"; se emiten al entrar y al salir de la condición, no en
+cada lectura):
+
+- sensor_trabado / sensor_recuperado: con la ventana llena, el rango
+  (máx - mín) de un sensor no supera `analitica_trabado_delta`. Un
+  porcentaje clavado en 0 o 100 no cuenta: un tanque lleno o la humedad
+  saturada son constantes legítimas.
+- caida_brusca: el nivel de agua cae `analitica_caida_pct` o más por debajo
+  de su EWMA previa (vuelve a armarse cuando deja de estar por debajo).
+- tanque_seco / tanque_recuperado: la EWMA del nivel baja de
+  `analitica_tanque_seco_pct` (sale 5 puntos por encima, con histéresis).
+
+La ingesta alimenta las ventanas después del commit de cada lote (sólo con
+lecturas confirmadas) y manda las alertas al diario de eventos
+(`app/servicios/eventos.py`). Con ingesta compartida cada device tiene un
+único proceso dueño, así que sus ventanas están en un solo lugar.
+"""
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from app.core.config import config
+from app.db.models import Lectura
+from app.servicios.metricas import metricas
+
+SENSORES = ("temperatura", "humedad", "humedad_suelo", "nivel_de_agua")
+# sensores en %: en 0 o 100 una ventana sin variación es saturación, no un sensor trabado
+_PORCENTAJES = ("humedad", "humedad_suelo", "nivel_de_agua")
+_HISTERESIS_TANQUE = 5.0
+
+alertas_total = metricas.contador(
+    "grow_analitica_alertas_total", "Alertas de la analítica en vivo, por subtipo.", ("subtipo",))
+
+
+class Ventana:
+    """Estadísticas de las últimas `n` muestras de un sensor, O(1) amortizado por muestra."""
+
+    __slots__ = ("n", "alfa", "valores", "ewma", "media", "m2", "_mins", "_maxs", "_i")
+
+    def __init__(self, n: int, alfa: float):
+        self.n = n
+        self.alfa = alfa
+        self.valores: deque = deque(maxlen=n)
+        self.ewma: float | None = None
+        self.media = 0.0
+        self.m2 = 0.0
+        self._mins: deque = deque()   # (índice, valor) crecientes: el primero es el mínimo
+        self._maxs: deque = deque()   # (índice, valor) decrecientes: el primero es el máximo
+        self._i = 0
+
+    def agregar(self, x: float):
+        self.ewma = x if self.ewma is None else self.ewma + self.alfa * (x - self.ewma)
+
+        valores = self.valores
+        if len(valores) == self.n:
+            # Welford con reemplazo: entra x y sale la muestra más vieja
+            viejo = valores[0]
+            media = self.media + (x - viejo) / self.n
+            self.m2 = max(0.0, self.m2 + (x - viejo) * (x - media + viejo - self.media))
+            self.media = media
+        else:
+            d = x - self.media
+            self.media += d / (len(valores) + 1)
+            self.m2 += d * (x - self.media)
+        valores.append(x)
+
+        i = self._i
+        self._i += 1
+        vence = i - self.n
+        mins, maxs = self._mins, self._maxs
+        while mins and mins[-1][1] >= x:
+            mins.pop()
+        mins.append((i, x))
+        if mins[0][0] <= vence:
+            mins.popleft()
+        while maxs and maxs[-1][1] <= x:
+            maxs.pop()
+        maxs.append((i, x))
+        if maxs[0][0] <= vence:
+            maxs.popleft()
+
+    @property
+    def llena(self) -> bool:
+        return len(self.valores) == self.n
+
+    @property
+    def minimo(self) -> float:
+        return self._mins[0][1]
+
+    @property
+    def maximo(self) -> float:
+        return self._maxs[0][1]
+
+    @property
+    def varianza(self) -> float:
+        k = len(self.valores)
+        return self.m2 / (k - 1) if k > 1 else 0.0
+
+    def resumen(self) -> dict:
+        return {"n": len(self.valores), "ewma": self.ewma, "min": self.minimo, "max": self.maximo,
+                "media": self.media, "varianza": self.varianza}
+
+
+@dataclass(slots=True, frozen=True)
+class Alerta:
+    esp_id: str
+    device_id: int
+    fecha_hora: datetime
+    subtipo: str
+    detalle: str
+    mensaje: str
+
+
+class _EstadoDevice:
+    __slots__ = ("ventanas", "tiempos", "activas")
+
+    def __init__(self, n: int, alfa: float):
+        self.ventanas = {s: Ventana(n, alfa) for s in SENSORES}
+        self.tiempos: deque = deque(maxlen=n)
+        self.activas: set[str] = set()   # condiciones en curso ("trabado:<sensor>", "caida", "seco")
+
+
+class AnaliticaTelemetria:
+    """Ventanas por device y detección de anomalías. Thread-safe."""
+
+    def __init__(
+        self,
+        ventana: int = config.analitica_ventana,
+        alfa: float = config.analitica_alfa,
+        trabado_delta: float = config.analitica_trabado_delta,
+        caida_pct: float = config.analitica_caida_pct,
+        tanque_seco_pct: float = config.analitica_tanque_seco_pct,
+    ):
+        self.ventana = max(2, ventana)
+        self.alfa = alfa
+        self.trabado_delta = trabado_delta
+        self.caida_pct = caida_pct
+        self.tanque_seco_pct = tanque_seco_pct
+        self._lock = threading.Lock()
+        self._devices: dict[str, _EstadoDevice] = {}
+        self._lecturas = 0
+        self._por_subtipo: Counter = Counter()
+
+    # ---------- camino caliente ----------
+
+    def observar(self, esp_id: str, lec: Lectura) -> list[Alerta]:
+        """Suma una lectura confirmada a las ventanas del device; devuelve las alertas nuevas."""
+        with self._lock:
+            st = self._devices.get(esp_id)
+            if st is None:
+                st = self._devices[esp_id] = _EstadoDevice(self.ventana, self.alfa)
+            self._lecturas += 1
+
+            nivel = st.ventanas["nivel_de_agua"]
+            ewma_previa = nivel.ewma
+            for s, v in st.ventanas.items():
+                v.agregar(getattr(lec, s))
+            st.tiempos.append(lec.fecha_hora)
+
+            out: list[tuple[str, str, str]] = []
+            self._detectar(st, lec, ewma_previa, out)
+            if not out:
+                return []
+            alertas = [Alerta(esp_id, lec.device_id, lec.fecha_hora, sub, det, msg) for sub, det, msg in out]
+            for a in alertas:
+                self._por_subtipo[a.subtipo] += 1
+        for a in alertas:
+            alertas_total.inc(a.subtipo)
+        return alertas
+
+    def _transicion(self, st: _EstadoDevice, clave: str, activa: bool) -> bool | None:
+        """True al entrar en la condición, False al salir, None si no cambió."""
+        if activa == (clave in st.activas):
+            return None
+        (st.activas.add if activa else st.activas.discard)(clave)
+        return activa
+
+    def _detectar(self, st: _EstadoDevice, lec: Lectura, ewma_previa: float | None, out: list):
+        for s, v in st.ventanas.items():
+            if not v.llena:
+                continue
+            rango = v.maximo - v.minimo
+            saturado = s in _PORCENTAJES and (v.minimo <= 0.0 or v.maximo >= 100.0)
+            t = self._transicion(st, f"trabado:{s}", rango <= self.trabado_delta and not saturado)
+            if t is True:
+                out.append(("sensor_trabado", s, f"{s} sin variación en {v.n} lecturas (valor {v.valores[-1]:g})"))
+            elif t is False:
+                out.append(("sensor_recuperado", s, f"{s} volvió a variar (rango {rango:g})"))
+
+        nivel = st.ventanas["nivel_de_agua"]
+        x = lec.nivel_de_agua
+        if ewma_previa is not None:
+            caida = ewma_previa - x
+            if self._transicion(st, "caida", caida >= self.caida_pct):
+                out.append(("caida_brusca", "nivel_de_agua",
+                            f"nivel de agua {x:g}% ({caida:.1f} puntos bajo su promedio {ewma_previa:.1f}%)"))
+
+        seco = "seco" in st.activas
+        umbral = self.tanque_seco_pct + (_HISTERESIS_TANQUE if seco else 0.0)
+        t = self._transicion(st, "seco", nivel.ewma < umbral)
+        if t is True:
+            out.append(("tanque_seco", "nivel_de_agua", f"tanque casi vacío (promedio {nivel.ewma:.1f}%)"))
+        elif t is False:
+            out.append(("tanque_recuperado", "nivel_de_agua", f"tanque recuperado (promedio {nivel.ewma:.1f}%)"))
+
+    # ---------- consulta ----------
+
+    @staticmethod
+    def _pendiente_min(st: _EstadoDevice) -> float | None:
+        """Pendiente del nivel de agua a lo largo de la ventana, en puntos por minuto."""
+        t = st.tiempos
+        valores = st.ventanas["nivel_de_agua"].valores
+        if len(t) < 2:
+            return None
+        dt = (t[-1] - t[0]).total_seconds()
+        return (valores[-1] - valores[0]) / dt * 60 if dt > 0 else None
+
+    def estado(self, esp_id: str) -> dict | None:
+        with self._lock:
+            st = self._devices.get(esp_id)
+            if st is None:
+                return None
+            return {
+                "sensores": {s: v.resumen() for s, v in st.ventanas.items()},
+                "nivel_pendiente_min": self._pendiente_min(st),
+                "activas": sorted(st.activas),
+            }
+
+    def olvidar(self, esp_id: str | None = None):
+        """Descarta las ventanas de un device (o de todos)."""
+        with self._lock:
+            if esp_id is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(esp_id, None)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "ventana": self.ventana,
+                "devices": len(self._devices),
+                "lecturas": self._lecturas,
+                "alertas": dict(self._por_subtipo),
+                "activas": {e: sorted(st.activas) for e, st in self._devices.items() if st.activas},
+            }
+
+
+analitica = AnaliticaTelemetria() if config.analitica else None
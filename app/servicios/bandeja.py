@@ -0,0 +1,327 @@
+"""
+Bandeja de salida de los comandos MQTT (tabla `comandos_salientes`).
+
+Un comando que no se puede publicar (broker caído, cliente reconectando,
+publish con error) no se pierde: queda en la bandeja y se publica apenas se
+pueda. Así un corte del broker no deja el estado de `mecanismos` (que el
+autocontrol ya actualizó) distinto del que tiene el ESP32, y la API puede
+responder 202 en lugar de 503.
+
+- Orden por device: mientras un device tenga comandos en la bandeja, los
+  nuevos van detrás de ellos (no se adelantan por el camino normal).
+- Un SET más nuevo al mismo target reemplaza al que esperaba: sólo importa
+  el último valor.
+- Si el publish falla con el cliente conectado, el device se reintenta con
+  espera exponencial (`bandeja_backoff_s`, duplicándose hasta
+  `bandeja_backoff_max_s`).
+- Al reconectar (`_on_connect`) se reanudan todos los devices sin esperar.
+- Lo que tiene más de `bandeja_ttl_s` ya no se envía ("vencido").
+
+Quien guarda (la API, el autocontrol dentro de la transacción de la
+ingesta, la cola de SET) no toca la DB: la bandeja vive en memoria y un
+hilo propio la copia a `comandos_salientes` (y borra lo que se publicó o se
+reemplazó) antes de cada reenvío. Las filas que quedan de una ejecución
+anterior se cargan al arrancar ese hilo. Cada proceso con cliente MQTT (la
+API líder, cada proceso de ingesta compartida) reenvía sólo las suyas
+(`origen`).
+
+Los comandos conservan su id de correlación: el ack que llegue después de
+reenviarlos resuelve el mismo pendiente del rastreador, si no venció.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import delete, select
+
+from app.core.config import config
+from app.db.models import ComandoSaliente
+from app.db.session import SessionLocal
+
+log = logging.getLogger("bandeja")
+
+
+def _utc(ts: datetime) -> datetime:
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+@dataclass(slots=True, eq=False)
+class _Saliente:
+    cmd: dict
+    target: str | None              # SET: uno más nuevo al mismo target lo reemplaza
+    motivo: str
+    creado: datetime
+    fila: int | None = None         # id en comandos_salientes (None: todavía no se copió a la DB)
+
+
+class BandejaSalida:
+    """
+    Comandos pendientes de publicar, por device y en orden, con reintento.
+
+    `publicar(esp_id, cmd) -> bool` hace el publish real y `conectado() ->
+    bool` dice si el cliente MQTT está conectado. Thread-safe: guardan la
+    API, el autocontrol y la cola de comandos; la DB y el reenvío son del
+    hilo de la bandeja.
+    """
+
+    def __init__(
+        self,
+        publicar: Callable[[str, dict], bool],
+        conectado: Callable[[], bool],
+        session_factory=SessionLocal,
+        origen: str = "api",
+        backoff_s: float = config.bandeja_backoff_s,
+        backoff_max_s: float = config.bandeja_backoff_max_s,
+        ttl_s: float = config.bandeja_ttl_s,
+        maximo: int = config.bandeja_max,
+        lote_max: int = config.bandeja_lote_max,
+    ):
+        self._publicar = publicar
+        self._conectado = conectado
+        self.session_factory = session_factory
+        self.origen = origen
+        self.backoff_s = backoff_s
+        self.backoff_max_s = backoff_max_s
+        self.ttl_s = ttl_s
+        self.maximo = maximo
+        self.lote_max = lote_max
+        self._cond = threading.Condition()
+        self._colas: dict[str, deque[_Saliente]] = {}
+        self._total = 0
+        self._borrar: list[int] = []                          # filas publicadas, reemplazadas o vencidas
+        self._reintento: dict[str, tuple[int, float]] = {}    # esp_id -> (fallos seguidos, monotonic del próximo intento)
+        self._hilo: threading.Thread | None = None
+        self._al_salir = False
+        self._parar = threading.Event()
+        self._stats = {"guardados": 0, "reemplazados": 0, "descartados": 0, "publicados": 0, "fallos": 0,
+                       "vencidos": 0, "reanudaciones": 0, "cargados": 0, "errores_db": 0}
+
+    # ---------- lado productor ----------
+
+    def tiene(self, esp_id: str) -> bool:
+        """True si el device tiene comandos esperando (lo nuevo tiene que ir detrás)."""
+        with self._cond:
+            return esp_id in self._colas
+
+    def guardar(self, esp_id: str, cmd: dict, motivo: str = "desconectado") -> bool:
+        """Agrega un comando (ya con su id) al final de la cola del device. False si la bandeja está llena."""
+        if self._hilo is None:
+            self.iniciar()
+        target = cmd.get("target") if cmd.get("cmd") == "SET" else None
+        s = _Saliente(cmd, target, motivo[:64], datetime.now(timezone.utc))
+        with self._cond:
+            cola = self._colas.get(esp_id)
+            if cola is None:
+                cola = self._colas[esp_id] = deque()
+                self._reintento.setdefault(esp_id, (0, 0.0))
+            if target is not None:
+                for viejo in [x for x in cola if x.target == target]:
+                    self._quitar(cola, viejo)
+                    self._stats["reemplazados"] += 1
+            if self._total >= self.maximo:
+                self._stats["descartados"] += 1
+                if not cola:
+                    self._olvidar(esp_id)
+                log.error("Bandeja de salida llena (%d): se descarta un comando %s para %s.",
+                          self.maximo, cmd.get("cmd"), esp_id)
+                return False
+            cola.append(s)
+            self._total += 1
+            self._stats["guardados"] += 1
+            self._cond.notify()
+        log.warning("Comando %s para %s en la bandeja de salida (%s).", cmd.get("cmd"), esp_id, motivo)
+        return True
+
+    def reanudar(self):
+        """El cliente (re)conectó: todos los devices se reintentan ya, sin esperar el backoff."""
+        with self._cond:
+            self._reintento = {e: (0, 0.0) for e in self._colas}
+            self._stats["reanudaciones"] += 1
+            self._cond.notify()
+
+    def _quitar(self, cola: deque, s: _Saliente):
+        # con el lock tomado
+        cola.remove(s)
+        self._total -= 1
+        if s.fila is not None:
+            self._borrar.append(s.fila)
+
+    def _olvidar(self, esp_id: str):
+        # con el lock tomado
+        self._colas.pop(esp_id, None)
+        self._reintento.pop(esp_id, None)
+
+    # ---------- hilo de la bandeja: DB y reenvío ----------
+
+    def _cargar(self):
+        """Filas que quedaron de una ejecución anterior: van antes de lo guardado desde el arranque."""
+        try:
+            with self.session_factory() as db:
+                filas = db.execute(
+                    select(ComandoSaliente).where(ComandoSaliente.origen == self.origen).order_by(ComandoSaliente.id)
+                ).scalars().all()
+                previas: dict[str, list[_Saliente]] = {}
+                for f in filas:
+                    previas.setdefault(f.esp_id, []).append(
+                        _Saliente(json.loads(f.payload), f.target, f.motivo, _utc(f.creado), f.id))
+        except Exception:
+            log.exception("No se pudo leer la bandeja de salida.")
+            return
+        if not previas:
+            return
+        with self._cond:
+            for esp_id, ss in previas.items():
+                cola = self._colas.setdefault(esp_id, deque())
+                cola.extendleft(reversed(ss))
+                self._reintento.setdefault(esp_id, (0, 0.0))
+            n = sum(len(ss) for ss in previas.values())
+            self._total += n
+            self._stats["cargados"] += n
+        log.info("Bandeja de salida (%s): %d comandos de %d devices sin enviar de la ejecución anterior.",
+                 self.origen, n, len(previas))
+
+    def _sincronizar(self):
+        """Copia a la DB lo guardado y borra lo publicado, reemplazado o vencido desde la pasada anterior."""
+        with self._cond:
+            nuevos = [(e, s) for e, cola in self._colas.items() for s in cola if s.fila is None]
+            borrar, self._borrar = self._borrar, []
+        if not nuevos and not borrar:
+            return
+        try:
+            with self.session_factory() as db:
+                if borrar:
+                    db.execute(delete(ComandoSaliente).where(ComandoSaliente.id.in_(borrar)))
+                filas = [ComandoSaliente(origen=self.origen, esp_id=e, cmd=str(s.cmd.get("cmd", ""))[:16],
+                                         target=s.target, payload=json.dumps(s.cmd), creado=s.creado, motivo=s.motivo)
+                         for e, s in nuevos]
+                db.add_all(filas)
+                db.flush()
+                ids = [f.id for f in filas]
+                db.commit()
+        except Exception:
+            log.exception("No se pudo guardar la bandeja de salida en la DB.")
+            with self._cond:
+                self._borrar.extend(borrar)     # se reintenta en la próxima pasada
+                self._stats["errores_db"] += 1
+            return
+        with self._cond:
+            for (e, s), fila in zip(nuevos, ids):
+                if any(x is s for x in self._colas.get(e, ())):
+                    s.fila = fila
+                else:
+                    self._borrar.append(fila)   # se reemplazó mientras se guardaba
+
+    def reintentar(self) -> dict:
+        """Una pasada: publica, en orden, lo de cada device que ya no está esperando el backoff."""
+        ahora = time.monotonic()
+        with self._cond:
+            listos = [e for e, (_, t) in self._reintento.items() if t <= ahora]
+        out = {"publicados": 0, "fallos": 0, "vencidos": 0}
+        for esp_id in listos:
+            if not self._conectado():
+                break
+            for k, v in self._reenviar(esp_id).items():
+                out[k] += v
+        return out
+
+    def _reenviar(self, esp_id: str) -> dict:
+        corte = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_s)
+        publicados = vencidos = 0
+        fallo = False
+        with self._cond:
+            cola = self._colas.get(esp_id)
+            if cola is None:
+                return {"publicados": 0, "fallos": 0, "vencidos": 0}
+            for s in [x for x in cola if x.creado < corte]:
+                self._quitar(cola, s)
+                vencidos += 1
+            # el publish de paho sólo encola en su hilo de red: no demora a quien espera el lock
+            while cola and publicados < self.lote_max:
+                if not self._publicar(esp_id, cola[0].cmd):
+                    fallo = True
+                    break
+                self._quitar(cola, cola[0])
+                publicados += 1
+            if not cola:
+                self._olvidar(esp_id)
+            else:
+                n = self._reintento.get(esp_id, (0, 0.0))[0] + 1 if fallo else 0
+                espera = min(self.backoff_s * 2 ** (n - 1), self.backoff_max_s) if n else 0.0
+                self._reintento[esp_id] = (n, time.monotonic() + espera)
+            restantes = len(cola)
+            self._stats["publicados"] += publicados
+            self._stats["fallos"] += fallo
+            self._stats["vencidos"] += vencidos
+        if vencidos:
+            log.warning("Bandeja de salida: %d comandos para %s vencidos sin enviar.", vencidos, esp_id)
+        if publicados:
+            log.info("Bandeja de salida: %d comandos reenviados a %s (quedan %d).", publicados, esp_id, restantes)
+        return {"publicados": publicados, "fallos": int(fallo), "vencidos": vencidos}
+
+    def _espera(self) -> float:
+        # con el lock tomado: segundos hasta el próximo device a reintentar
+        if not self._reintento or not self._conectado():
+            return self.backoff_max_s       # lo despiertan guardar() y reanudar()
+        return max(0.0, min(t for _, t in self._reintento.values()) - time.monotonic())
+
+    def _bucle(self):
+        self._cargar()
+        while not self._parar.is_set():
+            try:
+                self._sincronizar()
+                with self._cond:
+                    espera = self._espera()
+                    if espera > 0:
+                        self._cond.wait(espera)
+                        continue
+                self.reintentar()
+            except Exception:
+                log.exception("Error en la bandeja de salida.")
+                self._parar.wait(self.backoff_s)
+        self._sincronizar()
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self):
+        """Arranca el hilo de la bandeja (idempotente)."""
+        with self._cond:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="bandeja-salida", daemon=True)
+            self._hilo.start()
+            if self._al_salir:
+                return
+            self._al_salir = True
+        atexit.register(self.detener)   # una vez por instancia, aunque el hilo se reinicie
+
+    def detener(self, timeout: float = 5.0):
+        """Detiene el hilo; lo que no se envió queda en la DB para la próxima ejecución."""
+        self._parar.set()
+        with self._cond:
+            self._cond.notify()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    # ---------- consulta ----------
+
+    def metricas(self, top: int = 20) -> dict:
+        with self._cond:
+            m = dict(self._stats)
+            m["en_espera"] = self._total
+            m["sin_guardar"] = sum(s.fila is None for cola in self._colas.values() for s in cola)
+            m["devices"] = len(self._colas)
+            mayores = sorted(self._colas.items(), key=lambda kv: len(kv[1]), reverse=True)[:top]
+            m["por_device"] = {e: {"comandos": len(cola), "fallos_seguidos": self._reintento.get(e, (0, 0.0))[0]}
+                               for e, cola in mayores}
+        m["capacidad"] = self.maximo
+        m["origen"] = self.origen
+        m["conectado"] = self._conectado()
+        return m
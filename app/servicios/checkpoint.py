@@ -0,0 +1,103 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.core.config import config
+from app.db.session import engine
+
+log = logging.getLogger("checkpoint")
+
+
+class CheckpointWAL:
+    """
+    Checkpoint del WAL de SQLite en un hilo propio, cada `intervalo_s`.
+
+    Sin esto, el checkpoint automático lo hace la conexión que comete la
+    transacción que cruza el umbral de páginas: le toca a la ingesta, y en una
+    tarjeta SD eso son cientos de ms de fsync en medio de un lote. Acá corre
+    PASSIVE (no espera a lectores ni escritores) con una conexión propia, fuera
+    del pool de escritura; si el WAL superó `wal_max_mb`, TRUNCATE para
+    devolver el espacio.
+    """
+
+    def __init__(
+        self,
+        ruta_db: str,
+        intervalo_s: float = config.sqlite_checkpoint_s,
+        wal_max_mb: int = config.sqlite_wal_max_mb,
+    ):
+        self._ruta = ruta_db
+        self._intervalo_s = intervalo_s
+        self._wal_max = wal_max_mb * 1024 * 1024
+        self._parar = threading.Event()
+        self._hilo: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkpoints": 0,
+            "truncados": 0,
+            "bloqueados": 0,          # no pudo completar (un lector en curso): se reintenta en el próximo
+            "paginas": 0,
+            "ultimo_ms": 0.0,
+            "max_ms": 0.0,
+            "wal_mb": 0.0,
+        }
+
+    def _wal_bytes(self) -> int:
+        try:
+            return os.path.getsize(self._ruta + "-wal")
+        except OSError:
+            return 0
+
+    def ejecutar(self, con: sqlite3.Connection) -> dict:
+        """Un checkpoint: devuelve el modo usado, si quedó bloqueado y las páginas copiadas."""
+        modo = "TRUNCATE" if self._wal_bytes() > self._wal_max else "PASSIVE"
+        t0 = time.perf_counter()
+        busy, _, copiadas = con.execute(f"PRAGMA wal_checkpoint({modo})").fetchone()
+        ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            s = self._stats
+            s["checkpoints"] += 1
+            s["truncados"] += modo == "TRUNCATE"
+            s["bloqueados"] += bool(busy)
+            s["paginas"] += max(copiadas, 0)
+            s["ultimo_ms"] = round(ms, 2)
+            s["max_ms"] = round(max(s["max_ms"], ms), 2)
+            s["wal_mb"] = round(self._wal_bytes() / 1024 / 1024, 2)
+        return {"modo": modo, "bloqueado": bool(busy), "paginas": copiadas}
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="checkpoint-wal", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+
+    def _bucle(self):
+        con = sqlite3.connect(self._ruta, timeout=config.sqlite_busy_timeout_ms / 1000, check_same_thread=False)
+        try:
+            while not self._parar.wait(self._intervalo_s):
+                try:
+                    self.ejecutar(con)
+                except sqlite3.Error:
+                    log.exception("Fallo en el checkpoint del WAL.")
+        finally:
+            con.close()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return dict(self._stats, intervalo_s=self._intervalo_s)
+
+
+def crear_checkpoint(eng) -> CheckpointWAL | None:
+    """El checkpointer de la DB del engine (None si no es un archivo SQLite)."""
+    if eng.dialect.name != "sqlite" or eng.url.database in (None, "", ":memory:"):
+        return None
+    return CheckpointWAL(eng.url.database)
+
+
+checkpoint_wal = crear_checkpoint(engine)
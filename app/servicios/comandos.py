@@ -0,0 +1,390 @@
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from typing import Callable
+
+log = logging.getLogger("comandos")
+
+# target del comando SET -> atributo de EstadoMecanismos
+_ATRIBUTO = {"RIEGO": "bomba", "VENT": "ventilador", "LUZ": "luz"}
+
+TTL_S = 60.0   # un comando sin confirmar se olvida a los 60 s
+
+
+@dataclass(slots=True)
+class ComandoPendiente:
+    cid: str
+    esp_id: str
+    cmd: str
+    target: str | None
+    value: str | None
+    enviado: float                       # time.monotonic() al publicar
+    futuro: Future = field(default_factory=Future)
+    # cómo salió por MQTT: True, "diferido" (bandeja), "reemplazado" (otro SET en cola) o False (perdido)
+    publicado: Future = field(default_factory=Future)
+    diferido: bool = False               # quedó en la bandeja de salida (se publica al reconectar)
+    incierto: bool = False               # el líder no respondió a tiempo: puede haberse publicado o no
+
+
+class RastreadorComandos:
+    """
+    Seguimiento de comandos enviados por MQTT.
+
+    Cada comando lleva un id de correlación (`"id"` en el payload) y un
+    Future. El Future se resuelve con:
+      - "ack": el ESP32 publicó `invernaderos/{esp_id}/ack` con ese id
+        (`{"id": ..., "ok": true}`; con `"ok": false` -> "rechazado");
+      - "telemetria": llegó telemetría con el target en el valor pedido (SET)
+        o cualquier telemetría (STATUS, REBOOT), para firmware que no manda ack;
+      - "reemplazado": otro SET posterior al mismo target salió (`salio()`)
+        y lo dejó sin efecto. Hasta entonces el anterior sigue pendiente: si
+        el nuevo no se llega a publicar (`descartar()`), el viejo no se pierde.
+    Lo que no se confirma en TTL_S se descarta ("vencido").
+
+    Thread-safe: registran la API y el autocontrol, resuelven el hilo de paho
+    (ack) y el escritor de ingesta (telemetría ya confirmada en la DB).
+    """
+
+    def __init__(self, ttl_s: float = TTL_S):
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._por_esp: dict[str, list[ComandoPendiente]] = {}
+        self._por_id: dict[str, ComandoPendiente] = {}
+        # id de un SET_MULTI -> (momento de envío, SET que agrupa, qué hacer si se rechaza)
+        self._lotes: dict[str, tuple[float, list[ComandoPendiente], Callable | None]] = {}
+        self._latencias: deque = deque(maxlen=512)
+        self._stats = {"enviados": 0, "ack": 0, "telemetria": 0, "rechazado": 0,
+                       "reemplazado": 0, "vencido": 0}
+        # ingesta en otro proceso: cada observación se reenvía al que registró los comandos
+        self.al_observar: Callable[[str, object, float | None], None] | None = None
+
+    def registrar(self, esp_id: str, cmd: dict) -> ComandoPendiente:
+        """Asigna id de correlación al comando (lo agrega a `cmd`) y devuelve su pendiente."""
+        cid = cmd.setdefault("id", uuid.uuid4().hex[:12])
+        p = ComandoPendiente(cid, esp_id, cmd.get("cmd"), cmd.get("target"), cmd.get("value"), time.monotonic())
+        with self._lock:
+            self._podar(p.enviado)
+            self._por_esp.setdefault(esp_id, []).append(p)
+            self._por_id[cid] = p
+            self._stats["enviados"] += 1
+        return p
+
+    def agrupar(self, cid: str, pendientes: list[ComandoPendiente], al_rechazar: Callable | None = None):
+        """
+        Registra el id de un SET_MULTI que agrupa varios SET ya registrados: su
+        ack los confirma a todos. Si el ESP32 lo rechaza, los SET siguen
+        pendientes y se llama `al_rechazar(pendientes)` (p. ej. para reenviarlos sueltos).
+        """
+        with self._lock:
+            self._lotes[cid] = (time.monotonic(), pendientes, al_rechazar)
+
+    def salio(self, p: ComandoPendiente):
+        """El comando se publicó (o quedó en la bandeja): los SET anteriores al mismo target quedan reemplazados."""
+        if p.cmd != "SET":
+            return
+        with self._lock:
+            lista = self._por_esp.get(p.esp_id, ())
+            for viejo in [q for q in lista if q is not p and q.cmd == "SET" and q.target == p.target
+                          and q.enviado <= p.enviado]:
+                self._resolver(viejo, "reemplazado")
+
+    def descartar(self, p: ComandoPendiente):
+        """Quita un pendiente que no se llegó a publicar."""
+        with self._lock:
+            self._quitar(p)
+            self._stats["enviados"] -= 1
+        p.futuro.cancel()
+
+    # ---------- resolución ----------
+
+    def confirmar_ack(self, esp_id: str, payload: str):
+        """Ack del ESP32 (`invernaderos/{esp_id}/ack`). Se llama desde el hilo de paho."""
+        try:
+            data = json.loads(payload)
+            cid = data["id"]
+        except (ValueError, KeyError, TypeError):
+            log.warning("ACK inválido de %s: %s", esp_id, payload)
+            return
+        ok = data.get("ok", True)
+        with self._lock:
+            lote = self._lotes.pop(cid, None)
+            if lote is None:
+                p = self._por_id.get(cid)
+                if p is None or p.esp_id != esp_id:
+                    return
+                self._resolver(p, "ack" if ok else "rechazado")
+                return
+            _, miembros, al_rechazar = lote
+            vivos = [p for p in miembros if p.cid in self._por_id and p.esp_id == esp_id]
+            if ok:
+                for p in vivos:
+                    self._resolver(p, "ack")
+        if not ok and vivos and al_rechazar:
+            al_rechazar(vivos)
+
+    def observar_estado(self, esp_id: str, estado, antes_de: float | None = None, propagar: bool = True):
+        """
+        Telemetría ya persistida de esp_id (estado = EstadoMecanismos o None).
+        Sólo cuenta para comandos enviados antes de `antes_de` (inicio del lote):
+        los que publicó el propio autocontrol del lote todavía no llegaron al ESP32.
+        """
+        if propagar and self.al_observar:
+            self.al_observar(esp_id, estado, antes_de)
+        with self._lock:
+            lista = self._por_esp.get(esp_id)
+            if not lista:
+                return
+            for p in list(lista):
+                if antes_de is not None and p.enviado >= antes_de:
+                    continue
+                if p.cmd != "SET":
+                    self._resolver(p, "telemetria")
+                elif p.cmd == "SET" and estado is not None and p.target in _ATRIBUTO:
+                    if bool(getattr(estado, _ATRIBUTO[p.target])) == (p.value == "ON"):
+                        self._resolver(p, "telemetria")
+
+    def _resolver(self, p: ComandoPendiente, resultado: str):
+        # con el lock tomado
+        self._quitar(p)
+        self._stats[resultado] += 1
+        if resultado in ("ack", "telemetria"):
+            self._latencias.append(time.monotonic() - p.enviado)
+        if not p.futuro.done():
+            p.futuro.set_result(resultado)
+
+    def _quitar(self, p: ComandoPendiente):
+        self._por_id.pop(p.cid, None)
+        lista = self._por_esp.get(p.esp_id)
+        if lista and p in lista:
+            lista.remove(p)
+            if not lista:
+                del self._por_esp[p.esp_id]
+
+    def _podar(self, ahora: float):
+        # _por_id está en orden de envío: se corta en el primero que no venció
+        while self._por_id:
+            p = next(iter(self._por_id.values()))
+            if ahora - p.enviado <= self._ttl_s:
+                break
+            self._resolver(p, "vencido")
+        while self._lotes:
+            cid, (enviado, _, _) = next(iter(self._lotes.items()))
+            if ahora - enviado <= self._ttl_s:
+                break
+            del self._lotes[cid]
+
+    def metricas(self) -> dict:
+        with self._lock:
+            self._podar(time.monotonic())
+            m = dict(self._stats)
+            m["pendientes"] = len(self._por_id)
+            lat = sorted(self._latencias)
+        if lat:
+            m["latencia_p50_ms"] = round(lat[len(lat) // 2] * 1000, 1)
+            m["latencia_p95_ms"] = round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 1)
+        return m
+
+
+rastreador = RastreadorComandos()
+
+
+def marcar_publicado(p: ComandoPendiente, resultado):
+    """Resuelve `p.publicado` (la primera vez: un reenvío posterior no lo cambia)."""
+    try:
+        p.publicado.set_result(resultado)
+    except InvalidStateError:
+        pass
+
+
+# ============================================================
+# COLA DE SALIDA (coalescencia de SET por device)
+# ============================================================
+
+@dataclass(slots=True)
+class _LoteSet:
+    limite: float                                   # monotonic en que se publica
+    targets: dict[str, tuple[str, ComandoPendiente]] = field(default_factory=dict)
+
+
+class ColaComandos:
+    """
+    Cola de salida por device para los SET. Los que llegan dentro de
+    `ventana_ms` se publican juntos:
+      - un solo target: `{"cmd": "SET", ...}` como siempre;
+      - varios, con `set_multi`: un solo `{"cmd": "SET_MULTI", "targets":
+        {"RIEGO": "ON", "LUZ": "OFF"}, "id": ...}`;
+      - varios, sin `set_multi` (firmware que sólo entiende SET): un SET por
+        target, uno detrás del otro.
+    Un SET posterior al mismo target reemplaza al anterior todavía en cola,
+    así que ese nunca se publica (el rastreador lo resuelve como
+    "reemplazado" cuando sale el nuevo). Si un device rechaza un SET_MULTI
+    (ack con `"ok": false`) pasa a recibir SET sueltos y el lote se reenvía
+    así, desde el hilo de la cola (el ack llega en el hilo de paho, que no
+    debe publicar).
+
+    `publicar(esp_id, cmd)` hace el publish real: True si salió, "diferido"
+    si quedó para después (bandeja de salida), False si se perdió. Con eso se
+    resuelve `publicado` de cada pendiente. Con ventana 0 se publica en el
+    hilo que llama, sin demora.
+    """
+
+    def __init__(self, publicar: Callable[[str, dict], bool | str], ventana_ms: int = 50,
+                 set_multi: bool = False, rastreador: RastreadorComandos = rastreador):
+        self._publicar = publicar
+        self._ventana_s = ventana_ms / 1000
+        self._set_multi = set_multi
+        self._rastreador = rastreador
+        self._cond = threading.Condition()
+        self._lotes: dict[str, _LoteSet] = {}       # en orden de límite (ventana fija)
+        self._solo_set: set[str] = set()            # devices que rechazaron SET_MULTI
+        self._hilo: threading.Thread | None = None
+        self._al_salir = False                      # atexit ya registrado
+        self._por_device: dict[str, list[int]] = {}  # esp_id -> [pedidos, publicaciones]
+        self._stats = {"pedidos": 0, "publicaciones": 0, "reemplazados": 0, "set_multi": 0,
+                       "fallos": 0, "degradados": 0}
+
+    def encolar(self, esp_id: str, cmd: dict, pendiente: ComandoPendiente):
+        """Agrega un SET (ya registrado en el rastreador) al lote del device."""
+        if self._ventana_s <= 0:
+            with self._cond:
+                self._contar(esp_id, pedidos=1)
+            self._publicar_lote(esp_id, {cmd["target"]: (cmd["value"], pendiente)})
+            return
+        with self._cond:
+            self._contar(esp_id, pedidos=1)
+            lote = self._lotes.get(esp_id)
+            if lote is None:
+                lote = self._lotes[esp_id] = _LoteSet(time.monotonic() + self._ventana_s)
+                self._arrancar()
+                self._cond.notify()
+            elif cmd["target"] in lote.targets:
+                self._stats["reemplazados"] += 1
+                marcar_publicado(lote.targets[cmd["target"]][1], "reemplazado")
+            lote.targets[cmd["target"]] = (cmd["value"], pendiente)
+
+    def vaciar(self, esp_id: str | None = None):
+        """Publica ya lo que esté en cola (de un device o de todos); p. ej. antes de un STATUS."""
+        with self._cond:
+            if esp_id is None:
+                lotes = list(self._lotes.items())
+                self._lotes.clear()
+            else:
+                lote = self._lotes.pop(esp_id, None)
+                lotes = [(esp_id, lote)] if lote else []
+        for esp, lote in lotes:
+            self._publicar_lote(esp, lote.targets)
+
+    # ---------- publicación ----------
+
+    def _publicar_lote(self, esp_id: str, targets: dict[str, tuple[str, ComandoPendiente]]):
+        if len(targets) > 1 and self._set_multi and esp_id not in self._solo_set:
+            cmd = {"cmd": "SET_MULTI", "targets": {t: v for t, (v, _) in targets.items()},
+                   "id": uuid.uuid4().hex[:12]}
+            pendientes = [p for _, p in targets.values()]
+            self._rastreador.agrupar(cmd["id"], pendientes, al_rechazar=lambda ps: self._degradar(esp_id, ps))
+            ok = self._publicar(esp_id, cmd)
+            with self._cond:
+                self._stats["set_multi"] += 1
+                self._contar(esp_id, publicaciones=1)
+            self._salida(pendientes, ok)
+            return
+        for t, (v, p) in targets.items():
+            ok = self._publicar(esp_id, {"cmd": "SET", "target": t, "value": v, "id": p.cid})
+            with self._cond:
+                self._contar(esp_id, publicaciones=1)
+            self._salida([p], ok)
+
+    def _salida(self, pendientes: list[ComandoPendiente], ok: bool | str):
+        if not ok:
+            with self._cond:
+                self._stats["fallos"] += len(pendientes)
+        for p in pendientes:
+            if ok:
+                self._rastreador.salio(p)
+            else:
+                self._rastreador.descartar(p)
+            marcar_publicado(p, ok)
+
+    def _degradar(self, esp_id: str, pendientes: list[ComandoPendiente]):
+        """
+        El device no entiende SET_MULTI: de acá en más SET sueltos, y el lote
+        vuelve a la cola (lo publica el hilo de la cola, no el de paho). Lo
+        que ya esté en cola para el mismo target es más nuevo y manda.
+        """
+        with self._cond:
+            if esp_id not in self._solo_set:
+                self._solo_set.add(esp_id)
+                self._stats["degradados"] += 1
+                log.warning("%s rechazó SET_MULTI: se le envían SET sueltos.", esp_id)
+            lote = self._lotes.get(esp_id)
+            if lote is None:
+                lote = self._lotes[esp_id] = _LoteSet(time.monotonic() + self._ventana_s)
+                self._arrancar()
+                self._cond.notify()
+            for p in pendientes:
+                lote.targets.setdefault(p.target, (p.value, p))
+
+    def _contar(self, esp_id: str, pedidos: int = 0, publicaciones: int = 0):
+        # con el lock tomado
+        c = self._por_device.setdefault(esp_id, [0, 0])
+        c[0] += pedidos
+        c[1] += publicaciones
+        self._stats["pedidos"] += pedidos
+        self._stats["publicaciones"] += publicaciones
+
+    # ---------- hilo de envío ----------
+
+    def _arrancar(self):
+        # con el lock tomado
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, name="cola-comandos", daemon=True)
+            self._hilo.start()
+            if not self._al_salir:
+                self._al_salir = True
+                atexit.register(self.vaciar)
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._lotes:
+                    self._cond.wait()
+                ahora = time.monotonic()
+                esp_id, lote = next(iter(self._lotes.items()))
+                if lote.limite > ahora:
+                    self._cond.wait(lote.limite - ahora)
+                    continue
+                listos = []
+                while self._lotes:
+                    esp_id, lote = next(iter(self._lotes.items()))
+                    if lote.limite > ahora:
+                        break
+                    listos.append((esp_id, self._lotes.pop(esp_id)))
+            for esp_id, lote in listos:
+                try:
+                    self._publicar_lote(esp_id, lote.targets)
+                except Exception:
+                    log.exception("Fallo al publicar los comandos en cola de %s.", esp_id)
+
+    def metricas(self, esp_id: str | None = None, top: int = 20) -> dict:
+        """Totales y, por device, pedidos vs. publicaciones (ratio = pedidos / publicaciones)."""
+        ratio = lambda ped, pub: round(ped / pub, 2) if pub else None
+        with self._cond:
+            if esp_id is not None:
+                ped, pub = self._por_device.get(esp_id, (0, 0))
+                return {"esp_id": esp_id, "pedidos": ped, "publicaciones": pub, "ratio": ratio(ped, pub),
+                        "set_multi": esp_id not in self._solo_set and self._set_multi,
+                        "en_cola": len(self._lotes[esp_id].targets) if esp_id in self._lotes else 0}
+            m = dict(self._stats)
+            m["ventana_ms"] = round(self._ventana_s * 1000)
+            m["en_cola"] = sum(len(l.targets) for l in self._lotes.values())
+            m["ratio"] = ratio(m["pedidos"], m["publicaciones"])
+            mayores = sorted(self._por_device.items(), key=lambda kv: kv[1][1], reverse=True)[:top]
+        m["por_device"] = {e: {"pedidos": ped, "publicaciones": pub, "ratio": ratio(ped, pub)}
+                           for e, (ped, pub) in mayores}
+        return m
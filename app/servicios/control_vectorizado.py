@@ -0,0 +1,294 @@
+import logging
+import threading
+from dataclasses import replace
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.models import Mecanismos, Lectura
+from app.servicios.mqtt_funciones import enviar_cmd_mqtt
+from app.servicios.metricas import decisiones
+from app.servicios.eventos import diario
+from app.servicios.registro import registro, ConfigSnapshot, EstadoMecanismos
+from app.servicios.umbrales import procesar_umbrales
+from app.servicios.cooldown import CooldownStore, cooldowns
+from app.servicios.efectos import EfectosLote, diferir
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa procesar_umbrales
+    np = None
+
+log = logging.getLogger("control")
+
+
+def compilar_config(cfg: ConfigSnapshot) -> tuple:
+    """
+    Config -> fila de la tabla de reglas:
+    (low_suelo, high_suelo, high_hum, low_temp, high_temp, hay_suelo, hay_hum, hay_temp).
+
+    Los umbrales se calculan una vez por cambio de config, con las mismas
+    operaciones en float que procesar_umbrales, para que las decisiones den
+    exactamente igual.
+    """
+    try:
+        margen_base = float(cfg.margen or 0)
+    except ValueError:
+        margen_base = 0.0
+    margen_temp = min(margen_base, 2.0)
+    margen_suelo = max(margen_base, 5.0)
+    margen_hum_amb = max(margen_base, 5.0)
+
+    def _num(v):
+        if v is None:
+            return None
+        try:
+            return float(v)
+        except ValueError:
+            return None
+
+    s, h, t = _num(cfg.humedad_suelo), _num(cfg.humedad_ambiente), _num(cfg.temperatura)
+    nan = float("nan")
+    return (
+        s - margen_suelo if s is not None else nan,
+        s + margen_suelo if s is not None else nan,
+        h + margen_hum_amb if h is not None else nan,
+        t - margen_temp if t is not None else nan,
+        t + margen_temp if t is not None else nan,
+        s is not None,
+        h is not None,
+        t is not None,
+    )
+
+
+class MotorControl:
+    """
+    Autocontrol por lotes: misma lógica que `umbrales.procesar_umbrales`
+    (histéresis de riego, ventilador por humedad, ventilador/luz por
+    temperatura, cooldown por actuador), evaluada para muchos devices a la vez
+    con NumPy.
+
+    Cada device tiene una fila fija en la tabla de reglas (umbrales ya
+    calculados a partir de su Config). El cooldown se consulta en el
+    CooldownStore compartido, sólo para los devices que piden un cambio. Una "ola" es un
+    conjunto de lecturas con a lo sumo una por device, que se evalúa en una
+    sola pasada de máscaras en el mismo orden que la cadena de if/else.
+    """
+
+    _CAMPOS = ("low_suelo", "high_suelo", "high_hum", "low_temp", "high_temp")
+
+    def __init__(self, store: CooldownStore | None = None, capacidad: int = 64):
+        if np is None:
+            raise RuntimeError("MotorControl requiere NumPy.")
+        self._cooldowns = store or cooldowns
+        self._lock = threading.Lock()
+        self._filas: dict[str, int] = {}
+        self._config: list[ConfigSnapshot | None] = []
+        self._reglas = {c: np.full(capacidad, np.nan) for c in self._CAMPOS}
+        self._hay = np.zeros((3, capacidad), dtype=bool)          # suelo, hum, temp configurados
+
+    # ---------- tabla de reglas ----------
+
+    def _crecer(self, n: int):
+        cap = len(self._hay[0])
+        if n <= cap:
+            return
+        nueva = max(n, cap * 2)
+        for c, arr in self._reglas.items():
+            self._reglas[c] = np.concatenate([arr, np.full(nueva - cap, np.nan)])
+        self._hay = np.concatenate([self._hay, np.zeros((3, nueva - cap), dtype=bool)], axis=1)
+
+    def _fila(self, esp_id: str, cfg: ConfigSnapshot) -> int:
+        """Fila del device; recompila sus reglas si la Config cambió (snapshot nuevo)."""
+        i = self._filas.get(esp_id)
+        if i is None:
+            i = self._filas[esp_id] = len(self._config)
+            self._config.append(None)
+            self._crecer(i + 1)
+        if self._config[i] is not cfg:
+            *umbrales, hs, hh, ht = compilar_config(cfg)
+            for c, v in zip(self._CAMPOS, umbrales):
+                self._reglas[c][i] = v
+            self._hay[:, i] = (hs, hh, ht)
+            self._config[i] = cfg
+        return i
+
+    # ---------- evaluación ----------
+
+    def evaluar(self, db: Session, items: list[tuple[str, Lectura]], efectos: EfectosLote | None = None):
+        """
+        Evalúa una ola (a lo sumo una lectura por esp_id) y aplica los cambios
+        (sin commit). Con `efectos`, comandos, eventos y métricas salen recién
+        cuando el lote confirma.
+        """
+        with self._lock:
+            self._evaluar(db, items, efectos)
+
+    def _evaluar(self, db: Session, items: list[tuple[str, Lectura]], efectos: EfectosLote | None):
+        esps, devs, filas, mechs, creados, lects = [], [], [], [], set(), []
+        for esp_id, lectura in items:
+            entrada = registro.obtener(db, esp_id, crear=False)
+            if not entrada:
+                log.warning("[auto] dispositivo %s no encontrado.", esp_id)
+                continue
+            if not entrada.config:
+                log.warning("[auto] configuración no encontrada para %s.", esp_id)
+                continue
+            if entrada.mecanismos is None:
+                nuevo = Mecanismos(device_id=entrada.device_id, bomba=False, luz=False, ventilador=False)
+                db.add(nuevo)
+                db.flush()
+                mech = EstadoMecanismos(nuevo.id, False, False, False)
+                creados.add(esp_id)
+            else:
+                mech = replace(entrada.mecanismos)
+            esps.append(esp_id)
+            devs.append(entrada.device_id)
+            filas.append(self._fila(esp_id, entrada.config))
+            mechs.append(mech)
+            lects.append(lectura)
+        if not esps:
+            return
+
+        idx = np.fromiter(filas, dtype=np.intp, count=len(filas))
+        suelo, hay_s = _columna(lects, "humedad_suelo")
+        hum, hay_h = _columna(lects, "humedad")
+        temp, hay_t = _columna(lects, "temperatura")
+        bomba = np.fromiter((m.bomba for m in mechs), dtype=bool, count=len(mechs))
+        vent = np.fromiter((m.ventilador for m in mechs), dtype=bool, count=len(mechs))
+        luz = np.fromiter((m.luz for m in mechs), dtype=bool, count=len(mechs))
+        dev_ids = np.fromiter(devs, dtype=np.int64, count=len(devs))
+        ahora = self._cooldowns.reloj()
+
+        def permitir(act: str, pide: "np.ndarray") -> "np.ndarray":
+            # el cooldown sólo se consulta (y registra) donde la condición previa del `and` es cierta
+            cand = np.flatnonzero(pide)
+            if cand.size:
+                pide = pide.copy()
+                pide[cand] = self._cooldowns.permitir_lote(dev_ids[cand].tolist(), act, ahora, efectos)
+            return pide
+
+        r = self._reglas
+
+        # --- 1. RIEGO ---
+        hay = hay_s & self._hay[0, idx]
+        seco = hay & (suelo < r["low_suelo"][idx])
+        mojado = hay & ~seco & (suelo > r["high_suelo"][idx])
+        riego_on = seco & ~bomba
+        riego_off = mojado & bomba
+        ok_riego = permitir("riego", riego_on | riego_off)
+        bomba = bomba ^ ok_riego
+
+        # --- 2. HUMEDAD AMBIENTAL -> ventilador ON ---
+        hay = hay_h & self._hay[1, idx]
+        ok_hum = permitir("vent", hay & (hum > r["high_hum"][idx]) & ~vent)
+        vent = vent | ok_hum
+
+        # --- 3. TEMPERATURA -> ventilador / luz ---
+        hay = hay_t & self._hay[2, idx]
+        calor = hay & (temp > r["high_temp"][idx])
+        frio = hay & ~calor & (temp < r["low_temp"][idx])
+        ideal = hay & ~calor & ~frio
+        ok_vent = permitir("vent", (calor & ~vent) | (frio & vent))
+        vent = vent ^ ok_vent
+        ok_luz = permitir("luz", (calor & luz) | ((frio | ideal) & ~luz))
+        luz = luz ^ ok_luz
+
+        # --- aplicar ---
+        cambio = ok_riego | ok_hum | ok_vent | ok_luz
+        filas_db = []
+        for i in np.flatnonzero(cambio).tolist():
+            esp_id, mech = esps[i], mechs[i]
+            cambios = {}
+            if ok_riego[i]:
+                cambios["riego"] = "ON" if bomba[i] else "OFF"
+                diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "RIEGO", "value": cambios["riego"]}, esp_id)
+            if ok_hum[i] or ok_vent[i]:
+                cambios["ventilador"] = "ON" if vent[i] else "OFF"
+                diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "VENT", "value": cambios["ventilador"]}, esp_id)
+            if ok_luz[i]:
+                cambios["luz"] = "ON" if luz[i] else "OFF"
+                diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "LUZ", "value": cambios["luz"]}, esp_id)
+            for actuador, valor in cambios.items():
+                diferir(efectos, decisiones.inc, actuador, valor)
+            diferir(efectos, diario.actuadores, esp_id, cambios, device_id=devs[i])
+            mech.bomba, mech.ventilador, mech.luz = bool(bomba[i]), bool(vent[i]), bool(luz[i])
+            filas_db.append({"id": mech.id, "bomba": mech.bomba, "ventilador": mech.ventilador, "luz": mech.luz})
+            log.info("[auto control] %s → cambios: %s", esp_id, cambios)
+
+        if filas_db:
+            db.execute(update(Mecanismos), filas_db)
+        for i, esp_id in enumerate(esps):
+            if cambio[i] or esp_id in creados:
+                registro.actualizar_mecanismos(esp_id, mechs[i])
+        log.debug("[auto control] ola de %d lecturas, %d con cambios.", len(esps), len(filas_db))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {"devices": len(self._filas), "capacidad": len(self._hay[0])}
+
+
+def _columna(lects: list[Lectura], attr: str):
+    """Valores float de una métrica y máscara de presentes (None -> ausente)."""
+    vals = np.empty(len(lects))
+    hay = np.ones(len(lects), dtype=bool)
+    for i, l in enumerate(lects):
+        v = getattr(l, attr)
+        if v is None:
+            vals[i], hay[i] = np.nan, False
+            continue
+        try:
+            vals[i] = float(v)
+        except ValueError:
+            vals[i], hay[i] = np.nan, False
+    return vals, hay
+
+
+class LoteControl:
+    """
+    Acumula las lecturas de un lote de ingesta en olas. Antes de tocar los
+    mecanismos de un device con una lectura pendiente (sincronización desde
+    telemetría u otra lectura suya) se evalúa la ola, así cada device ve sus
+    mensajes en el mismo orden que con procesar_umbrales mensaje a mensaje.
+
+    Los efectos fuera de la DB (SET, diario, métricas) van a `efectos`, que
+    la ingesta aplica después del commit. Un fallo del autocontrol se
+    propaga: la ingesta vuelve atrás el lote (lecturas incluidas) y descarta
+    sus efectos, como el on_message original.
+    """
+
+    def __init__(self, motor: MotorControl | None, db: Session, efectos: EfectosLote | None = None):
+        self._motor = motor
+        self._db = db
+        self._efectos = efectos
+        self._pendientes: dict[str, Lectura] = {}
+
+    def pendiente(self, esp_id: str) -> bool:
+        return esp_id in self._pendientes
+
+    def agregar(self, esp_id: str, lectura: Lectura):
+        if self._motor is None:
+            # camino escalar, mensaje a mensaje
+            procesar_umbrales(self._db, esp_id, lectura, self._efectos)
+            return
+        if esp_id in self._pendientes:
+            self.evaluar()
+        self._pendientes[esp_id] = lectura
+
+    def evaluar(self):
+        if not self._pendientes:
+            return
+        items = list(self._pendientes.items())
+        self._pendientes.clear()
+        self._motor.evaluar(self._db, items, self._efectos)
+
+
+motor_control = MotorControl() if np is not None else None
+if motor_control is None and config.control_vectorizado:
+    log.warning("CONTROL_VECTORIZADO activo pero NumPy no está instalado: el autocontrol va mensaje a mensaje.")
+
+
+def lote_control(db: Session, efectos: EfectosLote | None = None) -> LoteControl:
+    """Acumulador de autocontrol para un lote (vectorizado si hay NumPy y está habilitado)."""
+    return LoteControl(motor_control if config.control_vectorizado else None, db, efectos)
@@ -0,0 +1,222 @@
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import delete, insert, select
+
+from app.core.config import config
+from app.db.session import SessionLocal
+from app.db.models import CooldownActuador, Device
+from app.servicios.efectos import EfectosLote
+
+log = logging.getLogger("cooldown")
+
+COOLDOWN_S = 30  # segundos mínimos entre cambios automáticos de un mismo actuador
+
+
+@dataclass(slots=True)
+class EstadoCooldown:
+    ultimo: float   # reloj monotónico del último cambio permitido
+
+
+class CooldownStore:
+    """
+    Cooldown por (device_id, actuador) compartido por el autocontrol escalar y
+    el vectorizado.
+
+    Los tiempos son monotónicos (no saltan con NTP). Cada `snapshot_s` se
+    guardan en la tabla `cooldowns` los que siguen vigentes, convertidos a
+    hora UTC, y al arrancar se restauran: un reinicio ya no habilita a todos
+    los actuadores a cambiar de inmediato. Lo vencido se descarta en cada
+    snapshot (una entrada vencida equivale a no tener entrada), así el dict
+    queda acotado a los actuadores que cambiaron en los últimos `cooldown_s`.
+
+    Thread-safe: lo usan el hilo de ingesta y los workers de la API.
+
+    Con ingesta compartida cada proceso tiene su store y sólo es dueño de
+    sus devices: `particionar(filtro)` hace que restaure sólo los esp_id con
+    `filtro(esp_id)` True y que cada snapshot reemplace sólo sus filas.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        cooldown_s: float = COOLDOWN_S,
+        snapshot_s: float = config.cooldown_snapshot_s,
+        reloj=time.monotonic,
+    ):
+        self._session_factory = session_factory
+        self.cooldown_s = float(cooldown_s)
+        self._snapshot_s = snapshot_s
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._estados: dict[tuple[int, str], EstadoCooldown] = {}
+        self._parar = threading.Event()
+        self._hilo: threading.Thread | None = None
+        self._stats = {"permitidos": 0, "negados": 0, "snapshots": 0, "restaurados": 0}
+        self._filtro: Callable[[str], bool] | None = None
+        self._propios: set[int] = set()     # devices de este proceso (con filtro)
+
+    # ---------- consulta ----------
+
+    def _intentar(self, clave: tuple[int, str], ahora: float, efectos: EfectosLote | None = None) -> bool:
+        # con el lock tomado
+        e = self._estados.get(clave)
+        if e is not None and (ahora - e.ultimo) < self.cooldown_s:
+            self._stats["negados"] += 1
+            return False
+        if efectos is not None:
+            efectos.al_fallar(self._devolver, clave, None if e is None else e.ultimo, ahora)
+        if e is None:
+            self._estados[clave] = EstadoCooldown(ahora)
+            if self._filtro is not None:
+                self._propios.add(clave[0])
+        else:
+            e.ultimo = ahora
+        self._stats["permitidos"] += 1
+        return True
+
+    def _devolver(self, clave: tuple[int, str], previo: float | None, ahora: float):
+        """Deshace un cambio registrado por un lote que volvió atrás (si nadie lo pisó después)."""
+        with self._lock:
+            e = self._estados.get(clave)
+            if e is None or e.ultimo != ahora:
+                return
+            if previo is None:
+                del self._estados[clave]
+            else:
+                e.ultimo = previo
+            self._stats["permitidos"] -= 1
+
+    def puede_cambiar(self, device_id: int, actuador: str, ahora: float | None = None,
+                      efectos: EfectosLote | None = None) -> bool:
+        """
+        Si pasó el cooldown, registra el cambio y devuelve True (chequeo y
+        registro atómicos). Con `efectos`, el registro se deshace si la
+        transacción del lote vuelve atrás.
+        """
+        ahora = self.reloj() if ahora is None else ahora
+        with self._lock:
+            return self._intentar((device_id, actuador), ahora, efectos)
+
+    def permitir_lote(self, device_ids: list[int], actuador: str, ahora: float,
+                      efectos: EfectosLote | None = None) -> list[bool]:
+        """`puede_cambiar` para varios devices con un solo lock (lo usa el motor vectorizado)."""
+        with self._lock:
+            return [self._intentar((d, actuador), ahora, efectos) for d in device_ids]
+
+    def restante(self, device_id: int, actuador: str) -> float:
+        """Segundos que faltan para poder cambiar (0 si ya puede)."""
+        with self._lock:
+            e = self._estados.get((device_id, actuador))
+            if e is None:
+                return 0.0
+            return max(0.0, self.cooldown_s - (self.reloj() - e.ultimo))
+
+    def limpiar(self):
+        with self._lock:
+            self._estados.clear()
+
+    # ---------- persistencia ----------
+
+    def particionar(self, filtro: Callable[[str], bool]):
+        """Limita restauración y snapshots a los esp_id de este proceso (llamar antes de restaurar)."""
+        self._filtro = filtro
+
+    def _podar(self, ahora: float):
+        vencidos = [k for k, e in self._estados.items() if ahora - e.ultimo >= self.cooldown_s]
+        for k in vencidos:
+            del self._estados[k]
+
+    def guardar(self):
+        """Snapshot de los cooldowns vigentes en la tabla `cooldowns` (reemplaza el anterior)."""
+        with self._lock:
+            mono, wall = self.reloj(), time.time()
+            self._podar(mono)
+            filas = [
+                {"device_id": dev, "actuador": act,
+                 "ultimo_cambio": datetime.fromtimestamp(wall - (mono - e.ultimo), tz=timezone.utc)}
+                for (dev, act), e in self._estados.items()
+            ]
+            propios = list(self._propios)
+        with self._session_factory() as db:
+            if self._filtro is None:
+                db.execute(delete(CooldownActuador))
+            else:
+                for i in range(0, len(propios), 500):
+                    db.execute(delete(CooldownActuador).where(CooldownActuador.device_id.in_(propios[i:i + 500])))
+            if filas:
+                db.execute(insert(CooldownActuador), filas)
+            db.commit()
+        with self._lock:
+            self._stats["snapshots"] += 1
+
+    def restaurar(self):
+        """Carga el último snapshot (llamar al arrancar, antes de la ingesta)."""
+        with self._session_factory() as db:
+            filas = db.execute(
+                select(CooldownActuador.device_id, CooldownActuador.actuador, CooldownActuador.ultimo_cambio,
+                       Device.esp_id)
+                .join(Device, Device.id == CooldownActuador.device_id)
+            ).all()
+        mono, wall = self.reloj(), time.time()
+        n = 0
+        with self._lock:
+            for dev, act, ts, esp_id in filas:
+                if self._filtro is not None:
+                    if not self._filtro(esp_id):
+                        continue
+                    self._propios.add(dev)
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                edad = max(0.0, wall - ts.timestamp())
+                if edad >= self.cooldown_s:
+                    continue
+                e = self._estados.get((dev, act))
+                if e is None or e.ultimo < mono - edad:
+                    self._estados[(dev, act)] = EstadoCooldown(mono - edad)
+                    n += 1
+            self._stats["restaurados"] += n
+        if n:
+            log.info("Restaurados %d cooldowns vigentes.", n)
+
+    # ---------- programador ----------
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="cooldown-snapshot", daemon=True)
+        self._hilo.start()
+        atexit.register(self.detener)
+
+    def detener(self):
+        """Detiene el hilo y guarda un último snapshot."""
+        if self._parar.is_set():
+            return
+        self._parar.set()
+        try:
+            self.guardar()
+        except Exception:
+            log.exception("No se pudo guardar el snapshot final de cooldowns.")
+
+    def _bucle(self):
+        while not self._parar.wait(self._snapshot_s):
+            try:
+                self.guardar()
+            except Exception:
+                log.exception("Fallo al guardar el snapshot de cooldowns.")
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            m["vigentes"] = sum(1 for e in self._estados.values() if self.reloj() - e.ultimo < self.cooldown_s)
+            m["entradas"] = len(self._estados)
+        return m
+
+
+cooldowns = CooldownStore()
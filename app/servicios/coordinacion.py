@@ -0,0 +1,507 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows): un solo proceso, que siempre es líder
+    fcntl = None
+
+from app.core.config import config
+from app.servicios import mqtt_funciones
+from app.servicios.comandos import ComandoPendiente, TTL_S, marcar_publicado, rastreador
+from app.servicios.registro import registro, EstadoMecanismos
+from app.servicios.stream import hub
+
+log = logging.getLogger("coordinacion")
+
+COLA_POR_CONEXION = 10_000   # mensajes en espera hacia otro proceso antes de descartar
+IPC_TIMEOUT_S = 2.0          # cuánto espera un seguidor la respuesta del líder a un comando
+REINTENTO_S = 1.0            # cada cuánto un seguidor reintenta el lock / la conexión
+
+
+@contextmanager
+def bloqueo_exclusivo(ruta: Path):
+    """Lock de archivo bloqueante entre procesos (p. ej. para el create_all del arranque)."""
+    with open(ruta, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _linea(msg: dict) -> bytes:
+    return (json.dumps(msg, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+# ============================================================
+# CONEXIÓN (socket Unix, JSON por línea)
+# ============================================================
+
+class Conexion:
+    """
+    Un extremo del canal entre procesos. Enviar sólo encola: un hilo propio
+    escribe, así un proceso lento no frena a la ingesta del líder. Si la cola
+    se llena se vacía y se manda `al_desbordar` en su lugar (un "limpiar" del
+    registro: el otro lado vuelve a leer de la DB lo que se haya perdido).
+    """
+
+    def __init__(self, sock: socket.socket, nombre: str, al_desbordar: dict | None = None):
+        self.sock = sock
+        self._cola: queue.Queue = queue.Queue(maxsize=COLA_POR_CONEXION)
+        self._al_desbordar = _linea(al_desbordar) if al_desbordar else None
+        self.descartados = 0
+        self.cerrada = False
+        threading.Thread(target=self._escribir, name=f"{nombre}-tx", daemon=True).start()
+
+    def enviar(self, msg: dict):
+        self.enviar_linea(_linea(msg))
+
+    def enviar_linea(self, linea: bytes):
+        if self.cerrada:
+            return
+        try:
+            self._cola.put_nowait(linea)
+        except queue.Full:
+            while True:
+                try:
+                    self._cola.get_nowait()
+                    self.descartados += 1
+                except queue.Empty:
+                    break
+            if self._al_desbordar:
+                self._cola.put_nowait(self._al_desbordar)
+            log.warning("Cola IPC llena: se descartaron mensajes hacia otro proceso.")
+
+    def _escribir(self):
+        try:
+            while True:
+                datos = [self._cola.get()]
+                while datos[-1] is not None and len(datos) < 512:
+                    try:
+                        datos.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                fin = datos[-1] is None
+                if fin:
+                    datos.pop()
+                if datos:
+                    self.sock.sendall(b"".join(datos))
+                if fin:
+                    return
+        except OSError:
+            self.cerrar()
+
+    def lineas(self):
+        """Mensajes recibidos hasta que el otro lado cierra."""
+        with self.sock.makefile("rb") as f:
+            for linea in f:
+                yield json.loads(linea)
+
+    def cerrar(self):
+        if self.cerrada:
+            return
+        self.cerrada = True
+        try:
+            self._cola.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# ============================================================
+# COORDINADOR
+# ============================================================
+
+class Coordinador:
+    """
+    Reparto de roles entre los workers de uvicorn (WORKERS=N).
+
+    El primero que toma el lock de archivo (`grow.lock`) es el líder: corre
+    el listener MQTT, la ingesta y las tareas de fondo, y atiende a los demás
+    por un socket Unix (`grow.sock`). Los seguidores sólo sirven la API:
+      - los comandos (`enviar_cmd`) se reenvían al líder, que es el único con
+        cliente MQTT; `publicado` y el Future local se resuelven cuando el
+        líder avisa ("pub" al salir de su cola, "res" al confirmarse). El
+        id de correlación lo pone el seguidor: si el líder tarda más de
+        IPC_TIMEOUT_S en contestar, el pendiente vuelve igual, marcado
+        `incierto`, y un "res" posterior lo resuelve por ese id;
+      - el registro se mantiene coherente: cada invalidación o cambio de
+        mecanismos se replica al resto de los procesos;
+      - los eventos del stream en vivo los genera el líder y se reparten a
+        los seguidores, así /stream funciona en cualquier worker.
+    Si el líder muere, el lock se libera y el primer seguidor que lo toma
+    asume el rol (y arranca MQTT, ingesta y tareas de fondo).
+
+    Con ingesta compartida, los procesos de ingesta se conectan con `unirse()`
+    (nunca compiten por el lock): le mandan al líder sus eventos en vivo, sus
+    cambios del registro, la telemetría que confirma comandos y los comandos
+    de su autocontrol. Así todos los SET pasan por la cola de salida y el
+    rastreador del líder (se agrupan con los de la API y los confirma el ack,
+    que sólo escucha el líder). Sin conexión con el líder, el proceso de
+    ingesta publica con su propio cliente.
+    """
+
+    def __init__(self, directorio: str = config.coordinacion_dir):
+        base = Path(directorio)
+        self.ruta_lock = base / "grow.lock"
+        self.ruta_socket = base / "grow.sock"
+        self.rol: str | None = None      # "lider" | "seguidor" | "ingesta"
+        self._al_asumir: Callable[[], None] | None = None
+        self._fd: int | None = None
+        self._lock = threading.Lock()
+        # líder
+        self._servidor: socket.socket | None = None
+        self._seguidores: set[Conexion] = set()
+        # seguidor
+        self._conexion: Conexion | None = None
+        self._refs = itertools.count(1)
+        self._esperando: dict[int, list] = {}             # ref -> [Event, ComandoPendiente | None]
+        self._pendientes: dict[int, ComandoPendiente] = {}
+        self._stats = {"comandos_reenviados": 0, "comandos_remotos": 0, "comandos_inciertos": 0, "eventos": 0,
+                       "cambios_registro": 0, "reconexiones": 0}
+
+    # ---------- rol ----------
+
+    def _tomar_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        fd = os.open(self.ruta_lock, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # el fd queda abierto: el lock dura lo que viva el proceso
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def iniciar(self, al_asumir: Callable[[], None]):
+        """
+        Elige el rol de este proceso. `al_asumir()` arranca lo que debe correr
+        una sola vez (MQTT, ingesta, tareas de fondo): lo ejecuta el líder, ahora
+        o cuando un seguidor tome el relevo.
+        """
+        self._al_asumir = al_asumir
+        registro.al_cambiar = self._registro_cambio
+        if self._tomar_lock():
+            self._asumir()
+            return
+        self.rol = "seguidor"
+        mqtt_funciones.setup_reenvio(self._enviar_cmd)
+        try:
+            self._conectar()
+        except OSError:
+            pass  # el líder todavía no abrió el socket: reintenta el vigilante
+        threading.Thread(target=self._vigilar, name="coordinacion", daemon=True).start()
+
+    def unirse(self):
+        """Proceso de ingesta compartida: se conecta al líder de la API sin competir por el lock."""
+        self.rol = "ingesta"
+        registro.al_cambiar = self._registro_cambio
+        hub.al_publicar = self._evento_hub
+        rastreador.al_observar = self._observacion
+        mqtt_funciones.setup_reenvio(self._reenviar_cmd)
+        try:
+            self._conectar()
+        except OSError:
+            log.warning("No hay API líder en %s: se reintenta en segundo plano.", self.ruta_socket)
+        threading.Thread(target=self._vigilar, name="coordinacion", daemon=True).start()
+
+    def _asumir(self):
+        if self._conexion is not None:
+            self._conexion.cerrar()
+        self.rol = "lider"
+        mqtt_funciones.setup_reenvio(None)
+        hub.al_publicar = self._evento_hub
+        if fcntl is not None:
+            self._servir()
+        log.info("Proceso %d: líder (MQTT, ingesta y tareas de fondo).", os.getpid())
+        self._al_asumir()
+
+    # ---------- líder ----------
+
+    def _servir(self):
+        try:
+            self.ruta_socket.unlink()
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(str(self.ruta_socket))
+        srv.listen(64)
+        self._servidor = srv
+        threading.Thread(target=self._aceptar, name="ipc-servidor", daemon=True).start()
+
+    def _aceptar(self):
+        while True:
+            try:
+                sock, _ = self._servidor.accept()
+            except OSError:
+                return
+            conn = Conexion(sock, "ipc-seguidor", al_desbordar={"t": "reg", "op": "limpiar"})
+            with self._lock:
+                self._seguidores.add(conn)
+            threading.Thread(target=self._atender, args=(conn,), name="ipc-seguidor-rx", daemon=True).start()
+
+    def _atender(self, conn: Conexion):
+        try:
+            for msg in conn.lineas():
+                if msg["t"] == "cmd":
+                    self._cmd_remoto(conn, msg)
+                elif msg["t"] == "reg":
+                    self._aplicar_registro(msg)
+                    self._difundir(_linea(msg), excepto=conn)
+                elif msg["t"] == "ev":
+                    # evento de un proceso de ingesta: a este proceso y al resto de los workers
+                    hub.difundir(msg["esp_id"], msg["tipo"], msg["data"])
+                    self._difundir(_linea(msg), excepto=conn)
+                elif msg["t"] == "obs":
+                    e = msg["estado"]
+                    rastreador.observar_estado(msg["esp_id"], EstadoMecanismos(*e) if e else None,
+                                               antes_de=msg["antes_de"], propagar=False)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Conexión IPC con un seguidor terminada: %s", e)
+        finally:
+            with self._lock:
+                self._seguidores.discard(conn)
+            conn.cerrar()
+
+    def _cmd_remoto(self, conn: Conexion, msg: dict):
+        ref = msg["ref"]
+        # sin esperar la ventana de la cola: este hilo atiende todo lo que manda el seguidor
+        p = mqtt_funciones.enviar_cmd(msg["cmd"], msg.get("esp_id"), esperar=False)
+        with self._lock:
+            self._stats["comandos_remotos"] += 1
+        if p is None:
+            conn.enviar({"t": "cmd", "ref": ref, "id": None})
+            return
+        conn.enviar({"t": "cmd", "ref": ref, "id": p.cid, "esp_id": p.esp_id, "diferido": p.diferido})
+        p.publicado.add_done_callback(
+            lambda f: conn.enviar({"t": "pub", "ref": ref, "r": f.result()})
+        )
+        p.futuro.add_done_callback(
+            lambda f: conn.enviar({"t": "res", "ref": ref, "r": None if f.cancelled() else f.result()})
+        )
+
+    def _evento_hub(self, esp_id: str, tipo: str, data: str):
+        linea = _linea({"t": "ev", "esp_id": esp_id, "tipo": tipo, "data": data})
+        if self.rol == "lider":
+            self._difundir(linea)
+        elif self._conexion is not None:
+            self._conexion.enviar_linea(linea)
+
+    def _observacion(self, esp_id: str, estado: EstadoMecanismos | None, antes_de: float | None):
+        # time.monotonic() es el mismo reloj para todos los procesos del host (CLOCK_MONOTONIC)
+        if self._conexion is not None:
+            e = [estado.id, estado.bomba, estado.luz, estado.ventilador] if estado else None
+            self._conexion.enviar({"t": "obs", "esp_id": esp_id, "estado": e, "antes_de": antes_de})
+
+    def _difundir(self, linea: bytes, excepto: Conexion | None = None):
+        with self._lock:
+            conns = [c for c in self._seguidores if c is not excepto]
+        for c in conns:
+            c.enviar_linea(linea)
+
+    # ---------- registro (ambos roles) ----------
+
+    def _registro_cambio(self, op: str, esp_id: str | None, estado: EstadoMecanismos | None):
+        msg = {"t": "reg", "op": op, "esp_id": esp_id}
+        if estado is not None:
+            msg["estado"] = [estado.id, estado.bomba, estado.luz, estado.ventilador]
+        if self.rol == "lider":
+            self._difundir(_linea(msg))
+        elif self._conexion is not None:
+            self._conexion.enviar(msg)
+
+    def _aplicar_registro(self, msg: dict):
+        with self._lock:
+            self._stats["cambios_registro"] += 1
+        op = msg["op"]
+        if op == "invalidar":
+            registro.invalidar(msg["esp_id"], propagar=False)
+        elif op == "limpiar":
+            registro.limpiar(propagar=False)
+        elif op == "mecanismos":
+            registro.actualizar_mecanismos(msg["esp_id"], EstadoMecanismos(*msg["estado"]), propagar=False)
+
+    # ---------- seguidor ----------
+
+    def _vigilar(self):
+        while self.rol in ("seguidor", "ingesta"):
+            time.sleep(REINTENTO_S)
+            if self.rol == "seguidor" and self._tomar_lock():
+                log.warning("El líder dejó el lock: el proceso %d asume.", os.getpid())
+                self._asumir()
+                return
+            if self._conexion is None:
+                try:
+                    self._conectar()
+                except OSError:
+                    pass
+
+    def _conectar(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.ruta_socket))
+        except OSError:
+            sock.close()
+            raise
+        conn = Conexion(sock, "ipc-lider")
+        with self._lock:
+            self._conexion = conn
+            self._stats["reconexiones"] += 1
+        # lo que cambió mientras no había conexión se vuelve a leer de la DB
+        registro.limpiar(propagar=False)
+        threading.Thread(target=self._recibir, args=(conn,), name="ipc-lider-rx", daemon=True).start()
+
+    def _recibir(self, conn: Conexion):
+        try:
+            for msg in conn.lineas():
+                t = msg["t"]
+                if t == "ev":
+                    hub.difundir(msg["esp_id"], msg["tipo"], msg["data"])
+                    self._stats["eventos"] += 1
+                elif t == "reg":
+                    self._aplicar_registro(msg)
+                elif t == "cmd":
+                    self._respuesta_cmd(msg)
+                elif t == "pub":
+                    with self._lock:
+                        p = self._pendientes.get(msg["ref"])
+                    if p is not None:
+                        marcar_publicado(p, msg["r"])
+                elif t == "res":
+                    with self._lock:
+                        p = self._pendientes.pop(msg["ref"], None)
+                    if p is not None and not p.futuro.done():
+                        if msg["r"] is None:
+                            p.futuro.cancel()
+                        else:
+                            p.futuro.set_result(msg["r"])
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Conexión IPC con el líder terminada: %s", e)
+        finally:
+            conn.cerrar()
+            with self._lock:
+                if self._conexion is conn:
+                    self._conexion = None
+                pendientes = list(self._pendientes.values())
+                self._pendientes.clear()
+                esperando = list(self._esperando.values())
+            for p in pendientes:
+                p.futuro.cancel()
+            for ev, _ in esperando:
+                ev.set()
+
+    def _respuesta_cmd(self, msg: dict):
+        # la arma este hilo (y no el que espera) para que un "res" posterior ya la encuentre
+        with self._lock:
+            espera = self._esperando.get(msg["ref"])
+            if espera is None:
+                # respuesta tardía de un comando que ya volvió como incierto
+                p = self._pendientes.get(msg["ref"])
+                if p is not None and msg["id"] is None:
+                    del self._pendientes[msg["ref"]]   # el líder no lo pudo enviar
+                    p.futuro.cancel()
+                elif p is not None:
+                    p.diferido = msg.get("diferido", False)
+                return
+            if msg["id"] is not None:
+                cmd = espera[2]
+                cmd["id"] = msg["id"]
+                espera[1] = self._pendientes[msg["ref"]] = ComandoPendiente(
+                    msg["id"], msg["esp_id"], cmd.get("cmd"), cmd.get("target"), cmd.get("value"), time.monotonic(),
+                    diferido=msg.get("diferido", False),
+                )
+        espera[0].set()
+
+    def _enviar_cmd(self, cmd: dict, esp_id: str | None) -> ComandoPendiente | None:
+        conn = self._conexion
+        if conn is None:
+            log.warning("enviar_cmd_mqtt: sin conexión con el proceso líder.")
+            return None
+        ref = next(self._refs)
+        # el id de correlación sale de acá: el líder lo respeta (rastreador.registrar)
+        cid = cmd.setdefault("id", uuid.uuid4().hex[:12])
+        espera = [threading.Event(), None, cmd]
+        with self._lock:
+            self._esperando[ref] = espera
+            self._stats["comandos_reenviados"] += 1
+        conn.enviar({"t": "cmd", "ref": ref, "esp_id": esp_id, "cmd": cmd})
+        respondio = espera[0].wait(IPC_TIMEOUT_S)
+        with self._lock:
+            self._esperando.pop(ref, None)
+            caida = self._conexion is not conn
+            if espera[1] is not None or (respondio and not caida):
+                return espera[1]   # None: el líder contestó que no lo pudo enviar
+            # Sin respuesta no se sabe si el líder lo publicó: devolver None haría
+            # que el cliente reintente y duplique. Queda pendiente por su id.
+            p = ComandoPendiente(
+                cid, esp_id or mqtt_funciones._resolve_default_esp_id(), cmd.get("cmd"), cmd.get("target"),
+                cmd.get("value"), time.monotonic(), incierto=True,
+            )
+            if caida:
+                p.futuro.cancel()   # ya nadie va a avisar cómo terminó
+            else:
+                self._podar_inciertos()
+                self._pendientes[ref] = p
+            self._stats["comandos_inciertos"] += 1
+        log.warning("enviar_cmd_mqtt: el líder no respondió en %.1f s; el comando %s queda incierto.",
+                    IPC_TIMEOUT_S, cid)
+        return p
+
+    def _reenviar_cmd(self, cmd: dict, esp_id: str | None) -> ComandoPendiente | None:
+        """
+        Proceso de ingesta: el comando del autocontrol lo publica el líder, sin
+        esperar su respuesta (el escritor de ingesta no se frena). El pendiente
+        local queda `incierto`: quien sigue el comando es el rastreador del líder.
+        """
+        conn = self._conexion
+        if conn is None:
+            return mqtt_funciones.enviar_cmd_local(cmd, esp_id)
+        cid = cmd.setdefault("id", uuid.uuid4().hex[:12])
+        with self._lock:
+            self._stats["comandos_reenviados"] += 1
+        conn.enviar({"t": "cmd", "ref": next(self._refs), "esp_id": esp_id, "cmd": cmd})
+        return ComandoPendiente(cid, esp_id or mqtt_funciones._resolve_default_esp_id(), cmd.get("cmd"),
+                                cmd.get("target"), cmd.get("value"), time.monotonic(), incierto=True)
+
+    def _podar_inciertos(self):
+        # con el lock tomado: si el líder nunca recibió el comando, tampoco va a llegar su "res"
+        limite = time.monotonic() - TTL_S
+        for ref in [r for r, p in self._pendientes.items() if p.incierto and p.enviado < limite]:
+            self._pendientes.pop(ref).futuro.cancel()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            m["rol"] = self.rol
+            m["pid"] = os.getpid()
+            if self.rol == "lider":
+                m["seguidores"] = len(self._seguidores)  # workers de la API y procesos de ingesta
+                m["descartados"] = sum(c.descartados for c in self._seguidores)
+            else:
+                m["conectado"] = self._conexion is not None
+                m["comandos_pendientes"] = len(self._pendientes)
+        return m
+
+
+coordinador = Coordinador()
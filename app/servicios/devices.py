@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from app.db.models import Device, Mecanismos, Config
+from app.servicios.registro import registro
 
 
 # ============================================================
@@ -22,6 +23,7 @@ def create_device(db: Session, esp_id: str, nombre: str | None = None) -> Device
     db.add(Config(device_id=d.id))
     db.commit()
     db.refresh(d)
+    registro.invalidar(esp_id)
     return d
 
 
@@ -46,6 +48,7 @@ def update_device(db: Session, esp_id: str, nombre: str | None = None, activo: b
         d.activo = activo
     db.commit()
     db.refresh(d)
+    registro.invalidar(esp_id)
     return d
 
 
@@ -56,6 +59,7 @@ def delete_device(db: Session, esp_id: str) -> None:
         raise LookupError("Device no encontrado")
     db.delete(d)
     db.commit()
+    registro.invalidar(esp_id)
 
 
 # ============================================================
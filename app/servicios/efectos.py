@@ -0,0 +1,60 @@
+"""
+Efectos fuera de la DB que dependen de una transacción de la ingesta.
+
+El autocontrol decide dentro de la transacción del lote, pero publicar un
+SET, registrar el evento en el diario o contar la decisión no se pueden
+deshacer con un ROLLBACK. `EfectosLote` los acumula mientras la transacción
+está abierta: `confirmar()` los aplica después del commit y `descartar()`
+deshace lo que se reservó en memoria (cooldowns) si el lote vuelve atrás.
+Así el reintento mensaje a mensaje de un lote fallido decide de nuevo desde
+el mismo estado, sin comandos ya enviados ni cooldowns ya consumidos.
+"""
+import logging
+from typing import Callable
+
+log = logging.getLogger("efectos")
+
+
+class EfectosLote:
+    """Acciones a aplicar tras el commit y a deshacer tras el rollback, en orden."""
+
+    __slots__ = ("_despues", "_deshacer")
+
+    def __init__(self):
+        self._despues: list[tuple[Callable, tuple, dict]] = []
+        self._deshacer: list[tuple[Callable, tuple]] = []
+
+    def despues(self, fn: Callable, *args, **kwargs):
+        """`fn(*args, **kwargs)` cuando la transacción confirme."""
+        self._despues.append((fn, args, kwargs))
+
+    def al_fallar(self, fn: Callable, *args):
+        """`fn(*args)` si la transacción vuelve atrás (en orden inverso)."""
+        self._deshacer.append((fn, args))
+
+    def confirmar(self):
+        acciones, self._despues, self._deshacer = self._despues, [], []
+        for fn, args, kwargs in acciones:
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                log.exception("Fallo al aplicar un efecto del lote (%s).", getattr(fn, "__name__", fn))
+
+    def descartar(self):
+        acciones, self._despues, self._deshacer = self._deshacer, [], []
+        for fn, args in reversed(acciones):
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("Fallo al deshacer un efecto del lote (%s).", getattr(fn, "__name__", fn))
+
+    def __len__(self) -> int:
+        return len(self._despues)
+
+
+def diferir(efectos: EfectosLote | None, fn: Callable, *args, **kwargs):
+    """Aplica `fn` ahora (sin lote) o después del commit del lote."""
+    if efectos is None:
+        fn(*args, **kwargs)
+    else:
+        efectos.despues(fn, *args, **kwargs)
@@ -0,0 +1,266 @@
+"""
+Diario de eventos (tabla `eventos`, sólo se agrega): cambios de actuador del
+autocontrol, comandos manuales, transiciones de status, reinicios y alertas
+de la analítica.
+
+Quien registra (el autocontrol, la ingesta, un endpoint) sólo encola; un hilo
+escritor junta lo encolado durante `eventos_ventana_ms` y lo guarda con un
+commit por lote. Si la cola se llena el evento se descarta y se cuenta: el
+lazo de control nunca espera al diario. El hilo arranca con el primer evento
+del proceso, así que funciona igual en la API, en los procesos de ingesta
+compartida y en los benchmarks.
+
+Tipos:
+
+- autocontrol: subtipo riego/ventilador/luz, detalle ON/OFF.
+- manual: lo mismo desde la API (PUT /mecanismos, /system/mecanismos), y
+  subtipo "status" para los pedidos de telemetría.
+- status: transiciones de presencia online/stale/offline (detalle: el
+  estado anterior), ver `app/servicios/presencia.py`.
+- reinicio: subtipo "comando" (POST /system/reboot).
+- alerta: las de la analítica en vivo (sensor_trabado, tanque_seco, ...).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import desc, func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.models import Device, Evento
+from app.db.session import SessionLocal
+from app.servicios.metricas import metricas as metricas_prom
+from app.servicios.registro import registro
+
+log = logging.getLogger("eventos")
+
+TIPOS = ("autocontrol", "manual", "status", "reinicio", "alerta")
+# target de los comandos SET -> nombre del actuador en los eventos (y en los cambios del autocontrol)
+ACTUADORES = {"RIEGO": "riego", "VENT": "ventilador", "LUZ": "luz"}
+
+eventos_total = metricas_prom.contador(
+    "grow_eventos_total", "Eventos registrados en el diario, por tipo.", ("tipo",))
+
+
+@dataclass(slots=True)
+class EventoPendiente:
+    esp_id: str
+    tipo: str
+    subtipo: str
+    detalle: str
+    mensaje: str
+    fecha_hora: datetime
+    device_id: int | None
+
+
+class DiarioEventos:
+    """Cola acotada + hilo escritor por lotes para la tabla `eventos`."""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        cola_max: int = config.eventos_cola_max,
+        lote_max: int = config.eventos_lote_max,
+        ventana_s: float = config.eventos_ventana_ms / 1000,
+    ):
+        self.session_factory = session_factory
+        self._cola: queue.Queue = queue.Queue(maxsize=cola_max)
+        self._lote_max = lote_max
+        self._ventana_s = ventana_s
+        self._hilo: threading.Thread | None = None
+        self._al_salir = False
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._por_tipo: Counter = Counter()
+        self._stats = {"encolados": 0, "escritos": 0, "descartados": 0, "sin_device": 0, "lotes": 0, "errores": 0}
+
+    # ---------- lado productor ----------
+
+    def registrar(
+        self,
+        esp_id: str,
+        tipo: str,
+        subtipo: str,
+        detalle: str = "",
+        mensaje: str = "",
+        device_id: int | None = None,
+        fecha_hora: datetime | None = None,
+    ) -> bool:
+        """Encola un evento sin bloquear. False si se descartó (cola llena)."""
+        if self._hilo is None:
+            self.iniciar()
+        ev = EventoPendiente(esp_id, tipo, subtipo[:50], detalle[:255], (mensaje or subtipo)[:255],
+                             fecha_hora or datetime.now(timezone.utc), device_id)
+        try:
+            self._cola.put_nowait(ev)
+        except queue.Full:
+            with self._lock:
+                self._stats["descartados"] += 1
+            return False
+        with self._lock:
+            self._stats["encolados"] += 1
+            self._por_tipo[tipo] += 1
+        eventos_total.inc(tipo)
+        return True
+
+    def actuadores(self, esp_id: str, cambios: dict, tipo: str = "autocontrol", origen: str = "",
+                   device_id: int | None = None):
+        """Un evento por actuador cambiado ({"riego": "ON", ...})."""
+        for actuador, valor in cambios.items():
+            self.registrar(esp_id, tipo, actuador, valor, f"{origen or tipo}: {actuador} {valor}", device_id)
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self):
+        """Arranca el hilo escritor (idempotente)."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="eventos-writer", daemon=True)
+            self._hilo.start()
+            if self._al_salir:
+                return
+            self._al_salir = True
+        atexit.register(self.detener)   # una vez por instancia, aunque el hilo se reinicie
+
+    def detener(self, timeout: float = 5.0):
+        """Detiene el escritor tras guardar lo que quede en la cola."""
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def vaciar(self, timeout: float = 5.0) -> bool:
+        """Espera a que lo encolado hasta ahora esté guardado (benchmarks, pruebas)."""
+        limite = time.monotonic() + timeout
+        while self._cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.01)
+        return not self._cola.unfinished_tasks
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            m["por_tipo"] = dict(self._por_tipo)
+        m["profundidad"] = self._cola.qsize()
+        m["capacidad"] = self._cola.maxsize
+        return m
+
+    # ---------- lado consumidor (hilo escritor) ----------
+
+    def _tomar_lote(self) -> list[EventoPendiente]:
+        try:
+            lote = [self._cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self._ventana_s
+        while len(lote) < self._lote_max:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while not (self._parar.is_set() and self._cola.empty()):
+            lote = self._tomar_lote()
+            if not lote:
+                continue
+            try:
+                self._escribir(lote)
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+
+    def _escribir(self, lote: list[EventoPendiente]):
+        sin_device = 0
+        with self.session_factory() as db:
+            try:
+                filas = []
+                for ev in lote:
+                    device_id = ev.device_id
+                    if device_id is None:
+                        e = registro.obtener(db, ev.esp_id, crear=False)
+                        if e is None:
+                            sin_device += 1
+                            continue
+                        device_id = e.device_id
+                    filas.append(Evento(device_id=device_id, fecha_hora=ev.fecha_hora, tipo=ev.tipo,
+                                        subtipo=ev.subtipo, detalle=ev.detalle, mensaje=ev.mensaje))
+                db.add_all(filas)
+                db.commit()
+            except Exception:
+                db.rollback()
+                log.exception("No se pudo guardar un lote de %d eventos.", len(lote))
+                with self._lock:
+                    self._stats["errores"] += 1
+                return
+        with self._lock:
+            self._stats["lotes"] += 1
+            self._stats["escritos"] += len(filas)
+            self._stats["sin_device"] += sin_device
+
+
+diario = DiarioEventos()
+
+
+# ============================================================
+# CONSULTAS
+# ============================================================
+
+def _filtros(stmt, device_id: int | None, tipo: str | None, subtipo: str | None,
+             desde: datetime | None, hasta: datetime | None):
+    if device_id is not None:
+        stmt = stmt.where(Evento.device_id == device_id)
+    if tipo:
+        stmt = stmt.where(Evento.tipo == tipo)
+    if subtipo:
+        stmt = stmt.where(Evento.subtipo == subtipo)
+    if desde is not None:
+        stmt = stmt.where(Evento.fecha_hora >= desde)
+    if hasta is not None:
+        stmt = stmt.where(Evento.fecha_hora < hasta)
+    return stmt
+
+
+def listar_eventos(
+    db: Session,
+    device_id: int | None = None,
+    tipo: str | None = None,
+    subtipo: str | None = None,
+    desde: datetime | None = None,
+    hasta: datetime | None = None,
+    antes_de: int | None = None,
+    limit: int = 100,
+) -> list[tuple[Evento, str]]:
+    """
+    Eventos (desc por id) con su esp_id. Paginación por cursor: la página
+    siguiente se pide con `antes_de` = id del último evento recibido.
+    """
+    stmt = _filtros(select(Evento, Device.esp_id).join(Device, Device.id == Evento.device_id),
+                    device_id, tipo, subtipo, desde, hasta)
+    if antes_de is not None:
+        stmt = stmt.where(Evento.id < antes_de)
+    stmt = stmt.order_by(desc(Evento.id)).limit(limit)
+    return [(ev, esp_id) for ev, esp_id in db.execute(stmt)]
+
+
+def contar_eventos(
+    db: Session,
+    device_id: int | None = None,
+    desde: datetime | None = None,
+    hasta: datetime | None = None,
+) -> dict[str, dict[str, int]]:
+    """{tipo: {subtipo: cantidad}} con los mismos filtros de device y fechas."""
+    stmt = _filtros(select(Evento.tipo, Evento.subtipo, func.count()), device_id, None, None, desde, hasta)
+    out: dict[str, dict[str, int]] = {}
+    for tipo, subtipo, n in db.execute(stmt.group_by(Evento.tipo, Evento.subtipo)):
+        out.setdefault(tipo, {})[subtipo] = n
+    return out
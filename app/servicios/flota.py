@@ -0,0 +1,148 @@
+"""
+Estado actual de toda la flota: última lectura, actuadores, config y
+ultimo_contacto de cada device, en una sola consulta.
+
+La última lectura vive en `ultimas_lecturas` (una fila por device), que la
+ingesta actualiza con un upsert dentro de la misma transacción del lote. Los
+actuadores y la config ya están en `mecanismos` y `config` (una fila por
+device), así que `estado_flota` es un SELECT con joins de O(devices) que
+nunca toca `lecturas`. La presencia (online/stale/offline) sale de la
+memoria de `presencia`.
+"""
+import logging
+import threading
+from typing import Iterable, Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session
+
+from app.db.almacenamiento import almacen_de
+from app.db.models import Config, Device, Lectura, Mecanismos, UltimaLectura
+from app.db.session import SessionLocal
+from app.servicios.presencia import presencia
+
+log = logging.getLogger("flota")
+
+_CAMPOS = ("temperatura", "humedad", "humedad_suelo", "nivel_de_agua")
+
+
+def _fila(l) -> dict:
+    return {"device_id": l.device_id, "lectura_id": l.id, "fecha_hora": l.fecha_hora,
+            **{c: getattr(l, c) for c in _CAMPOS}}
+
+
+def actualizar_ultimas(db: Session, lecturas: Iterable[Lectura]):
+    """
+    Upsert de la lectura más nueva de cada device del lote (sin commit). Las
+    lecturas ya tienen id (después del flush). Una lectura más vieja que la
+    guardada (importación, mensaje demorado) no la pisa.
+    """
+    nuevas: dict[int, Lectura] = {}
+    for l in lecturas:
+        previa = nuevas.get(l.device_id)
+        if previa is None or l.fecha_hora >= previa.fecha_hora:
+            nuevas[l.device_id] = l
+    if not nuevas:
+        return
+
+    stmt = almacen_de(db).insert(UltimaLectura)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["device_id"],
+        set_={"lectura_id": ex.lectura_id, "fecha_hora": ex.fecha_hora, **{c: getattr(ex, c) for c in _CAMPOS}},
+        where=ex.fecha_hora >= UltimaLectura.fecha_hora,
+    )
+    db.execute(stmt, [_fila(l) for l in nuevas.values()])
+
+
+def reconstruir_ultimas(db: Session, device_id: Optional[int] = None) -> int:
+    """
+    Vuelve a tomar la última lectura de cada device (o de uno) desde
+    `lecturas`: una búsqueda por índice por device. Hace commit.
+    """
+    ids = [device_id] if device_id is not None else db.execute(select(Device.id)).scalars().all()
+    ultimas = []
+    for dev in ids:
+        l = db.execute(
+            select(Lectura)
+            .where(Lectura.device_id == dev)
+            .order_by(Lectura.fecha_hora.desc(), Lectura.id.desc())
+            .limit(1)
+        ).scalars().first()
+        if l is not None:
+            ultimas.append(l)
+    actualizar_ultimas(db, ultimas)
+    db.commit()
+    return len(ultimas)
+
+
+def devices_sin_ultima(db: Session) -> list[int]:
+    """
+    Devices con lecturas y sin fila en `ultimas_lecturas` (DB previa a la
+    tabla). Por device y no "la tabla está vacía": la ingesta puede haber
+    cargado la de algunos antes de que corra el backfill.
+    """
+    return db.execute(
+        select(Device.id).where(
+            ~exists().where(UltimaLectura.device_id == Device.id),
+            exists().where(Lectura.device_id == Device.id),
+        )
+    ).scalars().all()
+
+
+def backfill(device_ids: list[int], session_factory=SessionLocal) -> int:
+    """Llena `ultimas_lecturas` de esos devices desde `lecturas`."""
+    with session_factory() as db:
+        n = sum(reconstruir_ultimas(db, d) for d in device_ids)
+    log.info("Últimas lecturas generadas para %d devices.", n)
+    return n
+
+
+def iniciar_backfill(session_factory=SessionLocal):
+    """Decide qué devices faltan antes de arrancar la ingesta y los llena en segundo plano."""
+    with session_factory() as db:
+        faltan = devices_sin_ultima(db)
+    if faltan:
+        threading.Thread(target=backfill, args=(faltan, session_factory), name="flota-backfill",
+                         daemon=True).start()
+
+
+def estado_flota(db: Session) -> list[dict]:
+    """Un dict por device con su presencia, última lectura, mecanismos y config (None si no tiene)."""
+    stmt = (
+        select(
+            Device.esp_id, Device.nombre, Device.activo, Device.ultimo_contacto,
+            UltimaLectura.lectura_id, UltimaLectura.fecha_hora,
+            *(getattr(UltimaLectura, c) for c in _CAMPOS),
+            Mecanismos.bomba, Mecanismos.luz, Mecanismos.ventilador,
+            Config.temperatura.label("cfg_temperatura"), Config.humedad_suelo.label("cfg_humedad_suelo"),
+            Config.humedad_ambiente.label("cfg_humedad_ambiente"), Config.margen.label("cfg_margen"),
+        )
+        .outerjoin(UltimaLectura, UltimaLectura.device_id == Device.id)
+        .outerjoin(Mecanismos, Mecanismos.device_id == Device.id)
+        .outerjoin(Config, Config.device_id == Device.id)
+        .order_by(Device.id)
+    )
+    out = []
+    for r in db.execute(stmt):
+        out.append({
+            "esp_id": r.esp_id,
+            "nombre": r.nombre,
+            "activo": r.activo,
+            "ultimo_contacto": r.ultimo_contacto,
+            "presencia": presencia.estado(r.esp_id, r.ultimo_contacto)["estado"],
+            "lectura": None if r.lectura_id is None else {
+                "id": r.lectura_id, "fecha_hora": r.fecha_hora, **{c: getattr(r, c) for c in _CAMPOS}},
+            "mecanismos": None if r.bomba is None else {
+                "bomba": r.bomba, "luz": r.luz, "ventilador": r.ventilador},
+            "config": None if r.cfg_margen is None else {
+                "temperatura": r.cfg_temperatura, "humedad_suelo": r.cfg_humedad_suelo,
+                "humedad_ambiente": r.cfg_humedad_ambiente, "margen": r.cfg_margen},
+        })
+    return out
+
+
+def presencia_flota(db: Session) -> list[dict]:
+    """Presencia de cada device (de la memoria, o estimada desde ultimo_contacto)."""
+    filas = db.execute(select(Device.esp_id, Device.ultimo_contacto).order_by(Device.id))
+    return [{"esp_id": esp_id, **presencia.estado(esp_id, ultimo)} for esp_id, ultimo in filas]
@@ -1,15 +1,20 @@
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Iterable, Iterator
 from datetime import datetime, timezone, timedelta, date, time
 from zoneinfo import ZoneInfo
-import io, csv
+import io, csv, zlib
+from contextlib import nullcontext
 import logging
 import json
 
-from app.servicios.mqtt_funciones import enviar_cmd_mqtt  # Se usa para enviar comandos
+from app.servicios.mqtt_funciones import enviar_cmd, esperar_publicacion  # Se usa para enviar comandos
 from app.db.models import Device, Lectura, Mecanismos, Config
+from app.db.session import SessionLectura
 from app.servicios.devices import get_or_create_device, get_device_by_esp_id
+from app.servicios.registro import registro
+from app.servicios.flota import actualizar_ultimas
+from app.servicios.eventos import diario, ACTUADORES
 
 
 # ============================================================
@@ -34,6 +39,7 @@ def get_config(db: Session, esp_id: str) -> Config:
     cfg = db.query(Config).filter(Config.device_id == d.id).first()
     if not cfg:
         cfg = guardar(db, Config(device_id=d.id))
+        registro.invalidar(esp_id)
     return cfg
 
 
@@ -51,7 +57,9 @@ def set_config(
     if temperatura is not None:      cfg.temperatura = temperatura
     if humedad_ambiente is not None: cfg.humedad_ambiente = humedad_ambiente
     if margen is not None:           cfg.margen = margen
-    return guardar(db, cfg)
+    cfg = guardar(db, cfg)
+    registro.invalidar(esp_id)
+    return cfg
 
 
 # ============================================================
@@ -68,21 +76,28 @@ def get_status(db: Session, esp_id: str) -> Mecanismos:
 def set_mecanismo(db: Session, esp_id: str, bomba=None, luz=None, ventilador=None) -> Mecanismos:
     """
     Envía comandos por MQTT. El listener es responsable de actualizar la DB.
+    Los comandos publicados quedan en `mech._comandos` (pendientes con su Future).
     """
     d = get_or_create_device(db, esp_id)
     mech = db.query(Mecanismos).filter(Mecanismos.device_id == d.id).first() or Mecanismos(device_id=d.id)
     
-    mqtt_ok = True
-    
+    pedidos = []
     if bomba is not None:
-        mqtt_ok = enviar_cmd_mqtt({"cmd": "SET", "target": "RIEGO", "value": "ON" if bomba else "OFF"}, esp_id=esp_id) and mqtt_ok
+        pedidos.append({"cmd": "SET", "target": "RIEGO", "value": "ON" if bomba else "OFF"})
     if ventilador is not None:
-        mqtt_ok = enviar_cmd_mqtt({"cmd": "SET", "target": "VENT", "value": "ON" if ventilador else "OFF"}, esp_id=esp_id) and mqtt_ok
+        pedidos.append({"cmd": "SET", "target": "VENT", "value": "ON" if ventilador else "OFF"})
     if luz is not None:
-        mqtt_ok = enviar_cmd_mqtt({"cmd": "SET", "target": "LUZ", "value": "ON" if luz else "OFF"}, esp_id=esp_id) and mqtt_ok
-
-   
-    mech._warning = None if mqtt_ok else "serial_unavailable"
+        pedidos.append({"cmd": "SET", "target": "LUZ", "value": "ON" if luz else "OFF"})
+
+    # se encolan todos antes de esperar: así salen juntos en la misma ventana
+    enviados = [enviar_cmd(cmd, esp_id=esp_id, esperar=False) for cmd in pedidos]
+    enviados = [p and esperar_publicacion(p) for p in enviados]
+    for cmd, p in zip(pedidos, enviados):
+        if p is not None:
+            diario.registrar(esp_id, "manual", ACTUADORES[cmd["target"]], cmd["value"],
+                             f"PUT /mecanismos: {cmd['target']} {cmd['value']}", device_id=d.id)
+    mech._comandos = [p for p in enviados if p is not None]
+    mech._warning = None if len(mech._comandos) == len(pedidos) else "serial_unavailable"
     return mech
 
 
@@ -106,8 +121,11 @@ def agregar_lectura(
         humedad=humedad,
         humedad_suelo=humedad_suelo,
         nivel_de_agua=nivel_de_agua,
+        fecha_hora=datetime.now(timezone.utc),
     )
     db.add(obj)
+    db.flush()
+    actualizar_ultimas(db, [obj])
     db.commit()
     db.refresh(obj)
     return obj
@@ -141,58 +159,143 @@ def ultimas_lecturas_7d(db: Session, esp_id: str) -> List[Lectura]:
     return db.execute(stmt).scalars().all()
 
 
-def csv_from_range(db: Session, esp_id: str, desde: str, hasta: str) -> str:
-    """Exporta lecturas a CSV entre dos fechas."""
-    d = get_device_by_esp_id(db, esp_id)
-    if not d:
-        buf = io.StringIO()
-        writer = csv.writer(buf, lineterminator="\n")
-        writer.writerow(["fecha_hora", "temperatura", "humedad_suelo", "humedad"])
-        return buf.getvalue()
+def rango_ids_lectura(db: Session, device_id: int) -> tuple[int, int]:
+    """
+    Ids de la lectura más vieja y de la más reciente del device ((0, 0) si
+    no hay). Dos subconsultas para que cada una resuelva con el índice por device.
+    """
+    por_device = Lectura.device_id == device_id
+    primero, ultimo = db.execute(select(
+        select(func.min(Lectura.id)).where(por_device).scalar_subquery(),
+        select(func.max(Lectura.id)).where(por_device).scalar_subquery(),
+    )).one()
+    return primero or 0, ultimo or 0
+
 
-    tz_local = ZoneInfo("America/Montevideo")
+def lecturas_desde(
+    db: Session,
+    device_id: int,
+    since_id: Optional[int] = None,
+    since_ts: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Lectura]:
+    """
+    Lecturas posteriores al cursor `since_id` y/o `since_ts`.
+    Sin cursor se mantiene la ventana de 7 días de `ultimas_lecturas_7d`.
+    Con `since_id` van en orden de id (asc) y `limit` corta las siguientes al
+    cursor: el cliente pide de nuevo desde el último id hasta recibir una
+    página corta. Si no, desc por fecha (las `limit` más recientes).
+    """
+    stmt = select(Lectura).where(Lectura.device_id == device_id)
+    if since_id is not None:
+        stmt = stmt.where(Lectura.id > since_id)
+    if since_ts is not None:
+        if since_ts.tzinfo is None:
+            since_ts = since_ts.replace(tzinfo=timezone.utc)
+        # SQLite compara la hora sin la zona: el cursor va en UTC como las filas
+        stmt = stmt.where(Lectura.fecha_hora > since_ts.astimezone(timezone.utc))
+    if since_id is None and since_ts is None:
+        stmt = stmt.where(Lectura.fecha_hora >= datetime.now(timezone.utc) - timedelta(days=7))
+    if since_id is not None:
+        stmt = stmt.order_by(Lectura.id)
+    else:
+        stmt = stmt.order_by(desc(Lectura.fecha_hora), desc(Lectura.id))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return db.execute(stmt).scalars().all()
+
+
+CSV_COLUMNAS = ["fecha_hora", "temperatura", "humedad_suelo", "humedad"]
+CSV_TZ = ZoneInfo("America/Montevideo")
+
+
+def rango_local_a_utc(desde: str, hasta: str) -> tuple[datetime, datetime]:
+    """[desde 00:00, hasta 23:59:59] en hora local (YYYY-MM-DD) -> extremos en UTC."""
     d0 = datetime.strptime(desde, "%Y-%m-%d").date()
     d1 = datetime.strptime(hasta, "%Y-%m-%d").date()
     if d0 > d1:
         raise ValueError("La fecha 'desde' no puede ser posterior a 'hasta'.")
+    start_local = datetime.combine(d0, time.min).replace(tzinfo=CSV_TZ)
+    end_local   = datetime.combine(d1, time.max).replace(tzinfo=CSV_TZ)
+    return start_local.astimezone(timezone.utc), end_local.astimezone(timezone.utc)
 
-    start_local = datetime.combine(d0, time.min).replace(tzinfo=tz_local)
-    end_local   = datetime.combine(d1, time.max).replace(tzinfo=tz_local)
-    start_utc = start_local.astimezone(timezone.utc)
-    end_utc   = end_local.astimezone(timezone.utc)
-
-    stmt = (
-        select(
-            Lectura.fecha_hora,
-            Lectura.temperatura,
-            Lectura.humedad_suelo,
-            Lectura.humedad,
-        )
-        .where(
-            Lectura.device_id == d.id,
-            Lectura.fecha_hora >= start_utc,
-            Lectura.fecha_hora <= end_utc,
-        )
-        .order_by(desc(Lectura.fecha_hora))
-    )
-    rows = db.execute(stmt).all()
 
-    buf = io.StringIO()
-    writer = csv.writer(buf, lineterminator="\n")
-    writer.writerow(["fecha_hora", "temperatura", "humedad_suelo", "humedad"])
+def csv_stream(
+    esp_id: str,
+    desde: str,
+    hasta: str,
+    session_factory=None,
+    chunk: int = 2000,
+) -> Iterator[str]:
+    """
+    Exporta lecturas a CSV entre dos fechas como un generador de trozos de texto.
 
-    for dt, temperatura, humedad_suelo, humedad in rows:
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        dt_local = dt.astimezone(tz_local).strftime("%Y-%m-%d %H:%M:%S")
+    Las fechas se validan al llamar (ValueError antes de empezar a responder);
+    las filas se leen de a `chunk` con un cursor del lado del servidor
+    (`yield_per`) y se formatean a medida que se envían, así la memoria no
+    depende del tamaño del rango. Usa su propia sesión porque el generador
+    sigue corriendo después de que termina el endpoint.
+    """
+    start_utc, end_utc = rango_local_a_utc(desde, hasta)
+    session_factory = session_factory or SessionLectura
 
-        temp_str = f"{float(temperatura):.1f} °C"
-        soil_str = f"{float(humedad_suelo):.1f} %"
-        hum_str  = f"{float(humedad):.1f} %"
+    def generar():
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(CSV_COLUMNAS)
+
+        with session_factory() as db:
+            d = get_device_by_esp_id(db, esp_id)
+            if not d:
+                yield buf.getvalue()
+                return
+            stmt = (
+                select(
+                    Lectura.fecha_hora,
+                    Lectura.temperatura,
+                    Lectura.humedad_suelo,
+                    Lectura.humedad,
+                )
+                .where(
+                    Lectura.device_id == d.id,
+                    Lectura.fecha_hora >= start_utc,
+                    Lectura.fecha_hora <= end_utc,
+                )
+                .order_by(desc(Lectura.fecha_hora))
+                .execution_options(yield_per=chunk)
+            )
+            for filas in db.execute(stmt).partitions():
+                for dt, temperatura, humedad_suelo, humedad in filas:
+                    if dt.tzinfo is None:
+                        dt = dt.replace(tzinfo=timezone.utc)
+                    writer.writerow([
+                        dt.astimezone(CSV_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+                        f"{float(temperatura):.1f} °C",
+                        f"{float(humedad_suelo):.1f} %",
+                        f"{float(humedad):.1f} %",
+                    ])
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    return generar()
+
+
+def gzip_stream(trozos: Iterable[str], nivel: int = 6) -> Iterator[bytes]:
+    """Comprime al vuelo (formato gzip) un flujo de texto, sin juntarlo en memoria."""
+    z = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for t in trozos:
+        out = z.compress(t.encode("utf-8"))
+        if out:
+            yield out
+    yield z.flush()
 
-        writer.writerow([dt_local, temp_str, soil_str, hum_str])
 
-    return buf.getvalue()
+def csv_from_range(db: Session, esp_id: str, desde: str, hasta: str) -> str:
+    """Exporta lecturas a CSV entre dos fechas (todo en un string; para rangos chicos)."""
+    return "".join(csv_stream(esp_id, desde, hasta, session_factory=lambda: nullcontext(db)))
 
 
 # ============================================================
@@ -242,61 +345,3 @@ def get_plant_conditions(plant_name: str) -> dict:
         logging.error(f"Error en la llamada a Gemini para '{plant_name}': {e}")
         raise ConnectionError(f"Ocurrió un error al contactar el servicio de IA: {e}")
 
-
-
-
-
-
-
-sesión 
-
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker
-import sqlite3
-from pathlib import Path
-from app.core.config import config
-
-# CAMBIO: Base absoluta del repo
-BASE_DIR = Path(__file__).resolve().parents[2]
-
-# CAMBIO: DB unificada en carpeta data/
-DB_PATH = (BASE_DIR / "data" / "app.db").resolve()
-
-# CAMBIO: Normalizamos URL relativa si viniera como sqlite:///./loque sea
-def _normalize_sqlite_url(url: str) -> str:
-    """
-    CAMBIO: Si viene una URL relativa tipo sqlite:///./app.db, la convertimos a absoluta
-    dentro del repo para evitar dobles bases por CWD distinto.
-    """
-    if url.startswith("sqlite:///./"):
-        rel = url.replace("sqlite:///./", "")
-        return f"sqlite:///{(BASE_DIR / rel).resolve()}"
-    return url
-
-# CAMBIO: Usa la de config si existe; si es relativa, la normaliza; si no, usa data/app.db
-SQLALCHEMY_DATABASE_URL = _normalize_sqlite_url(
-    getattr(config, "database_url", f"sqlite:///{DB_PATH}")
-)
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=False,
-    connect_args={
-        "check_same_thread": False,
-        "timeout": 30,
-    },
-    pool_pre_ping=True,
-)
-
-@event.listens_for(engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    if isinstance(dbapi_connection, sqlite3.Connection):
-        dbapi_connection.execute("PRAGMA journal_mode=WAL")
-        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
-
-SessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine,
-    expire_on_commit=False,
-)
\ No newline at end of file
@@ -0,0 +1,381 @@
+import json
+import math
+import queue
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.almacenamiento import almacen_de
+from app.db.session import SessionLocal
+from app.db.models import Lectura, Device, Mecanismos
+from app.servicios.registro import registro, EstadoMecanismos
+from app.servicios.control_vectorizado import lote_control, LoteControl
+from app.servicios.efectos import EfectosLote
+from app.servicios.stream import publicar_lectura, publicar_mecanismos, publicar_alerta
+from app.servicios.rollups import acumular_lecturas
+from app.servicios.flota import actualizar_ultimas
+from app.servicios.analitica import analitica
+from app.servicios.eventos import diario
+from app.servicios.presencia import presencia, es_contacto
+from app.servicios.comandos import rastreador
+
+log = logging.getLogger("ingesta")
+
+
+# ============================================================
+# MENSAJES ENCOLADOS
+# ============================================================
+
+@dataclass(slots=True)
+class MensajeMQTT:
+    """Mensaje crudo tal como llegó al hilo de paho, listo para el escritor."""
+    topic: str
+    esp_id: str
+    payload: str
+    recibido: datetime   # hora de recepción (UTC), se usa como fecha_hora de la lectura
+    t_mono: float        # time.monotonic() al encolar, para medir la espera en cola
+
+
+def _is_num(x):
+    """Verifica si el valor es un número válido."""
+    return isinstance(x, (int, float)) and not (isinstance(x, float) and math.isnan(x))
+
+
+def _update_mecanismos_from_telemetria(db: Session, esp_id: str, data: dict):
+    """Persiste el estado REAL de los mecanismos reportado por el ESP32 en la DB."""
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
+        log.warning("DISPOSITIVO no encontrado para actualizar mecanismos: %s", esp_id)
+        return
+
+    new_bomba = (str(data.get("riego")).upper() == "ON")
+    new_vent = (str(data.get("vent")).upper() == "ON")
+    new_luz = (str(data.get("luz")).upper() == "ON")
+
+    mech = entrada.mecanismos
+    if mech is None:
+        nuevo = Mecanismos(device_id=entrada.device_id, bomba=new_bomba, ventilador=new_vent, luz=new_luz)
+        db.add(nuevo)
+        db.flush() # Asegura que el objeto tenga id
+        registro.actualizar_mecanismos(esp_id, EstadoMecanismos(nuevo.id, new_bomba, new_luz, new_vent))
+        return
+
+    # Comparación contra el registro en memoria: sin SELECT si nada cambió.
+    if mech.bomba != new_bomba or mech.ventilador != new_vent or mech.luz != new_luz:
+        log.info("SINCRONIZANDO estado de Mecanismos para %s.", esp_id)
+        db.execute(
+            update(Mecanismos)
+            .where(Mecanismos.id == mech.id)
+            .values(bomba=new_bomba, ventilador=new_vent, luz=new_luz)
+        )
+        registro.actualizar_mecanismos(esp_id, EstadoMecanismos(mech.id, new_bomba, new_luz, new_vent))
+
+
+# ============================================================
+# ESCRITOR POR LOTES
+# ============================================================
+
+class IngestaWriter:
+    """
+    Desacopla el hilo de red de paho de la escritura en la DB.
+
+    El hilo de paho sólo encola (`encolar`). Un hilo escritor drena la cola en
+    micro-lotes (hasta `lote_max` mensajes o `ventana_s` segundos) y los
+    persiste en UNA transacción: inserción de lecturas en bloque y, para los
+    devices a los que les toca (ver `presencia`), un UPDATE de `ultimo_contacto`.
+
+    Lo que no vuelve atrás con un ROLLBACK (SET del autocontrol, diario,
+    presencia, métricas) se junta en un `EfectosLote` y se aplica después del
+    commit; si el lote falla se descarta y los cooldowns que reservó se
+    devuelven, así el reintento mensaje a mensaje decide desde cero.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        cola_max: int = config.ingesta_cola_max,
+        lote_max: int = config.ingesta_lote_max,
+        ventana_s: float = config.ingesta_ventana_ms / 1000,
+        put_timeout_s: float = config.ingesta_put_timeout_ms / 1000,
+        ordenar: bool = config.ingesta_compartida,
+    ):
+        self._session_factory = session_factory
+        self._ordenar = ordenar
+        self._cola: queue.Queue = queue.Queue(maxsize=cola_max)
+        self._lote_max = lote_max
+        self._ventana_s = ventana_s
+        self._put_timeout_s = put_timeout_s
+        self._hilo: threading.Thread | None = None
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "recibidos": 0,
+            "descartados": 0,        # cola llena tras put_timeout_s
+            "bloqueos": 0,           # veces que el hilo de paho tuvo que esperar
+            "procesados": 0,
+            "lecturas": 0,
+            "lotes": 0,
+            "errores_lote": 0,
+            "profundidad_max": 0,
+            "ultimo_lote_n": 0,
+            "ultimo_lote_ms": 0.0,
+            "espera_max_ms": 0.0,
+        }
+
+    # ---------- lado productor (hilo de paho) ----------
+
+    def encolar(self, topic: str, esp_id: str, payload: str, recibido: datetime | None = None) -> bool:
+        """
+        Encola un mensaje. Devuelve False si se descartó por backpressure.
+        `recibido` = cuándo llegó del broker, si lo recibió otro proceso (ingesta compartida).
+        """
+        msg = MensajeMQTT(topic, esp_id, payload, recibido or datetime.now(timezone.utc), time.monotonic())
+        with self._lock:
+            self._stats["recibidos"] += 1
+        try:
+            self._cola.put_nowait(msg)
+        except queue.Full:
+            with self._lock:
+                self._stats["bloqueos"] += 1
+            try:
+                self._cola.put(msg, timeout=self._put_timeout_s)
+            except queue.Full:
+                with self._lock:
+                    self._stats["descartados"] += 1
+                log.warning("Cola de ingesta llena (%d). Mensaje de %s descartado.", self._cola.maxsize, esp_id)
+                return False
+        profundidad = self._cola.qsize()
+        if profundidad > self._stats["profundidad_max"]:
+            with self._lock:
+                self._stats["profundidad_max"] = max(self._stats["profundidad_max"], profundidad)
+        return True
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self):
+        """Arranca el hilo escritor (idempotente)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="ingesta-writer", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout: float = 5.0):
+        """Detiene el escritor tras drenar lo que quede en la cola."""
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def metricas(self) -> dict:
+        """Contadores de backpressure y rendimiento del escritor."""
+        with self._lock:
+            m = dict(self._stats)
+        m["profundidad"] = self._cola.qsize()
+        m["capacidad"] = self._cola.maxsize
+        m["lote_promedio"] = round(m["procesados"] / m["lotes"], 2) if m["lotes"] else 0.0
+        return m
+
+    # ---------- lado consumidor (hilo escritor) ----------
+
+    def _tomar_lote(self) -> list[MensajeMQTT]:
+        """Bloquea hasta el primer mensaje y completa el lote dentro de la ventana."""
+        try:
+            primero = self._cola.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        lote = [primero]
+        limite = time.monotonic() + self._ventana_s
+        while len(lote) < self._lote_max:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while not (self._parar.is_set() and self._cola.empty()):
+            lote = self._tomar_lote()
+            if lote:
+                self.procesar_lote(lote)
+
+    def procesar_lote(self, lote: list[MensajeMQTT]):
+        """Persiste un lote en una sola transacción; si falla, reintenta de a uno."""
+        t0 = time.perf_counter()
+        ahora = time.monotonic()
+        espera_ms = max((ahora - m.t_mono) * 1000 for m in lote)
+        if self._ordenar:
+            # Un mensaje reenviado por otro proceso puede entrar a la cola después
+            # de uno posterior del mismo device: el orden es el de llegada al broker.
+            lote.sort(key=lambda m: m.recibido)
+
+        ok = self._escribir(lote)
+        if not ok and len(lote) > 1:
+            # Aísla el mensaje problemático sin perder el resto del lote.
+            for m in lote:
+                self._escribir([m])
+
+        dur_ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            s = self._stats
+            s["lotes"] += 1
+            s["procesados"] += len(lote)
+            s["ultimo_lote_n"] = len(lote)
+            s["ultimo_lote_ms"] = round(dur_ms, 3)
+            s["espera_max_ms"] = round(max(s["espera_max_ms"], espera_ms), 3)
+            if not ok:
+                s["errores_lote"] += 1
+
+    def _escribir(self, lote: list[MensajeMQTT]) -> bool:
+        inicio = time.monotonic()
+        efectos = EfectosLote()
+        with self._session_factory() as db:
+            try:
+                contactos: dict[int, tuple[str, datetime]] = {}
+                lecturas: list[tuple[str, Lectura]] = []
+                mech_antes: dict[str, EstadoMecanismos | None] = {}
+                control = lote_control(db, efectos)
+
+                for m in lote:
+                    self._procesar(db, m, contactos, lecturas, mech_antes, control, efectos)
+                control.evaluar()
+
+                # ultimo_contacto espaciado por presencia: a lo sumo un UPDATE por device cada presencia_flush_s.
+                if contactos:
+                    db.execute(
+                        update(Device),
+                        [{"id": dev_id, "ultimo_contacto": ts} for dev_id, (_, ts) in contactos.items()],
+                    )
+                    for esp_id, ts in contactos.values():
+                        efectos.despues(presencia.escrito, esp_id, ts)
+
+                almacen_de(db).insertar_lecturas(db, [lec for _, lec in lecturas])
+                acumular_lecturas(db, [lec for _, lec in lecturas])
+                actualizar_ultimas(db, [lec for _, lec in lecturas])
+                db.commit()
+            except Exception:
+                db.rollback()
+                # El registro pudo quedar con estado no confirmado: se descarta.
+                registro.limpiar()
+                efectos.descartar()
+                log.exception("FALLO al persistir lote de %d mensajes. Se realizó ROLLBACK.", len(lote))
+                return False
+
+        with self._lock:
+            self._stats["lecturas"] += len(lecturas)
+
+        # comandos del autocontrol, diario y presencia: sólo lo que quedó confirmado
+        efectos.confirmar()
+
+        # Sólo lo confirmado se publica a los clientes en vivo.
+        for esp_id, lec in lecturas:
+            publicar_lectura(esp_id, lec)
+        if analitica is not None and lecturas:
+            self._analizar(lecturas)
+        for esp_id, antes in mech_antes.items():
+            ahora = registro.mecanismos(esp_id)
+            if ahora is not None and ahora != antes:
+                publicar_mecanismos(esp_id, ahora)
+            # confirma los comandos que esta telemetría ya refleja (firmware sin ack)
+            rastreador.observar_estado(esp_id, ahora, antes_de=inicio)
+        return True
+
+    def _analizar(self, lecturas: list[tuple[str, Lectura]]):
+        """Ventanas de la analítica en vivo; las alertas van al diario y al stream (nunca corta el lote)."""
+        try:
+            for esp_id, lec in lecturas:
+                for a in analitica.observar(esp_id, lec):
+                    log.warning("ALERTA %s [%s] %s", a.esp_id, a.subtipo, a.mensaje)
+                    diario.registrar(a.esp_id, "alerta", a.subtipo, a.detalle, a.mensaje,
+                                     device_id=a.device_id, fecha_hora=a.fecha_hora)
+                    publicar_alerta(a)
+        except Exception:
+            log.exception("Error en la analítica de %d lecturas.", len(lecturas))
+
+    def _procesar(
+        self, db: Session, m: MensajeMQTT, contactos: dict, lecturas: list, mech_antes: dict,
+        control: LoteControl, efectos: EfectosLote,
+    ):
+        """Aplica un mensaje dentro de la transacción del lote (sin commit)."""
+        esp_id = m.esp_id
+        kind = m.topic.rsplit("/", 1)[-1]
+
+        # 1. CONTACTO DEL DISPOSITIVO (en memoria tras el commit; ultimo_contacto se escribe cada presencia_flush_s)
+        d = registro.obtener(db, esp_id)
+        simple = not m.payload or not m.payload.startswith("{")
+        contacto = True
+        if kind == "status" and simple:
+            log.debug("STATUS (simple) %s: %s", esp_id, m.payload)
+            contacto = es_contacto(m.payload)   # "offline" = last will
+            efectos.despues(presencia.status, esp_id, d.device_id, m.payload, m.recibido)
+        else:
+            efectos.despues(presencia.visto, esp_id, d.device_id, m.recibido)
+        if contacto and presencia.toca_escribir(esp_id, m.recibido):
+            previo = contactos.get(d.device_id)
+            if previo is None or m.recibido > previo[1]:
+                contactos[d.device_id] = (esp_id, m.recibido)
+
+        # Si el payload no es JSON, solo termina.
+        if simple:
+            return
+
+        # 2. PROCESAMIENTO DE JSON
+        try:
+            data = json.loads(m.payload)
+        except json.JSONDecodeError:
+            log.error("JSON INVÁLIDO. Topic: %s", m.topic)
+            return
+        esp_id = data.get("esp_id") or esp_id
+        if esp_id not in mech_antes:
+            mech_antes[esp_id] = registro.mecanismos(esp_id)
+
+        # A. Sincronizar Mecanismos (si los datos vienen en el payload)
+        if all(k in data for k in ("riego", "vent", "luz")):
+            if control.pendiente(esp_id):
+                control.evaluar()  # el autocontrol pendiente de este device va antes
+            _update_mecanismos_from_telemetria(db, esp_id, data)
+
+        # B. Guardar Lectura y Ejecutar Autocontrol (Solo para /telemetria)
+        if kind != "telemetria":
+            return
+        t, h, s, n = data.get("temp_c"), data.get("hum_amb"), data.get("suelo_pct"), data.get("nivel_pct")
+        if not (_is_num(t) and _is_num(h) and _is_num(s) and _is_num(n)):
+            log.info("Skip lectura %s: Datos de sensor inválidos.", esp_id)
+            return
+
+        nueva_lectura = Lectura(
+            device_id=d.device_id,
+            temperatura=float(t),
+            humedad=float(h),
+            humedad_suelo=float(s),
+            nivel_de_agua=float(n),
+            fecha_hora=m.recibido,
+        )
+        control.agregar(esp_id, nueva_lectura)
+        lecturas.append((m.esp_id, nueva_lectura))
+
+
+# Instancia del proceso (usada por el listener MQTT y por /system/ingesta)
+_writer: IngestaWriter | None = None
+
+
+def setup_ingesta(writer: IngestaWriter):
+    """Reemplaza el escritor del proceso (p. ej. uno ligado a otra DB en los benchmarks)."""
+    global _writer
+    _writer = writer
+
+
+def get_ingesta() -> IngestaWriter:
+    """Devuelve (creando si hace falta) el escritor de ingesta del proceso."""
+    global _writer
+    if _writer is None:
+        _writer = IngestaWriter()
+    return _writer
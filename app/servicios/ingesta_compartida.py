@@ -0,0 +1,231 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import paho.mqtt.client as mqtt
+
+from app.core.config import config
+from app.db.base import Base
+from app.db.session import almacen, engine
+from app.servicios.coordinacion import Conexion, bloqueo_exclusivo, coordinador
+from app.servicios.cooldown import cooldowns
+from app.servicios.ingesta import IngestaWriter, setup_ingesta
+from app.servicios.mqtt_funciones import setup_mqtt_client, bandeja
+from app.servicios.presencia import presencia
+
+log = logging.getLogger("ingesta-compartida")
+
+TOPICOS = ("invernaderos/+/telemetria", "invernaderos/+/status")
+BROKER = ("localhost", 1883)
+
+
+def particion(esp_id: str, procesos: int) -> int:
+    """Proceso dueño de un device (estable entre reinicios y entre procesos)."""
+    return zlib.crc32(esp_id.encode("utf-8")) % procesos
+
+
+def _cliente_paho(client_id: str) -> mqtt.Client:
+    # Las suscripciones compartidas son de MQTT v5.
+    return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5)
+
+
+class TrabajadorIngesta:
+    """
+    Un miembro del grupo de consumo `$share/<grupo>/invernaderos/+/...`.
+
+    El broker reparte los mensajes entre los K miembros sin mirar el device,
+    pero cada device tiene un único dueño (`particion(esp_id, K)`): sólo el
+    dueño escribe sus lecturas y corre su autocontrol, así cooldowns, estado
+    de mecanismos y orden de llegada quedan en un solo proceso. Lo que recibe
+    un miembro que no es el dueño se reenvía por el socket Unix del dueño
+    (`grow-ingesta-<i>.sock`) con la hora en que llegó del broker; el
+    escritor ordena cada lote por esa hora. Un mensaje reenviado sólo puede
+    quedar detrás de uno posterior del mismo device si ambos llegaron con
+    menos tiempo de diferencia que lo que tarda el reenvío (sub-milisegundo
+    en el mismo host; un ESP32 publica cada varios segundos).
+
+    Cada miembro tiene su propio IngestaWriter (su transacción por lote) y su
+    propio cliente MQTT. Los comandos de su autocontrol los publica la API
+    líder (ver `Coordinador.unirse`); el cliente propio queda para cuando el
+    líder no está. Si el socket del dueño no está disponible, el mensaje se
+    procesa acá antes que perderlo.
+    """
+
+    def __init__(
+        self,
+        indice: int,
+        procesos: int,
+        grupo: str = config.ingesta_grupo,
+        directorio: str = config.coordinacion_dir,
+        writer: IngestaWriter | None = None,
+        cliente_factory=_cliente_paho,
+    ):
+        self.indice = indice
+        self.procesos = procesos
+        self.grupo = grupo
+        self._dir = Path(directorio)
+        self.writer = writer or IngestaWriter()
+        self.cliente = cliente_factory(f"grow-ingesta-{indice}")
+        self.cliente.on_connect = self._on_connect
+        self.cliente.on_message = self._on_message
+        self._servidor: socket.socket | None = None
+        self._pares: dict[int, Conexion] = {}
+        self._lock = threading.Lock()
+        self._stats = {"recibidos": 0, "propios": 0, "reenviados": 0, "recibidos_de_pares": 0, "sin_dueno": 0}
+
+    def ruta_socket(self, indice: int) -> Path:
+        return self._dir / f"grow-ingesta-{indice}.sock"
+
+    # ---------- MQTT ----------
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            log.warning("[%d] Conexión MQTT fallida con rc=%s", self.indice, rc)
+            return
+        for t in TOPICOS:
+            client.subscribe(f"$share/{self.grupo}/{t}", qos=1)
+        log.info("[%d/%d] Suscripto a $share/%s/...", self.indice, self.procesos, self.grupo)
+        if bandeja is not None:
+            bandeja.reanudar()
+
+    def _on_message(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        esp_id = parts[1] if len(parts) >= 2 else None
+        if not esp_id:
+            log.error("No se pudo extraer esp_id del tópico: %s", msg.topic)
+            return
+        payload = msg.payload.decode(errors="ignore").strip()
+        dueno = particion(esp_id, self.procesos)
+        with self._lock:
+            self._stats["recibidos"] += 1
+        if dueno == self.indice:
+            with self._lock:
+                self._stats["propios"] += 1
+            self.writer.encolar(msg.topic, esp_id, payload)
+            return
+
+        conn = self._par(dueno)
+        if conn is None:
+            with self._lock:
+                self._stats["sin_dueno"] += 1
+            self.writer.encolar(msg.topic, esp_id, payload)
+            return
+        with self._lock:
+            self._stats["reenviados"] += 1
+        conn.enviar({"topic": msg.topic, "esp_id": esp_id, "payload": payload, "ts": time.time()})
+
+    # ---------- reenvío entre miembros ----------
+
+    def _par(self, indice: int) -> Conexion | None:
+        conn = self._pares.get(indice)
+        if conn is not None and not conn.cerrada:
+            return conn
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.ruta_socket(indice)))
+        except OSError:
+            sock.close()
+            return None
+        conn = self._pares[indice] = Conexion(sock, f"ingesta-{self.indice}-a-{indice}")
+        return conn
+
+    def _servir(self):
+        ruta = self.ruta_socket(self.indice)
+        try:
+            ruta.unlink()
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(str(ruta))
+        srv.listen(16)
+        self._servidor = srv
+        threading.Thread(target=self._aceptar, name=f"ingesta-{self.indice}-srv", daemon=True).start()
+
+    def _aceptar(self):
+        while True:
+            try:
+                sock, _ = self._servidor.accept()
+            except OSError:
+                return
+            conn = Conexion(sock, f"ingesta-{self.indice}-par")
+            threading.Thread(target=self._recibir, args=(conn,), daemon=True).start()
+
+    def _recibir(self, conn: Conexion):
+        try:
+            for m in conn.lineas():
+                with self._lock:
+                    self._stats["recibidos_de_pares"] += 1
+                recibido = datetime.fromtimestamp(m["ts"], tz=timezone.utc)
+                self.writer.encolar(m["topic"], m["esp_id"], m["payload"], recibido=recibido)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("[%d] Conexión con otro miembro terminada: %s", self.indice, e)
+        finally:
+            conn.cerrar()
+
+    # ---------- ciclo de vida ----------
+
+    def iniciar(self, host: str = BROKER[0], port: int = BROKER[1]):
+        """Escritor, socket de reenvío y, al final, la suscripción (para no perder mensajes)."""
+        self.writer.iniciar()
+        self._servir()
+        self.cliente.connect(host, port, keepalive=25)
+        self.cliente.loop_start()
+
+    def detener(self):
+        self.cliente.loop_stop()
+        self.cliente.disconnect()
+        if self._servidor is not None:
+            self._servidor.close()
+            self.ruta_socket(self.indice).unlink(missing_ok=True)
+        for conn in self._pares.values():
+            conn.cerrar()
+        self.writer.detener()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+        m.update(indice=self.indice, procesos=self.procesos, escritor=self.writer.metricas())
+        return m
+
+
+def correr_proceso(indice: int, procesos: int):
+    """
+    Cuerpo de cada proceso lanzado por run_ingesta.py: cooldowns y presencia
+    de su partición, conexión con la API líder (eventos en vivo, registro y
+    confirmación de comandos) y el trabajador hasta SIGTERM/SIGINT.
+    """
+    with bloqueo_exclusivo(coordinador.ruta_lock.with_suffix(".init")):
+        Base.metadata.create_all(bind=engine)  # puede arrancar antes que la API
+        almacen.preparar_esquema(engine)
+    propio = lambda esp_id: particion(esp_id, procesos) == indice
+    cooldowns.particionar(propio)
+    cooldowns.restaurar()
+    cooldowns.iniciar()
+    presencia.restaurar(propio)
+    coordinador.unirse()
+
+    t = TrabajadorIngesta(indice, procesos)
+    setup_ingesta(t.writer)
+    setup_mqtt_client(t.cliente)  # comandos del autocontrol mientras no haya conexión con el líder
+    if bandeja is not None:
+        bandeja.origen = f"ingesta-{indice}"   # reenvía sólo los comandos de este proceso
+        bandeja.iniciar()
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+    try:
+        t.iniciar()
+        log.info("Proceso de ingesta %d/%d (pid %d) en marcha.", indice, procesos, os.getpid())
+        parar.wait()
+    except ConnectionRefusedError:
+        log.error("[%d] No se pudo conectar al broker en %s:%d.", indice, *BROKER)
+    finally:
+        t.detener()
+        cooldowns.detener()
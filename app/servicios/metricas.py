@@ -0,0 +1,221 @@
+"""
+Métricas en formato de exposición de Prometheus (texto 0.0.4), sin dependencias.
+
+Contadores e histogramas en memoria, con un lock por métrica: incrementar u
+observar cuesta alrededor de un microsegundo (`python -m bench.metricas`), así
+que se pueden llamar desde el hilo de paho y desde el escritor de ingesta.
+Los medidores (profundidad de colas, etc.) no se actualizan en el camino
+caliente: se leen de los `metricas()` de cada servicio al momento del scrape.
+
+Cada proceso tiene sus propias métricas. Con WORKERS=N, las de MQTT e
+ingesta están en el líder; `grow_proceso_info` dice qué proceso respondió.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Segundos: de 10 µs (on_message) a 10 s (commits en una SD con el WAL grande).
+BUCKETS_S = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+def _escapar(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres: tuple[str, ...], valores: tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _num(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Contador:
+    """Contador monótono, con etiquetas posicionales: `c.inc("telemetria")`."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._lock = threading.Lock()
+        self._valores: dict[tuple, float] = {}
+
+    def inc(self, *valores, n: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def muestras(self) -> Iterable[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, v in valores:
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_num(v)}"
+
+
+class Histograma:
+    """Histograma de buckets fijos (acumulados recién al exponerlo)."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS_S):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # por etiquetas: [cuentas por bucket (+Inf al final), suma]
+        self._series: dict[tuple, list] = {}
+
+    def observar(self, valor: float, *valores):
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def muestras(self) -> Iterable[str]:
+        with self._lock:
+            series = [(k, list(c), s) for k, (c, s) in self._series.items()]
+        for etiquetas, cuentas, suma in series:
+            acumulado = 0
+            for limite, n in zip(self.buckets + (float("inf"),), cuentas):
+                acumulado += n
+                le = f'le="{_num(limite)}"'
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_num(suma)}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}"
+
+
+class Medidor:
+    """
+    Valor leído al exponer: `leer()` devuelve un número o un dict
+    {tupla de etiquetas: número}. Si falla, la métrica se omite en ese scrape.
+    Con `tipo="counter"` expone un contador que ya lleva otro servicio.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, leer: Callable[[], float | dict], etiquetas: tuple[str, ...] = (),
+                 tipo: str = "gauge"):
+        self.tipo = tipo
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._leer = leer
+
+    def muestras(self) -> Iterable[str]:
+        try:
+            v = self._leer()
+        except Exception:
+            return
+        if v is None:
+            return
+        for etiquetas, valor in (v.items() if isinstance(v, dict) else [((), v)]):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_num(valor)}"
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas: dict[str, Contador | Histograma | Medidor] = {}
+
+    def agregar(self, metrica):
+        """Registra una métrica (si ya había una con ese nombre, la reemplaza)."""
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()) -> Contador:
+        return self.agregar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), buckets=BUCKETS_S) -> Histograma:
+        return self.agregar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def medidor(self, nombre: str, ayuda: str, leer, etiquetas: tuple[str, ...] = (), tipo: str = "gauge") -> Medidor:
+        return self.agregar(Medidor(nombre, ayuda, leer, etiquetas, tipo))
+
+    def exponer(self) -> str:
+        lineas = []
+        for m in list(self._metricas.values()):
+            lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+            lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+            lineas.extend(m.muestras())
+        return "\n".join(lineas) + "\n"
+
+
+metricas = RegistroMetricas()
+
+# ---------- camino caliente ----------
+
+mqtt_descartados = metricas.contador(
+    "grow_mqtt_descartados_total", "Mensajes MQTT descartados (cola de ingesta llena o tópico inválido).", ("topico",))
+# su _count por tópico es la cuenta de mensajes recibidos (una operación menos por mensaje)
+on_message_s = metricas.histograma(
+    "grow_mqtt_on_message_segundos", "Duración de on_message en el hilo de paho, por tipo de tópico.", ("topico",))
+db_commit_s = metricas.histograma(
+    "grow_db_commit_segundos", "Duración de cada commit de sesión (flush incluido).")
+decisiones = metricas.contador(
+    "grow_autocontrol_decisiones_total", "Cambios de actuador decididos por el autocontrol.", ("actuador", "valor"))
+publicacion_fallos = metricas.contador(
+    "grow_mqtt_publicacion_fallos_total", "Comandos MQTT que no se pudieron publicar.", ("motivo",))
+http_s = metricas.histograma(
+    "grow_http_pedido_segundos", "Duración de los pedidos HTTP, por ruta.", ("ruta", "metodo", "codigo"))
+
+
+def tipo_topico(topic: str) -> str:
+    """Último segmento del tópico (telemetria, status, ack): sin el esp_id, para acotar las series."""
+    return topic.rsplit("/", 1)[-1] or "otro"
+
+
+# ---------- commits de cualquier sesión ORM ----------
+
+@event.listens_for(Session, "before_commit")
+def _antes_commit(session):
+    session.info["_t_commit"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _despues_commit(session):
+    t0 = session.info.pop("_t_commit", None)
+    if t0 is not None:
+        db_commit_s.observar(time.perf_counter() - t0)
+
+
+# ---------- pedidos HTTP ----------
+
+class MedirPedidos:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware, que agrega una tarea por
+    pedido): la ruta es la plantilla de FastAPI ("/api/v1/lecturas"), no la
+    URL, para no abrir una serie por esp_id; lo que no es de la API (el
+    frontend estático) va como "estatico".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        codigo = 500
+        t0 = time.perf_counter()
+
+        async def enviar(mensaje):
+            nonlocal codigo
+            if mensaje["type"] == "http.response.start":
+                codigo = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = getattr(scope.get("route"), "path", None)
+            if not ruta or ruta == "/":
+                ruta = "estatico"
+            http_s.observar(time.perf_counter() - t0, ruta, scope["method"], codigo)
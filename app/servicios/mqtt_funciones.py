@@ -1,19 +1,35 @@
 import paho.mqtt.client as mqtt
 import logging
 import json
+from concurrent.futures import CancelledError
 from typing import Optional
 
+from app.core.config import config
+from app.servicios.comandos import rastreador, ComandoPendiente, ColaComandos, marcar_publicado
+from app.servicios.bandeja import BandejaSalida
+from app.servicios.metricas import publicacion_fallos
+
 CMD_TOPIC_BASE = "invernaderos/{esp_id}/cmd"
 
 DEFAULT_ESP_ID = "main" 
 
 _mqtt_client = None
+_reenvio = None
 
 def setup_mqtt_client(client: mqtt.Client):
     """Guarda la referencia del cliente MQTT para ser usada globalmente."""
     global _mqtt_client
     _mqtt_client = client
 
+def setup_reenvio(fn):
+    """
+    En un worker sin MQTT (o un proceso de ingesta compartida), `fn(cmd,
+    esp_id) -> ComandoPendiente | None` lleva los comandos al proceso líder,
+    que tiene la cola de salida y el rastreador (None = publicar acá).
+    """
+    global _reenvio
+    _reenvio = fn
+
 def get_mqtt_client() -> Optional[mqtt.Client]:
     """Retorna el cliente MQTT conectado."""
     return _mqtt_client
@@ -22,37 +38,168 @@ def _resolve_default_esp_id() -> Optional[str]:
     """Resuelve el ID de dispositivo por defecto si no se proporciona."""
     return DEFAULT_ESP_ID
 
-def enviar_cmd_mqtt(cmd: dict, esp_id: Optional[str] = None) -> bool:
-    """
-    Publica un comando JSON al tópico CMD específico del dispositivo.
-    Ejemplo: {"cmd": "SET", "target": "RIEGO", "value": "ON"}
-    """
+def _publicar(esp_id: str, cmd: dict) -> bool:
+    """PUBLISH QoS 1 de un comando ya armado al tópico CMD del dispositivo."""
     client = get_mqtt_client()
     if not client or not client.is_connected():
         logging.warning("enviar_cmd_mqtt: Cliente MQTT no conectado.")
+        publicacion_fallos.inc("desconectado")
         return False
 
-    final_esp_id = esp_id
-    if not final_esp_id:
-        final_esp_id = _resolve_default_esp_id()
-        
-    if not final_esp_id:
-        logging.error("enviar_cmd_mqtt: No se pudo resolver un esp_id para enviar el comando.")
-        return False
-
-    topic = CMD_TOPIC_BASE.format(esp_id=final_esp_id)
+    topic = CMD_TOPIC_BASE.format(esp_id=esp_id)
     payload = json.dumps(cmd)
     
     try:
-        logging.info(f"Intentando PUBLISH de comando a {topic} | Payload: {payload}")
+        logging.debug("Intentando PUBLISH de comando a %s | Payload: %s", topic, payload)
         result = client.publish(topic, payload, qos=1)
         
         if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            logging.error(f"Fallo al publicar MQTT (rc: {result.rc}) a {topic}")
+            logging.error("Fallo al publicar MQTT (rc: %s) a %s", result.rc, topic)
+            publicacion_fallos.inc("rc")
             return False
         
-        logging.info(f"Comando MQTT PUBLICADO con éxito (rc: {result.rc})")
+        logging.info("Comando MQTT publicado a %s: %s", topic, payload)
         return True
     except Exception as e:
-        logging.error(f"Excepción al publicar MQTT: {e}")
-        return False
\ No newline at end of file
+        logging.error("Excepción al publicar MQTT: %s", e)
+        publicacion_fallos.inc("excepcion")
+        return False
+
+
+def _conectado() -> bool:
+    client = get_mqtt_client()
+    return client is not None and client.is_connected()
+
+
+# Lo que no se puede publicar espera en la DB y sale al reconectar (None = se descarta como antes).
+bandeja = BandejaSalida(_publicar, _conectado) if config.bandeja_salida else None
+
+
+def _entregar(esp_id: str, cmd: dict) -> bool | str:
+    """
+    Publica un comando o, si el device ya tiene comandos en la bandeja (no
+    se adelanta) o el publish falla, lo deja en la bandeja ("diferido").
+    False sólo si se perdió.
+    """
+    if bandeja is not None and bandeja.tiene(esp_id):
+        return bandeja.guardar(esp_id, cmd, "en_orden") and "diferido"
+    if _publicar(esp_id, cmd):
+        return True
+    return bandeja is not None and bandeja.guardar(esp_id, cmd, "publish") and "diferido"
+
+
+# un SET espera a lo sumo la ventana de la cola más esto a que salga
+ESPERA_PUBLICACION_S = 5.0
+
+
+# Los SET pasan por la cola de salida: los de un mismo device dentro de la ventana salen juntos.
+cola_comandos = ColaComandos(_entregar, ventana_ms=config.comando_ventana_ms, set_multi=config.comando_set_multi)
+
+
+def enviar_cmd(cmd: dict, esp_id: Optional[str] = None, esperar: bool = True) -> Optional[ComandoPendiente]:
+    """
+    Envía un comando JSON al tópico CMD específico del dispositivo, con id de
+    correlación. Devuelve el pendiente (con su Future) o None si no se pudo enviar.
+    Ejemplo: {"cmd": "SET", "target": "RIEGO", "value": "ON", "id": "9f2c..."}
+
+    Los SET se encolan y se publican al cerrar la ventana de coalescencia; el
+    resto de los comandos sale en el momento, después de lo que el device
+    tenga en cola. Sin broker (o con comandos del device todavía en la
+    bandeja de salida) el comando queda en la bandeja y el pendiente sale
+    con `diferido=True`.
+
+    Con `esperar` vuelve recién cuando el comando salió (o quedó en la
+    bandeja, o se perdió: None). Sin esperar devuelve el pendiente apenas se
+    encola; `esperar_publicacion()` espera después (p. ej. varios SET que
+    tienen que coalescer) y `p.publicado` dice cómo salió.
+    """
+    if _reenvio is not None:
+        p = _reenvio(cmd, esp_id)
+    else:
+        p = enviar_cmd_local(cmd, esp_id)
+    if p is None or not esperar:
+        return p
+    return esperar_publicacion(p)
+
+
+def esperar_publicacion(p: ComandoPendiente, timeout: Optional[float] = None) -> Optional[ComandoPendiente]:
+    """
+    Espera a que un pendiente salga de la cola de SET. None si se perdió; si
+    no se sabe a tiempo (o ya venía así del líder) vuelve `incierto`.
+    """
+    if p.incierto:
+        return p
+    if timeout is None:
+        timeout = config.comando_ventana_ms / 1000 + ESPERA_PUBLICACION_S
+    try:
+        r = p.publicado.result(timeout)
+    except CancelledError:
+        return None
+    except TimeoutError:
+        logging.warning("enviar_cmd_mqtt: el comando %s no salió de la cola en %.1f s.", p.cid, timeout)
+        p.incierto = True
+        return p
+    if not r:
+        return None
+    if r == "diferido":
+        p.diferido = True
+    return p
+
+
+def enviar_cmd_local(cmd: dict, esp_id: Optional[str] = None) -> Optional[ComandoPendiente]:
+    """`enviar_cmd` con el cliente MQTT de este proceso, aunque haya reenvío configurado."""
+    client = get_mqtt_client()
+    if not client or (bandeja is None and not client.is_connected()):
+        logging.warning("enviar_cmd_mqtt: Cliente MQTT no conectado.")
+        publicacion_fallos.inc("desconectado")
+        return None
+
+    final_esp_id = esp_id
+    if not final_esp_id:
+        final_esp_id = _resolve_default_esp_id()
+        
+    if not final_esp_id:
+        logging.error("enviar_cmd_mqtt: No se pudo resolver un esp_id para enviar el comando.")
+        publicacion_fallos.inc("sin_esp_id")
+        return None
+
+    pendiente = rastreador.registrar(final_esp_id, cmd)
+    if bandeja is not None:
+        motivo = "desconectado" if not client.is_connected() else "en_orden" if bandeja.tiene(final_esp_id) else None
+        if motivo:
+            # detrás de lo que el device tenga en la cola de SET y en la bandeja
+            cola_comandos.vaciar(final_esp_id)
+            return _diferir(final_esp_id, cmd, pendiente, motivo)
+
+    if cmd.get("cmd") == "SET":
+        cola_comandos.encolar(final_esp_id, cmd, pendiente)
+        return pendiente
+
+    cola_comandos.vaciar(final_esp_id)
+    if not _publicar(final_esp_id, cmd):
+        return _diferir(final_esp_id, cmd, pendiente, "publish")
+    marcar_publicado(pendiente, True)
+    return pendiente
+
+
+def _diferir(esp_id: str, cmd: dict, pendiente: ComandoPendiente, motivo: str) -> Optional[ComandoPendiente]:
+    if bandeja is None or not bandeja.guardar(esp_id, cmd, motivo):
+        rastreador.descartar(pendiente)
+        marcar_publicado(pendiente, False)
+        return None
+    pendiente.diferido = True
+    rastreador.salio(pendiente)
+    marcar_publicado(pendiente, "diferido")
+    return pendiente
+
+
+def enviar_cmd_mqtt(cmd: dict, esp_id: Optional[str] = None) -> bool:
+    """
+    Publica un comando JSON al tópico CMD específico del dispositivo.
+    Ejemplo: {"cmd": "SET", "target": "RIEGO", "value": "ON"}
+
+    Es el envío del autocontrol: no espera a que el SET salga de la cola
+    (frenaría al escritor de ingesta una ventana por device). True si se
+    aceptó; si después se pierde lo cuentan las métricas de la cola ("fallos").
+    """
+    return enviar_cmd(cmd, esp_id, esperar=False) is not None
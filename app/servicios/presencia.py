@@ -0,0 +1,288 @@
+"""
+Presencia de los devices: último contacto en memoria, estado online / stale /
+offline y escritura espaciada de `ultimo_contacto`.
+
+Cada mensaje de telemetría o status de un device cuenta como contacto y
+sólo actualiza la memoria. `Device.ultimo_contacto` se escribe a lo sumo cada
+`presencia_flush_s` por device: la ingesta pregunta `toca_escribir`, lo
+agrega al UPDATE de su lote y, recién cuando el lote confirma, registra el
+contacto (`visto`/`status`) y la escritura (`escrito`). Un lote que vuelve
+atrás no deja rastro en la presencia. El barrido escribe el contacto que
+quedó pendiente de un device que dejó de mandar.
+
+Estados:
+
+- online: hubo contacto en los últimos `presencia_stale_s`, o llegó "online"
+  por `invernaderos/{esp_id}/status`.
+- stale: sin contacto hace más de `presencia_stale_s`.
+- offline: sin contacto hace más de `presencia_offline_s`, o llegó "offline"
+  por status (el last will que el broker publica cuando el ESP32 se cae; ese
+  mensaje no cuenta como contacto).
+
+Un hilo de barrido (cada `presencia_barrido_s`) aplica los vencimientos y
+escribe los contactos pendientes; arranca con el primer contacto del
+proceso. Cada transición va al diario de eventos (tipo "status") y al
+stream en vivo (evento "presencia").
+
+Sólo el proceso que consume MQTT tiene los contactos. Al arrancar parte de
+`ultimo_contacto` (`restaurar()`): el estado estimado de cada device, sin
+eventos, así un reinicio no registra "? → online" para toda la flota. Para
+un device que este proceso no vio (otro worker, ingesta compartida) el
+estado también se estima desde `ultimo_contacto` en la DB, que puede estar
+atrasado hasta `presencia_flush_s`.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import select, update
+
+from app.core.config import config
+from app.db.models import Device
+from app.db.session import SessionLocal
+from app.servicios.eventos import diario
+from app.servicios.stream import hub
+
+log = logging.getLogger("presencia")
+
+ESTADOS = ("online", "stale", "offline")
+
+
+def _utc(ts: datetime) -> datetime:
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def es_contacto(payload: str) -> bool:
+    """Un status simple cuenta como contacto salvo "offline" (el last will lo publica el broker)."""
+    return payload.strip().strip('"').lower() != "offline"
+
+
+@dataclass(slots=True)
+class _Presencia:
+    device_id: int
+    visto: datetime | None          # último contacto (None: sólo se supo su status)
+    escrito: datetime | None        # último ultimo_contacto escrito en la DB
+    estado: str
+    desde: datetime                 # desde cuándo está en `estado`
+    motivo: str
+    estimado: bool = False          # restaurado de ultimo_contacto, todavía sin contacto propio
+
+
+class RastreadorPresencia:
+    """Último contacto por device en memoria y transiciones de estado. Thread-safe."""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_s: float = config.presencia_flush_s,
+        stale_s: float = config.presencia_stale_s,
+        offline_s: float = config.presencia_offline_s,
+        barrido_s: float = config.presencia_barrido_s,
+        reloj: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+    ):
+        self.session_factory = session_factory
+        self.flush_s = flush_s
+        self.stale_s = stale_s
+        self.offline_s = offline_s
+        self.barrido_s = barrido_s
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._devices: dict[str, _Presencia] = {}
+        self._hilo: threading.Thread | None = None
+        self._parar = threading.Event()
+        self._stats = {"contactos": 0, "escrituras": 0, "transiciones": 0, "barridos": 0, "restaurados": 0}
+
+    # ---------- camino caliente (hilo escritor de ingesta) ----------
+
+    def toca_escribir(self, esp_id: str, cuando: datetime) -> bool:
+        """
+        True si un contacto en `cuando` tiene que ir a `ultimo_contacto` (el
+        llamador lo agrega a su UPDATE y, tras el commit, llama a `escrito`).
+        No cambia nada: si la transacción vuelve atrás no hay que deshacer.
+        """
+        with self._lock:
+            p = self._devices.get(esp_id)
+            return p is None or p.escrito is None or (cuando - p.escrito).total_seconds() >= self.flush_s
+
+    def escrito(self, esp_id: str, cuando: datetime):
+        """`ultimo_contacto = cuando` ya está confirmado en la DB; el próximo va `flush_s` después."""
+        with self._lock:
+            p = self._devices.get(esp_id)
+            if p is not None and (p.escrito is None or cuando > p.escrito):
+                p.escrito = cuando
+                self._stats["escrituras"] += 1
+
+    def visto(self, esp_id: str, device_id: int, cuando: datetime):
+        """Registra un contacto (llamar después del commit del mensaje que lo trajo)."""
+        if self._hilo is None:
+            self.iniciar()
+        with self._lock:
+            self._stats["contactos"] += 1
+            p = self._devices.get(esp_id)
+            if p is None:
+                p = self._devices[esp_id] = _Presencia(device_id, cuando, None, "", cuando, "")
+            elif p.visto is None or cuando > p.visto:
+                p.visto = cuando
+            p.estimado = False
+            transicion = self._cambiar(esp_id, p, "online", "contacto", cuando) if p.estado != "online" else None
+        if transicion:
+            self._emitir(*transicion)
+
+    def status(self, esp_id: str, device_id: int, payload: str, cuando: datetime):
+        """
+        Payload simple de `invernaderos/{esp_id}/status`. "offline" (last will)
+        pasa el device a offline sin contar como contacto; cualquier otro es
+        un contacto (ver `es_contacto`).
+        """
+        if es_contacto(payload):
+            self.visto(esp_id, device_id, cuando)
+            return
+        with self._lock:
+            p = self._devices.get(esp_id)
+            if p is None:
+                p = self._devices[esp_id] = _Presencia(device_id, None, None, "", cuando, "")
+            transicion = self._cambiar(esp_id, p, "offline", "lwt", cuando) if p.estado != "offline" else None
+        if transicion:
+            self._emitir(*transicion)
+
+    # ---------- transiciones ----------
+
+    def _cambiar(self, esp_id: str, p: _Presencia, estado: str, motivo: str, cuando: datetime) -> tuple:
+        """Cambia el estado (con el lock tomado); devuelve lo que hay que emitir fuera del lock."""
+        previo = p.estado
+        p.estado, p.motivo, p.desde = estado, motivo, cuando
+        self._stats["transiciones"] += 1
+        return esp_id, p.device_id, previo, estado, motivo, cuando
+
+    def _emitir(self, esp_id: str, device_id: int, previo: str, estado: str, motivo: str, cuando: datetime):
+        log.info("PRESENCIA %s: %s → %s (%s)", esp_id, previo or "?", estado, motivo)
+        diario.registrar(esp_id, "status", estado, previo, f"{previo or '?'} → {estado} ({motivo})",
+                         device_id=device_id, fecha_hora=cuando)
+        hub.publicar(esp_id, "presencia", {"esp_id": esp_id, "estado": estado, "previo": previo or None,
+                                           "motivo": motivo, "desde": cuando.isoformat()})
+
+    def restaurar(self, filtro: Callable[[str], bool] | None = None) -> int:
+        """
+        Parte del `ultimo_contacto` de la DB (llamar al arrancar, antes de la
+        ingesta). Con ingesta compartida `filtro(esp_id)` deja sólo los
+        devices de este proceso. No emite transiciones: el primer contacto
+        de un device que estaba online no es un cambio de estado.
+        """
+        with self.session_factory() as db:
+            filas = db.execute(
+                select(Device.esp_id, Device.id, Device.ultimo_contacto).where(Device.ultimo_contacto.is_not(None))
+            ).all()
+        ahora = self.reloj()
+        n = 0
+        with self._lock:
+            for esp_id, device_id, ultimo in filas:
+                if esp_id in self._devices or (filtro is not None and not filtro(esp_id)):
+                    continue
+                ultimo = _utc(ultimo)
+                self._devices[esp_id] = _Presencia(device_id, ultimo, ultimo, self._estimar(ultimo, ahora),
+                                                   ultimo, "reinicio", estimado=True)
+                n += 1
+            self._stats["restaurados"] += n
+        if n:
+            log.info("Presencia de %d devices restaurada desde ultimo_contacto.", n)
+        return n
+
+    # ---------- barrido ----------
+
+    def barrer(self) -> dict:
+        """Aplica los vencimientos (stale/offline) y escribe los contactos pendientes."""
+        ahora = self.reloj()
+        transiciones, pendientes = [], {}
+        with self._lock:
+            self._stats["barridos"] += 1
+            for esp_id, p in self._devices.items():
+                if p.visto is None:
+                    continue
+                edad = (ahora - p.visto).total_seconds()
+                if p.estimado:
+                    edad -= self.flush_s    # ultimo_contacto puede estar atrasado hasta flush_s
+                if p.estado != "offline" and edad > self.offline_s:
+                    transiciones.append(self._cambiar(esp_id, p, "offline", "sin_contacto", ahora))
+                elif p.estado == "online" and edad > self.stale_s:
+                    transiciones.append(self._cambiar(esp_id, p, "stale", "sin_contacto", ahora))
+                if p.escrito is not None and p.visto > p.escrito and (ahora - p.escrito).total_seconds() >= self.flush_s:
+                    pendientes[p.device_id] = (esp_id, p.visto)
+        for t in transiciones:
+            self._emitir(*t)
+        if pendientes:
+            try:
+                with self.session_factory() as db:
+                    db.execute(update(Device), [{"id": d, "ultimo_contacto": ts} for d, (_, ts) in pendientes.items()])
+                    db.commit()
+            except Exception:
+                # `escrito` no avanzó: el próximo barrido lo vuelve a intentar
+                log.exception("No se pudo escribir ultimo_contacto de %d devices.", len(pendientes))
+                return {"transiciones": len(transiciones), "escritos": 0}
+            for esp_id, ts in pendientes.values():
+                self.escrito(esp_id, ts)
+        return {"transiciones": len(transiciones), "escritos": len(pendientes)}
+
+    def iniciar(self):
+        """Arranca el hilo de barrido (idempotente)."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="presencia-barrido", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+
+    def _bucle(self):
+        while not self._parar.wait(self.barrido_s):
+            try:
+                self.barrer()
+            except Exception:
+                log.exception("Error en el barrido de presencia.")
+
+    # ---------- consulta ----------
+
+    def _estimar(self, ultimo_contacto: datetime | None, ahora: datetime) -> str:
+        if ultimo_contacto is None:
+            return "offline"
+        edad = (ahora - _utc(ultimo_contacto)).total_seconds()
+        # ultimo_contacto puede estar atrasado hasta flush_s
+        if edad <= self.stale_s + self.flush_s:
+            return "online"
+        return "stale" if edad <= self.offline_s + self.flush_s else "offline"
+
+    def estado(self, esp_id: str, ultimo_contacto: datetime | None = None) -> dict:
+        """Estado del device; si este proceso no lo vio, estimado desde `ultimo_contacto` de la DB."""
+        with self._lock:
+            p = self._devices.get(esp_id)
+            if p is not None:
+                return {"estado": p.estado, "visto": p.visto, "desde": p.desde, "motivo": p.motivo,
+                        "estimado": p.estimado}
+        return {"estado": self._estimar(ultimo_contacto, self.reloj()), "visto": ultimo_contacto,
+                "desde": None, "motivo": "ultimo_contacto", "estimado": True}
+
+    def olvidar(self, esp_id: str | None = None):
+        with self._lock:
+            if esp_id is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(esp_id, None)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            por_estado = {e: 0 for e in ESTADOS}
+            for p in self._devices.values():
+                if p.estado in por_estado:
+                    por_estado[p.estado] += 1
+        return {**m, "devices": por_estado, "flush_s": self.flush_s, "stale_s": self.stale_s,
+                "offline_s": self.offline_s}
+
+
+presencia = RastreadorPresencia()
@@ -0,0 +1,184 @@
+import threading
+from dataclasses import dataclass, replace
+from typing import Callable
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.db.models import Device, Mecanismos, Config
+
+
+# ============================================================
+# SNAPSHOTS (copias inmutables de lo que hay en la DB)
+# ============================================================
+
+@dataclass(slots=True, frozen=True)
+class ConfigSnapshot:
+    id: int
+    temperatura: int
+    humedad_suelo: int
+    humedad_ambiente: int
+    margen: int
+
+
+@dataclass(slots=True)
+class EstadoMecanismos:
+    """Estado de actuadores. Mutable para que el autocontrol trabaje sobre una copia."""
+    id: int
+    bomba: bool
+    luz: bool
+    ventilador: bool
+
+
+@dataclass(slots=True, frozen=True)
+class EntradaDispositivo:
+    device_id: int
+    esp_id: str
+    config: ConfigSnapshot | None
+    mecanismos: EstadoMecanismos | None
+
+
+def _snap_config(cfg: Config | None) -> ConfigSnapshot | None:
+    if cfg is None:
+        return None
+    return ConfigSnapshot(cfg.id, cfg.temperatura, cfg.humedad_suelo, cfg.humedad_ambiente, cfg.margen)
+
+
+def _snap_mech(mech: Mecanismos | None) -> EstadoMecanismos | None:
+    if mech is None:
+        return None
+    return EstadoMecanismos(mech.id, bool(mech.bomba), bool(mech.luz), bool(mech.ventilador))
+
+
+# ============================================================
+# REGISTRO
+# ============================================================
+
+class RegistroDispositivos:
+    """
+    Caché en proceso esp_id -> (device_id, config, mecanismos).
+
+    Thread-safe: lo comparten el hilo de ingesta MQTT y los workers de la API.
+    Las escrituras (set_config, update/delete_device, sincronización de
+    mecanismos) invalidan o actualizan la entrada, de modo que el camino
+    caliente no hace SELECTs mientras nada cambie.
+
+    Con varios procesos, `al_cambiar(op, esp_id, estado)` recibe cada cambio
+    local ("invalidar", "limpiar", "mecanismos") para replicarlo en los demás,
+    que lo aplican con `propagar=False`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas: dict[str, EntradaDispositivo] = {}
+        self._generacion: dict[str, int] = {}
+        self._epoca = 0
+        self._default_esp: str | None = None
+        self._stats = {"hits": 0, "misses": 0, "invalidaciones": 0}
+        self.al_cambiar: Callable[[str, str | None, EstadoMecanismos | None], None] | None = None
+
+    def obtener(self, db: Session, esp_id: str, crear: bool = True) -> EntradaDispositivo | None:
+        """
+        Devuelve la entrada del device. En un miss la carga desde `db`
+        (creando el device si `crear` es True, como hace la ingesta MQTT).
+
+        El device nuevo se crea con `flush`, dentro de la transacción del
+        llamador (sin commit): si el lote de la ingesta vuelve atrás, el device
+        también. Esa entrada no se cachea hasta que un miss posterior la lea.
+        """
+        with self._lock:
+            e = self._entradas.get(esp_id)
+            if e is not None:
+                self._stats["hits"] += 1
+                return e
+            self._stats["misses"] += 1
+            gen = (self._epoca, self._generacion.get(esp_id, 0))
+
+        d = db.query(Device).filter(Device.esp_id == esp_id).first()
+        if d is None:
+            if not crear:
+                return None
+            d = Device(esp_id=esp_id)
+            db.add(d)
+            db.flush()
+            # snapshots 1:1, como create_device
+            db.add_all([Mecanismos(device_id=d.id), Config(device_id=d.id)])
+            db.flush()
+            with self._lock:
+                self._default_esp = None
+            gen = None
+        cfg = db.query(Config).filter(Config.device_id == d.id).first()
+        mech = db.query(Mecanismos).filter(Mecanismos.device_id == d.id).first()
+        e = EntradaDispositivo(d.id, esp_id, _snap_config(cfg), _snap_mech(mech))
+
+        with self._lock:
+            # Si alguien invalidó mientras leíamos, no guardamos datos viejos.
+            if gen is not None and (self._epoca, self._generacion.get(esp_id, 0)) == gen:
+                self._entradas[esp_id] = e
+        return e
+
+    def mecanismos(self, esp_id: str) -> EstadoMecanismos | None:
+        """Copia del estado de mecanismos cacheado (None si no está en caché)."""
+        with self._lock:
+            e = self._entradas.get(esp_id)
+            if e is None or e.mecanismos is None:
+                return None
+            return replace(e.mecanismos)
+
+    def actualizar_mecanismos(self, esp_id: str, estado: EstadoMecanismos, propagar: bool = True):
+        """Reemplaza el estado de mecanismos tras escribirlo en la DB."""
+        with self._lock:
+            e = self._entradas.get(esp_id)
+            if e is not None:
+                self._entradas[esp_id] = replace(e, mecanismos=replace(estado))
+        if propagar and self.al_cambiar:
+            self.al_cambiar("mecanismos", esp_id, estado)
+
+    def invalidar(self, esp_id: str, propagar: bool = True):
+        """Descarta la entrada de un device (la próxima lectura va a la DB)."""
+        with self._lock:
+            self._entradas.pop(esp_id, None)
+            self._generacion[esp_id] = self._generacion.get(esp_id, 0) + 1
+            self._default_esp = None
+            self._stats["invalidaciones"] += 1
+        if propagar and self.al_cambiar:
+            self.al_cambiar("invalidar", esp_id, None)
+
+    def limpiar(self, propagar: bool = True):
+        """Descarta todo el caché (p. ej. tras un ROLLBACK de la ingesta)."""
+        with self._lock:
+            self._epoca += 1
+            self._entradas.clear()
+            self._default_esp = None
+            self._stats["invalidaciones"] += 1
+        if propagar and self.al_cambiar:
+            self.al_cambiar("limpiar", None, None)
+
+    def esp_id_por_defecto(self, db: Session) -> tuple[int, str | None]:
+        """
+        (cantidad de devices, esp_id) para resolver el device por defecto.
+        Sólo se cachea el caso de un único device.
+        """
+        with self._lock:
+            if self._default_esp is not None:
+                self._stats["hits"] += 1
+                return 1, self._default_esp
+            self._stats["misses"] += 1
+        count = db.execute(select(func.count(Device.id))).scalar_one()
+        if count != 1:
+            return count, None
+        esp_id = db.execute(select(Device.esp_id)).scalar_one()
+        with self._lock:
+            self._default_esp = esp_id
+        return 1, esp_id
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            m["entradas"] = len(self._entradas)
+        total = m["hits"] + m["misses"]
+        m["hit_ratio"] = round(m["hits"] / total, 4) if total else 0.0
+        return m
+
+
+registro = RegistroDispositivos()
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import select, delete, text
+
+from app.core.config import config
+from app.db.almacenamiento import almacen_de
+from app.db.session import SessionLocal
+from app.db.models import Lectura, LecturaRollup, Evento
+from app.servicios.rollups import RESOLUCIONES
+
+log = logging.getLogger("retencion")
+
+
+def _politicas() -> list[tuple]:
+    """(nombre, tabla, columna de tiempo, días, filtro extra) para cada conjunto con retención."""
+    rollup = LecturaRollup.__table__
+    dias_rollup = {
+        "1m": config.retencion_rollup_1m_dias,
+        "1h": config.retencion_rollup_1h_dias,
+        "1d": config.retencion_rollup_1d_dias,
+    }
+    pol = [
+        ("lecturas", Lectura.__table__, Lectura.__table__.c.fecha_hora, config.retencion_lecturas_dias, None),
+        ("eventos", Evento.__table__, Evento.__table__.c.fecha_hora, config.retencion_eventos_dias, None),
+    ]
+    for nombre, res in RESOLUCIONES.items():
+        pol.append((f"rollup_{nombre}", rollup, rollup.c.bucket, dias_rollup[nombre], rollup.c.resolucion == res))
+    return pol
+
+
+class MotorRetencion:
+    """
+    Borra datos vencidos en chunks acotados (cada uno en su propia transacción
+    corta, con una pausa entre chunks para no bloquear a la ingesta) y después
+    libera espacio con `incremental_vacuum` y `wal_checkpoint(TRUNCATE)`.
+    En PostgreSQL con TimescaleDB, antes descarta los chunks ya vencidos de
+    lecturas y eventos (sin vacuum posterior: el espacio vuelve al instante).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        chunk: int = config.retencion_chunk,
+        pausa_s: float = config.retencion_pausa_ms / 1000,
+        intervalo_s: float = config.retencion_intervalo_s,
+    ):
+        self._session_factory = session_factory
+        self._chunk = chunk
+        self._pausa_s = pausa_s
+        self._intervalo_s = intervalo_s
+        self._parar = threading.Event()
+        self._hilo: threading.Thread | None = None
+        self._lock = threading.Lock()          # una pasada a la vez
+        self._slock = threading.Lock()         # métricas (se leen desde la API)
+        self._stats = {
+            "pasadas": 0,
+            "filas_borradas": {},              # acumulado por conjunto
+            "ultima_pasada": None,
+        }
+
+    # ---------- una pasada ----------
+
+    def _descartar_chunks(self, tabla, cutoff: datetime) -> int:
+        """Hypertables de TimescaleDB: los chunks enteramente vencidos se descartan de una vez."""
+        with self._session_factory() as db:
+            n = almacen_de(db).descartar_vencidos(db, tabla.name, cutoff)
+            db.commit()
+        return n
+
+    def _borrar_vencidos(self, tabla, col, cutoff: datetime, extra=None) -> int:
+        borradas = 0
+        while not self._parar.is_set():
+            ids = select(tabla.c.id).where(col < cutoff)
+            if extra is not None:
+                ids = ids.where(extra)
+            stmt = delete(tabla).where(tabla.c.id.in_(ids.limit(self._chunk).scalar_subquery()))
+            with self._session_factory() as db:
+                n = db.execute(stmt).rowcount
+                db.commit()
+            borradas += n
+            if n < self._chunk:
+                break
+            time.sleep(self._pausa_s)
+        return borradas
+
+    def _liberar_espacio(self) -> dict:
+        with self._session_factory() as db:
+            if db.get_bind().dialect.name != "sqlite":
+                return {}
+            libres = db.execute(text("PRAGMA freelist_count")).scalar() or 0
+            modo = db.execute(text("PRAGMA auto_vacuum")).scalar()
+            if modo == 2:  # INCREMENTAL
+                db.execute(text("PRAGMA incremental_vacuum"))
+            elif libres:
+                log.info("auto_vacuum no es INCREMENTAL: %d páginas libres quedan para reutilizar. "
+                         "Un VACUUM manual las devolvería al disco.", libres)
+            db.commit()
+            busy, _, movidas = db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).one()
+        return {"paginas_libres": libres, "vacuum_incremental": modo == 2,
+                "checkpoint_bloqueado": bool(busy), "checkpoint_paginas": movidas}
+
+    def ejecutar(self) -> dict:
+        """Corre una pasada completa de retención y devuelve su resumen."""
+        if not self._lock.acquire(blocking=False):
+            return {"omitida": "ya hay una pasada en curso"}
+        try:
+            t0 = time.perf_counter()
+            ahora = datetime.now(timezone.utc)
+            filas = {}
+            chunks = {}
+            for nombre, tabla, col, dias, extra in _politicas():
+                if dias <= 0:
+                    continue
+                cutoff = ahora - timedelta(days=dias)
+                if extra is None and (n := self._descartar_chunks(tabla, cutoff)):
+                    chunks[nombre] = n
+                # lo que queda (el chunk parcialmente vencido, o todo si no es hypertable) va por chunks de filas
+                filas[nombre] = self._borrar_vencidos(tabla, col, cutoff, extra)
+            t_borrado = time.perf_counter() - t0
+
+            espacio = self._liberar_espacio() if any(filas.values()) else {}
+            resumen = {
+                "inicio": ahora.isoformat(),
+                "filas": filas,
+                **({"chunks_descartados": chunks} if chunks else {}),
+                "duracion_s": round(time.perf_counter() - t0, 3),
+                "borrado_s": round(t_borrado, 3),
+                **espacio,
+            }
+            with self._slock:
+                self._stats["pasadas"] += 1
+                acum = self._stats["filas_borradas"]
+                for k, v in filas.items():
+                    acum[k] = acum.get(k, 0) + v
+                self._stats["ultima_pasada"] = resumen
+            if any(filas.values()):
+                log.info("Retención: %s en %.2fs.", filas, resumen["duracion_s"])
+            return resumen
+        finally:
+            self._lock.release()
+
+    # ---------- programador ----------
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="retencion", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+
+    def _bucle(self):
+        # primera pasada poco después del arranque, luego cada intervalo
+        espera = min(60.0, self._intervalo_s)
+        while not self._parar.wait(espera):
+            try:
+                self.ejecutar()
+            except Exception:
+                log.exception("Fallo en la pasada de retención.")
+            espera = self._intervalo_s
+
+    def metricas(self) -> dict:
+        with self._slock:
+            return {
+                "pasadas": self._stats["pasadas"],
+                "filas_borradas": dict(self._stats["filas_borradas"]),
+                "ultima_pasada": self._stats["ultima_pasada"],
+                "politica_dias": {p[0]: p[3] for p in _politicas()},
+            }
+
+
+motor_retencion = MotorRetencion()
@@ -0,0 +1,258 @@
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.almacenamiento import almacen_de
+from app.db.session import SessionLocal
+from app.db.models import Lectura, LecturaRollup
+
+log = logging.getLogger("rollups")
+
+# Resoluciones mantenidas, de la más fina a la más gruesa (segundos por bucket).
+RESOLUCIONES = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# prefijo de columna en lecturas_rollup -> atributo de Lectura
+_METRICAS = (
+    ("temp", "temperatura"),
+    ("hum", "humedad"),
+    ("suelo", "humedad_suelo"),
+    ("agua", "nivel_de_agua"),
+)
+
+
+def _utc(ts: datetime) -> datetime:
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def inicio_bucket(ts: datetime, resolucion: int) -> datetime:
+    """Inicio (UTC) del bucket de `resolucion` segundos que contiene a `ts`."""
+    epoch = int(_utc(ts).timestamp()) // resolucion * resolucion
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+# ============================================================
+# ACTUALIZACIÓN INCREMENTAL
+# ============================================================
+
+def _agregar(filas: Iterable[tuple]) -> dict:
+    """(device_id, fecha_hora, temp, hum, suelo, agua) -> {(device, res, bucket): [n, min, max, sum, ...]}"""
+    acc: dict[tuple, list] = {}
+    for device_id, fecha_hora, *vals in filas:
+        for res in RESOLUCIONES.values():
+            k = (device_id, res, inicio_bucket(fecha_hora, res))
+            a = acc.get(k)
+            if a is None:
+                a = acc[k] = [0] + [v for x in vals for v in (x, x, 0.0)]
+            a[0] += 1
+            for i, v in enumerate(vals):
+                j = 1 + 3 * i
+                if v < a[j]:
+                    a[j] = v
+                if v > a[j + 1]:
+                    a[j + 1] = v
+                a[j + 2] += v
+    return acc
+
+
+def _filas_rollup(acc: dict) -> list[dict]:
+    out = []
+    for (device_id, res, bucket), a in acc.items():
+        fila = {"device_id": device_id, "resolucion": res, "bucket": bucket, "n": a[0]}
+        for i, (pref, _) in enumerate(_METRICAS):
+            j = 1 + 3 * i
+            fila[f"{pref}_min"], fila[f"{pref}_max"], fila[f"{pref}_sum"] = a[j], a[j + 1], a[j + 2]
+        out.append(fila)
+    return out
+
+
+def acumular_lecturas(db: Session, lecturas: Iterable[Lectura]):
+    """
+    Suma un lote de lecturas a los rollups (upsert, sin commit).
+    Lo llama el escritor de ingesta dentro de la misma transacción del lote.
+    """
+    acc = _agregar(
+        (l.device_id, l.fecha_hora, l.temperatura, l.humedad, l.humedad_suelo, l.nivel_de_agua)
+        for l in lecturas
+    )
+    if not acc:
+        return
+
+    almacen = almacen_de(db)
+    stmt = almacen.insert(LecturaRollup)
+    ex = stmt.excluded
+    set_ = {"n": LecturaRollup.n + ex.n}
+    for pref, _ in _METRICAS:
+        set_[f"{pref}_min"] = almacen.menor(getattr(LecturaRollup, f"{pref}_min"), getattr(ex, f"{pref}_min"))
+        set_[f"{pref}_max"] = almacen.mayor(getattr(LecturaRollup, f"{pref}_max"), getattr(ex, f"{pref}_max"))
+        set_[f"{pref}_sum"] = getattr(LecturaRollup, f"{pref}_sum") + getattr(ex, f"{pref}_sum")
+    stmt = stmt.on_conflict_do_update(index_elements=["device_id", "resolucion", "bucket"], set_=set_)
+    db.execute(stmt, _filas_rollup(acc))
+
+
+# ============================================================
+# COMPACTADOR (reconstrucción desde las lecturas crudas)
+# ============================================================
+
+def recompactar(db: Session, desde: datetime, hasta: datetime, device_id: Optional[int] = None) -> int:
+    """
+    Reconstruye los rollups de [desde, hasta) a partir de `lecturas`, de a un
+    día UTC por transacción para no retener el lock de escritura. Devuelve la
+    cantidad de lecturas procesadas.
+    """
+    dia = inicio_bucket(desde, RESOLUCIONES["1d"])
+    fin = _utc(hasta)
+    total = 0
+    while dia < fin:
+        sig = dia + timedelta(days=1)
+        borrar = (
+            delete(LecturaRollup)
+            .where(LecturaRollup.bucket >= dia, LecturaRollup.bucket < sig)
+            .execution_options(synchronize_session=False)
+        )
+        leer = (
+            select(Lectura.device_id, Lectura.fecha_hora, Lectura.temperatura,
+                   Lectura.humedad, Lectura.humedad_suelo, Lectura.nivel_de_agua)
+            .where(Lectura.fecha_hora >= dia, Lectura.fecha_hora < sig)
+            .execution_options(yield_per=5000)   # se agrega en streaming, sin .all()
+        )
+        if device_id is not None:
+            borrar = borrar.where(LecturaRollup.device_id == device_id)
+            leer = leer.where(Lectura.device_id == device_id)
+
+        db.execute(borrar)
+        acc = _agregar(db.execute(leer))
+        if acc:
+            db.execute(LecturaRollup.__table__.insert(), _filas_rollup(acc))
+        db.commit()
+        total += sum(a[0] for (_, res, _), a in acc.items() if res == RESOLUCIONES["1d"])
+        dia = sig
+    return total
+
+
+def rango_sin_rollups(db: Session) -> Optional[tuple[datetime, datetime]]:
+    """
+    [desde, hasta) de las lecturas que todavía no tienen rollups (DB previa a
+    los rollups), o None. Se compara la lectura más vieja con el primer
+    bucket diario: la ingesta puede haber creado rollups nuevos antes de que
+    corra el backfill, así que "la tabla no está vacía" no alcanza. El día
+    de ese primer bucket se reconstruye entero (puede tener lecturas de
+    antes del arranque).
+    """
+    desde, hasta = db.execute(select(func.min(Lectura.fecha_hora), func.max(Lectura.fecha_hora))).one()
+    if desde is None:
+        return None
+    desde = _utc(desde)
+    if config.retencion_rollup_1d_dias > 0:
+        # lo que la retención ya borró no se vuelve a generar
+        desde = max(desde, datetime.now(timezone.utc) - timedelta(days=config.retencion_rollup_1d_dias))
+    primero = db.execute(
+        select(func.min(LecturaRollup.bucket)).where(LecturaRollup.resolucion == RESOLUCIONES["1d"])
+    ).scalar()
+    if primero is None:
+        return desde, _utc(hasta) + timedelta(seconds=1)
+    primero = _utc(primero)
+    if desde >= primero:
+        return None
+    return desde, primero + timedelta(days=1)
+
+
+def backfill(rango: tuple[datetime, datetime], session_factory=SessionLocal) -> int:
+    """Genera los rollups de `rango` (ver `rango_sin_rollups`)."""
+    desde, hasta = rango
+    log.info("Generando rollups de lecturas existentes (%s → %s)...", desde, hasta)
+    with session_factory() as db:
+        n = recompactar(db, desde, hasta)
+    log.info("Rollups generados a partir de %d lecturas.", n)
+    return n
+
+
+def iniciar_backfill(session_factory=SessionLocal):
+    """
+    Decide qué falta antes de arrancar la ingesta (llamar antes de
+    `start_mqtt_listener`) y lo genera en segundo plano para no demorar el
+    arranque.
+    """
+    with session_factory() as db:
+        rango = rango_sin_rollups(db)
+    if rango is not None:
+        threading.Thread(target=backfill, args=(rango, session_factory), name="rollups-backfill",
+                         daemon=True).start()
+
+
+# ============================================================
+# CONSULTA DE SERIES
+# ============================================================
+
+def elegir_resolucion(desde: datetime, hasta: datetime, ancho: int) -> str:
+    """La resolución más gruesa que todavía da al menos `ancho` puntos; si ninguna, crudo."""
+    span = (_utc(hasta) - _utc(desde)).total_seconds()
+    for nombre, res in sorted(RESOLUCIONES.items(), key=lambda kv: -kv[1]):
+        if span / res >= ancho:
+            return nombre
+    return "raw"
+
+
+def serie_lecturas(
+    db: Session,
+    device_id: int,
+    desde: datetime,
+    hasta: datetime,
+    resolucion: str = "auto",
+    ancho: int = 360,
+) -> tuple[str, list[dict]]:
+    """
+    Serie (asc) de promedios y extremos por bucket para graficar. Las
+    lecturas crudas se cortan en `config.serie_max_crudas`: con más, "auto"
+    pasa a 1m y "raw" da ValueError.
+    """
+    auto = resolucion == "auto"
+    if auto:
+        resolucion = elegir_resolucion(desde, hasta, ancho)
+
+    if resolucion == "raw":
+        tope = config.serie_max_crudas
+        stmt = (
+            select(Lectura)
+            .where(Lectura.device_id == device_id, Lectura.fecha_hora >= desde, Lectura.fecha_hora <= hasta)
+            .order_by(Lectura.fecha_hora)
+            .limit(tope + 1)
+        )
+        lecturas = db.execute(stmt).scalars().all()
+        if len(lecturas) <= tope:
+            puntos = []
+            for l in lecturas:
+                p = {"t": l.fecha_hora, "n": 1}
+                for _, attr in _METRICAS:
+                    v = getattr(l, attr)
+                    p[attr] = p[f"{attr}_min"] = p[f"{attr}_max"] = v
+                puntos.append(p)
+            return resolucion, puntos
+        if not auto:
+            raise ValueError(f"Más de {tope} lecturas crudas en el rango: usar una resolución agregada o un rango menor.")
+        resolucion = "1m"
+
+    res = RESOLUCIONES[resolucion]
+    stmt = (
+        select(LecturaRollup)
+        .where(
+            LecturaRollup.device_id == device_id,
+            LecturaRollup.resolucion == res,
+            LecturaRollup.bucket >= inicio_bucket(desde, res),
+            LecturaRollup.bucket <= hasta,
+        )
+        .order_by(LecturaRollup.bucket)
+    )
+    puntos = []
+    for r in db.execute(stmt).scalars():
+        p = {"t": r.bucket, "n": r.n}
+        for pref, attr in _METRICAS:
+            p[attr] = getattr(r, f"{pref}_sum") / r.n
+            p[f"{attr}_min"] = getattr(r, f"{pref}_min")
+            p[f"{attr}_max"] = getattr(r, f"{pref}_max")
+        puntos.append(p)
+    return resolucion, puntos
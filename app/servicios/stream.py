@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+from app.db.models import Lectura
+from app.servicios.registro import EstadoMecanismos
+from app.servicios.analitica import Alerta
+
+log = logging.getLogger("stream")
+
+BUFFER_POR_CLIENTE = 256  # eventos pendientes por cliente antes de descartar los más viejos
+
+
+# ============================================================
+# SUSCRIPCIONES (una por pestaña / conexión SSE)
+# ============================================================
+
+class Suscripcion:
+    """Buffer acotado de un cliente. Si se llena, se descartan los eventos más viejos."""
+    __slots__ = ("esp_id", "buffer", "descartados", "_loop", "_evento")
+
+    def __init__(self, esp_id: Optional[str], maxlen: int, loop: asyncio.AbstractEventLoop):
+        self.esp_id = esp_id
+        self.buffer: deque = deque(maxlen=maxlen)
+        self.descartados = 0
+        self._loop = loop
+        self._evento = asyncio.Event()
+
+    def _empujar(self, evento: tuple[str, str]):
+        """Se llama desde cualquier hilo (con el lock del hub tomado)."""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.descartados += 1
+        self.buffer.append(evento)
+        try:
+            self._loop.call_soon_threadsafe(self._evento.set)
+        except RuntimeError:
+            pass  # el loop del cliente ya se cerró
+
+    async def siguiente(self, timeout: float) -> list[tuple[str, str]]:
+        """Espera hasta `timeout` segundos y devuelve todo lo pendiente."""
+        if not self.buffer:
+            try:
+                await asyncio.wait_for(self._evento.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._evento.clear()
+        pendientes = []
+        while self.buffer:
+            pendientes.append(self.buffer.popleft())
+        return pendientes
+
+
+# ============================================================
+# HUB (fan-out en memoria)
+# ============================================================
+
+class HubTelemetria:
+    """
+    Fan-out en memoria de lecturas y cambios de mecanismos.
+    El escritor de ingesta publica después de cada commit; cada conexión SSE
+    tiene su propia Suscripcion. El JSON se serializa una sola vez por evento.
+    Con varios procesos, `al_publicar(esp_id, tipo, data)` reenvía cada evento
+    ya serializado a los demás, que lo entregan con `difundir`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: set[Suscripcion] = set()
+        self._stats = {"publicados": 0, "entregados": 0}
+        self.al_publicar: Callable[[str, str, str], None] | None = None
+
+    def suscribir(self, esp_id: Optional[str] = None, maxlen: int = BUFFER_POR_CLIENTE) -> Suscripcion:
+        """Crea una suscripción ligada al event loop actual (None = todos los devices)."""
+        s = Suscripcion(esp_id, maxlen, asyncio.get_running_loop())
+        with self._lock:
+            self._subs.add(s)
+        return s
+
+    def desuscribir(self, s: Suscripcion):
+        with self._lock:
+            self._subs.discard(s)
+
+    def publicar(self, esp_id: str, tipo: str, datos: dict):
+        data = json.dumps(datos, separators=(",", ":"))
+        self.difundir(esp_id, tipo, data)
+        if self.al_publicar:
+            self.al_publicar(esp_id, tipo, data)
+
+    def difundir(self, esp_id: str, tipo: str, data: str):
+        """Entrega un evento ya serializado a las suscripciones de este proceso."""
+        evento = (tipo, data)
+        entregados = 0
+        with self._lock:
+            self._stats["publicados"] += 1
+            for s in self._subs:
+                if s.esp_id is None or s.esp_id == esp_id:
+                    s._empujar(evento)
+                    entregados += 1
+            self._stats["entregados"] += entregados
+
+    def metricas(self) -> dict:
+        with self._lock:
+            m = dict(self._stats)
+            m["clientes"] = len(self._subs)
+            m["descartados"] = sum(s.descartados for s in self._subs)
+        return m
+
+
+hub = HubTelemetria()
+
+
+def publicar_lectura(esp_id: str, lectura: Lectura):
+    """Publica una lectura ya persistida (mismo formato que LecturaOut)."""
+    hub.publicar(esp_id, "lectura", {
+        "id": lectura.id,
+        "device_id": lectura.device_id,
+        "fecha_hora": lectura.fecha_hora.isoformat(),
+        "temperatura": lectura.temperatura,
+        "humedad": lectura.humedad,
+        "humedad_suelo": lectura.humedad_suelo,
+        "nivel_de_agua": lectura.nivel_de_agua,
+        "esp_id": esp_id,
+    })
+
+
+def publicar_mecanismos(esp_id: str, estado: EstadoMecanismos):
+    """Publica el estado de mecanismos confirmado en la DB (mismo formato que MecanismosOut)."""
+    hub.publicar(esp_id, "mecanismos", {
+        "id": estado.id,
+        "bomba": estado.bomba,
+        "luz": estado.luz,
+        "ventilador": estado.ventilador,
+        "esp_id": esp_id,
+    })
+
+
+def publicar_alerta(alerta: Alerta):
+    """Publica una alerta de la analítica en vivo (ya guardada en `eventos`)."""
+    hub.publicar(alerta.esp_id, "alerta", {
+        "fecha_hora": alerta.fecha_hora.isoformat(),
+        "subtipo": alerta.subtipo,
+        "detalle": alerta.detalle,
+        "mensaje": alerta.mensaje,
+        "esp_id": alerta.esp_id,
+    })
@@ -0,0 +1,287 @@
+import json
+import logging
+import math
+from datetime import datetime, timezone, timedelta
+from typing import IO, Iterator, Optional
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal, SessionLectura
+from app.db.models import Lectura
+from app.servicios.funciones import rango_local_a_utc
+from app.servicios.registro import registro
+from app.servicios.rollups import recompactar
+from app.servicios.flota import reconstruir_ultimas
+
+log = logging.getLogger("transferencia")
+
+# formato -> (media type, extensión)
+FORMATOS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+METRICAS = ("temperatura", "humedad", "humedad_suelo", "nivel_de_agua")
+
+LOTE_EXPORTACION = 50_000   # filas por record batch / row group
+LOTE_IMPORTACION = 5_000    # filas por executemany + commit (lock de escritura corto)
+
+
+class FormatoNoDisponible(Exception):
+    """El formato pedido necesita una dependencia opcional que no está instalada."""
+
+
+def _pyarrow():
+    """pyarrow es opcional: sólo lo necesitan parquet y arrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise FormatoNoDisponible("Parquet/Arrow requieren 'pyarrow' (pip install pyarrow).")
+    return pa
+
+
+def validar_formato(formato: str):
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato}. Opciones: {', '.join(FORMATOS)}")
+    if formato != "ndjson":
+        _pyarrow()
+
+
+def _schema(pa):
+    return pa.schema(
+        [("fecha_hora", pa.timestamp("us", tz="UTC"))] + [(m, pa.float64()) for m in METRICAS]
+    )
+
+
+def _utc(ts: datetime) -> datetime:
+    # SQLite guarda la hora sin la zona: una hora con offset se pasa a UTC
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+# ============================================================
+# EXPORTACIÓN
+# ============================================================
+
+class _Sumidero:
+    """Archivo de sólo escritura que junta lo que escribe pyarrow hasta que el generador lo retira."""
+
+    def __init__(self):
+        self._partes: list[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self._partes.append(datos)
+        self._pos += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self) -> bytes:
+        out = b"".join(self._partes)
+        self._partes.clear()
+        return out
+
+
+def _lotes_lecturas(db: Session, device_id: int, desde: datetime, hasta: datetime, lote: int):
+    """Listas de (fecha_hora, temperatura, humedad, humedad_suelo, nivel_de_agua) en orden asc."""
+    stmt = (
+        select(Lectura.fecha_hora, *(getattr(Lectura, m) for m in METRICAS))
+        .where(Lectura.device_id == device_id, Lectura.fecha_hora >= desde, Lectura.fecha_hora <= hasta)
+        .order_by(Lectura.fecha_hora, Lectura.id)
+        .execution_options(yield_per=lote)
+    )
+    for filas in db.execute(stmt).partitions():
+        yield filas
+
+
+def exportar_lecturas(
+    esp_id: str,
+    desde: str,
+    hasta: str,
+    formato: str,
+    session_factory=None,
+    lote: int = LOTE_EXPORTACION,
+) -> Iterator[bytes]:
+    """
+    Exporta lecturas de esp_id entre fechas (YYYY-MM-DD, hora local, como el CSV)
+    en un formato columnar con tipos reales: float64 por métrica y timestamp UTC.
+
+    Valida formato y fechas al llamar; después genera bytes de a un record
+    batch (parquet: un row group por batch; arrow: formato IPC de streaming).
+    """
+    validar_formato(formato)
+    start_utc, end_utc = rango_local_a_utc(desde, hasta)
+    session_factory = session_factory or SessionLectura
+
+    def generar():
+        with session_factory() as db:
+            entrada = registro.obtener(db, esp_id, crear=False)
+            lotes = _lotes_lecturas(db, entrada.device_id, start_utc, end_utc, lote) if entrada else iter(())
+            if formato == "ndjson":
+                yield from _ndjson(lotes)
+            else:
+                yield from _arrow(lotes, formato, esp_id)
+
+    return generar()
+
+
+def _ndjson(lotes) -> Iterator[bytes]:
+    for filas in lotes:
+        partes = []
+        for ts, *vals in filas:
+            d = {"fecha_hora": _utc(ts).isoformat()}
+            d.update(zip(METRICAS, vals))
+            partes.append(json.dumps(d, separators=(",", ":")))
+        yield ("\n".join(partes) + "\n").encode("utf-8")
+
+
+def _arrow(lotes, formato: str, esp_id: str) -> Iterator[bytes]:
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = _schema(pa).with_metadata({"esp_id": esp_id})
+    sumidero = _Sumidero()
+    destino = pa.PythonFile(sumidero, mode="w")
+    writer = pq.ParquetWriter(destino, schema) if formato == "parquet" else pa.ipc.new_stream(destino, schema)
+    with writer:
+        for filas in lotes:
+            cols = list(zip(*filas))
+            batch = pa.record_batch(
+                [pa.array([_utc(t) for t in cols[0]], type=schema.field(0).type)]
+                + [pa.array(c, type=pa.float64()) for c in cols[1:]],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            out = sumidero.retirar()
+            if out:
+                yield out
+    yield sumidero.retirar()  # footer (parquet) / fin de stream (arrow)
+
+
+# ============================================================
+# IMPORTACIÓN
+# ============================================================
+
+def _fecha(v) -> datetime:
+    if isinstance(v, datetime):
+        return _utc(v)
+    if isinstance(v, str):
+        return _utc(datetime.fromisoformat(v))
+    raise ValueError(f"fecha_hora inválida: {v!r}")
+
+
+def _metrica(m: str, v) -> float:
+    x = float(v)
+    if not math.isfinite(x):
+        raise ValueError(f"{m} no finito: {v!r}")
+    return x
+
+
+def _filas_ndjson(f: IO[bytes], lote: int) -> Iterator[list[dict]]:
+    filas = []
+    for n, linea in enumerate(f, start=1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            d = json.loads(linea)
+            filas.append({"fecha_hora": _fecha(d["fecha_hora"]), **{m: _metrica(m, d[m]) for m in METRICAS}})
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Línea {n}: {e!r}") from e
+        if len(filas) >= lote:
+            yield filas
+            filas = []
+    if filas:
+        yield filas
+
+
+def _filas_arrow(f: IO[bytes], formato: str, lote: int) -> Iterator[list[dict]]:
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    try:
+        if formato == "parquet":
+            pf = pq.ParquetFile(f)
+            faltan = {"fecha_hora", *METRICAS} - set(pf.schema_arrow.names)
+            batches = pf.iter_batches(batch_size=lote, columns=["fecha_hora", *METRICAS])
+        else:
+            reader = pa.ipc.open_stream(f)
+            faltan = {"fecha_hora", *METRICAS} - set(reader.schema.names)
+            batches = reader
+        if faltan:
+            raise ValueError(f"Faltan columnas: {', '.join(sorted(faltan))}")
+        for b in batches:
+            cols = {c: b.column(c).to_pylist() for c in ("fecha_hora", *METRICAS)}
+            yield [
+                {"fecha_hora": _fecha(cols["fecha_hora"][i]), **{m: _metrica(m, cols[m][i]) for m in METRICAS}}
+                for i in range(b.num_rows)
+            ]
+    except pa.ArrowException as e:
+        raise ValueError(f"Archivo {formato} inválido: {e}") from e
+    except TypeError as e:
+        raise ValueError(f"Valor inválido: {e}") from e
+
+
+def importar_lecturas(
+    f: IO[bytes],
+    esp_id: str,
+    formato: str,
+    session_factory=None,
+    lote: int = LOTE_IMPORTACION,
+) -> dict:
+    """
+    Carga un archivo histórico (ndjson/parquet/arrow) en `lecturas` para esp_id,
+    que tiene que existir (si no, LookupError).
+
+    Lee el archivo de a lotes e inserta cada uno con un executemany y su propio
+    commit, para no retener el lock de escritura frente a la ingesta. Al final
+    reconstruye los rollups del rango importado y la última lectura del device. Un error de formato corta la
+    importación: las filas de lotes anteriores ya quedaron guardadas y se
+    informan en el mensaje. Ojo: lo más viejo que la retención de lecturas lo
+    borra la próxima pasada (los rollups sí se conservan).
+    """
+    validar_formato(formato)
+    session_factory = session_factory or SessionLocal
+    filas_lotes = _filas_ndjson(f, lote) if formato == "ndjson" else _filas_arrow(f, formato, lote)
+
+    total = 0
+    desde: Optional[datetime] = None
+    hasta: Optional[datetime] = None
+    with session_factory() as db:
+        entrada = registro.obtener(db, esp_id, crear=False)
+        if entrada is None:
+            # un esp_id mal escrito no crea un device nuevo lleno de historia
+            raise LookupError("Device no encontrado")
+        device_id = entrada.device_id
+        try:
+            for filas in filas_lotes:
+                for r in filas:
+                    r["device_id"] = device_id
+                db.execute(insert(Lectura), filas)
+                db.commit()
+                total += len(filas)
+                t0 = min(r["fecha_hora"] for r in filas)
+                t1 = max(r["fecha_hora"] for r in filas)
+                desde = t0 if desde is None or t0 < desde else desde
+                hasta = t1 if hasta is None or t1 > hasta else hasta
+        except ValueError as e:
+            db.rollback()
+            raise ValueError(f"{e} (se importaron {total} filas antes del error)") from e
+        finally:
+            if total:
+                recompactar(db, desde, hasta + timedelta(seconds=1), device_id=device_id)
+                reconstruir_ultimas(db, device_id)
+
+    log.info("Importadas %d lecturas para %s (%s → %s).", total, esp_id, desde, hasta)
+    return {"esp_id": esp_id, "filas": total, "desde": desde, "hasta": hasta}
@@ -1,54 +1,65 @@
 import logging
-from datetime import datetime, timedelta
+from dataclasses import replace
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
-from app.db.models import Device, Config, Mecanismos, Lectura 
+from app.core.logs import sin_accion
+from app.db.models import Mecanismos, Lectura
 from app.servicios.mqtt_funciones import enviar_cmd_mqtt
+from app.servicios.registro import registro, EstadoMecanismos
+from app.servicios.cooldown import cooldowns, COOLDOWN_S
+from app.servicios.metricas import decisiones
+from app.servicios.eventos import diario
+from app.servicios.efectos import EfectosLote, diferir
 
-# configuración del logging.
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Las líneas "no acción" se repiten en cada telemetría: `sin_accion` las muestrea por device.
+log = logging.getLogger("autocontrol")
 
-# --- variables globales y función de cooldown ---
-_COOLDOWN_S = 30 # segundos mínimos entre cambios de estado.
-_ultimo_cambio = {}
+# --- cooldown por actuador (CooldownStore: thread-safe, persistido en la DB) ---
+_COOLDOWN_S = COOLDOWN_S # segundos mínimos entre cambios de estado.
 
-def _puede_cambiar(clave_mecanismo: str) -> bool:
+def _puede_cambiar(device_id: int, actuador: str, esp_id: str, efectos: EfectosLote | None = None) -> bool:
     """verifica si ha pasado el tiempo de cooldown desde el último cambio."""
-    ahora = datetime.utcnow()
-    t = _ultimo_cambio.get(clave_mecanismo)
-    
-    if t is None or (ahora - t) >= timedelta(seconds=_COOLDOWN_S):
-        _ultimo_cambio[clave_mecanismo] = ahora
-        logging.info(f"[cooldown] permitido cambio para {clave_mecanismo}.")
+    if cooldowns.puede_cambiar(device_id, actuador, efectos=efectos):
+        log.debug("[cooldown] permitido cambio para %s:%s.", esp_id, actuador)
         return True
-        
-    logging.info(f"[cooldown] negado cambio para {clave_mecanismo}. cooldown activo.")
+
+    sin_accion(log, esp_id, "[cooldown] negado cambio para %s:%s. cooldown activo.", esp_id, actuador)
     return False
 
-def procesar_umbrales(db: Session, esp_id: str, lectura: Lectura):
-    """aplica la lógica de control automático (histéresis y cooldown)."""
-    device = db.query(Device).filter(Device.esp_id == esp_id).first()
-    if not device:
-        logging.warning(f"[auto] dispositivo {esp_id} no encontrado.")
+def procesar_umbrales(db: Session, esp_id: str, lectura: Lectura, efectos: EfectosLote | None = None):
+    """
+    aplica la lógica de control automático (histéresis y cooldown).
+    con `efectos` (lote de ingesta) los SET, el diario y las métricas salen después del commit.
+    """
+    # device, config y mecanismos salen del registro en memoria (sin SELECTs si no cambiaron)
+    entrada = registro.obtener(db, esp_id, crear=False)
+    if not entrada:
+        log.warning("[auto] dispositivo %s no encontrado.", esp_id)
         return
 
-    cfg = db.query(Config).filter(Config.device_id == device.id).first()
+    cfg = entrada.config
     if not cfg:
-        logging.warning(f"[auto] configuración no encontrada para {esp_id}.")
+        log.warning("[auto] configuración no encontrada para %s.", esp_id)
         return
 
-    # obtener o crear estado de mecanismos
-    mech = db.query(Mecanismos).filter(Mecanismos.device_id == device.id).first()
-    if not mech:
-        mech = Mecanismos(device_id=device.id)
-        db.add(mech)
+    # obtener o crear estado de mecanismos (se trabaja sobre una copia)
+    creado = False
+    if entrada.mecanismos is None:
+        nuevo = Mecanismos(device_id=entrada.device_id, bomba=False, luz=False, ventilador=False)
+        db.add(nuevo)
+        db.flush()
+        mech = EstadoMecanismos(nuevo.id, False, False, False)
+        creado = True
         # el commit lo maneja el mqtt_listener
+    else:
+        mech = replace(entrada.mecanismos)
 
     try:
         # margen de histéresis base
         margen_base = float(cfg.margen or 0)
     except ValueError:
-        logging.error(f"[auto] el margen '{cfg.margen}' no es un número válido.")
+        log.error("[auto] el margen '%s' no es un número válido.", cfg.margen)
         margen_base = 0.0
 
     # márgenes específicos
@@ -68,33 +79,34 @@ def procesar_umbrales(db: Session, esp_id: str, lectura: Lectura):
             low_suelo  = set_suelo - margen_suelo # umbral inferior para encender
             high_suelo = set_suelo + margen_suelo # umbral superior para apagar
             
-            mecanismo_key = f"{esp_id}:riego"
 
-            logging.info(f"[auto-riego] l: {suelo:.1f}%. set: {set_suelo:.1f}%. umbrales: low={low_suelo:.1f}%, high={high_suelo:.1f}%. actual: {'on' if mech.bomba else 'off'}")
+            log.debug("[auto-riego] %s l: %.1f%%. set: %.1f%%. umbrales: low=%.1f%%, high=%.1f%%. actual: %s",
+                      esp_id, suelo, set_suelo, low_suelo, high_suelo, "on" if mech.bomba else "off")
 
 
             if suelo < low_suelo:
                 # suelo seco -> encender bomba
-                if not mech.bomba and _puede_cambiar(mecanismo_key):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "RIEGO", "value": "ON"}, esp_id)
+                if not mech.bomba and _puede_cambiar(entrada.device_id, "riego", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "RIEGO", "value": "ON"}, esp_id)
                     mech.bomba = True
                     cambios["riego"] = "ON"
-                    logging.info(f"[auto-riego] acción: humedad ({suelo:.1f}%) < low ({low_suelo:.1f}%). se ha encendido riego.")
+                    log.info("[auto-riego] %s acción: humedad (%.1f%%) < low (%.1f%%). se ha encendido riego.", esp_id, suelo, low_suelo)
                 else:
-                    logging.info(f"[auto-riego] no acción: requiere on, pero ya estaba on o en cooldown.")
+                    sin_accion(log, esp_id, "[auto-riego] %s no acción: requiere on, pero ya estaba on o en cooldown.", esp_id)
             elif suelo > high_suelo:
                 # suelo muy húmedo -> apagar bomba
-                if mech.bomba and _puede_cambiar(mecanismo_key):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "RIEGO", "value": "OFF"}, esp_id)
+                if mech.bomba and _puede_cambiar(entrada.device_id, "riego", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "RIEGO", "value": "OFF"}, esp_id)
                     mech.bomba = False
                     cambios["riego"] = "OFF"
-                    logging.info(f"[auto-riego] acción: humedad ({suelo:.1f}%) > high ({high_suelo:.1f}%). se ha apagado riego.")
+                    log.info("[auto-riego] %s acción: humedad (%.1f%%) > high (%.1f%%). se ha apagado riego.", esp_id, suelo, high_suelo)
                 else:
-                    logging.info(f"[auto-riego] no acción: requiere off, pero ya estaba off o en cooldown.")
+                    sin_accion(log, esp_id, "[auto-riego] %s no acción: requiere off, pero ya estaba off o en cooldown.", esp_id)
             else:
-                logging.info(f"[auto-riego] no acción: humedad está dentro del margen de histéresis ({low_suelo:.1f}% - {high_suelo:.1f}%).")
+                sin_accion(log, esp_id, "[auto-riego] %s no acción: humedad está dentro del margen de histéresis (%.1f%% - %.1f%%).",
+                           esp_id, low_suelo, high_suelo)
         except ValueError as e:
-            logging.error(f"[auto-riego] error de valor: {e}")
+            log.error("[auto-riego] error de valor: %s", e)
 
     # --- 2. HUMEDAD AMBIENTAL (Ventilador) ---
     # CORREGIDO: Usamos 'lectura.humedad' y 'cfg.humedad_ambiente'
@@ -105,24 +117,24 @@ def procesar_umbrales(db: Session, esp_id: str, lectura: Lectura):
             
             high_hum_amb = set_hum_amb + margen_hum_amb # Umbral superior para encender ventilador
             
-            key_vent = f"{esp_id}:vent" # Reusamos la misma clave de cooldown
             
-            logging.info(f"[auto-hum] l: {hum_amb:.1f}%. set: {set_hum_amb:.1f}%. umbral: high={high_hum_amb:.1f}%. actual: {'on' if mech.ventilador else 'off'}")
+            log.debug("[auto-hum] %s l: %.1f%%. set: %.1f%%. umbral: high=%.1f%%. actual: %s",
+                      esp_id, hum_amb, set_hum_amb, high_hum_amb, "on" if mech.ventilador else "off")
 
             if hum_amb > high_hum_amb:
                 # Humedad ambiental alta -> forzar ventilador ON
-                if not mech.ventilador and _puede_cambiar(key_vent):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "VENT", "value": "ON"}, esp_id)
+                if not mech.ventilador and _puede_cambiar(entrada.device_id, "vent", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "VENT", "value": "ON"}, esp_id)
                     mech.ventilador = True
                     cambios["ventilador"] = "ON"
-                    logging.info(f"[auto-hum] acción: humedad ambiente ({hum_amb:.1f}%) > high ({high_hum_amb:.1f}%). se ha encendido ventilador.")
+                    log.info("[auto-hum] %s acción: humedad ambiente (%.1f%%) > high (%.1f%%). se ha encendido ventilador.", esp_id, hum_amb, high_hum_amb)
                 else:
-                    logging.info(f"[auto-hum] no acción: requiere vent on, pero ya estaba on o en cooldown.")
+                    sin_accion(log, esp_id, "[auto-hum] %s no acción: requiere vent on, pero ya estaba on o en cooldown.", esp_id)
 
             # Nota: El apagado por humedad ambiente se maneja en la lógica de temperatura.
             
         except ValueError as e:
-            logging.error(f"[auto-hum] error de valor: {e}")
+            log.error("[auto-hum] error de valor: %s", e)
 
     # --- 3. TEMPERATURA (Ventilador y Luz-Calor) ---
     # Lógica: Maximizar la Luz (ON) para el crecimiento. Solo apagar la luz si la temperatura es crítica.
@@ -135,77 +147,89 @@ def procesar_umbrales(db: Session, esp_id: str, lectura: Lectura):
             low_temp  = set_temp - margen_temp # umbral inferior para calentar (luz on)
             high_temp = set_temp + margen_temp # umbral superior para enfriar (ventilador on/luz off)
 
-            key_vent = f"{esp_id}:vent"
-            key_luz = f"{esp_id}:luz"
 
-            logging.info(f"[auto-temp] l: {temp:.1f}°c. set: {set_temp:.1f}°c. umbrales: low={low_temp:.1f}°c, high={high_temp:.1f}°c. actual: v={'on' if mech.ventilador else 'off'}, l={'on' if mech.luz else 'off'}")
+            log.debug("[auto-temp] %s l: %.1f°c. set: %.1f°c. umbrales: low=%.1f°c, high=%.1f°c. actual: v=%s, l=%s",
+                      esp_id, temp, set_temp, low_temp, high_temp,
+                      "on" if mech.ventilador else "off", "on" if mech.luz else "off")
 
 
             if temp > high_temp:
                 # 1. HACE CALOR: Objetivo enfriar -> Vent ON, Luz OFF (solo si es necesario)
-                logging.info(f"[auto-temp] enfriando. temp ({temp:.1f}°c) > high ({high_temp:.1f}°c).")
+                log.debug("[auto-temp] %s enfriando. temp (%.1f°c) > high (%.1f°c).", esp_id, temp, high_temp)
                 
                 # Accion Ventilador: debe estar ON (si no lo activó ya la humedad)
-                if not mech.ventilador and _puede_cambiar(key_vent):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "VENT", "value": "ON"}, esp_id)
+                if not mech.ventilador and _puede_cambiar(entrada.device_id, "vent", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "VENT", "value": "ON"}, esp_id)
                     mech.ventilador = True
                     cambios["ventilador"] = "ON"
-                    logging.info("[auto-temp] acción: Vent ON.")
+                    log.info("[auto-temp] %s acción: Vent ON.", esp_id)
                 elif mech.ventilador:
-                    logging.info("[auto-temp] no acción: Vent ya estaba ON.")
+                    sin_accion(log, esp_id, "[auto-temp] %s no acción: Vent ya estaba ON.", esp_id)
                     
                 # Accion Luz: Se APAGA SOLO AQUÍ para evitar el sobrecalentamiento.
-                if mech.luz and _puede_cambiar(key_luz):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "LUZ", "value": "OFF"}, esp_id)
+                if mech.luz and _puede_cambiar(entrada.device_id, "luz", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "LUZ", "value": "OFF"}, esp_id)
                     mech.luz = False
                     cambios["luz"] = "OFF"
-                    logging.info("[auto-temp] acción: Luz OFF para enfriar.")
+                    log.info("[auto-temp] %s acción: Luz OFF para enfriar.", esp_id)
                 elif not mech.luz:
-                    logging.info("[auto-temp] no acción: Luz ya estaba OFF.")
+                    sin_accion(log, esp_id, "[auto-temp] %s no acción: Luz ya estaba OFF.", esp_id)
 
             elif temp < low_temp:
                 # 2. HACE FRÍO: Objetivo calentar -> Vent OFF, Luz ON
-                logging.info(f"[auto-temp] calentando. temp ({temp:.1f}°c) < low ({low_temp:.1f}°c).")
+                log.debug("[auto-temp] %s calentando. temp (%.1f°c) < low (%.1f°c).", esp_id, temp, low_temp)
                 
                 # Accion Ventilador: Se APAGA para calentar.
-                if mech.ventilador and _puede_cambiar(key_vent):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "VENT", "value": "OFF"}, esp_id)
+                if mech.ventilador and _puede_cambiar(entrada.device_id, "vent", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "VENT", "value": "OFF"}, esp_id)
                     mech.ventilador = False
                     cambios["ventilador"] = "OFF"
-                    logging.info("[auto-temp] acción: Vent OFF para calentar.")
+                    log.info("[auto-temp] %s acción: Vent OFF para calentar.", esp_id)
                 elif not mech.ventilador:
-                    logging.info("[auto-temp] no acción: Vent ya estaba OFF.")
+                    sin_accion(log, esp_id, "[auto-temp] %s no acción: Vent ya estaba OFF.", esp_id)
                     
                 # Accion Luz: Se ENCIENDE para calentar y para el crecimiento.
-                if not mech.luz and _puede_cambiar(key_luz):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "LUZ", "value": "ON"}, esp_id)
+                if not mech.luz and _puede_cambiar(entrada.device_id, "luz", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "LUZ", "value": "ON"}, esp_id)
                     mech.luz = True
                     cambios["luz"] = "ON"
-                    logging.info("[auto-temp] acción: Luz ON para calentar y crecer.")
+                    log.info("[auto-temp] %s acción: Luz ON para calentar y crecer.", esp_id)
                 elif mech.luz:
-                    logging.info("[auto-temp] no acción: Luz ya estaba ON.")
+                    sin_accion(log, esp_id, "[auto-temp] %s no acción: Luz ya estaba ON.", esp_id)
 
             else:
                 # 3. ZONA DE HISTÉRESIS (low_temp <= temp <= high_temp): Prioridad a la Luz
-                logging.info("[auto-temp] zona ideal. mantener luz ON para crecimiento.")
+                log.debug("[auto-temp] %s zona ideal. mantener luz ON para crecimiento.", esp_id)
 
                 # Accion Luz: SIEMPRE debe estar ON en este rango.
-                if not mech.luz and _puede_cambiar(key_luz):
-                    enviar_cmd_mqtt({"cmd": "SET", "target": "LUZ", "value": "ON"}, esp_id)
+                if not mech.luz and _puede_cambiar(entrada.device_id, "luz", esp_id, efectos):
+                    diferir(efectos, enviar_cmd_mqtt, {"cmd": "SET", "target": "LUZ", "value": "ON"}, esp_id)
                     mech.luz = True
                     cambios["luz"] = "ON"
-                    logging.info("[auto-temp] acción: Luz ON (crecimiento).")
+                    log.info("[auto-temp] %s acción: Luz ON (crecimiento).", esp_id)
                 
                 # Accion Ventilador: Mantiene el estado que tenía al entrar en la histéresis.
-                logging.info(f"[auto-temp] no acción: vent mantiene estado ('{'on' if mech.ventilador else 'off'}).")
-                logging.info(f"[auto-temp] no acción: temp dentro del margen de histéresis ({low_temp:.1f}°c - {high_temp:.1f}°c).")
+                sin_accion(log, esp_id, "[auto-temp] %s no acción: temp dentro del margen de histéresis (%.1f°c - %.1f°c), vent mantiene estado (%s).",
+                           esp_id, low_temp, high_temp, "on" if mech.ventilador else "off")
             
         except ValueError as e:
-            logging.error(f"[auto-temp] error de valor: {e}")
+            log.error("[auto-temp] error de valor: %s", e)
 
-    # notificar si hubo cambios
+    for actuador, valor in cambios.items():
+        diferir(efectos, decisiones.inc, actuador, valor)
+    diferir(efectos, diario.actuadores, esp_id, cambios, device_id=entrada.device_id)
     if cambios:
         # nota: el commit se hará en el mqtt_listener.py
-        logging.info(f"[auto control] {esp_id} → cambios propuestos: {cambios}")
+        db.execute(
+            update(Mecanismos)
+            .where(Mecanismos.id == mech.id)
+            .values(bomba=mech.bomba, ventilador=mech.ventilador, luz=mech.luz)
+        )
+    if cambios or creado:
+        registro.actualizar_mecanismos(esp_id, mech)
+
+    # notificar si hubo cambios
+    if cambios:
+        log.info("[auto control] %s → cambios propuestos: %s", esp_id, cambios, extra={"esp_id": esp_id, "cambios": cambios})
     else:
-        logging.info(f"[auto control] {esp_id} → no se requirieron cambios de estado.")
\ No newline at end of file
+        sin_accion(log, esp_id, "[auto control] %s → no se requirieron cambios de estado.", esp_id)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Costo por lectura de la analítica en vivo según el largo de la ventana.
+
+    python -m bench.analitica --ventanas 10,100,1000,10000 --devices 20 --mensajes 20000
+
+Para cada largo de ventana pasa las mismas lecturas sintéticas (ruido
+gaussiano, algún sensor trabado y caídas del tanque, para que también se
+ejerciten las alertas) por `AnaliticaTelemetria.observar` y, como
+referencia, por un cálculo ingenuo que recorre la ventana completa en cada
+lectura (min/max/varianza sobre la lista). Informa µs por lectura de cada
+uno: el primero tiene que quedar plano al crecer la ventana, el segundo crece
+lineal. La fase medida empieza con las ventanas ya llenas.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from app.db.models import Lectura
+from app.servicios.analitica import SENSORES, AnaliticaTelemetria
+
+
+def _lecturas(devices: int, n: int, seed: int) -> list[tuple[str, Lectura]]:
+    rnd = random.Random(seed)
+    t0 = datetime.now(timezone.utc)
+    nivel = [80.0] * devices
+    out = []
+    for i in range(n):
+        d = i % devices
+        if rnd.random() < 0.001:
+            nivel[d] = rnd.uniform(0, 30)            # caída del tanque
+        nivel[d] = min(100.0, nivel[d] + rnd.gauss(0.05, 0.5))
+        out.append((f"esp-{d:03d}", Lectura(
+            device_id=d + 1, fecha_hora=t0 + timedelta(seconds=5 * (i // devices)),
+            temperatura=25.0 if d == 0 else rnd.gauss(25, 2),   # el device 0 tiene el sensor trabado
+            humedad=rnd.gauss(60, 5), humedad_suelo=rnd.gauss(50, 5), nivel_de_agua=nivel[d])))
+    return out
+
+
+def _ingenuo(ventana: int, previas, medidas) -> float:
+    """Lo mismo recalculado sobre la ventana completa en cada lectura: segundos por lectura medida."""
+    ventanas: dict[tuple[str, str], deque] = {}
+    for esp_id, lec in previas:
+        for s in SENSORES:
+            ventanas.setdefault((esp_id, s), deque(maxlen=ventana)).append(getattr(lec, s))
+    t0 = time.perf_counter()
+    for esp_id, lec in medidas:
+        for s in SENSORES:
+            w = ventanas[(esp_id, s)]
+            w.append(getattr(lec, s))
+            min(w), max(w), statistics.fmean(w), statistics.variance(w)
+    return (time.perf_counter() - t0) / len(medidas)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--ventanas", default="10,100,1000,10000")
+    ap.add_argument("--devices", type=int, default=20)
+    ap.add_argument("--mensajes", type=int, default=20000, help="lecturas medidas (además del llenado)")
+    ap.add_argument("--sin-ingenuo", action="store_true", help="no correr la referencia ingenua (lenta con ventanas largas)")
+    ap.add_argument("--seed", type=int, default=9)
+    args = ap.parse_args()
+
+    res = []
+    for ventana in (int(v) for v in args.ventanas.split(",")):
+        llenado = ventana * args.devices
+        lecturas = _lecturas(args.devices, llenado + args.mensajes, args.seed)
+        previas, medidas = lecturas[:llenado], lecturas[llenado:]
+
+        a = AnaliticaTelemetria(ventana=ventana, alfa=0.2, trabado_delta=0.0, caida_pct=15, tanque_seco_pct=10)
+        for esp_id, lec in previas:
+            a.observar(esp_id, lec)
+        alertas = 0
+        t0 = time.perf_counter()
+        for esp_id, lec in medidas:
+            alertas += len(a.observar(esp_id, lec))
+        dur = time.perf_counter() - t0
+
+        fila = {"ventana": ventana, "us_lectura": round(dur / len(medidas) * 1e6, 2), "alertas": alertas}
+        if not args.sin_ingenuo:
+            # con ventanas largas alcanza con una parte de las lecturas medidas
+            muestra = medidas[: max(args.devices, min(len(medidas), 2_000_000 // ventana))]
+            fila["us_lectura_ingenuo"] = round(_ingenuo(ventana, previas, muestra) * 1e6, 2)
+        res.append(fila)
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Carga sobre la API REST v1: pedidos/s, latencia y serialización por endpoint según el tamaño de la DB.
+
+    python -m bench.api --periodos semana,mes,anio --devices 10 --segundos 5
+    python -m bench.api --periodos anio --perfil /tmp/api    # + pilas para flamegraph
+
+Por cada período (semana = 7 días, mes = 30, anio = 365) siembra una SQLite
+temporal con `--devices` devices y una lectura cada `--intervalo-s` por
+device durante ese período (con los rollups de los últimos 8 días), y en un
+proceso hijo con esa DB como `app.db` levanta la app real (`app.main`) y la
+maneja en proceso con un cliente ASGI (httpx.ASGITransport, sin sockets). El
+MQTT no tiene broker: la app arranca igual y sólo sirve HTTP.
+
+Cada endpoint se carga por separado durante `--segundos` con
+`--concurrencia` clientes, con las consultas que hace el frontend en sus
+timers (primer poll con limit, poll incremental con since_id, última lectura,
+mecanismos, config, lista de dispositivos, serie de 7 días). Por endpoint
+informa pedidos/s, p50/p95/p99 de latencia y el tiempo medio en
+`serialize_response` de FastAPI (validación + conversión del response_model).
+La latencia incluye al cliente, que corre en el mismo event loop.
+
+Con `--perfil PREFIJO`, un hilo muestrea cada `--perfil-ms` las pilas de
+los hilos que no están esperando y escribe `PREFIJO-<periodo>.folded`
+(formato "plegado": una pila por línea con su cuenta), listo para
+flamegraph.pl o speedscope.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+PERIODOS = {"semana": 7, "mes": 30, "anio": 365}
+# hojas de pila de un hilo bloqueado esperando: no son trabajo (como el --idle apagado de py-spy)
+OCIOSAS = {"threading:wait", "queue:get", "socket:accept", "selectors:select"}
+
+
+def _pcts(xs: list[float]) -> dict:
+    if not xs:
+        return {"n": 0}
+    xs = sorted(xs)
+    p = lambda q: round(xs[min(len(xs) - 1, int(len(xs) * q))] * 1000, 2)
+    return {"p50_ms": round(statistics.median(xs) * 1000, 2), "p95_ms": p(0.95),
+            "p99_ms": p(0.99), "max_ms": round(xs[-1] * 1000, 2)}
+
+
+# ---------- siembra ----------
+
+def sembrar(ruta: Path, devices: int, dias: int, intervalo_s: int) -> dict:
+    """Devices con Config y Mecanismos, y sus lecturas hacia atrás desde ahora."""
+    from sqlalchemy import insert, text
+    from app.db.models import Lectura
+    from app.servicios.devices import get_or_create_device
+    from app.servicios.rollups import recompactar
+    from bench.ingesta import crear_sesiones
+
+    eng, Session = crear_sesiones(ruta)
+    rnd = random.Random(11)
+    ahora = datetime.now(timezone.utc)
+    por_device = dias * 86400 // intervalo_s
+    t0 = time.perf_counter()
+    with Session() as db:
+        ids = [get_or_create_device(db, f"esp-{i:03d}").id for i in range(devices)]
+        db.commit()
+        filas = []
+        for paso in range(por_device, 0, -1):
+            fecha = ahora - timedelta(seconds=paso * intervalo_s)
+            for dev in ids:
+                filas.append({"device_id": dev, "fecha_hora": fecha, "temperatura": rnd.uniform(15, 35),
+                              "humedad": rnd.uniform(30, 90), "humedad_suelo": rnd.uniform(20, 80),
+                              "nivel_de_agua": rnd.uniform(0, 100)})
+            if len(filas) >= 20000:
+                db.execute(insert(Lectura), filas)
+                filas.clear()
+        if filas:
+            db.execute(insert(Lectura), filas)
+        db.commit()
+        recompactar(db, ahora - timedelta(days=8), ahora + timedelta(seconds=1))
+        db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    eng.dispose()
+    return {"lecturas": por_device * devices, "siembra_s": round(time.perf_counter() - t0, 1),
+            "db_mb": round(ruta.stat().st_size / 1024 / 1024, 1)}
+
+
+# ---------- perfilador por muestreo ----------
+
+class Muestreador:
+    """Muestrea sys._current_frames() en un hilo y acumula pilas plegadas."""
+
+    def __init__(self, intervalo_s: float):
+        self._intervalo_s = intervalo_s
+        self._pilas: Counter = Counter()
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="muestreador", daemon=True)
+
+    def _bucle(self):
+        propio = threading.get_ident()
+        nombres = {}
+        while not self._parar.wait(self._intervalo_s):
+            for tid, frame in sys._current_frames().items():
+                if tid == propio:
+                    continue
+                co = frame.f_code
+                if f"{Path(co.co_filename).stem}:{co.co_name}" in OCIOSAS:
+                    continue
+                pila = []
+                while frame is not None:
+                    co = frame.f_code
+                    pila.append(f"{Path(co.co_filename).stem}:{co.co_name}")
+                    frame = frame.f_back
+                if tid not in nombres:
+                    nombres = {t.ident: t.name for t in threading.enumerate()}
+                pila.append(nombres.get(tid, str(tid)))
+                self._pilas[";".join(reversed(pila))] += 1
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self, destino: Path) -> int:
+        self._parar.set()
+        self._hilo.join()
+        destino.write_text("".join(f"{p} {n}\n" for p, n in self._pilas.most_common()))
+        return sum(self._pilas.values())
+
+
+# ---------- proceso hijo: la app en proceso ----------
+
+def _rutas(devices: int, rnd: random.Random):
+    """Generadores de URL por endpoint, como los timers del frontend."""
+    esp = lambda: f"esp-{rnd.randrange(devices):03d}"
+    desde = (datetime.now(timezone.utc) - timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "lecturas?limit=100": lambda u: f"/api/v1/lecturas?esp_id={esp()}&limit=100",
+        "lecturas?since_id": lambda u: f"/api/v1/lecturas?esp_id={esp()}&since_id={u - rnd.randrange(devices * 3)}&limit=100",
+        "lecturas/ultima": lambda u: f"/api/v1/lecturas/ultima?esp_id={esp()}",
+        "lecturas/series 7d": lambda u: f"/api/v1/lecturas/series?esp_id={esp()}&desde={desde}",
+        "mecanismos": lambda u: f"/api/v1/mecanismos?esp_id={esp()}",
+        "config": lambda u: f"/api/v1/config?esp_id={esp()}",
+        "dispositivos": lambda u: "/api/v1/dispositivos",
+    }
+
+
+async def _cargar(c, ruta, ultimo_id: int, segundos: float, concurrencia: int) -> tuple[list[float], int]:
+    latencias: list[float] = []
+    errores = 0
+    fin = time.monotonic() + segundos
+
+    async def cliente():
+        nonlocal errores
+        while time.monotonic() < fin:
+            t0 = time.perf_counter()
+            r = await c.get(ruta(ultimo_id))
+            latencias.append(time.perf_counter() - t0)
+            if r.status_code not in (200, 304):
+                errores += 1
+
+    await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+    return latencias, errores
+
+
+async def _medir(args, resumen: dict) -> dict:
+    import fastapi.routing
+    import httpx
+    from sqlalchemy import func, select
+    from app.db.models import Lectura
+    from app.db.session import SessionLocal
+    from app.main import app
+
+    # tiempo de serialización del response_model, por endpoint (se cargan de a uno)
+    serializacion: list[float] = []
+    original = fastapi.routing.serialize_response
+
+    async def serialize_response(*a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return await original(*a, **kw)
+        finally:
+            serializacion.append(time.perf_counter() - t0)
+
+    fastapi.routing.serialize_response = serialize_response
+    with SessionLocal() as db:
+        ultimo_id = db.execute(select(func.max(Lectura.id))).scalar() or 0
+
+    res = {}
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=60) as c:
+        for nombre, ruta in _rutas(args.devices, random.Random(3)).items():
+            await _cargar(c, ruta, ultimo_id, min(1.0, args.segundos), 1)  # calentar registro y caché
+            serializacion.clear()
+            t0 = time.monotonic()
+            latencias, errores = await _cargar(c, ruta, ultimo_id, args.segundos, args.concurrencia)
+            dur = time.monotonic() - t0
+            res[nombre] = {"pedidos_s": round(len(latencias) / dur, 1), **_pcts(latencias),
+                           "serializacion_ms": round(statistics.fmean(serializacion) * 1000, 3) if serializacion else None,
+                           "errores": errores}
+            print(json.dumps({"periodo": resumen["periodo"], "endpoint": nombre, "pedidos_s": res[nombre]["pedidos_s"],
+                              "p99_ms": res[nombre].get("p99_ms")}), file=sys.stderr)
+    fastapi.routing.serialize_response = original
+    return res
+
+
+def hijo(args):
+    logging.disable(logging.WARNING)
+    resumen = {"periodo": args.hijo, **sembrar(Path("app.db"), args.devices, PERIODOS[args.hijo], args.intervalo_s)}
+    muestreador = Muestreador(args.perfil_ms / 1000) if args.perfil else None
+    if muestreador:
+        muestreador.iniciar()
+    resumen["endpoints"] = asyncio.run(_medir(args, resumen))
+    if muestreador:
+        destino = Path(f"{args.perfil}-{args.hijo}.folded")
+        resumen["perfil"] = {"archivo": str(destino), "muestras": muestreador.detener(destino)}
+    print(json.dumps(resumen))
+    os._exit(0)  # sin esperar a los hilos de la app (MQTT, coordinación)
+
+
+# ---------- proceso padre ----------
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--periodos", default="semana,mes,anio", help="historia sembrada: " + ",".join(PERIODOS))
+    ap.add_argument("--devices", type=int, default=10)
+    ap.add_argument("--intervalo-s", type=int, default=300, help="una lectura por device cada tantos segundos")
+    ap.add_argument("--segundos", type=float, default=5, help="carga por endpoint")
+    ap.add_argument("--concurrencia", type=int, default=8)
+    ap.add_argument("--perfil", help="prefijo de los archivos .folded (activa el muestreo de pilas)")
+    ap.add_argument("--perfil-ms", type=float, default=5)
+    ap.add_argument("--hijo", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.hijo:
+        return hijo(args)
+
+    res = []
+    for periodo in args.periodos.split(","):
+        if periodo not in PERIODOS:
+            ap.error(f"período desconocido: {periodo}")
+        with tempfile.TemporaryDirectory() as d:
+            cmd = [sys.executable, "-m", "bench.api", "--hijo", periodo]
+            for k in ("devices", "intervalo_s", "segundos", "concurrencia", "perfil_ms"):
+                cmd += [f"--{k.replace('_', '-')}", str(getattr(args, k))]
+            if args.perfil:
+                cmd += ["--perfil", str(Path(args.perfil).resolve())]
+            env = dict(os.environ, PYTHONPATH=str(RAIZ), APP_MODE="NORMAL")
+            out = subprocess.run(cmd, cwd=d, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+            res.append(json.loads(out.strip().splitlines()[-1]))
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Broker MQTT en proceso para benchmarks (sustituto de Mosquitto).
+
+`ClienteSimulado` imita la parte de `paho.mqtt.client.Client` que usa la app
+(on_connect/on_message, connect, subscribe, publish, is_connected,
+loop_start/loop_stop). Cada cliente entrega sus mensajes en un hilo propio,
+como el hilo de red de paho. Soporta comodines (+/#) y suscripciones
+compartidas `$share/<grupo>/<filtro>` con reparto round-robin.
+"""
+import itertools
+import queue
+import threading
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import topic_matches_sub
+
+
+class BrokerSimulado:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: list[tuple[str, "ClienteSimulado"]] = []
+        self._grupos: dict[tuple[str, str], list["ClienteSimulado"]] = {}
+        self._rr: dict[tuple[str, str], itertools.count] = {}
+        self.publicados = 0
+
+    def suscribir(self, cliente: "ClienteSimulado", filtro: str):
+        with self._lock:
+            if filtro.startswith("$share/"):
+                _, grupo, real = filtro.split("/", 2)
+                miembros = self._grupos.setdefault((grupo, real), [])
+                if cliente not in miembros:
+                    miembros.append(cliente)
+                self._rr.setdefault((grupo, real), itertools.count())
+            elif (filtro, cliente) not in self._subs:
+                self._subs.append((filtro, cliente))
+
+    def desconectar(self, cliente: "ClienteSimulado"):
+        with self._lock:
+            self._subs = [(f, c) for f, c in self._subs if c is not cliente]
+            for miembros in self._grupos.values():
+                if cliente in miembros:
+                    miembros.remove(cliente)
+
+    def publicar(self, topic: str, payload: bytes, qos: int = 0):
+        with self._lock:
+            self.publicados += 1
+            destinos = [c for f, c in self._subs if topic_matches_sub(f, topic)]
+            for (grupo, filtro), miembros in self._grupos.items():
+                if miembros and topic_matches_sub(filtro, topic):
+                    destinos.append(miembros[next(self._rr[(grupo, filtro)]) % len(miembros)])
+        msg = SimpleNamespace(topic=topic, payload=payload, qos=qos, retain=False)
+        for c in destinos:
+            c._entregar(msg)
+
+
+class ClienteSimulado:
+    def __init__(self, broker: BrokerSimulado, client_id: str = ""):
+        self._broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_message = None
+        self.userdata = None
+        self._conectado = False
+        self._cola: queue.Queue = queue.Queue()
+        self._hilo: threading.Thread | None = None
+
+    # --- API estilo paho ---
+    def connect(self, host="localhost", port=1883, keepalive=60, **kwargs):
+        self._conectado = True
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {}, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def is_connected(self) -> bool:
+        return self._conectado
+
+    def subscribe(self, topic: str, qos: int = 0, **kwargs):
+        self._broker.suscribir(self, topic)
+        return (mqtt.MQTT_ERR_SUCCESS, 1)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._broker.publicar(topic, payload or b"", qos)
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=0)
+
+    def loop_start(self):
+        self._hilo = threading.Thread(target=self._bucle, name=f"sim-{self.client_id}", daemon=True)
+        self._hilo.start()
+
+    def loop_stop(self):
+        self._cola.put(None)
+        if self._hilo:
+            self._hilo.join(5)
+
+    def disconnect(self):
+        self._conectado = False
+        self._broker.desconectar(self)
+
+    # --- entrega en el "hilo de red" del cliente ---
+    def _entregar(self, msg):
+        self._cola.put(msg)
+
+    def _bucle(self):
+        while True:
+            msg = self._cola.get()
+            if msg is None:
+                return
+            if self.on_message:
+                self.on_message(self, self.userdata, msg)
@@ -0,0 +1,161 @@
+"""
+Benchmark de exportación CSV: pico de memoria (RSS) y tiempo antes/después del streaming.
+
+    python -m bench.exportacion --filas 1000000
+
+Genera una SQLite temporal con `--filas` lecturas de un device y exporta todo
+el rango en un subproceso por variante, para que el pico de RSS de una no
+contamine a la otra:
+
+- "antes": el csv_from_range original (`.all()` + StringIO con todo el texto).
+- "despues": `csv_stream` (cursor con yield_per, trozos de texto).
+- "despues_gzip": `csv_stream` + `gzip_stream`.
+
+El CSV se consume y se descarta, como haría el socket.
+"""
+import argparse
+import io
+import csv
+import json
+import logging
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+ESP_ID = "esp-bench"
+
+
+def _rss_mb() -> float:
+    # ru_maxrss está en KiB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def poblar(db_path: Path, filas: int):
+    """Crea el esquema de la app y carga `filas` lecturas (una cada 30 s, hacia atrás)."""
+    from bench.ingesta import crear_sesiones
+    from app.servicios.devices import get_or_create_device
+
+    eng, Session = crear_sesiones(db_path)
+    with Session() as db:
+        device_id = get_or_create_device(db, ESP_ID).id
+    eng.dispose()
+    # carga directa con sqlite3: el ORM tardaría más que el propio benchmark
+    con = sqlite3.connect(db_path)
+    fin = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    lote = []
+    for i in range(filas):
+        ts = (fin - timedelta(seconds=30 * i)).replace(tzinfo=None)
+        lote.append((device_id, ts.isoformat(sep=" "), 20 + i % 10, 50 + i % 30, 40 + i % 20, 60 + i % 25))
+        if len(lote) == 50_000:
+            con.executemany("INSERT INTO lecturas (device_id, fecha_hora, temperatura, humedad, "
+                            "humedad_suelo, nivel_de_agua) VALUES (?, ?, ?, ?, ?, ?)", lote)
+            lote.clear()
+    if lote:
+        con.executemany("INSERT INTO lecturas (device_id, fecha_hora, temperatura, humedad, "
+                        "humedad_suelo, nivel_de_agua) VALUES (?, ?, ?, ?, ?, ?)", lote)
+    con.commit()
+    con.close()
+    return fin - timedelta(seconds=30 * filas), fin
+
+
+def csv_legacy(db, esp_id: str, desde: str, hasta: str) -> str:
+    """Copia del csv_from_range previo al streaming (todo en memoria)."""
+    from datetime import time as dtime
+    from sqlalchemy import select, desc
+    from app.db.models import Lectura
+    from app.servicios.devices import get_device_by_esp_id
+
+    d = get_device_by_esp_id(db, esp_id)
+    tz_local = ZoneInfo("America/Montevideo")
+    d0 = datetime.strptime(desde, "%Y-%m-%d").date()
+    d1 = datetime.strptime(hasta, "%Y-%m-%d").date()
+    start_utc = datetime.combine(d0, dtime.min).replace(tzinfo=tz_local).astimezone(timezone.utc)
+    end_utc = datetime.combine(d1, dtime.max).replace(tzinfo=tz_local).astimezone(timezone.utc)
+    stmt = (
+        select(Lectura.fecha_hora, Lectura.temperatura, Lectura.humedad_suelo, Lectura.humedad)
+        .where(Lectura.device_id == d.id, Lectura.fecha_hora >= start_utc, Lectura.fecha_hora <= end_utc)
+        .order_by(desc(Lectura.fecha_hora))
+    )
+    rows = db.execute(stmt).all()
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(["fecha_hora", "temperatura", "humedad_suelo", "humedad"])
+    for dt, temperatura, humedad_suelo, humedad in rows:
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        writer.writerow([dt.astimezone(tz_local).strftime("%Y-%m-%d %H:%M:%S"),
+                         f"{float(temperatura):.1f} °C", f"{float(humedad_suelo):.1f} %", f"{float(humedad):.1f} %"])
+    return buf.getvalue()
+
+
+def medir(db_path: Path, modo: str, desde: str, hasta: str) -> dict:
+    """Corre una variante en este proceso y devuelve tiempo, bytes y pico de RSS."""
+    from bench.ingesta import crear_sesiones
+    from app.servicios.funciones import csv_stream, gzip_stream
+
+    eng, Session = crear_sesiones(db_path)
+    rss_base = _rss_mb()
+    t0 = time.perf_counter()
+    total = 0
+    if modo == "antes":
+        with Session() as db:
+            for trozo in iter([csv_legacy(db, ESP_ID, desde, hasta)]):
+                total += len(trozo.encode("utf-8"))
+    else:
+        trozos = csv_stream(ESP_ID, desde, hasta, session_factory=Session)
+        if modo == "despues_gzip":
+            for b in gzip_stream(trozos):
+                total += len(b)
+        else:
+            for trozo in trozos:
+                total += len(trozo.encode("utf-8"))
+    dur = time.perf_counter() - t0
+    eng.dispose()
+    return {
+        "modo": modo,
+        "segundos": round(dur, 2),
+        "mb_enviados": round(total / 1e6, 1),
+        "rss_base_mb": round(rss_base, 1),
+        "rss_pico_mb": round(_rss_mb(), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--filas", type=int, default=1_000_000)
+    ap.add_argument("--modos", default="antes,despues,despues_gzip")
+    ap.add_argument("--_medir", help=argparse.SUPPRESS)      # uso interno: subproceso
+    ap.add_argument("--_db", help=argparse.SUPPRESS)
+    ap.add_argument("--_rango", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    if args._medir:
+        desde, hasta = args._rango.split(",")
+        print(json.dumps(medir(Path(args._db), args._medir, desde, hasta)))
+        return
+
+    resultados = {"filas": args.filas}
+    with tempfile.TemporaryDirectory() as d:
+        db_path = Path(d) / "export.db"
+        t0 = time.perf_counter()
+        ini, fin = poblar(db_path, args.filas)
+        resultados["carga_s"] = round(time.perf_counter() - t0, 1)
+        rango = f"{(ini - timedelta(days=1)).date()},{(fin + timedelta(days=1)).date()}"
+        for modo in args.modos.split(","):
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.exportacion", "--_medir", modo, "--_db", str(db_path), "--_rango", rango],
+                capture_output=True, text=True, check=True,
+            )
+            resultados[modo] = json.loads(out.stdout.strip().splitlines()[-1])
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Flota de ESP32 simulados contra la ingesta y el autocontrol reales.
+
+    python -m bench.flota --devices 200 --hz 1 --segundos 30
+    python -m bench.flota --salida base.json
+    python -m bench.flota --comparar base.json --tolerancia 0.25
+
+Cada ESP32 simulado es un cliente del broker en proceso (bench/broker.py):
+publica la telemetría del contrato del README (temp_c, hum_amb, suelo_pct,
+nivel_pct, riego, vent, luz) `--hz` veces por segundo, con una física simple
+(el suelo se seca si la bomba está apagada, la temperatura sube si el
+ventilador está apagado), y obedece los comandos SET/SET_MULTI del
+autocontrol respondiendo con ack. Del lado del servidor corren el listener
+real (`app.mqtt_client.on_message`), el IngestaWriter y el autocontrol
+sobre una SQLite temporal.
+
+Mide:
+- latencia publicación → lectura confirmada en la DB (el hub publica cada
+  lectura justo después del commit);
+- latencia de decisión del autocontrol: última telemetría publicada por el
+  device → comando recibido por el ESP32;
+- mensajes/s confirmados, crecimiento de la DB por lectura (con el WAL volcado);
+- microbenchmarks de `on_message`, `procesar_umbrales` y `agregar_lectura`.
+
+La salida es JSON con un esquema estable ("version"). Con --salida se guarda;
+con --comparar se contrasta contra una corrida anterior y sale con código 1
+si alguna métrica empeoró más que --tolerancia (fracción).
+"""
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from app import mqtt_client
+from app.db.models import Lectura
+from app.servicios import control_vectorizado, umbrales
+from app.servicios.comandos import rastreador
+from app.servicios.cooldown import CooldownStore
+from app.servicios.devices import get_or_create_device
+from app.servicios.funciones import agregar_lectura
+from app.servicios.ingesta import IngestaWriter, setup_ingesta
+from app.servicios.mqtt_funciones import setup_mqtt_client
+from app.servicios.registro import registro
+from app.servicios.stream import hub
+from bench.broker import BrokerSimulado, ClienteSimulado
+from bench.ingesta import crear_sesiones, directorio_temporal
+
+VERSION = 1
+
+# métrica -> True si más alto es mejor (para --comparar)
+COMPARABLES = {
+    "ingesta.p50_ms": False,
+    "ingesta.p99_ms": False,
+    "autocontrol.p50_ms": False,
+    "autocontrol.p99_ms": False,
+    "msg_s": True,
+    "db.bytes_por_lectura": False,
+    "micro.on_message_us": False,
+    "micro.procesar_umbrales_us": False,
+    "micro.agregar_lectura_ms": False,
+}
+
+
+def _pcts(xs: list[float]) -> dict:
+    if not xs:
+        return {"n": 0}
+    xs = sorted(xs)
+    p = lambda q: round(xs[min(len(xs) - 1, int(len(xs) * q))], 2)
+    return {"n": len(xs), "p50_ms": round(statistics.median(xs), 2), "p95_ms": p(0.95),
+            "p99_ms": p(0.99), "max_ms": round(xs[-1], 2)}
+
+
+def _tamano(ruta: Path) -> int:
+    """Tamaño de la DB con el WAL volcado (lo que ocupa en disco a la larga)."""
+    con = sqlite3.connect(ruta)
+    try:
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        con.close()
+    return ruta.stat().st_size
+
+
+class Esp32Simulado:
+    """Un ESP32 con el firmware del README: telemetría, comandos y ack."""
+
+    def __init__(self, broker: BrokerSimulado, esp_id: str, rnd: random.Random, flota: "Flota"):
+        self.esp_id = esp_id
+        self.rnd = rnd
+        self.flota = flota
+        self.riego = self.vent = self.luz = False
+        self.suelo = rnd.uniform(35, 75)
+        self.temp = rnd.uniform(22, 38)
+        self.hum = rnd.uniform(25, 70)
+        self.cliente = ClienteSimulado(broker, esp_id)
+        self.cliente.on_message = self._comando
+        self.cliente.connect()
+        self.cliente.subscribe(f"invernaderos/{esp_id}/cmd", qos=1)
+        self.cliente.loop_start()
+
+    def publicar(self):
+        # física mínima para que el autocontrol tenga algo que decidir
+        self.suelo = min(100.0, max(0.0, self.suelo + (3.0 if self.riego else -1.0) + self.rnd.uniform(-0.5, 0.5)))
+        self.temp += (-0.8 if self.vent else 0.4) + self.rnd.uniform(-0.3, 0.3)
+        self.hum = min(100.0, max(0.0, self.hum + self.rnd.uniform(-1, 1)))
+        payload = json.dumps({
+            "temp_c": round(self.temp, 1), "hum_amb": round(self.hum, 1),
+            "suelo_pct": round(self.suelo, 1), "nivel_pct": round(self.rnd.uniform(20, 90), 1),
+            "riego": "ON" if self.riego else "OFF", "vent": "ON" if self.vent else "OFF",
+            "luz": "ON" if self.luz else "OFF",
+        })
+        self.flota.publicado(self.esp_id)
+        self.cliente.publish(f"invernaderos/{self.esp_id}/telemetria", payload, qos=1)
+
+    def _comando(self, client, userdata, msg):
+        cmd = json.loads(msg.payload)
+        self.flota.comando(self.esp_id, cmd)
+        targets = cmd.get("targets") or ({cmd["target"]: cmd["value"]} if cmd.get("cmd") == "SET" else {})
+        for target, value in targets.items():
+            setattr(self, {"RIEGO": "riego", "VENT": "vent", "LUZ": "luz"}[target], value == "ON")
+        if cmd.get("id"):
+            self.cliente.publish(f"invernaderos/{self.esp_id}/ack", json.dumps({"id": cmd["id"], "ok": True}), qos=1)
+
+    def detener(self):
+        self.cliente.loop_stop()
+        self.cliente.disconnect()
+
+
+class Flota:
+    """Lleva los tiempos de publicación para medir ingesta y decisiones."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pendientes: dict[str, deque] = defaultdict(deque)
+        self._ultima_pub: dict[str, float] = {}
+        self.ingesta_ms: list[float] = []
+        self.decision_ms: list[float] = []
+        self.comandos = 0
+        self.confirmadas = 0
+
+    def publicado(self, esp_id: str):
+        t = time.perf_counter()
+        with self._lock:
+            self._pendientes[esp_id].append(t)
+            self._ultima_pub[esp_id] = t
+
+    def confirmado(self, esp_id: str, tipo: str, data: str):
+        """Hook del hub: cada lectura se publica justo después de su commit."""
+        if tipo != "lectura":
+            return
+        t = time.perf_counter()
+        with self._lock:
+            cola = self._pendientes.get(esp_id)
+            if cola:
+                self.ingesta_ms.append((t - cola.popleft()) * 1000)
+                self.confirmadas += 1
+
+    def comando(self, esp_id: str, cmd: dict):
+        t = time.perf_counter()
+        with self._lock:
+            self.comandos += 1
+            if cmd.get("cmd") in ("SET", "SET_MULTI") and esp_id in self._ultima_pub:
+                self.decision_ms.append((t - self._ultima_pub[esp_id]) * 1000)
+
+
+def correr_flota(args, tmp: Path) -> dict:
+    ruta = tmp / "flota.db"
+    eng, Session = crear_sesiones(ruta)
+    registro.limpiar()
+    # cooldowns sobre la DB temporal (los globales persisten en la de la app)
+    store = CooldownStore(session_factory=Session, cooldown_s=args.cooldown_s)
+    umbrales.cooldowns = store
+    if control_vectorizado.motor_control:
+        control_vectorizado.motor_control._cooldowns = store
+    writer = IngestaWriter(session_factory=Session, ventana_s=args.ventana_ms / 1000)
+    setup_ingesta(writer)
+    writer.iniciar()
+
+    broker = BrokerSimulado()
+    listener = ClienteSimulado(broker, "listener")
+    listener.on_message = mqtt_client.on_message
+    listener.on_connect = mqtt_client._on_connect
+    setup_mqtt_client(listener)  # los comandos del autocontrol vuelven por el broker
+    listener.connect()
+    listener.loop_start()
+
+    flota = Flota()
+    hub.al_publicar = flota.confirmado
+    rnd = random.Random(args.seed)
+    esps = [Esp32Simulado(broker, f"esp-{i:04d}", random.Random(rnd.random()), flota) for i in range(args.devices)]
+
+    # primera ola fuera de la medición: crea devices, Config y Mecanismos
+    for e in esps:
+        e.publicar()
+    limite = time.monotonic() + 60
+    while flota.confirmadas < len(esps) and time.monotonic() < limite:
+        time.sleep(0.05)
+    flota.ingesta_ms.clear()
+    flota.decision_ms.clear()
+    flota.comandos = flota.confirmadas = 0
+    bytes0 = _tamano(ruta)
+    rastreo0 = rastreador.metricas()
+
+    # cada device publica a `hz`, con fases repartidas dentro del período
+    periodo = 1.0 / args.hz
+    paso = periodo / len(esps)
+    t0 = time.perf_counter()
+    fin = time.monotonic() + args.segundos
+    publicados = 0
+    while time.monotonic() < fin:
+        inicio = time.monotonic()
+        for i, e in enumerate(esps):
+            objetivo = inicio + i * paso
+            espera = objetivo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            e.publicar()
+            publicados += 1
+        time.sleep(max(0.0, periodo - (time.monotonic() - inicio)))
+    limite = time.monotonic() + 60
+    while flota.confirmadas < publicados and time.monotonic() < limite:
+        time.sleep(0.05)
+    dur = time.perf_counter() - t0
+
+    for e in esps:
+        e.detener()
+    listener.loop_stop()
+    writer.detener()
+    hub.al_publicar = None
+    rastreo = rastreador.metricas()
+    bytes1 = _tamano(ruta)
+    eng.dispose()
+
+    return {
+        "publicados": publicados,
+        "confirmados": flota.confirmadas,
+        "msg_s": round(flota.confirmadas / dur, 1),
+        "ingesta": _pcts(flota.ingesta_ms),
+        "autocontrol": _pcts(flota.decision_ms) | {"comandos": flota.comandos,
+                                                   "ack": rastreo["ack"] - rastreo0["ack"]},
+        "db": {"bytes_inicio": bytes0, "bytes_fin": bytes1,
+               "bytes_por_lectura": round((bytes1 - bytes0) / max(1, flota.confirmadas), 1)},
+        "escritor": {k: v for k, v in writer.metricas().items() if k in ("lotes", "lote_promedio", "descartados")},
+    }
+
+
+# ---------- microbenchmarks de las funciones del camino caliente ----------
+
+def _medir(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n
+
+
+def micro(args, tmp: Path) -> dict:
+    eng, Session = crear_sesiones(tmp / "micro.db")
+    registro.limpiar()
+    umbrales.cooldowns = CooldownStore(session_factory=Session, cooldown_s=args.cooldown_s)
+    rnd = random.Random(args.seed)
+    esps = [f"micro-{i:03d}" for i in range(50)]
+    payloads = [json.dumps({"temp_c": rnd.uniform(15, 40), "hum_amb": rnd.uniform(20, 90),
+                            "suelo_pct": rnd.uniform(10, 90), "nivel_pct": 50.0,
+                            "riego": "OFF", "vent": "OFF", "luz": "OFF"}) for _ in range(1000)]
+
+    # on_message: decodificar y encolar (el hilo de paho), con el escritor detenido
+    writer = IngestaWriter(session_factory=Session, cola_max=args.micro_n + 1)
+    setup_ingesta(writer)
+    msgs = [SimpleNamespace(topic=f"invernaderos/{esps[i % 50]}/telemetria", payload=payloads[i % 1000].encode())
+            for i in range(args.micro_n)]
+    on_message_s = _medir(lambda i: mqtt_client.on_message(None, None, msgs[i]), args.micro_n)
+
+    # procesar_umbrales: registro caliente, comandos anotados en vez de publicados
+    enviados = []
+    original = umbrales.enviar_cmd_mqtt
+    umbrales.enviar_cmd_mqtt = lambda cmd, esp_id=None: enviados.append(cmd) or True
+    try:
+        with Session() as db:
+            ids = {e: get_or_create_device(db, e).id for e in esps}
+            db.commit()
+            for e in esps:
+                registro.obtener(db, e)
+            lecturas = [Lectura(device_id=ids[esps[i % 50]], temperatura=rnd.uniform(15, 40), humedad=rnd.uniform(20, 90),
+                                humedad_suelo=rnd.uniform(10, 90), nivel_de_agua=50.0) for i in range(args.micro_n)]
+            umbrales_s = _medir(lambda i: umbrales.procesar_umbrales(db, esps[i % 50], lecturas[i]), args.micro_n)
+            db.rollback()
+    finally:
+        umbrales.enviar_cmd_mqtt = original
+
+    # agregar_lectura: un commit por lectura (camino de POST /lecturas)
+    n_agregar = max(1, args.micro_n // 10)
+    with Session() as db:
+        agregar_s = _medir(lambda i: agregar_lectura(db, esps[i % 50], 20.0, 50.0, 40.0, 70.0), n_agregar)
+    eng.dispose()
+    return {
+        "on_message_us": round(on_message_s * 1e6, 2),
+        "procesar_umbrales_us": round(umbrales_s * 1e6, 2),
+        "agregar_lectura_ms": round(agregar_s * 1000, 3),
+    }
+
+
+# ---------- comparación contra una corrida guardada ----------
+
+def _valor(res: dict, clave: str):
+    for parte in clave.split("."):
+        res = res.get(parte) if isinstance(res, dict) else None
+    return res
+
+
+def comparar(actual: dict, base: dict, tolerancia: float) -> list[dict]:
+    regresiones = []
+    for clave, mas_es_mejor in COMPARABLES.items():
+        a, b = _valor(actual, clave), _valor(base, clave)
+        if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or b == 0:
+            continue
+        cambio = (a - b) / b
+        if (-cambio if mas_es_mejor else cambio) > tolerancia:
+            regresiones.append({"metrica": clave, "base": b, "actual": a, "cambio": round(cambio, 3)})
+    return regresiones
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--hz", type=float, default=1.0, help="telemetrías por segundo de cada device")
+    ap.add_argument("--segundos", type=float, default=30)
+    ap.add_argument("--ventana-ms", type=int, default=250, help="ventana del escritor por lotes")
+    ap.add_argument("--cooldown-s", type=float, default=5, help="cooldown por actuador del autocontrol")
+    ap.add_argument("--micro-n", type=int, default=2000, help="iteraciones de cada microbenchmark (0 = no correr)")
+    ap.add_argument("--seed", type=int, default=17)
+    ap.add_argument("--salida", help="guardar el resultado en este archivo JSON")
+    ap.add_argument("--comparar", help="resultado anterior (JSON) contra el que comparar")
+    ap.add_argument("--tolerancia", type=float, default=0.25)
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    logging.disable(logging.WARNING)
+    with directorio_temporal() as d:
+        res = {
+            "version": VERSION,
+            "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "parametros": {k: getattr(args, k) for k in ("devices", "hz", "segundos", "ventana_ms", "cooldown_s", "micro_n", "seed")},
+            **correr_flota(args, Path(d)),
+        }
+        if args.micro_n:
+            res["micro"] = micro(args, Path(d))
+
+    codigo = 0
+    if args.comparar:
+        base = json.loads(Path(args.comparar).read_text())
+        res["regresiones"] = comparar(res, base, args.tolerancia)
+        codigo = 1 if res["regresiones"] else 0
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(res, indent=2))
+    print(json.dumps(res, indent=2))
+    sys.exit(codigo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Ingesta compartida: K miembros de `$share/<grupo>/invernaderos/+/telemetria`.
+
+    python -m bench.ingesta_compartida --procesos 1,2,4 --devices 200 --olas 50
+    python -m bench.ingesta_compartida --broker localhost:1883   # contra Mosquitto
+
+Por cada K levanta K `TrabajadorIngesta` (cada uno con su IngestaWriter y su
+engine sobre la misma SQLite temporal) suscriptos al grupo, publica la
+telemetría de una flota en olas (un mensaje por device por ola) con un
+número de secuencia por device en `nivel_pct`, dos veces:
+
+- "rafaga": todas las olas sin pausa; mide mensajes/s hasta que todas las
+  lecturas están en la DB. Los miembros se atrasan distinto y dos mensajes
+  de un device pueden cruzarse en el reenvío (el límite documentado en
+  TrabajadorIngesta): los cruces se informan, no se exigen.
+- "pausado": una ola cada `--intervalo-ms`, por debajo de la capacidad,
+  como una flota real. Ahí el orden por device tiene que ser exacto.
+
+Sale con código 1 si se perdió alguna lectura o si hubo cruces en "pausado".
+
+Sin --broker usa el broker en proceso (bench.broker): los K miembros son
+hilos de un mismo proceso, así que mide reparto, reenvío y orden, no la
+escala en núcleos; con run_ingesta.py cada miembro es un proceso.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from itertools import groupby
+from pathlib import Path
+
+from sqlalchemy import select
+
+from app.db.models import Device, Lectura
+from app.servicios.ingesta import IngestaWriter
+from app.servicios.ingesta_compartida import TrabajadorIngesta, _cliente_paho, particion
+from app.servicios.registro import registro
+from bench.broker import BrokerSimulado, ClienteSimulado
+from bench.ingesta import crear_sesiones, directorio_temporal
+
+
+def flota(n_devices: int, olas: int, seed: int = 7):
+    """Una ola = un mensaje por device, en orden aleatorio. `nivel_pct` es la secuencia del device."""
+    rnd = random.Random(seed)
+    esps = [f"esp-{i:04d}" for i in range(n_devices)]
+    out = []
+    for seq in range(1, olas + 1):
+        ola = []
+        for e in rnd.sample(esps, k=n_devices):
+            payload = {"temp_c": round(rnd.uniform(15, 40), 1), "hum_amb": round(rnd.uniform(20, 95), 1),
+                       "suelo_pct": round(rnd.uniform(10, 90), 1), "nivel_pct": seq}
+            ola.append((f"invernaderos/{e}/telemetria", json.dumps(payload)))
+        out.append(ola)
+    return out
+
+
+def correr(procesos: int, olas, intervalo_ms: float, args, tmp: Path) -> dict:
+    registro.limpiar()
+    total = sum(len(o) for o in olas)
+    ruta = tmp / f"k{procesos}_{intervalo_ms:g}.db"
+    directorio = tmp / f"k{procesos}_{intervalo_ms:g}"
+    directorio.mkdir()
+    motores, trabajadores = [], []
+    if args.broker:
+        host, port = args.broker.split(":")
+        fabrica, destino = _cliente_paho, (host, int(port))
+    else:
+        broker = BrokerSimulado()
+        fabrica, destino = (lambda cid: ClienteSimulado(broker, cid)), ("localhost", 1883)
+    for i in range(procesos):
+        eng, Session = crear_sesiones(ruta)
+        motores.append(eng)
+        w = IngestaWriter(session_factory=Session, cola_max=total + 1,
+                          lote_max=args.lote_max, ventana_s=args.ventana_ms / 1000, ordenar=True)
+        t = TrabajadorIngesta(i, procesos, grupo=args.grupo, directorio=str(directorio),
+                              writer=w, cliente_factory=fabrica)
+        t.iniciar(*destino)
+        trabajadores.append(t)
+
+    pub = fabrica("bench-flota")
+    if args.broker:
+        pub.connect(*destino)
+        pub.loop_start()
+        time.sleep(1)  # suscripciones confirmadas antes de publicar
+    t0 = time.perf_counter()
+    for ola in olas:
+        for topic, payload in ola:
+            pub.publish(topic, payload, qos=1)
+        if intervalo_ms:
+            time.sleep(intervalo_ms / 1000)
+    limite = time.monotonic() + 600
+    while sum(t.writer.metricas()["lecturas"] for t in trabajadores) < total and time.monotonic() < limite:
+        time.sleep(0.01)
+    dur = time.perf_counter() - t0
+
+    metricas = [t.metricas() for t in trabajadores]
+    for t in trabajadores:
+        t.detener()
+    if args.broker:
+        pub.loop_stop()
+        pub.disconnect()
+
+    _, Session = crear_sesiones(ruta)
+    with Session() as db:
+        filas = db.execute(
+            select(Device.esp_id, Lectura.nivel_de_agua)
+            .join(Device, Device.id == Lectura.device_id)
+            .order_by(Device.esp_id, Lectura.id)
+        ).all()
+    desordenados = 0
+    for _, grupo in groupby(filas, key=lambda f: f[0]):
+        secuencia = [f[1] for f in grupo]
+        desordenados += sum(a > b for a, b in zip(secuencia, secuencia[1:]))
+    for eng in motores:
+        eng.dispose()
+
+    return {
+        "procesos": procesos,
+        "modo": "pausado" if intervalo_ms else "rafaga",
+        "mensajes": total,
+        "lecturas": len(filas),
+        "desordenados": desordenados,
+        "segundos": round(dur, 3),
+        "msg_s": round(total / dur, 1),
+        "por_miembro": [
+            {k: m[k] for k in ("recibidos", "propios", "reenviados", "recibidos_de_pares", "sin_dueno")}
+            | {"lotes": m["escritor"]["lotes"]}
+            for m in metricas
+        ],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--procesos", default="1,2,4")
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--olas", type=int, default=50)
+    ap.add_argument("--intervalo-ms", type=float, default=250,
+                    help="período de cada device en el modo pausado")
+    ap.add_argument("--grupo", default="bench")
+    ap.add_argument("--broker", help="host:puerto de un broker MQTT v5 real (por defecto, el simulado)")
+    ap.add_argument("--lote-max", type=int, default=200)
+    ap.add_argument("--ventana-ms", type=int, default=50)
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    olas = flota(args.devices, args.olas)
+    with directorio_temporal() as d:
+        res = []
+        for k in (int(p) for p in args.procesos.split(",")):
+            for intervalo in (0, args.intervalo_ms):
+                r = correr(k, olas, intervalo, args, Path(d))
+                res.append(r)
+                print(json.dumps({x: r[x] for x in ("procesos", "modo", "msg_s", "desordenados")}), file=sys.stderr)
+    reparto = [sum(particion(f"esp-{i:04d}", r["procesos"]) == j for i in range(args.devices))
+               for r in res[-1:] for j in range(r["procesos"])]
+    print(json.dumps({"resultados": res, "devices_por_miembro": reparto}, indent=2))
+    ok = all(r["lecturas"] == r["mensajes"] and (r["modo"] == "rafaga" or r["desordenados"] == 0) for r in res)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
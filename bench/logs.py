@@ -0,0 +1,119 @@
+"""
+Costo del logging del autocontrol por mensaje: escritura directa vs. cola + muestreo.
+
+    python -m bench.logs --devices 50 --mensajes 5000
+
+Corre `procesar_umbrales` sobre las mismas lecturas (SQLite temporal, registro
+caliente, comandos anotados en vez de publicados) con cuatro configuraciones
+de logging, todas escribiendo a un archivo temporal:
+
+- "antes": como el basicConfig previo: todas las líneas (nivel DEBUG, que hoy
+  son las de estado que antes salían en INFO), formateadas y escritas en el
+  hilo que loguea.
+- "sin_log": logging apagado (el piso).
+- "cola_texto" / "cola_json": `configurar_logging` (INFO, QueueHandler + hilo
+  escritor, una línea "sin acción" por device y regla cada 60 s).
+
+Informa µs por mensaje en el hilo que llama (thread_time: lo que ve el hilo
+de paho / escritor) y del proceso completo (process_time: incluye al hilo
+escritor del log), y cuántas líneas y bytes se escribieron.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from pathlib import Path
+
+from app.core import logs
+from app.core.logs import FORMATO_TEXTO, configurar_logging, detener_logging
+from app.db.models import Lectura
+from app.servicios import umbrales
+from app.servicios.cooldown import CooldownStore
+from app.servicios.devices import get_or_create_device
+from app.servicios.registro import registro
+from bench.ingesta import crear_sesiones, directorio_temporal
+
+
+def _lecturas(ids: dict, n: int, seed: int) -> list[tuple[str, Lectura]]:
+    rnd = random.Random(seed)
+    esps = list(ids)
+    # la mayoría dentro de la histéresis (el caso común: nada que cambiar), algunas fuera
+    return [(e, Lectura(device_id=ids[e], temperatura=rnd.gauss(35, 3), humedad=rnd.gauss(30, 6),
+                        humedad_suelo=rnd.gauss(55, 8), nivel_de_agua=50.0))
+            for e in (esps[i % len(esps)] for i in range(n))]
+
+
+def correr(variante: str, Session, lecturas, archivo: Path) -> dict:
+    registro.limpiar()
+    umbrales.cooldowns = CooldownStore(session_factory=Session)
+    raiz = logging.getLogger()
+    if variante == "antes":
+        for h in list(raiz.handlers):
+            raiz.removeHandler(h)
+        h = logging.FileHandler(archivo, encoding="utf-8")
+        h.setFormatter(logging.Formatter(FORMATO_TEXTO))
+        raiz.addHandler(h)
+        raiz.setLevel(logging.DEBUG)
+    elif variante == "sin_log":
+        raiz.setLevel(logging.CRITICAL)
+    else:
+        configurar_logging(nivel="INFO", formato=variante.removeprefix("cola_"), archivo=str(archivo), sin_accion_s=60)
+
+    with Session() as db:
+        for e, _ in lecturas[:50]:
+            registro.obtener(db, e)
+        h0, p0 = time.thread_time(), time.process_time()
+        for e, lec in lecturas:
+            umbrales.procesar_umbrales(db, e, lec)
+        hilo = time.thread_time() - h0
+        db.rollback()
+
+    if variante.startswith("cola_"):
+        detener_logging()   # drena la cola: el trabajo del hilo escritor queda en process_time
+        m = logs.metricas()
+    else:
+        m = {}
+    proceso = time.process_time() - p0
+    for h in list(raiz.handlers):
+        raiz.removeHandler(h)
+        h.close()
+    texto = archivo.read_text(encoding="utf-8") if archivo.exists() else ""
+    n = len(lecturas)
+    return {
+        "variante": variante,
+        "us_mensaje_hilo": round(hilo / n * 1e6, 1),
+        "us_mensaje_proceso": round(proceso / n * 1e6, 1),
+        "lineas": texto.count("\n"),
+        "bytes_mensaje": round(len(texto.encode()) / n, 1),
+        **({"suprimidas": m["suprimidas"], "descartadas": m["descartadas"]} if m else {}),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--devices", type=int, default=50)
+    ap.add_argument("--mensajes", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=5)
+    args = ap.parse_args()
+
+    original = umbrales.enviar_cmd_mqtt
+    umbrales.enviar_cmd_mqtt = lambda cmd, esp_id=None: True
+    res = []
+    try:
+        with directorio_temporal() as d:
+            eng, Session = crear_sesiones(Path(d) / "bench.db")
+            with Session() as db:
+                ids = {f"esp-{i:03d}": get_or_create_device(db, f"esp-{i:03d}").id for i in range(args.devices)}
+                db.commit()
+            lecturas = _lecturas(ids, args.mensajes, args.seed)
+            for variante in ("antes", "sin_log", "cola_texto", "cola_json"):
+                res.append(correr(variante, Session, lecturas, Path(d) / f"{variante}.log"))
+            eng.dispose()
+    finally:
+        umbrales.enviar_cmd_mqtt = original
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Perfil SQLite en almacenamiento lento (tarjeta SD): latencia de escritura y de consulta.
+
+    python -m bench.sqlite_sd --fsync-ms 0,50 --segundos 20 --lectores 4
+
+Simula la SD frenando cada fsync/fdatasync de SQLite: compila un shim de C
+(hace falta `cc`) que se carga con LD_PRELOAD en un proceso hijo y duerme
+`--fsync-ms` antes de la llamada real. Las lecturas no se frenan (salen de la
+caché de páginas, como en la Pi una vez caliente).
+
+Por cada demora corre dos perfiles sobre una SQLite temporal con
+`--lecturas` filas previas:
+
+- "antes": el engine previo (sólo WAL + synchronous=NORMAL, un único pool
+  compartido, pool_pre_ping, checkpoint automático cada 1000 páginas).
+- "perfil": AlmacenSQLite (cache/mmap/temp_store, un escritor, pool de
+  lectura query_only) + CheckpointWAL cada `--checkpoint-s`.
+
+El hilo escritor persiste un lote de ingesta (IngestaWriter.procesar_lote)
+cada `--ventana-ms`; `--lectores` hilos consultan lecturas recientes y series
+como la API. Informa p50/p95/p99/máx de ambos y cuántos fsync hubo.
+"""
+import argparse
+import ctypes
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+SHIM = r"""
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stdlib.h>
+#include <time.h>
+
+static long demora_us = -1;
+static volatile long contador = 0;
+
+static void frenar(void) {
+    if (demora_us < 0) {
+        const char *e = getenv("FSYNC_DELAY_US");
+        demora_us = e ? atol(e) : 0;
+    }
+    __sync_fetch_and_add(&contador, 1);
+    if (demora_us > 0) {
+        struct timespec t = {demora_us / 1000000, (demora_us % 1000000) * 1000};
+        nanosleep(&t, NULL);
+    }
+}
+
+long grow_fsyncs(void) { return contador; }
+
+int fsync(int fd) {
+    static int (*real)(int);
+    if (!real) real = dlsym(RTLD_NEXT, "fsync");
+    frenar();
+    return real(fd);
+}
+
+int fdatasync(int fd) {
+    static int (*real)(int);
+    if (!real) real = dlsym(RTLD_NEXT, "fdatasync");
+    frenar();
+    return real(fd);
+}
+"""
+
+
+def compilar_shim(directorio: Path) -> Path:
+    fuente, lib = directorio / "fsync_lento.c", directorio / "fsync_lento.so"
+    fuente.write_text(SHIM)
+    subprocess.run(["cc", "-O2", "-shared", "-fPIC", "-o", str(lib), str(fuente), "-ldl"], check=True)
+    return lib
+
+
+def _pcts(xs: list[float]) -> dict:
+    if not xs:
+        return {"n": 0}
+    xs = sorted(xs)
+    p = lambda q: round(xs[min(len(xs) - 1, int(len(xs) * q))] * 1000, 2)
+    return {"n": len(xs), "p50_ms": round(statistics.median(xs) * 1000, 2),
+            "p95_ms": p(0.95), "p99_ms": p(0.99), "max_ms": round(xs[-1] * 1000, 2)}
+
+
+# ---------- proceso hijo (con el shim cargado) ----------
+
+def _engines(perfil: str, ruta: Path):
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+
+    url = f"sqlite:///{ruta}"
+    if perfil == "antes":
+        def pragmas(con, _):
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+        eng = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30}, pool_pre_ping=True)
+        event.listen(eng, "connect", pragmas)
+        lectura = eng
+    else:
+        from app.db.almacenamiento import AlmacenSQLite
+        almacen = AlmacenSQLite()
+        eng = almacen.crear_engine(url)
+        lectura = almacen.crear_engine_lectura(url, eng)
+    hacer = lambda e: sessionmaker(autocommit=False, autoflush=False, bind=e, expire_on_commit=False)
+    return eng, lectura, hacer(eng), hacer(lectura)
+
+
+def _sembrar(Session, devices: int, filas: int) -> list[int]:
+    from sqlalchemy import insert, select, text
+    from app.db.models import Device, Lectura
+    from app.servicios.rollups import recompactar
+
+    rnd = random.Random(3)
+    ahora = datetime.now(timezone.utc)
+    with Session() as db:
+        db.execute(insert(Device), [{"esp_id": f"esp-{i:03d}"} for i in range(devices)])
+        ids = list(db.execute(select(Device.id)).scalars())
+        for i in range(0, filas, 10000):
+            db.execute(insert(Lectura), [
+                {"device_id": ids[j % devices], "fecha_hora": ahora - timedelta(seconds=10 * (filas - j) / devices),
+                 "temperatura": rnd.uniform(15, 35), "humedad": rnd.uniform(30, 90),
+                 "humedad_suelo": rnd.uniform(20, 80), "nivel_de_agua": rnd.uniform(0, 100)}
+                for j in range(i, min(filas, i + 10000))
+            ])
+        db.commit()
+        recompactar(db, ahora - timedelta(days=2), ahora + timedelta(seconds=1))
+        db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))  # los dos perfiles arrancan con el WAL vacío
+    return ids
+
+
+def hijo(args):
+    from app.db.base import Base
+    from app.servicios.checkpoint import CheckpointWAL
+    from app.servicios.funciones import lecturas_desde
+    from app.servicios.ingesta import IngestaWriter, MensajeMQTT
+    from app.servicios.rollups import serie_lecturas
+
+    logging.disable(logging.WARNING)
+    shim = ctypes.CDLL(os.environ["LD_PRELOAD"])
+    shim.grow_fsyncs.restype = ctypes.c_long
+
+    ruta = Path(args.dir) / f"{args.hijo}.db"
+    eng, eng_lectura, Escritura, Lectura_ = _engines(args.hijo, ruta)
+    Base.metadata.create_all(bind=eng)
+    ids = _sembrar(Escritura, args.devices, args.lecturas)
+    esps = [f"esp-{i:03d}" for i in range(args.devices)]
+
+    checkpoint = None
+    if args.hijo == "perfil":
+        checkpoint = CheckpointWAL(str(ruta), intervalo_s=args.checkpoint_s)
+        checkpoint.iniciar()
+
+    writer = IngestaWriter(session_factory=Escritura)
+    fin = time.monotonic() + args.segundos
+    escrituras: list[float] = []
+    consultas: list[float] = []
+    f0 = shim.grow_fsyncs()
+
+    def escribir():
+        rnd = random.Random(5)
+        while time.monotonic() < fin:
+            lote = [
+                MensajeMQTT(f"invernaderos/{e}/telemetria", e, json.dumps({
+                    "temp_c": rnd.uniform(15, 35), "hum_amb": rnd.uniform(30, 90),
+                    "suelo_pct": rnd.uniform(20, 80), "nivel_pct": rnd.uniform(0, 100)}),
+                    datetime.now(timezone.utc), time.monotonic())
+                for e in rnd.sample(esps, k=min(args.lote, len(esps)))
+            ]
+            t0 = time.perf_counter()
+            writer.procesar_lote(lote)
+            escrituras.append(time.perf_counter() - t0)
+            time.sleep(args.ventana_ms / 1000)
+
+    def consultar(i: int):
+        rnd = random.Random(100 + i)
+        while time.monotonic() < fin:
+            dev = rnd.choice(ids)
+            t0 = time.perf_counter()
+            with Lectura_() as db:
+                if rnd.random() < 0.5:
+                    lecturas_desde(db, dev, limit=100)
+                else:
+                    hasta = datetime.now(timezone.utc)
+                    serie_lecturas(db, dev, hasta - timedelta(hours=24), hasta, "auto", 360)
+            consultas.append(time.perf_counter() - t0)
+            time.sleep(args.pausa_ms / 1000)
+
+    hilos = [threading.Thread(target=escribir)] + [threading.Thread(target=consultar, args=(i,)) for i in range(args.lectores)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    if checkpoint:
+        checkpoint.detener()
+
+    print(json.dumps({
+        "perfil": args.hijo,
+        "fsync_ms": args.fsync_ms_hijo,
+        "escritura_lote": _pcts(escrituras),
+        "consulta": _pcts(consultas),
+        "fsyncs": shim.grow_fsyncs() - f0,
+        "checkpoints": checkpoint.metricas()["checkpoints"] if checkpoint else None,
+        "wal_mb_final": round(os.path.getsize(str(ruta) + "-wal") / 1024 / 1024, 2),
+    }))
+    eng.dispose()
+    eng_lectura.dispose()
+
+
+# ---------- proceso padre ----------
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--fsync-ms", default="0,50", help="demoras por fsync a probar (ms)")
+    ap.add_argument("--segundos", type=float, default=20)
+    ap.add_argument("--lectores", type=int, default=4)
+    ap.add_argument("--devices", type=int, default=50)
+    ap.add_argument("--lecturas", type=int, default=100000, help="filas previas en la DB")
+    ap.add_argument("--lote", type=int, default=50, help="mensajes por lote de ingesta")
+    ap.add_argument("--ventana-ms", type=int, default=100)
+    ap.add_argument("--pausa-ms", type=int, default=50, help="pausa de cada lector entre consultas")
+    ap.add_argument("--checkpoint-s", type=float, default=2)
+    ap.add_argument("--hijo", help=argparse.SUPPRESS)
+    ap.add_argument("--dir", help=argparse.SUPPRESS)
+    ap.add_argument("--fsync-ms-hijo", type=float, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.hijo:
+        return hijo(args)
+
+    res = []
+    with tempfile.TemporaryDirectory() as d:
+        shim = compilar_shim(Path(d))
+        for ms in (float(x) for x in args.fsync_ms.split(",")):
+            for perfil in ("antes", "perfil"):
+                sub = Path(d) / f"{perfil}-{ms:g}"
+                sub.mkdir()
+                env = dict(os.environ, LD_PRELOAD=str(shim), FSYNC_DELAY_US=str(int(ms * 1000)))
+                cmd = [sys.executable, "-m", "bench.sqlite_sd", "--hijo", perfil, "--dir", str(sub),
+                       "--fsync-ms-hijo", str(ms)]
+                for k in ("segundos", "lectores", "devices", "lecturas", "lote", "ventana_ms", "pausa_ms", "checkpoint_s"):
+                    cmd += [f"--{k.replace('_', '-')}", str(getattr(args, k))]
+                out = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                res.append(r)
+                print(json.dumps({k: r[k] for k in ("perfil", "fsync_ms")}
+                                 | {"escritura_p99": r["escritura_lote"].get("p99_ms"),
+                                    "consulta_p99": r["consulta"].get("p99_ms")}), file=sys.stderr)
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Prueba de carga del stream en vivo (hub SSE) con cientos de clientes.
+
+    python -m bench.stream --clientes 500 --devices 20 --hz 1 --segundos 10
+
+Los ESP32 simulados publican telemetría en el broker en proceso
+(bench/broker.py); el listener real (`app.mqtt_client.on_message`) la encola,
+el escritor por lotes la persiste y publica en el hub, y cada cliente
+simulado mide la latencia recepción MQTT -> evento entregado.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from app import mqtt_client
+from app.servicios.ingesta import IngestaWriter, setup_ingesta
+from app.servicios.stream import hub
+from bench.broker import BrokerSimulado, ClienteSimulado
+from bench.ingesta import crear_sesiones, directorio_temporal
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def publicar_flota(broker, n_devices: int, hz: float, segundos: float, parar: threading.Event):
+    """Un hilo que hace de flota: cada device publica `hz` veces por segundo."""
+    rnd = random.Random(1)
+    esps = [ClienteSimulado(broker, f"esp-{i:03d}") for i in range(n_devices)]
+    for c in esps:
+        c.connect()
+    periodo = 1.0 / hz
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin and not parar.is_set():
+        t0 = time.monotonic()
+        for c in esps:
+            c.publish(f"invernaderos/{c.client_id}/telemetria", json.dumps({
+                "temp_c": round(rnd.uniform(18, 30), 1), "hum_amb": round(rnd.uniform(40, 80), 1),
+                "suelo_pct": round(rnd.uniform(30, 70), 1), "nivel_pct": round(rnd.uniform(20, 90), 1),
+                "riego": "OFF", "vent": "OFF", "luz": "ON",
+            }), qos=1)
+        time.sleep(max(0.0, periodo - (time.monotonic() - t0)))
+
+
+async def cliente(esp_id, latencias: list, recibidos: list, parar: asyncio.Event):
+    sus = hub.suscribir(esp_id)
+    try:
+        while not parar.is_set():
+            for tipo, data in await sus.siguiente(timeout=0.5):
+                if tipo == "lectura":
+                    ts = datetime.fromisoformat(json.loads(data)["fecha_hora"])
+                    latencias.append((datetime.now(timezone.utc) - ts).total_seconds() * 1000)
+                    recibidos[0] += 1
+    finally:
+        hub.desuscribir(sus)
+
+
+async def correr(args, tmp: Path) -> dict:
+    eng, Session = crear_sesiones(tmp / "stream.db")
+    writer = IngestaWriter(session_factory=Session, ventana_s=args.ventana_ms / 1000)
+    setup_ingesta(writer)
+    writer.iniciar()
+
+    broker = BrokerSimulado()
+    listener = ClienteSimulado(broker, "listener")
+    listener.on_message = mqtt_client.on_message
+    listener.on_connect = mqtt_client._on_connect
+    listener.connect()
+    listener.loop_start()
+
+    latencias: list[float] = []
+    recibidos = [0]
+    parar = asyncio.Event()
+    esps = [f"esp-{i:03d}" for i in range(args.devices)]
+    # la mitad de los clientes mira un device concreto, la otra mitad toda la flota
+    tareas = [asyncio.create_task(cliente(esps[i % len(esps)] if i % 2 else None, latencias, recibidos, parar))
+              for i in range(args.clientes)]
+    await asyncio.sleep(0.2)
+
+    parar_flota = threading.Event()
+    t0 = time.perf_counter()
+    await asyncio.to_thread(publicar_flota, broker, args.devices, args.hz, args.segundos, parar_flota)
+    await asyncio.sleep(args.ventana_ms / 1000 + 0.5)
+    dur = time.perf_counter() - t0
+    parar.set()
+    await asyncio.gather(*tareas)
+
+    listener.loop_stop()
+    writer.detener()
+    eng.dispose()
+    m = hub.metricas()
+    return {
+        "clientes": args.clientes,
+        "devices": args.devices,
+        "mensajes_mqtt": broker.publicados,
+        "eventos_publicados": m["publicados"],
+        "eventos_entregados": recibidos[0],
+        "entregas_s": round(recibidos[0] / dur, 1),
+        "latencia_p50_ms": round(_percentil(latencias, 50), 2),
+        "latencia_p99_ms": round(_percentil(latencias, 99), 2),
+        "latencia_media_ms": round(statistics.fmean(latencias), 2) if latencias else 0.0,
+        "descartados": m["descartados"],
+        # con polling cada pestaña hacía /lecturas/ultima + /lecturas cada 2 s
+        "consultas_sqlite_evitadas_s": args.clientes,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clientes", type=int, default=500)
+    ap.add_argument("--devices", type=int, default=20)
+    ap.add_argument("--hz", type=float, default=1.0, help="telemetrías por segundo por device")
+    ap.add_argument("--segundos", type=float, default=10.0)
+    ap.add_argument("--ventana-ms", type=int, default=100)
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    with directorio_temporal() as d:
+        res = asyncio.run(correr(args, Path(d)))
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+API con varios workers de uvicorn: rendimiento según la cantidad de workers.
+
+    python -m bench.workers --workers 1,2,4 --segundos 10 --concurrencia 64
+
+Por cada valor levanta `uvicorn app.main:app --workers N` en un directorio
+temporal (DB, lock y socket propios) con 500 lecturas y mide pedidos/s y
+latencia con una mezcla de GET /lecturas?limit=100 y GET /mecanismos. También
+verifica que exactamente un proceso quedó como líder (el único con MQTT).
+
+La escala depende de los núcleos libres: en una máquina de un núcleo no hay
+nada que repartir (el generador de carga compite con los workers).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+from sqlalchemy import insert
+
+from app.db.models import Lectura
+from app.servicios.devices import get_or_create_device
+from bench.ingesta import crear_sesiones
+
+RAIZ = Path(__file__).resolve().parent.parent
+ESP = "bench-esp"
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def levantar(workers: int, directorio: Path, puerto: int) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=str(RAIZ), APP_MODE="NORMAL")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(puerto),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=directorio, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                # todos los workers tienen que haber arrancado
+                pids = {httpx.get(f"{url}/api/v1/system/coordinacion", timeout=1).json()["pid"] for _ in range(workers * 8)}
+                if len(pids) >= workers:
+                    return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError(f"uvicorn con {workers} workers no arrancó")
+
+
+def sembrar(directorio: Path, n: int = 500):
+    """Crea la DB del servidor con un device y `n` lecturas recientes (antes de levantarlo)."""
+    eng, Session = crear_sesiones(directorio / "app.db")
+    rnd = random.Random(1)
+    ahora = datetime.now(timezone.utc)
+    with Session() as db:
+        dev = get_or_create_device(db, ESP)
+        db.execute(insert(Lectura), [
+            {"device_id": dev.id, "fecha_hora": ahora - timedelta(minutes=i), "temperatura": rnd.uniform(15, 35),
+             "humedad": rnd.uniform(30, 90), "humedad_suelo": rnd.uniform(20, 80), "nivel_de_agua": rnd.uniform(0, 100)}
+            for i in range(n)
+        ])
+        db.commit()
+    eng.dispose()
+
+
+def roles(url: str, workers: int) -> dict:
+    vistos = {}
+    for _ in range(workers * 20):
+        # una conexión nueva por pedido, para que el kernel la reparta entre workers
+        m = httpx.get(f"{url}/api/v1/system/coordinacion").json()
+        vistos[m["pid"]] = m["rol"]
+    return {"procesos": len(vistos), "lideres": sum(r == "lider" for r in vistos.values())}
+
+
+async def cargar(url: str, segundos: float, concurrencia: int) -> dict:
+    rutas = [f"/api/v1/lecturas?esp_id={ESP}&limit=100", f"/api/v1/mecanismos?esp_id={ESP}"]
+    latencias: list[float] = []
+    errores = 0
+    fin = time.monotonic() + segundos
+
+    async def cliente(i: int, c: httpx.AsyncClient):
+        nonlocal errores
+        n = i
+        while time.monotonic() < fin:
+            t0 = time.perf_counter()
+            r = await c.get(rutas[n % len(rutas)])
+            latencias.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errores += 1
+            n += 1
+
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as c:
+        t0 = time.monotonic()
+        await asyncio.gather(*(cliente(i, c) for i in range(concurrencia)))
+        dur = time.monotonic() - t0
+    latencias.sort()
+    return {
+        "pedidos_s": round(len(latencias) / dur, 1),
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p95_ms": round(latencias[int(len(latencias) * 0.95)] * 1000, 1),
+        "errores": errores,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--segundos", type=float, default=10)
+    ap.add_argument("--concurrencia", type=int, default=64)
+    args = ap.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    res = []
+    for n in (int(w) for w in args.workers.split(",")):
+        with tempfile.TemporaryDirectory() as d:
+            puerto = _puerto_libre()
+            url = f"http://127.0.0.1:{puerto}"
+            sembrar(Path(d))
+            proc = levantar(n, Path(d), puerto)
+            try:
+                asyncio.run(cargar(url, 2, args.concurrencia))  # calentamiento
+                r = {"workers": n, **roles(url, n), **asyncio.run(cargar(url, args.segundos, args.concurrencia))}
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+        res.append(r)
+        print(json.dumps(r), file=sys.stderr)
+    base = res[0]["pedidos_s"]
+    for r in res:
+        r["escala"] = round(r["pedidos_s"] / base, 2)
+    print(json.dumps({"nucleos": os.cpu_count(), "resultados": res}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
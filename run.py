@@ -4,6 +4,11 @@ import os
 import socket
 import uvicorn
 
+try:
+    import fcntl  # lock de líder entre workers (app/servicios/coordinacion.py)
+except ImportError:
+    fcntl = None
+
 def init_db():
     """Crea todas las tablas si no existen."""
     print("Base de datos verificada/creada (idempotente).")
@@ -32,15 +37,21 @@ def main():
     ip_for_msg = get_ip()
     app_mode = os.getenv("APP_MODE", "NORMAL")
     reload_flag = os.getenv("RELOAD", "0") == "1"
+    # Con más de un worker, uno solo (el líder) consume MQTT: ver app/servicios/coordinacion.py
+    workers = int(os.getenv("WORKERS", "1"))
+    if workers > 1 and fcntl is None:
+        # sin flock no hay elección de líder: cada worker consumiría MQTT y publicaría comandos
+        print(f"[WORKERS={workers}] Sin flock en esta plataforma no se pueden coordinar varios workers: se usa 1.")
+        workers = 1
 
-    print(f"[APP_MODE={app_mode}] Iniciando FastAPI en http://{ip_for_msg}:{port} (host={host})")
+    print(f"[APP_MODE={app_mode}] Iniciando FastAPI en http://{ip_for_msg}:{port} (host={host}, workers={workers})")
 
     uvicorn.run(
         "app.main:app",
         host=host,
         port=port,
         reload=reload_flag,
-        workers=1,           
+        workers=workers,
         proxy_headers=False, 
     )
 
@@ -0,0 +1,36 @@
+import multiprocessing as mp
+import os
+import signal
+
+from app.core.config import config
+from app.core.logs import configurar_logging
+from app.servicios.ingesta_compartida import correr_proceso
+
+configurar_logging()  # también en cada hijo: con "spawn" reimportan este módulo
+
+
+def main():
+    """
+    Ingesta compartida: INGESTA_PROCESOS procesos en el grupo $share/INGESTA_GRUPO.
+    La API se levanta aparte (run.py) con INGESTA_COMPARTIDA=true.
+    """
+    procesos = int(os.getenv("INGESTA_PROCESOS", config.ingesta_procesos))
+    print(f"[INGESTA] {procesos} procesos en $share/{config.ingesta_grupo}/invernaderos/+/...")
+
+    ctx = mp.get_context("spawn")
+    hijos = [ctx.Process(target=correr_proceso, args=(i, procesos), name=f"ingesta-{i}") for i in range(procesos)]
+    for p in hijos:
+        p.start()
+
+    def terminar(*_):
+        for p in hijos:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, terminar)
+    signal.signal(signal.SIGINT, terminar)
+    for p in hijos:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
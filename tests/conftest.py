@@ -0,0 +1,124 @@
+"""
+Fixtures comunes: cada prueba corre sobre una SQLite temporal con los mismos
+PRAGMAs que la app, y los servicios del proceso (diario, presencia, bandeja,
+cooldowns, registro) apuntan a ella mientras dura.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# Antes de importar app.*: la config del proceso no tiene que tocar ./app.db ni los sockets del repo.
+_DIR = tempfile.mkdtemp(prefix="grow-pruebas-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DIR}/app.db"
+os.environ["COORDINACION_DIR"] = _DIR
+
+from datetime import datetime, timedelta, timezone  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+
+import paho.mqtt.client as paho  # noqa: E402
+import pytest  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.api.deps import get_db, get_db_lectura  # noqa: E402
+from app.db.base import Base  # noqa: E402
+from app.db.session import set_sqlite_pragma  # noqa: E402
+from app.servicios import mqtt_funciones  # noqa: E402
+from app.servicios.cooldown import cooldowns  # noqa: E402
+from app.servicios.eventos import diario  # noqa: E402
+from app.servicios.mqtt_funciones import bandeja  # noqa: E402
+from app.servicios.presencia import presencia  # noqa: E402
+from app.servicios.registro import registro  # noqa: E402
+
+T0 = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DIR, ignore_errors=True)
+
+
+def en(segundos: float) -> datetime:
+    """Hora fija de las pruebas + `segundos`."""
+    return T0 + timedelta(seconds=segundos)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path / 'grow.db'}", connect_args={"check_same_thread": False, "timeout": 30})
+    event.listen(eng, "connect", set_sqlite_pragma)
+    Base.metadata.create_all(bind=eng)
+    yield eng
+    eng.dispose()
+
+
+@pytest.fixture
+def Session(engine, monkeypatch):
+    """sessionmaker como SessionLocal, con los singletons del proceso apuntando a la DB de la prueba."""
+    S = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(diario, "session_factory", S)
+    monkeypatch.setattr(presencia, "session_factory", S)
+    if bandeja is not None:
+        monkeypatch.setattr(bandeja, "session_factory", S)
+    registro.limpiar()
+    cooldowns.limpiar()
+    presencia.olvidar()
+    yield S
+    diario.vaciar()
+    presencia.detener()
+    presencia.olvidar()
+    cooldowns.limpiar()
+    registro.limpiar()
+
+
+@pytest.fixture
+def api(Session):
+    """`api(router, ...)`: TestClient con esos routers y get_db/get_db_lectura sobre la DB de la prueba."""
+    def sesion():
+        with Session() as db:
+            yield db
+
+    def crear(*routers) -> TestClient:
+        app = FastAPI()
+        for r in routers:
+            app.include_router(r, prefix="/api/v1")
+        app.dependency_overrides[get_db] = app.dependency_overrides[get_db_lectura] = sesion
+        return TestClient(app)
+
+    return crear
+
+
+class ClienteMQTT:
+    """Cliente paho de mentira: guarda lo publicado; `conectado` y `rc` los cambia la prueba."""
+
+    def __init__(self):
+        self.conectado = True
+        self.rc = paho.MQTT_ERR_SUCCESS
+        self._lock = threading.Lock()
+        self.publicados: list[tuple[str, dict]] = []     # (esp_id, comando)
+
+    def is_connected(self) -> bool:
+        return self.conectado
+
+    def publish(self, topic: str, payload: str, qos: int = 0):
+        if self.rc == paho.MQTT_ERR_SUCCESS:
+            with self._lock:
+                self.publicados.append((topic.split("/")[1], json.loads(payload)))
+        return SimpleNamespace(rc=self.rc)
+
+    def cmds(self, esp_id: str | None = None) -> list[dict]:
+        with self._lock:
+            return [c for e, c in self.publicados if esp_id is None or e == esp_id]
+
+
+@pytest.fixture
+def cliente_mqtt(Session, monkeypatch) -> ClienteMQTT:
+    """Cliente MQTT del proceso (sin reenvío a otro proceso) que publica en memoria."""
+    c = ClienteMQTT()
+    monkeypatch.setattr(mqtt_funciones, "_mqtt_client", c)
+    monkeypatch.setattr(mqtt_funciones, "_reenvio", None)
+    yield c
+    mqtt_funciones.cola_comandos.vaciar()
@@ -0,0 +1,89 @@
+import random
+import statistics
+
+import pytest
+
+from app.db.models import Lectura
+from app.servicios.analitica import AnaliticaTelemetria, Ventana
+
+from tests.conftest import en
+
+
+def _lectura(segundo: float, temperatura: float = 20.0, humedad: float = 50.0, humedad_suelo: float = 40.0,
+             nivel_de_agua: float = 80.0) -> Lectura:
+    return Lectura(device_id=1, fecha_hora=en(segundo), temperatura=temperatura, humedad=humedad,
+                   humedad_suelo=humedad_suelo, nivel_de_agua=nivel_de_agua)
+
+
+def _subtipos(alertas) -> list[tuple[str, str]]:
+    return [(a.subtipo, a.detalle) for a in alertas]
+
+
+def test_ventana_igual_a_recalcular():
+    rnd = random.Random(3)
+    v = Ventana(5, alfa=0.5)
+    xs = []
+    for _ in range(40):
+        x = round(rnd.uniform(0, 100), 1)
+        ewma = x if not xs else v.ewma + 0.5 * (x - v.ewma)
+        v.agregar(x)
+        xs.append(x)
+        ultimos = xs[-5:]
+        assert (v.minimo, v.maximo) == (min(ultimos), max(ultimos))
+        assert v.media == pytest.approx(statistics.fmean(ultimos))
+        assert v.varianza == pytest.approx(statistics.variance(ultimos) if len(ultimos) > 1 else 0.0)
+        assert v.ewma == pytest.approx(ewma)
+        assert v.llena == (len(xs) >= 5)
+
+
+def test_sensor_trabado_al_entrar_y_al_salir():
+    a = AnaliticaTelemetria(ventana=4, trabado_delta=0.0, caida_pct=50, tanque_seco_pct=0)
+    alertas = []
+    for i in range(6):
+        alertas += a.observar("esp-a", _lectura(i, temperatura=22.0, humedad=50 + i, humedad_suelo=40 + i,
+                                                nivel_de_agua=80 + i))
+    # con la ventana llena y una sola vez, aunque siga trabado
+    assert _subtipos(alertas) == [("sensor_trabado", "temperatura")]
+    assert a.estado("esp-a")["activas"] == ["trabado:temperatura"]
+
+    assert _subtipos(a.observar("esp-a", _lectura(6, temperatura=23.0, humedad=60, humedad_suelo=50,
+                                                  nivel_de_agua=90))) == [("sensor_recuperado", "temperatura")]
+    assert a.estado("esp-a")["activas"] == []
+
+
+def test_porcentaje_saturado_no_es_sensor_trabado():
+    a = AnaliticaTelemetria(ventana=4, trabado_delta=0.0, caida_pct=50, tanque_seco_pct=0)
+    alertas = []
+    for i in range(8):
+        # humedad ambiente al 100 %, suelo seco en 0 y tanque lleno: constantes legítimas
+        alertas += a.observar("esp-a", _lectura(i, temperatura=20 + i, humedad=100.0, humedad_suelo=0.0,
+                                                nivel_de_agua=100.0))
+    assert alertas == []
+    # un porcentaje constante en el medio de la escala sí lo es
+    for i in range(4):
+        alertas += a.observar("esp-b", _lectura(i, temperatura=20 + i, humedad=100.0, humedad_suelo=40.0,
+                                                nivel_de_agua=100.0))
+    assert _subtipos(alertas) == [("sensor_trabado", "humedad_suelo")]
+
+
+def test_caida_brusca_y_tanque_seco_con_histeresis():
+    a = AnaliticaTelemetria(ventana=100, alfa=1.0, caida_pct=15, tanque_seco_pct=10)
+    for i in range(3):
+        a.observar("esp-a", _lectura(i, temperatura=20 + i, nivel_de_agua=80 - i))
+    assert _subtipos(a.observar("esp-a", _lectura(3, nivel_de_agua=60))) == [("caida_brusca", "nivel_de_agua")]
+    assert a.observar("esp-a", _lectura(4, nivel_de_agua=50)) == []      # sigue cayendo: no se repite
+
+    assert _subtipos(a.observar("esp-a", _lectura(5, nivel_de_agua=8))) == [
+        ("caida_brusca", "nivel_de_agua"), ("tanque_seco", "nivel_de_agua")]
+    assert a.observar("esp-a", _lectura(6, nivel_de_agua=12)) == []      # < 10 + 5: sigue seco
+    assert ("tanque_recuperado", "nivel_de_agua") in _subtipos(a.observar("esp-a", _lectura(7, nivel_de_agua=16)))
+
+
+def test_pendiente_del_nivel():
+    a = AnaliticaTelemetria(ventana=10)
+    for i in range(5):
+        a.observar("esp-a", _lectura(i * 30, temperatura=20 + i, nivel_de_agua=80 - i))
+    assert a.estado("esp-a")["nivel_pendiente_min"] == pytest.approx(-2.0)     # 1 punto cada 30 s
+    assert a.estado("otro") is None
+    a.olvidar("esp-a")
+    assert a.metricas()["devices"] == 0
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import select
+
+from app.db.models import ComandoSaliente
+from app.servicios import mqtt_funciones
+from app.servicios.bandeja import BandejaSalida
+
+
+class Broker:
+    """`publicar`/`conectado` de mentira para la bandeja; `fallar` publish seguidos fallan."""
+
+    def __init__(self, conectado: bool = False, fallar: int = 0):
+        self.conectado = conectado
+        self.fallar = fallar
+        self._lock = threading.Lock()
+        self.publicados: list[tuple[str, dict]] = []
+
+    def publicar(self, esp_id: str, cmd: dict) -> bool:
+        with self._lock:
+            if self.fallar:
+                self.fallar -= 1
+                return False
+            self.publicados.append((esp_id, cmd))
+            return True
+
+    def ids(self, esp_id: str) -> list[str]:
+        with self._lock:
+            return [c["id"] for e, c in self.publicados if e == esp_id]
+
+
+def _esperar(condicion, timeout: float = 3.0) -> bool:
+    limite = time.monotonic() + timeout
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+def _set(target: str, value: str, cid: str) -> dict:
+    return {"cmd": "SET", "target": target, "value": value, "id": cid}
+
+
+def _filas(Session, origen: str = "api") -> list[str]:
+    with Session() as db:
+        return [f.payload for f in db.scalars(
+            select(ComandoSaliente).where(ComandoSaliente.origen == origen).order_by(ComandoSaliente.id))]
+
+
+@pytest.fixture
+def crear(Session):
+    bandejas = []
+
+    def crear(broker: Broker, **kw) -> BandejaSalida:
+        b = BandejaSalida(broker.publicar, lambda: broker.conectado, session_factory=Session,
+                          backoff_s=0.05, backoff_max_s=0.2, **kw)
+        bandejas.append(b)
+        return b
+
+    yield crear
+    for b in bandejas:
+        b.detener()
+
+
+def test_orden_por_device_y_reemplazo_del_set(crear, Session):
+    broker = Broker()
+    b = crear(broker)
+    b.guardar("esp-a", _set("RIEGO", "ON", "1"))
+    b.guardar("esp-a", {"cmd": "GET_STATUS", "id": "2"})
+    b.guardar("esp-b", _set("LUZ", "ON", "3"))
+    b.guardar("esp-a", _set("RIEGO", "OFF", "4"))     # reemplaza al "1"
+    m = b.metricas()
+    assert (m["en_espera"], m["reemplazados"], m["devices"]) == (3, 1, 2)
+    assert b.tiene("esp-a") and not b.tiene("esp-c")
+    assert _esperar(lambda: len(_filas(Session)) == 3)
+
+    broker.conectado = True
+    b.reanudar()
+    assert _esperar(lambda: len(broker.publicados) == 3)
+    assert broker.ids("esp-a") == ["2", "4"] and broker.ids("esp-b") == ["3"]
+    assert not b.tiene("esp-a")
+    assert _esperar(lambda: _filas(Session) == [])      # lo publicado se borra de la DB
+
+
+def test_lo_que_queda_se_carga_al_arrancar(crear, Session):
+    broker = Broker()
+    b = crear(broker)
+    b.guardar("esp-a", _set("RIEGO", "ON", "1"))
+    b.guardar("esp-a", _set("LUZ", "ON", "2"))
+    crear(Broker(), origen="ingesta-0").guardar("esp-a", _set("LUZ", "OFF", "x"))
+    assert _esperar(lambda: len(_filas(Session)) == 2)
+    b.detener()                                          # reinicio: las filas quedan en la DB
+
+    broker = Broker(conectado=True)
+    b = crear(broker)
+    b.guardar("esp-a", _set("VENT", "ON", "3"))          # lo nuevo va detrás de lo anterior
+    assert _esperar(lambda: len(broker.publicados) == 3)
+    assert broker.ids("esp-a") == ["1", "2", "3"]        # mismo id de correlación: el ack lo resuelve
+    assert b.metricas()["cargados"] == 2
+    assert _esperar(lambda: _filas(Session) == [])
+    assert len(_filas(Session, "ingesta-0")) == 1        # cada origen reenvía sólo lo suyo
+
+
+def test_publish_fallido_reintenta_con_espera(crear):
+    broker = Broker(conectado=True, fallar=2)
+    b = crear(broker)
+    b.guardar("esp-a", _set("RIEGO", "ON", "1"))
+    b.guardar("esp-a", _set("LUZ", "ON", "2"))
+    assert _esperar(lambda: len(broker.publicados) == 2)
+    assert broker.ids("esp-a") == ["1", "2"]
+    m = b.metricas()
+    assert (m["fallos"], m["publicados"], m["en_espera"]) == (2, 2, 0)
+
+
+def test_vencidos_no_se_envian(crear, Session):
+    broker = Broker()
+    b = crear(broker, ttl_s=0)
+    b.guardar("esp-a", _set("RIEGO", "ON", "1"))
+    broker.conectado = True
+    b.reanudar()
+    assert _esperar(lambda: b.metricas()["vencidos"] == 1)
+    assert broker.publicados == [] and not b.tiene("esp-a")
+    assert _esperar(lambda: _filas(Session) == [])
+
+
+def test_bandeja_llena_descarta(crear):
+    b = crear(Broker(), maximo=1)
+    assert b.guardar("esp-a", _set("RIEGO", "ON", "1"))
+    assert not b.guardar("esp-b", _set("LUZ", "ON", "2"))
+    assert b.guardar("esp-a", _set("RIEGO", "OFF", "3"))     # reemplazar no ocupa lugar
+    assert not b.tiene("esp-b") and b.metricas()["descartados"] == 1
+
+
+@pytest.mark.skipif(mqtt_funciones.bandeja is None, reason="bandeja de salida desactivada")
+def test_enviar_sin_broker_queda_diferido(cliente_mqtt):
+    cliente_mqtt.conectado = False
+    p = mqtt_funciones.enviar_cmd({"cmd": "SET", "target": "RIEGO", "value": "ON"}, esp_id="esp-a")
+    assert p is not None and p.diferido
+    assert cliente_mqtt.cmds() == []
+    # el siguiente va detrás aunque el broker ya volvió
+    cliente_mqtt.conectado = True
+    q = mqtt_funciones.enviar_cmd({"cmd": "GET_STATUS"}, esp_id="esp-a")
+    assert q.diferido
+    mqtt_funciones.bandeja.reanudar()
+    assert _esperar(lambda: len(cliente_mqtt.cmds("esp-a")) == 2)
+    assert [c["id"] for c in cliente_mqtt.cmds("esp-a")] == [p.cid, q.cid]
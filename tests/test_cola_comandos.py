@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.servicios.comandos import ColaComandos, RastreadorComandos
+
+
+class Broker:
+    """`publicar` de la cola: guarda lo publicado (y en qué hilo) y responde `resultado`."""
+
+    def __init__(self, resultado=True):
+        self.resultado = resultado
+        self.publicados: list[tuple[str, dict, str]] = []
+
+    def __call__(self, esp_id: str, cmd: dict):
+        self.publicados.append((esp_id, cmd, threading.current_thread().name))
+        return self.resultado
+
+    def cmds(self) -> list[dict]:
+        return [c for _, c, _ in self.publicados]
+
+
+def _esperar(condicion, timeout: float = 2.0) -> bool:
+    limite = time.monotonic() + timeout
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.005)
+    return condicion()
+
+
+@pytest.fixture
+def rastreador() -> RastreadorComandos:
+    return RastreadorComandos()
+
+
+def _encolar(cola, rastreador, esp_id: str, target: str, value: str):
+    cmd = {"cmd": "SET", "target": target, "value": value}
+    p = rastreador.registrar(esp_id, cmd)
+    cola.encolar(esp_id, cmd, p)
+    return p
+
+
+def test_set_de_la_ventana_salen_en_un_set_multi(rastreador):
+    broker = Broker()
+    cola = ColaComandos(broker, ventana_ms=50, set_multi=True, rastreador=rastreador)
+    riego_on = _encolar(cola, rastreador, "esp-a", "RIEGO", "ON")
+    luz = _encolar(cola, rastreador, "esp-a", "LUZ", "OFF")
+    riego_off = _encolar(cola, rastreador, "esp-a", "RIEGO", "OFF")
+    otro = _encolar(cola, rastreador, "esp-b", "VENT", "ON")
+
+    assert riego_on.publicado.result(0) == "reemplazado"     # nunca sale
+    assert riego_off.publicado.result(2) is True and luz.publicado.result(2) is True
+    assert otro.publicado.result(2) is True
+
+    multi = [c for c in broker.cmds() if c["cmd"] == "SET_MULTI"]
+    assert len(multi) == 1 and multi[0]["targets"] == {"RIEGO": "OFF", "LUZ": "OFF"}
+    assert [c["target"] for c in broker.cmds() if c["cmd"] == "SET"] == ["VENT"]
+    assert riego_on.futuro.result(0) == "reemplazado"
+    m = cola.metricas("esp-a")
+    assert (m["pedidos"], m["publicaciones"]) == (3, 1)
+
+    # un ack del SET_MULTI confirma a todos los SET que agrupa
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": multi[0]["id"]}))
+    assert riego_off.futuro.result(0) == "ack" and luz.futuro.result(0) == "ack"
+
+
+def test_sin_set_multi_un_set_por_target(rastreador):
+    broker = Broker()
+    cola = ColaComandos(broker, ventana_ms=50, set_multi=False, rastreador=rastreador)
+    ps = [_encolar(cola, rastreador, "esp-a", t, "ON") for t in ("RIEGO", "LUZ")]
+    assert all(p.publicado.result(2) is True for p in ps)
+    assert [(c["cmd"], c["target"], c["id"]) for c in broker.cmds()] == [
+        ("SET", "RIEGO", ps[0].cid), ("SET", "LUZ", ps[1].cid)]
+
+
+def test_set_multi_rechazado_se_reenvia_suelto_desde_la_cola(rastreador):
+    broker = Broker()
+    cola = ColaComandos(broker, ventana_ms=20, set_multi=True, rastreador=rastreador)
+    ps = [_encolar(cola, rastreador, "esp-a", t, "ON") for t in ("RIEGO", "LUZ")]
+    assert all(p.publicado.result(2) is True for p in ps)
+    multi = broker.cmds()[0]
+
+    # el ack llega en el hilo de paho: ahí sólo se reencola
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": multi["id"], "ok": False}))
+    assert not ps[0].futuro.done()     # sigue pendiente hasta el ack de cada SET
+    cola.vaciar()
+    sueltos = broker.publicados[1:]
+    assert [(c["cmd"], c["target"]) for _, c, _ in sueltos] == [("SET", "RIEGO"), ("SET", "LUZ")]
+    assert cola.metricas()["degradados"] == 1
+
+    # de acá en más, SET sueltos aunque coincidan en la ventana
+    _encolar(cola, rastreador, "esp-a", "VENT", "ON")
+    _encolar(cola, rastreador, "esp-a", "RIEGO", "OFF").publicado.result(2)
+    assert all(c["cmd"] == "SET" for c in broker.cmds()[1:])
+
+
+def test_degradado_publica_el_hilo_de_la_cola(rastreador):
+    broker = Broker()
+    cola = ColaComandos(broker, ventana_ms=20, set_multi=True, rastreador=rastreador)
+    ps = [_encolar(cola, rastreador, "esp-a", t, "ON") for t in ("RIEGO", "LUZ")]
+    ps[0].publicado.result(2)
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": broker.cmds()[0]["id"], "ok": False}))
+    assert _esperar(lambda: len(broker.publicados) == 3)
+    assert {hilo for _, _, hilo in broker.publicados[1:]} == {"cola-comandos"}
+
+
+def test_publish_fallido(rastreador):
+    cola = ColaComandos(Broker(False), ventana_ms=0, rastreador=rastreador)
+    p = _encolar(cola, rastreador, "esp-a", "RIEGO", "ON")
+    # ventana 0: publica en el hilo que llama
+    assert p.publicado.result(0) is False
+    assert p.futuro.cancelled()
+    assert rastreador.metricas()["pendientes"] == 0
+    assert cola.metricas()["fallos"] == 1
+
+
+def test_diferido_cuenta_como_salida(rastreador):
+    cola = ColaComandos(Broker("diferido"), ventana_ms=0, rastreador=rastreador)
+    viejo = _encolar(cola, rastreador, "esp-a", "RIEGO", "ON")
+    nuevo = _encolar(cola, rastreador, "esp-a", "RIEGO", "OFF")
+    assert nuevo.publicado.result(0) == "diferido"
+    assert viejo.futuro.result(0) == "reemplazado"
+    assert not nuevo.futuro.done()
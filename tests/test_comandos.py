@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from app.servicios.comandos import RastreadorComandos
+from app.servicios.registro import EstadoMecanismos
+
+
+@pytest.fixture
+def rastreador() -> RastreadorComandos:
+    return RastreadorComandos()
+
+
+def _set(target: str, value: str) -> dict:
+    return {"cmd": "SET", "target": target, "value": value}
+
+
+def test_ack_por_id_de_correlacion(rastreador):
+    cmd = _set("RIEGO", "ON")
+    p = rastreador.registrar("esp-a", cmd)
+    assert cmd["id"] == p.cid
+
+    rastreador.confirmar_ack("esp-b", json.dumps({"id": p.cid}))     # otro device: no cuenta
+    rastreador.confirmar_ack("esp-a", "no es json")
+    assert not p.futuro.done()
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": p.cid, "ok": True}))
+    assert p.futuro.result(0) == "ack"
+
+    q = rastreador.registrar("esp-a", _set("LUZ", "ON"))
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": q.cid, "ok": False}))
+    assert q.futuro.result(0) == "rechazado"
+    m = rastreador.metricas()
+    assert (m["ack"], m["rechazado"], m["pendientes"]) == (1, 1, 0)
+
+
+def test_telemetria_confirma_sin_ack(rastreador):
+    riego = rastreador.registrar("esp-a", _set("RIEGO", "ON"))
+    status = rastreador.registrar("esp-a", {"cmd": "STATUS"})
+    luz = rastreador.registrar("esp-a", _set("LUZ", "ON"))
+
+    # la telemetría del lote sólo confirma lo enviado antes de que empezara
+    rastreador.observar_estado("esp-a", EstadoMecanismos(1, True, False, False), antes_de=luz.enviado)
+    assert riego.futuro.result(0) == "telemetria"
+    assert status.futuro.result(0) == "telemetria"
+    assert not luz.futuro.done()
+    # un estado que no refleja el SET no lo confirma
+    rastreador.observar_estado("esp-a", EstadoMecanismos(1, True, False, False))
+    assert not luz.futuro.done()
+    rastreador.observar_estado("esp-a", EstadoMecanismos(1, True, True, False))
+    assert luz.futuro.result(0) == "telemetria"
+
+
+def test_reemplazado_recien_cuando_sale_el_nuevo(rastreador):
+    viejo = rastreador.registrar("esp-a", _set("RIEGO", "ON"))
+    otro_target = rastreador.registrar("esp-a", _set("LUZ", "ON"))
+    nuevo = rastreador.registrar("esp-a", _set("RIEGO", "OFF"))
+    assert not viejo.futuro.done()
+
+    # el nuevo no se llegó a publicar: el viejo sigue pendiente
+    rastreador.descartar(nuevo)
+    assert nuevo.futuro.cancelled() and not viejo.futuro.done()
+
+    nuevo = rastreador.registrar("esp-a", _set("RIEGO", "OFF"))
+    rastreador.salio(nuevo)
+    assert viejo.futuro.result(0) == "reemplazado"
+    assert not otro_target.futuro.done() and not nuevo.futuro.done()
+
+
+def test_vencidos():
+    corto = RastreadorComandos(ttl_s=-1)
+    p = corto.registrar("esp-a", _set("RIEGO", "ON"))
+    assert corto.metricas()["vencido"] == 1
+    assert p.futuro.result(0) == "vencido"
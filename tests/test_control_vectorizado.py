@@ -0,0 +1,50 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.db.models import Config, Device
+from app.db.session import set_sqlite_pragma
+from app.servicios import control_vectorizado, umbrales
+from bench.control import Comandos, Reloj, correr, escenario, poblar
+
+pytest.importorskip("numpy")
+
+
+def _sesiones(path):
+    eng = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    event.listen(eng, "connect", set_sqlite_pragma)
+    Base.metadata.create_all(bind=eng)
+    return eng, sessionmaker(autocommit=False, autoflush=False, bind=eng, expire_on_commit=False)
+
+
+def _configs(Session) -> dict:
+    with Session() as db:
+        return {e: {"temperatura": c.temperatura, "humedad_suelo": c.humedad_suelo,
+                    "humedad_ambiente": c.humedad_ambiente, "margen": c.margen}
+                for e, c in db.execute(select(Device.esp_id, Config).join(Config, Config.device_id == Device.id))}
+
+
+@pytest.mark.parametrize("seed", [3, 11])
+def test_mismas_decisiones_que_procesar_umbrales(Session, tmp_path, monkeypatch, seed):
+    # correr() reemplaza el CooldownStore y el envío de los módulos: se restauran al terminar
+    monkeypatch.setattr(umbrales, "cooldowns", umbrales.cooldowns)
+    resultados = {}
+    for modo in ("escalar", "vectorizado"):
+        eng, S = _sesiones(tmp_path / f"{modo}.db")
+        # devices sin Config o sin Mecanismos, NaN, reportes del ESP32 y cambios de config
+        esps = poblar(S, 40, random.Random(seed), sin_config=0.05, sin_mech=0.05)
+        pasos = escenario(esps, _configs(S), 60, seed + 1)
+        comandos = Comandos()
+        monkeypatch.setattr(umbrales, "enviar_cmd_mqtt", comandos)
+        monkeypatch.setattr(control_vectorizado, "enviar_cmd_mqtt", comandos)
+        estado = correr(S, pasos, modo == "vectorizado", Reloj(), comandos)
+        resultados[modo] = (sorted(comandos.enviados, key=lambda c: (c[1], c[0])), estado)
+        eng.dispose()
+
+    (cmd_escalar, est_escalar), (cmd_vect, est_vect) = resultados["escalar"], resultados["vectorizado"]
+    assert cmd_escalar                          # el escenario dispara comandos
+    assert cmd_vect == cmd_escalar              # por device, en el mismo paso, con el mismo valor
+    assert est_vect == est_escalar
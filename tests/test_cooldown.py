@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import func, select
+
+from app.db.models import CooldownActuador
+from app.servicios.cooldown import CooldownStore
+from app.servicios.devices import create_device
+from app.servicios.efectos import EfectosLote
+
+
+class Reloj:
+    def __init__(self, t: float = 1000.0):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+
+@pytest.fixture
+def devices(Session) -> dict[str, int]:
+    with Session() as db:
+        return {e: create_device(db, e).id for e in ("esp-a", "esp-b")}
+
+
+def test_cooldown_por_device_y_actuador(Session):
+    reloj = Reloj()
+    store = CooldownStore(session_factory=Session, cooldown_s=30, reloj=reloj)
+    assert store.puede_cambiar(1, "riego")
+    assert not store.puede_cambiar(1, "riego")
+    assert store.puede_cambiar(1, "luz")            # otro actuador
+    assert store.puede_cambiar(2, "riego")          # otro device
+    reloj.t += 29
+    assert store.restante(1, "riego") == pytest.approx(1)
+    assert store.permitir_lote([1, 2, 3], "riego", reloj()) == [False, False, True]
+    reloj.t += 1
+    assert store.puede_cambiar(1, "riego")
+
+
+def test_rollback_devuelve_el_cooldown(Session):
+    reloj = Reloj()
+    store = CooldownStore(session_factory=Session, cooldown_s=30, reloj=reloj)
+    assert store.puede_cambiar(1, "riego")
+    reloj.t += 40
+    efectos = EfectosLote()
+    assert store.permitir_lote([1, 2], "riego", reloj(), efectos) == [True, True]
+    efectos.descartar()
+    # vuelve al estado previo al lote: el device 1 con su cambio viejo (vencido), el 2 sin entrada
+    assert store.puede_cambiar(1, "riego") and store.puede_cambiar(2, "riego")
+    assert store.metricas()["permitidos"] == 3
+
+
+def test_sobrevive_un_reinicio(Session, devices):
+    reloj = Reloj()
+    antes = CooldownStore(session_factory=Session, cooldown_s=30, reloj=reloj)
+    assert antes.puede_cambiar(devices["esp-a"], "riego")
+    reloj.t += 10
+    antes.guardar()
+
+    despues = CooldownStore(session_factory=Session, cooldown_s=30, reloj=Reloj(50.0))
+    despues.restaurar()
+    assert not despues.puede_cambiar(devices["esp-a"], "riego")
+    assert despues.restante(devices["esp-a"], "riego") == pytest.approx(20, abs=1)
+    assert despues.puede_cambiar(devices["esp-b"], "riego")
+    assert despues.metricas()["restaurados"] == 1
+
+
+def test_snapshot_descarta_lo_vencido(Session, devices):
+    reloj = Reloj()
+    store = CooldownStore(session_factory=Session, cooldown_s=30, reloj=reloj)
+    store.puede_cambiar(devices["esp-a"], "riego")
+    reloj.t += 31
+    store.guardar()
+    with Session() as db:
+        assert db.scalar(select(func.count(CooldownActuador.id))) == 0
+    assert store.metricas()["entradas"] == 0
+
+
+def test_particion_solo_toca_sus_devices(Session, devices):
+    a, b = devices["esp-a"], devices["esp-b"]
+    store_a = CooldownStore(session_factory=Session, cooldown_s=30)
+    store_a.particionar(lambda esp_id: esp_id == "esp-a")
+    store_b = CooldownStore(session_factory=Session, cooldown_s=30)
+    store_b.particionar(lambda esp_id: esp_id == "esp-b")
+    store_a.puede_cambiar(a, "riego")
+    store_b.puede_cambiar(b, "luz")
+    store_a.guardar()
+    store_b.guardar()
+    store_a.guardar()       # reemplaza sólo las filas de esp-a
+
+    with Session() as db:
+        filas = set(db.execute(select(CooldownActuador.device_id, CooldownActuador.actuador)).all())
+    assert filas == {(a, "riego"), (b, "luz")}
+
+    nuevo = CooldownStore(session_factory=Session, cooldown_s=30)
+    nuevo.particionar(lambda esp_id: esp_id == "esp-b")
+    nuevo.restaurar()
+    assert nuevo.puede_cambiar(a, "riego") and not nuevo.puede_cambiar(b, "luz")
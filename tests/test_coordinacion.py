@@ -0,0 +1,123 @@
+import json
+import os
+import time
+
+import pytest
+
+from app.servicios import coordinacion, mqtt_funciones
+from app.servicios.comandos import rastreador
+from app.servicios.coordinacion import Coordinador
+from app.servicios.registro import registro
+from app.servicios.stream import hub
+
+
+def _esperar(condicion, timeout: float = 3.0) -> bool:
+    limite = time.monotonic() + timeout
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+def _cerrar(c: Coordinador):
+    """Lo que haría la muerte del proceso: suelta el lock y cierra los sockets."""
+    c.rol = None
+    if c._servidor is not None:
+        c._servidor.close()
+    for conn in list(c._seguidores):
+        conn.cerrar()
+    if c._conexion is not None:
+        c._conexion.cerrar()
+    if c._fd is not None:
+        os.close(c._fd)
+        c._fd = None
+
+
+@pytest.fixture
+def procesos(tmp_path, cliente_mqtt, monkeypatch):
+    """
+    `procesos(n)`: n coordinadores sobre el mismo directorio, arrancados en
+    orden. Comparten este proceso, así que el reenvío de `enviar_cmd` queda
+    desactivado y el seguidor reenvía llamando directo a `_enviar_cmd`.
+    """
+    monkeypatch.setattr(coordinacion, "REINTENTO_S", 0.05)
+    monkeypatch.setattr(registro, "al_cambiar", None)
+    monkeypatch.setattr(hub, "al_publicar", None)
+    creados = []
+
+    def crear(n: int) -> list[tuple[Coordinador, list]]:
+        for _ in range(n):
+            c, asumidos = Coordinador(str(tmp_path)), []
+            c.iniciar(lambda asumidos=asumidos: asumidos.append(time.monotonic()))
+            mqtt_funciones.setup_reenvio(None)
+            creados.append((c, asumidos))
+        return creados
+
+    yield crear
+    for c, _ in creados:
+        _cerrar(c)
+
+
+def test_un_solo_lider(procesos):
+    (lider, a), (seguidor, b) = procesos(2)
+    assert (lider.rol, seguidor.rol) == ("lider", "seguidor")
+    assert len(a) == 1 and b == []
+    assert _esperar(lambda: seguidor.metricas()["conectado"])
+    assert _esperar(lambda: lider.metricas()["seguidores"] == 1)
+
+
+def test_relevo_al_caer_el_lider(procesos):
+    (lider, _), (seguidor, asumidos) = procesos(2)
+    _cerrar(lider)
+    assert _esperar(lambda: len(asumidos) == 1)
+    assert seguidor.rol == "lider"
+
+
+def test_comando_del_seguidor_lo_publica_el_lider(procesos, cliente_mqtt):
+    _, (seguidor, _) = procesos(2)
+    assert _esperar(lambda: seguidor.metricas()["conectado"])
+
+    cmd = {"cmd": "SET", "target": "LUZ", "value": "ON"}
+    p = seguidor._enviar_cmd(cmd, "esp-a")
+    assert p is not None and not p.incierto
+    assert p.cid == cmd["id"]                       # el id de correlación lo pone el seguidor
+    assert p.publicado.result(2) is True            # "pub" cuando salió de la cola del líder
+    assert cliente_mqtt.cmds("esp-a") == [{"cmd": "SET", "target": "LUZ", "value": "ON", "id": p.cid}]
+
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": p.cid}))   # el ack lo escucha el líder
+    assert p.futuro.result(2) == "ack"
+    assert seguidor.metricas()["comandos_pendientes"] == 0
+
+
+def test_lider_lento_deja_el_comando_incierto(procesos, cliente_mqtt, monkeypatch):
+    _, (seguidor, _) = procesos(2)
+    assert _esperar(lambda: seguidor.metricas()["conectado"])
+    monkeypatch.setattr(coordinacion, "IPC_TIMEOUT_S", 0.05)
+    original = mqtt_funciones.enviar_cmd
+
+    def lento(*args, **kwargs):
+        time.sleep(0.3)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(mqtt_funciones, "enviar_cmd", lento)
+
+    p = seguidor._enviar_cmd({"cmd": "SET", "target": "RIEGO", "value": "ON"}, "esp-a")
+    assert p is not None and p.incierto
+    assert mqtt_funciones.esperar_publicacion(p) is p       # no espera una publicación que no va a saber
+    assert seguidor.metricas()["comandos_inciertos"] == 1
+
+    # la respuesta tardía y el ack resuelven el mismo pendiente, por su ref
+    assert _esperar(lambda: cliente_mqtt.cmds("esp-a"))
+    rastreador.confirmar_ack("esp-a", json.dumps({"id": p.cid}))
+    assert p.futuro.result(2) == "ack"
+
+
+def test_sin_lider_el_incierto_se_cancela(procesos, cliente_mqtt, monkeypatch):
+    (lider, _), (seguidor, _) = procesos(2)
+    assert _esperar(lambda: seguidor.metricas()["conectado"])
+    monkeypatch.setattr(coordinacion, "IPC_TIMEOUT_S", 0.05)
+    monkeypatch.setattr(mqtt_funciones, "enviar_cmd", lambda *a, **k: time.sleep(0.3))
+
+    p = seguidor._enviar_cmd({"cmd": "STATUS"}, "esp-a")
+    assert p.incierto and not p.futuro.done()
+    _cerrar(lider)
+    assert _esperar(p.futuro.cancelled)
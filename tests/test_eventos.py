@@ -0,0 +1,70 @@
+import pytest
+
+from app.api.v1.eventos import router
+from app.servicios.devices import create_device
+from app.servicios.eventos import DiarioEventos, diario
+
+from tests.conftest import en
+
+
+@pytest.fixture
+def eventos(Session):
+    """Siete eventos de esp-a (uno por minuto) y uno de esp-b, ya guardados por el diario."""
+    with Session() as db:
+        create_device(db, "esp-a")
+        create_device(db, "esp-b")
+    for i in range(6):
+        diario.registrar("esp-a", "autocontrol", "riego", "ON" if i % 2 == 0 else "OFF", fecha_hora=en(60 * i))
+    diario.registrar("esp-a", "status", "offline", "online", fecha_hora=en(400))
+    diario.registrar("esp-b", "manual", "luz", "ON", fecha_hora=en(30))
+    diario.registrar("esp-x", "manual", "luz", "ON")        # device desconocido: se cuenta y no se guarda
+    assert diario.vaciar()
+
+
+def _paginas(c, **params) -> list[list[dict]]:
+    paginas, antes_de = [], None
+    while True:
+        q = {**params, **({"antes_de": antes_de} if antes_de else {})}
+        r = c.get("/api/v1/eventos", params=q).json()
+        paginas.append(r["eventos"])
+        antes_de = r["siguiente"]
+        if antes_de is None:
+            return paginas
+
+
+def test_paginacion_por_cursor(api, eventos):
+    c = api(router)
+    paginas = _paginas(c, limit=3)
+    assert [len(p) for p in paginas] == [3, 3, 2]
+    ids = [e["id"] for p in paginas for e in p]
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 8
+    assert paginas[0][0]["esp_id"] == "esp-b" and paginas[0][0]["fecha_hora"].endswith("Z")
+    # una página justa también termina: la siguiente viene vacía
+    assert [len(p) for p in _paginas(c, esp_id="esp-a", tipo="autocontrol", limit=3)] == [3, 3, 0]
+
+
+def test_filtros(api, eventos):
+    c = api(router)
+    r = c.get("/api/v1/eventos", params={"esp_id": "esp-a", "tipo": "autocontrol", "subtipo": "riego"}).json()
+    assert len(r["eventos"]) == 6
+    # desde inclusive, hasta exclusivo; sin zona = UTC
+    r = c.get("/api/v1/eventos", params={"esp_id": "esp-a", "desde": "2026-03-01T12:01:00",
+                                         "hasta": "2026-03-01T12:03:00"}).json()
+    assert [e["fecha_hora"] for e in r["eventos"]] == ["2026-03-01T12:02:00Z", "2026-03-01T12:01:00Z"]
+    r = c.get("/api/v1/eventos", params={"desde": "2026-03-01T09:05:00-03:00"}).json()
+    assert {e["tipo"] for e in r["eventos"]} == {"autocontrol", "status"}
+    assert c.get("/api/v1/eventos", params={"esp_id": "no-existe"}).status_code == 404
+
+
+def test_resumen(api, eventos):
+    r = api(router).get("/api/v1/eventos/resumen", params={"esp_id": "esp-a"}).json()
+    assert r == {"total": 7, "por_tipo": {"autocontrol": {"riego": 6}, "status": {"offline": 1}}}
+    assert diario.metricas()["sin_device"] >= 1
+
+
+def test_cola_llena_descarta_sin_bloquear(Session):
+    d = DiarioEventos(session_factory=Session, cola_max=2)
+    d.iniciar = lambda: None            # sin escritor: la cola no se vacía
+    assert [d.registrar("esp-a", "manual", "luz", "ON") for _ in range(3)] == [True, True, False]
+    m = d.metricas()
+    assert (m["encolados"], m["descartados"], m["profundidad"]) == (2, 1, 2)
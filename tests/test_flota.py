@@ -0,0 +1,89 @@
+import pytest
+from sqlalchemy import delete, select
+
+from app.api.v1.fleet import router
+from app.db.models import Lectura, UltimaLectura
+from app.servicios.devices import create_device
+from app.servicios.flota import actualizar_ultimas, backfill, devices_sin_ultima, reconstruir_ultimas
+
+from tests.conftest import en
+
+
+@pytest.fixture
+def devices(Session) -> dict[str, int]:
+    with Session() as db:
+        return {e: create_device(db, e).id for e in ("esp-a", "esp-b")}
+
+
+def _lote(Session, filas: list[tuple[int, float, float]]) -> list[int]:
+    """Inserta (device_id, segundo, temperatura) y actualiza las últimas en la misma transacción."""
+    with Session() as db:
+        lecturas = [Lectura(device_id=d, fecha_hora=en(s), temperatura=t, humedad=50, humedad_suelo=40,
+                            nivel_de_agua=80) for d, s, t in filas]
+        db.add_all(lecturas)
+        db.flush()
+        actualizar_ultimas(db, lecturas)
+        db.commit()
+        return [l.id for l in lecturas]
+
+
+def _ultimas(Session) -> dict[int, tuple[int, float]]:
+    with Session() as db:
+        return {d: (lid, t) for d, lid, t in
+                db.execute(select(UltimaLectura.device_id, UltimaLectura.lectura_id, UltimaLectura.temperatura))}
+
+
+def test_la_mas_nueva_de_cada_device(Session, devices):
+    a, b = devices["esp-a"], devices["esp-b"]
+    ids = _lote(Session, [(a, 10, 1.0), (a, 30, 3.0), (a, 20, 2.0), (b, 5, 9.0)])
+    assert _ultimas(Session) == {a: (ids[1], 3.0), b: (ids[3], 9.0)}
+
+
+def test_una_lectura_vieja_no_pisa_la_guardada(Session, devices):
+    a = devices["esp-a"]
+    nueva, = _lote(Session, [(a, 30, 3.0)])
+    _lote(Session, [(a, 10, 1.0)])                 # importación o mensaje demorado
+    assert _ultimas(Session)[a] == (nueva, 3.0)
+    misma_hora, = _lote(Session, [(a, 30, 4.0)])   # a igual hora gana la que llegó después
+    assert _ultimas(Session)[a] == (misma_hora, 4.0)
+
+
+def test_reconstruir_desde_lecturas(Session, devices):
+    a = devices["esp-a"]
+    ids = _lote(Session, [(a, 10, 1.0), (a, 20, 2.0)])
+    with Session() as db:
+        db.execute(delete(Lectura).where(Lectura.id == ids[1]))
+        db.commit()
+        db.execute(delete(UltimaLectura))
+        db.commit()
+        assert reconstruir_ultimas(db) == 1
+    assert _ultimas(Session) == {a: (ids[0], 1.0)}
+
+
+def test_backfill_de_los_que_faltan(Session, devices):
+    a, b = devices["esp-a"], devices["esp-b"]
+    with Session() as db:
+        db.add_all([Lectura(device_id=d, fecha_hora=en(0), temperatura=t, humedad=50, humedad_suelo=40,
+                            nivel_de_agua=80) for d, t in ((a, 1.0), (b, 2.0))])
+        db.commit()
+    _lote(Session, [(a, 10, 3.0)])              # la ingesta llegó antes que el backfill
+    with Session() as db:
+        assert devices_sin_ultima(db) == [b]
+    assert backfill([b], Session) == 1
+    assert {d: t for d, (_, t) in _ultimas(Session).items()} == {a: 3.0, b: 2.0}
+    with Session() as db:
+        assert devices_sin_ultima(db) == []
+
+
+def test_status_de_la_flota(api, Session, devices):
+    a = devices["esp-a"]
+    lid, = _lote(Session, [(a, 10, 21.5)])
+    r = api(router).get("/api/v1/fleet/status")
+    assert r.status_code == 200
+    por_esp = {d["esp_id"]: d for d in r.json()["dispositivos"]}
+    assert list(por_esp) == ["esp-a", "esp-b"]
+    assert por_esp["esp-a"]["lectura"]["id"] == lid
+    assert por_esp["esp-a"]["lectura"]["temperatura"] == 21.5
+    assert por_esp["esp-a"]["mecanismos"] == {"bomba": False, "luz": False, "ventilador": False}
+    assert por_esp["esp-b"]["lectura"] is None
+    assert por_esp["esp-b"]["presencia"] == "offline"       # nunca tuvo contacto
@@ -0,0 +1,151 @@
+import json
+import time
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core.config import config
+from app.db.models import Device, Lectura
+from app.servicios import control_vectorizado, ingesta, umbrales
+from app.servicios.efectos import EfectosLote, diferir
+from app.servicios.ingesta import IngestaWriter, MensajeMQTT
+from app.servicios.presencia import presencia
+
+from tests.conftest import en
+
+ROTA = -999.0   # temperatura que hace fallar el lote
+
+
+def _telemetria(esp_id: str, segundo: float, temp: float = 35.0, suelo: float = 20.0) -> MensajeMQTT:
+    payload = {"temp_c": temp, "hum_amb": 20.0, "suelo_pct": suelo, "nivel_pct": 50.0,
+               "riego": "OFF", "vent": "OFF", "luz": "OFF"}
+    return MensajeMQTT(f"invernaderos/{esp_id}/telemetria", esp_id, json.dumps(payload), en(segundo),
+                       time.monotonic())
+
+
+@pytest.fixture
+def comandos(monkeypatch):
+    """SET del autocontrol que llegaron a enviarse, en orden."""
+    enviados = []
+
+    def enviar(cmd, esp_id=None):
+        enviados.append((esp_id, cmd["target"], cmd["value"]))
+        return True
+
+    monkeypatch.setattr(control_vectorizado, "enviar_cmd_mqtt", enviar)
+    monkeypatch.setattr(umbrales, "enviar_cmd_mqtt", enviar)
+    return enviados
+
+
+@pytest.fixture
+def falla_lectura_rota(monkeypatch):
+    """El lote que trae una lectura con temperatura ROTA falla al final, antes del commit."""
+    original = ingesta.actualizar_ultimas
+
+    def actualizar(db, lecturas):
+        if any(lec.temperatura == ROTA for lec in lecturas):
+            raise RuntimeError("lectura rota")
+        return original(db, lecturas)
+
+    monkeypatch.setattr(ingesta, "actualizar_ultimas", actualizar)
+
+
+def _lecturas(Session) -> dict[str, int]:
+    with Session() as db:
+        filas = db.execute(
+            select(Device.esp_id, func.count(Lectura.id)).join(Lectura, Lectura.device_id == Device.id)
+            .group_by(Device.esp_id)
+        ).all()
+    return dict(filas)
+
+
+def test_lote_en_una_transaccion(Session, comandos):
+    w = IngestaWriter(session_factory=Session)
+    w.procesar_lote([_telemetria("esp-a", 0), _telemetria("esp-b", 1), _telemetria("esp-a", 2)])
+
+    assert _lecturas(Session) == {"esp-a": 2, "esp-b": 1}
+    m = w.metricas()
+    assert (m["lotes"], m["procesados"], m["lecturas"], m["errores_lote"]) == (1, 3, 3, 0)
+    # suelo seco: un solo RIEGO ON por device (el segundo mensaje de esp-a ya lo ve prendido)
+    assert sorted(c for c in comandos if c[1] == "RIEGO") == [("esp-a", "RIEGO", "ON"), ("esp-b", "RIEGO", "ON")]
+    assert presencia.estado("esp-a")["visto"] == en(2)
+
+
+def test_rollback_del_lote_reintenta_de_a_uno(Session, comandos, falla_lectura_rota):
+    w = IngestaWriter(session_factory=Session)
+    w.procesar_lote([_telemetria("esp-a", 0), _telemetria("esp-rota", 1, temp=ROTA)])
+
+    # el mensaje bueno se guarda en el reintento; el roto ni siquiera deja su device creado
+    assert _lecturas(Session) == {"esp-a": 1}
+    with Session() as db:
+        assert db.scalar(select(Device.id).where(Device.esp_id == "esp-rota")) is None
+    assert w.metricas()["errores_lote"] == 1
+
+
+def test_rollback_no_deja_efectos(Session, comandos, falla_lectura_rota):
+    w = IngestaWriter(session_factory=Session)
+    w.procesar_lote([_telemetria("esp-a", 0), _telemetria("esp-rota", 1, temp=ROTA)])
+
+    # el lote fallido no publicó ni consumió el cooldown: el reintento manda el SET una sola vez
+    assert [c for c in comandos if c[1] == "RIEGO"] == [("esp-a", "RIEGO", "ON")]
+    assert presencia.estado("esp-a")["estimado"] is False
+    assert presencia.estado("esp-rota")["estimado"] is True   # nunca se registró el contacto
+
+
+@pytest.fixture
+def falla_autocontrol(monkeypatch):
+    """El autocontrol de esp-rota falla después de tocar mecanismos y dejar su SET pendiente."""
+    escalar, vectorizado = control_vectorizado.procesar_umbrales, control_vectorizado.MotorControl.evaluar
+
+    def procesar(db, esp_id, lectura, efectos=None):
+        escalar(db, esp_id, lectura, efectos)
+        if esp_id == "esp-rota":
+            raise RuntimeError("autocontrol roto")
+
+    def evaluar(self, db, items, efectos=None):
+        vectorizado(self, db, items, efectos)
+        if any(e == "esp-rota" for e, _ in items):
+            raise RuntimeError("autocontrol roto")
+
+    monkeypatch.setattr(control_vectorizado, "procesar_umbrales", procesar)
+    monkeypatch.setattr(control_vectorizado.MotorControl, "evaluar", evaluar)
+
+
+@pytest.mark.parametrize("vectorizado", [False, True])
+def test_fallo_del_autocontrol_vuelve_atras_la_lectura(Session, comandos, falla_autocontrol, monkeypatch,
+                                                       vectorizado):
+    if vectorizado and control_vectorizado.motor_control is None:
+        pytest.skip("sin NumPy")
+    monkeypatch.setattr(config, "control_vectorizado", vectorizado)
+    w = IngestaWriter(session_factory=Session)
+    w.procesar_lote([_telemetria("esp-a", 0), _telemetria("esp-rota", 1)])
+
+    # como el on_message original: lectura y autocontrol van juntos o no va ninguno
+    assert _lecturas(Session) == {"esp-a": 1}
+    with Session() as db:
+        assert db.scalar(select(Device.id).where(Device.esp_id == "esp-rota")) is None
+    assert [c for c in comandos if c[1] == "RIEGO"] == [("esp-a", "RIEGO", "ON")]
+    assert w.metricas()["errores_lote"] == 1
+
+
+def test_efectos_lote():
+    hechos = []
+    ef = EfectosLote()
+    ef.despues(hechos.append, "publicar")
+    ef.al_fallar(hechos.append, "devolver-1")
+    ef.al_fallar(hechos.append, "devolver-2")
+    ef.descartar()
+    assert hechos == ["devolver-2", "devolver-1"]
+
+    ef.despues(hechos.append, "a")
+    ef.despues(lambda: 1 / 0)           # un efecto que falla no corta los demás
+    ef.despues(hechos.append, "b")
+    ef.al_fallar(hechos.append, "no")
+    assert len(ef) == 3
+    ef.confirmar()
+    assert hechos[2:] == ["a", "b"]
+    ef.descartar()                      # lo de un lote ya confirmado no se deshace
+    assert hechos[2:] == ["a", "b"]
+
+    diferir(None, hechos.append, "ya")
+    assert hechos[-1] == "ya"
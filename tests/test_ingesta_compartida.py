@@ -0,0 +1,105 @@
+import json
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app.db.models import Lectura
+from app.servicios.ingesta import IngestaWriter, MensajeMQTT
+from app.servicios.ingesta_compartida import TrabajadorIngesta, particion
+
+from tests.conftest import en
+
+
+class Escritor:
+    """IngestaWriter de mentira: sólo anota lo encolado."""
+
+    def __init__(self):
+        self.encolados: list[tuple[str, str, datetime | None]] = []
+
+    def encolar(self, topic: str, esp_id: str, payload: str, recibido: datetime | None = None) -> bool:
+        self.encolados.append((esp_id, payload, recibido))
+        return True
+
+    def metricas(self) -> dict:
+        return {}
+
+
+def _esperar(condicion, timeout: float = 3.0) -> bool:
+    limite = time.monotonic() + timeout
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+def _esp_de(indice: int, procesos: int) -> str:
+    return next(e for e in (f"esp-{i:03d}" for i in range(100)) if particion(e, procesos) == indice)
+
+
+def _mensaje(esp_id: str, payload: str = "{}"):
+    return SimpleNamespace(topic=f"invernaderos/{esp_id}/telemetria", payload=payload.encode())
+
+
+@pytest.fixture
+def miembros(tmp_path):
+    """Dos miembros del grupo con su socket de reenvío, sin broker."""
+    ts = [TrabajadorIngesta(i, 2, directorio=str(tmp_path), writer=Escritor(),
+                            cliente_factory=lambda _: SimpleNamespace()) for i in range(2)]
+    for t in ts:
+        t._servir()
+    yield ts
+    for t in ts:
+        t._servidor.close()
+        for conn in t._pares.values():
+            conn.cerrar()
+
+
+def test_particion_estable():
+    esp_ids = [f"esp-{i:03d}" for i in range(200)]
+    duenos = [particion(e, 4) for e in esp_ids]
+    assert duenos == [particion(e, 4) for e in esp_ids]
+    assert set(duenos) == {0, 1, 2, 3}
+    assert all(particion(e, 1) == 0 for e in esp_ids)
+
+
+def test_cada_device_lo_escribe_su_dueno(miembros):
+    a, b = miembros
+    propio, ajeno = _esp_de(0, 2), _esp_de(1, 2)
+
+    antes = time.time()
+    a._on_message(None, None, _mensaje(propio, '{"n": 1}'))
+    a._on_message(None, None, _mensaje(ajeno, '{"n": 2}'))
+
+    assert a.writer.encolados == [(propio, '{"n": 1}', None)]
+    assert _esperar(lambda: b.writer.encolados)
+    esp_id, payload, recibido = b.writer.encolados[0]
+    # el dueño recibe la hora de llegada al broker, no la del reenvío
+    assert (esp_id, payload) == (ajeno, '{"n": 2}')
+    assert antes <= recibido.timestamp() <= time.time()
+    assert a.metricas()["reenviados"] == 1
+    assert _esperar(lambda: b.metricas()["recibidos_de_pares"] == 1)
+
+
+def test_sin_el_dueno_se_procesa_aca(miembros):
+    a, b = miembros
+    b._servidor.close()
+    b.ruta_socket(1).unlink()
+    a._on_message(None, None, _mensaje(_esp_de(1, 2)))
+    assert len(a.writer.encolados) == 1
+    assert a.metricas()["sin_dueno"] == 1
+
+
+def _telemetria(esp_id: str, recibido: datetime, temp: float) -> MensajeMQTT:
+    payload = {"temp_c": temp, "hum_amb": 20.0, "suelo_pct": 60.0, "nivel_pct": 50.0}
+    return MensajeMQTT(f"invernaderos/{esp_id}/telemetria", esp_id, json.dumps(payload), recibido, time.monotonic())
+
+
+@pytest.mark.parametrize("ordenar, esperado", [(True, [1.0, 2.0, 3.0]), (False, [2.0, 3.0, 1.0])])
+def test_orden_del_lote(Session, ordenar, esperado):
+    # el mensaje reenviado (el más viejo) entra a la cola después de los propios
+    lote = [_telemetria("esp-a", en(2), 2.0), _telemetria("esp-a", en(3), 3.0), _telemetria("esp-a", en(1), 1.0)]
+    IngestaWriter(session_factory=Session, ordenar=ordenar).procesar_lote(lote)
+    with Session() as db:
+        assert db.scalars(select(Lectura.temperatura).order_by(Lectura.id)).all() == esperado
@@ -0,0 +1,166 @@
+import gzip
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete
+
+from app.api.v1.lecturas import router
+from app.db.models import Lectura
+from app.servicios import funciones
+from app.servicios.devices import create_device
+
+
+def _agregar(Session, device_id: int, n: int, hace_min: int = 0) -> list[int]:
+    ahora = datetime.now(timezone.utc) - timedelta(minutes=hace_min)
+    with Session() as db:
+        filas = [Lectura(device_id=device_id, fecha_hora=ahora + timedelta(seconds=i), temperatura=20 + i,
+                         humedad=50, humedad_suelo=40, nivel_de_agua=80) for i in range(n)]
+        db.add_all(filas)
+        db.commit()
+        return [f.id for f in filas]
+
+
+@pytest.fixture
+def device_id(Session) -> int:
+    with Session() as db:
+        return create_device(db, "esp-a").id
+
+
+def test_since_id_devuelve_solo_lo_nuevo(api, Session, device_id):
+    c = api(router)
+    ids = _agregar(Session, device_id, 5)
+
+    todas = c.get("/api/v1/lecturas", params={"esp_id": "esp-a"}).json()
+    assert [l["id"] for l in todas] == ids[::-1]
+    assert todas[0]["fecha_hora"].endswith("Z")
+
+    nuevas = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "since_id": ids[2]}).json()
+    assert [l["id"] for l in nuevas] == [ids[3], ids[4]]
+    siguiente = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "since_id": ids[2], "limit": 1}).json()
+    assert [l["id"] for l in siguiente] == [ids[3]]
+    assert c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "since_id": ids[4]}).json() == []
+
+
+def test_since_id_pagina_sin_saltear(api, Session, device_id):
+    c = api(router)
+    primeras = _agregar(Session, device_id, 2, hace_min=5)
+    nuevas = _agregar(Session, device_id, 7)            # más que `limit` desde el último poll
+    vistas, cursor, paginas = [], primeras[-1], 0
+    while True:
+        pagina = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "since_id": cursor, "limit": 3}).json()
+        paginas += 1
+        vistas += [l["id"] for l in pagina]
+        if len(pagina) < 3:
+            break
+        cursor = pagina[-1]["id"]
+    assert vistas == nuevas and paginas == 3
+
+
+def test_since_ts_con_zona(api, Session, device_id):
+    c = api(router)
+    ids = _agregar(Session, device_id, 3, hace_min=10)
+    with Session() as db:
+        corte = db.get(Lectura, ids[0]).fecha_hora.replace(tzinfo=timezone.utc)
+    local = corte.astimezone(timezone(timedelta(hours=-3)))
+    for ts in (corte.replace(tzinfo=None), local):
+        r = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "since_ts": ts.isoformat()}).json()
+        assert [l["id"] for l in r] == [ids[2], ids[1]]
+
+
+def test_etag_304_hasta_que_cambian_las_lecturas(api, Session, device_id):
+    c = api(router)
+    ids = _agregar(Session, device_id, 3, hace_min=10)
+    params = {"esp_id": "esp-a", "since_id": ids[0]}
+
+    r = c.get("/api/v1/lecturas", params=params)
+    etag = r.headers["ETag"]
+    assert r.status_code == 200 and len(r.json()) == 2
+    r = c.get("/api/v1/lecturas", params=params, headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+
+    # una lectura nueva cambia el ETag
+    _agregar(Session, device_id, 1)
+    r = c.get("/api/v1/lecturas", params=params, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and len(r.json()) == 3
+    etag = r.headers["ETag"]
+
+    # borrar la más vieja (retención) también, aunque no haya nada nuevo
+    with Session() as db:
+        db.execute(delete(Lectura).where(Lectura.id == ids[0]))
+        db.commit()
+    r = c.get("/api/v1/lecturas", params=params, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
+
+
+def test_etag_depende_del_cursor(api, Session, device_id):
+    c = api(router)
+    _agregar(Session, device_id, 3)
+    a = c.get("/api/v1/lecturas", params={"esp_id": "esp-a"}).headers["ETag"]
+    b = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "limit": 2}).headers["ETag"]
+    assert a != b
+    r = c.get("/api/v1/lecturas", params={"esp_id": "esp-a", "limit": 2}, headers={"If-None-Match": a})
+    assert r.status_code == 200 and len(r.json()) == 2
+
+
+def test_device_desconocido(api, Session):
+    c = api(router)
+    r = c.get("/api/v1/lecturas", params={"esp_id": "no-existe"})
+    assert r.status_code == 200 and r.json() == [] and "ETag" not in r.headers
+
+
+def test_serie_con_zona(api, Session, device_id):
+    c = api(router)
+    _agregar(Session, device_id, 3, hace_min=30)
+    hasta = datetime.now(timezone.utc).replace(microsecond=0)
+    local = timezone(timedelta(hours=-3))
+    r = c.get("/api/v1/lecturas/series", params={
+        "esp_id": "esp-a", "resolution": "raw",
+        "desde": (hasta - timedelta(hours=1)).astimezone(local).isoformat(),
+        "hasta": hasta.astimezone(local).isoformat()}).json()
+    assert r["hasta"] == hasta.strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert len(r["puntos"]) == 3
+
+
+@pytest.fixture
+def csv_api(api, Session, monkeypatch):
+    """El CSV se lee con su propia sesión (SessionLectura), no con get_db_lectura."""
+    monkeypatch.setattr(funciones, "SessionLectura", Session)
+    return api(router)
+
+
+def test_csv_en_streaming_por_dia_local(csv_api, Session, device_id):
+    # Montevideo es UTC-3: el 2026-03-01 local va de 03:00 UTC a 02:59:59.999 UTC del 2
+    bordes = [datetime(2026, 3, 1, 2, 59, 59, tzinfo=timezone.utc),    # 28/02 23:59:59 local, afuera
+              datetime(2026, 3, 1, 3, 0, 0, tzinfo=timezone.utc),      # 01/03 00:00:00 local
+              datetime(2026, 3, 2, 2, 59, 59, tzinfo=timezone.utc),    # 01/03 23:59:59 local
+              datetime(2026, 3, 2, 3, 0, 0, tzinfo=timezone.utc)]      # 02/03 00:00:00 local, afuera
+    medio = [datetime(2026, 3, 1, 12, tzinfo=timezone.utc) + timedelta(minutes=i) for i in range(50)]
+    with Session() as db:
+        db.add_all(Lectura(device_id=device_id, fecha_hora=f, temperatura=21.25, humedad=55, humedad_suelo=40,
+                           nivel_de_agua=80) for f in bordes + medio)
+        db.commit()
+
+    params = {"esp_id": "esp-a", "desde": "2026-03-01", "hasta": "2026-03-01"}
+    r = csv_api.get("/api/v1/lecturas/csv", params=params)
+    assert r.status_code == 200
+    assert r.headers["content-disposition"] == 'attachment; filename="esp-a_2026-03-01_a_2026-03-01.csv"'
+    filas = r.content.decode("utf-8").splitlines()
+    assert filas[0] == ",".join(funciones.CSV_COLUMNAS)
+    assert len(filas) == 1 + 2 + 50
+    assert filas[1] == "2026-03-01 23:59:59,21.2 °C,40.0 %,55.0 %"     # más nueva primero
+    assert filas[-1].startswith("2026-03-01 00:00:00,")
+
+    # de a pocas filas por trozo sale el mismo CSV
+    assert "".join(funciones.csv_stream("esp-a", "2026-03-01", "2026-03-01", chunk=7)).encode() == r.content
+
+    with csv_api.stream("GET", "/api/v1/lecturas/csv", params={**params, "gzip": True}) as rz:
+        assert rz.headers["content-encoding"] == "gzip"
+        comprimido = b"".join(rz.iter_raw())
+    assert gzip.decompress(comprimido) == r.content
+
+
+def test_csv_rango_invalido_y_device_sin_lecturas(csv_api, device_id):
+    r = csv_api.get("/api/v1/lecturas/csv", params={"esp_id": "esp-a", "desde": "2026-03-02", "hasta": "2026-03-01"})
+    assert r.status_code == 400
+    r = csv_api.get("/api/v1/lecturas/csv", params={"esp_id": "esp-x", "desde": "2026-03-01", "hasta": "2026-03-01"})
+    assert r.text.splitlines() == [",".join(funciones.CSV_COLUMNAS)]
@@ -0,0 +1,147 @@
+from datetime import timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.db.models import Device, Evento
+from app.servicios.devices import create_device
+from app.servicios.eventos import diario
+from app.servicios.presencia import RastreadorPresencia
+
+from tests.conftest import en
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = en(0)
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def devices(Session) -> dict[str, int]:
+    with Session() as db:
+        return {e: create_device(db, e).id for e in ("esp-a", "esp-b", "esp-c", "esp-d")}
+
+
+@pytest.fixture
+def reloj() -> Reloj:
+    return Reloj()
+
+
+@pytest.fixture
+def rastreador(Session, reloj):
+    # barrido_s largo: las pruebas llaman a barrer() a mano con el reloj de mentira
+    r = RastreadorPresencia(session_factory=Session, flush_s=60, stale_s=120, offline_s=300, barrido_s=3600,
+                            reloj=reloj)
+    yield r
+    r.detener()
+
+
+def _transiciones(Session) -> list[tuple[str, str]]:
+    assert diario.vaciar()
+    with Session() as db:
+        return [(s, d) for s, d in db.execute(
+            select(Evento.subtipo, Evento.detalle).where(Evento.tipo == "status").order_by(Evento.id))]
+
+
+def _ultimo_contacto(Session, esp_id: str):
+    with Session() as db:
+        ts = db.scalar(select(Device.ultimo_contacto).where(Device.esp_id == esp_id))
+    return ts and ts.replace(tzinfo=timezone.utc)
+
+
+def test_escritura_espaciada(rastreador, devices):
+    r, a = rastreador, devices["esp-a"]
+    assert r.toca_escribir("esp-a", en(0))          # device nuevo
+    r.visto("esp-a", a, en(0))
+    assert r.toca_escribir("esp-a", en(0))          # todavía no se escribió nada
+    r.escrito("esp-a", en(0))
+    assert not r.toca_escribir("esp-a", en(30))
+    assert r.toca_escribir("esp-a", en(60))
+    r.escrito("esp-a", en(-10))                     # una confirmación vieja no lo atrasa
+    assert not r.toca_escribir("esp-a", en(59))
+    assert r.metricas()["escrituras"] == 1
+
+
+def test_transiciones_por_barrido(Session, rastreador, reloj, devices):
+    r, a = rastreador, devices["esp-a"]
+    r.visto("esp-a", a, en(0))
+    for segundo, estado in ((100, "online"), (130, "stale"), (290, "stale"), (310, "offline")):
+        reloj.ahora = en(segundo)
+        r.barrer()
+        assert r.estado("esp-a")["estado"] == estado
+    r.visto("esp-a", a, en(320))
+    assert r.estado("esp-a")["motivo"] == "contacto"
+    assert _transiciones(Session) == [("online", ""), ("stale", "online"), ("offline", "stale"),
+                                      ("online", "offline")]
+
+
+def test_barrido_escribe_el_contacto_pendiente(Session, rastreador, reloj, devices):
+    r, a = rastreador, devices["esp-a"]
+    r.visto("esp-a", a, en(0))
+    r.escrito("esp-a", en(0))                       # lo escribió el lote de la ingesta
+    r.visto("esp-a", a, en(30))                     # dentro de flush_s: sólo en memoria
+    reloj.ahora = en(40)
+    assert r.barrer()["escritos"] == 0              # todavía no pasó flush_s desde la escritura
+    reloj.ahora = en(70)
+    assert r.barrer()["escritos"] == 1
+    assert _ultimo_contacto(Session, "esp-a") == en(30)
+    assert not r.toca_escribir("esp-a", en(80))
+    assert r.barrer()["escritos"] == 0              # ya no queda nada pendiente
+
+
+def test_barrido_que_falla_reintenta(rastreador, reloj, devices, Session):
+    r, a = rastreador, devices["esp-a"]
+    r.visto("esp-a", a, en(0))
+    r.escrito("esp-a", en(0))
+    r.visto("esp-a", a, en(30))
+    reloj.ahora = en(70)
+
+    def rota():
+        raise RuntimeError("db caída")
+
+    r.session_factory = rota
+    assert r.barrer()["escritos"] == 0
+    r.session_factory = Session
+    assert r.barrer()["escritos"] == 1
+    assert _ultimo_contacto(Session, "esp-a") == en(30)
+
+
+def test_last_will(Session, rastreador, reloj, devices):
+    r, a = rastreador, devices["esp-a"]
+    r.status("esp-a", a, '"offline"', en(0))
+    assert r.estado("esp-a")["estado"] == "offline" and r.estado("esp-a")["visto"] is None
+    reloj.ahora = en(1000)
+    assert r.barrer()["transiciones"] == 0          # sin contacto no hay vencimientos que aplicar
+    r.status("esp-a", a, "online", en(1000))
+    assert r.estado("esp-a")["visto"] == en(1000)
+    assert _transiciones(Session) == [("offline", ""), ("online", "offline")]
+
+
+def test_restaurar_sin_eventos(Session, rastreador, reloj, devices):
+    with Session() as db:
+        for esp_id, segundo in (("esp-a", 0), ("esp-b", -200), ("esp-c", -1000)):
+            db.get(Device, devices[esp_id]).ultimo_contacto = en(segundo)
+        db.commit()
+    reloj.ahora = en(30)
+    r = rastreador
+    assert r.restaurar() == 3
+    assert {e: r.estado(e)["estado"] for e in ("esp-a", "esp-b", "esp-c")} == {
+        "esp-a": "online", "esp-b": "stale", "esp-c": "offline"}
+    assert r.estado("esp-a")["estimado"] and r.estado("esp-d")["estado"] == "offline"
+    assert _transiciones(Session) == []
+    # restaurado: ultimo_contacto puede estar atrasado hasta flush_s
+    reloj.ahora = en(170)
+    r.barrer()
+    assert r.estado("esp-a")["estado"] == "online"
+
+
+def test_restaurar_con_filtro(Session, rastreador, devices):
+    with Session() as db:
+        for d in db.scalars(select(Device)):
+            d.ultimo_contacto = en(0)
+        db.commit()
+    assert rastreador.restaurar(filtro=lambda e: e in ("esp-a", "esp-c")) == 2
+    assert rastreador.metricas()["devices"]["online"] == 2
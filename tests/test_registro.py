@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import event
+
+from app.api.v1.config import router
+from app.servicios.devices import create_device
+from app.servicios.registro import EstadoMecanismos, registro
+
+
+@pytest.fixture
+def consultas(engine) -> list[str]:
+    """Sentencias SQL que llegan a la DB de la prueba."""
+    sql: list[str] = []
+
+    def anotar(conn, cursor, statement, *args):
+        sql.append(statement)
+
+    event.listen(engine, "before_cursor_execute", anotar)
+    yield sql
+    event.remove(engine, "before_cursor_execute", anotar)
+
+
+@pytest.fixture
+def device(Session):
+    with Session() as db:
+        create_device(db, "esp-a")
+
+
+def _obtener(Session, esp_id="esp-a"):
+    with Session() as db:
+        return registro.obtener(db, esp_id)
+
+
+def test_hit_sin_consultas(Session, device, consultas):
+    antes = registro.metricas()                         # los contadores son del proceso: se miran diferencias
+    primera = _obtener(Session)
+    assert consultas and registro.metricas()["misses"] == antes["misses"] + 1
+    consultas.clear()
+    assert _obtener(Session) is primera
+    assert consultas == []
+    m = registro.metricas()
+    assert (m["hits"] - antes["hits"], m["misses"] - antes["misses"], m["entradas"]) == (1, 1, 1)
+
+
+def test_put_config_invalida_y_el_siguiente_obtener_la_cachea(Session, device, consultas, api):
+    assert _obtener(Session).config.temperatura != 31
+    antes = registro.metricas()
+
+    r = api(router).put("/api/v1/config", json={"esp_id": "esp-a", "temperatura": 31})
+    assert r.status_code == 200, r.text
+    m = registro.metricas()
+    assert m["invalidaciones"] > antes["invalidaciones"]
+    assert m["entradas"] == 0
+
+    assert _obtener(Session).config.temperatura == 31     # miss: vuelve a la DB
+    assert registro.metricas()["misses"] == m["misses"] + 1
+    consultas.clear()
+    assert _obtener(Session).config.temperatura == 31     # hit: sin tocar la DB
+    assert consultas == []
+    fin = registro.metricas()
+    assert fin["hits"] == m["hits"] + 1 and fin["misses"] == m["misses"] + 1
+
+
+@pytest.mark.parametrize("cambio", [lambda: registro.invalidar("esp-a"), registro.limpiar],
+                         ids=["generacion", "epoca"])
+def test_invalidar_durante_la_carga_no_cachea_lo_viejo(Session, device, engine, cambio):
+    pendiente = [cambio]
+
+    def a_mitad(conn, cursor, statement, *args):
+        if "FROM config" in statement and pendiente:
+            pendiente.pop()()
+
+    event.listen(engine, "before_cursor_execute", a_mitad)
+    assert _obtener(Session) is not None
+    event.remove(engine, "before_cursor_execute", a_mitad)
+    assert registro.metricas()["entradas"] == 0
+    _obtener(Session)
+    assert registro.metricas()["entradas"] == 1
+
+
+def test_el_device_nuevo_no_se_cachea_hasta_el_commit(Session):
+    with Session() as db:
+        assert registro.obtener(db, "esp-nuevo").device_id is not None
+        db.rollback()
+    assert registro.metricas()["entradas"] == 0
+    with Session() as db:
+        assert registro.obtener(db, "esp-nuevo", crear=False) is None
+
+
+def test_al_cambiar_recibe_cada_cambio_local(Session, device, monkeypatch):
+    cambios = []
+    monkeypatch.setattr(registro, "al_cambiar", lambda op, esp_id, estado: cambios.append((op, esp_id, estado)))
+    mech = _obtener(Session).mecanismos
+    estado = EstadoMecanismos(mech.id, True, False, True)
+
+    registro.actualizar_mecanismos("esp-a", estado)
+    assert registro.mecanismos("esp-a") == estado
+    registro.invalidar("esp-a")
+    registro.limpiar()
+    assert cambios == [("mecanismos", "esp-a", estado), ("invalidar", "esp-a", None), ("limpiar", None, None)]
+
+    # lo que llega de otro proceso se aplica sin volver a propagarse
+    _obtener(Session)
+    registro.actualizar_mecanismos("esp-a", EstadoMecanismos(mech.id, False, False, False), propagar=False)
+    registro.invalidar("esp-a", propagar=False)
+    registro.limpiar(propagar=False)
+    assert len(cambios) == 3
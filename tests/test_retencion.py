@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core.config import config
+from app.db.models import Evento, Lectura, LecturaRollup
+from app.servicios.devices import create_device
+from app.servicios.retencion import MotorRetencion
+
+
+def _hace(dias: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=dias)
+
+
+def _rollup(device_id: int, resolucion: int, bucket: datetime) -> LecturaRollup:
+    v = dict.fromkeys([f"{p}_{s}" for p in ("temp", "hum", "suelo", "agua") for s in ("min", "max", "sum")], 1.0)
+    return LecturaRollup(device_id=device_id, resolucion=resolucion, bucket=bucket, n=1, **v)
+
+
+@pytest.fixture
+def datos(Session):
+    """Lecturas, eventos y rollups de 1m/1h/1d con 1, 60 y 400 días de antigüedad."""
+    with Session() as db:
+        dev = create_device(db, "esp-a").id
+        for dias in (1, 60, 400):
+            db.add(Lectura(device_id=dev, fecha_hora=_hace(dias), temperatura=20, humedad=50,
+                           humedad_suelo=40, nivel_de_agua=80))
+            db.add(Evento(device_id=dev, fecha_hora=_hace(dias), tipo="manual", subtipo="riego",
+                          detalle="ON", mensaje="riego ON"))
+            for res in (60, 3600, 86400):
+                db.add(_rollup(dev, res, _hace(dias)))
+        db.commit()
+
+
+def _contar(Session, stmt) -> int:
+    with Session() as db:
+        return db.scalar(stmt)
+
+
+def _rollups(Session, resolucion: int) -> int:
+    return _contar(Session, select(func.count()).select_from(LecturaRollup)
+                   .where(LecturaRollup.resolucion == resolucion))
+
+
+def test_politica_por_defecto(Session, datos):
+    resumen = MotorRetencion(session_factory=Session, pausa_s=0).ejecutar()
+
+    # lecturas crudas y rollups diarios: para siempre; eventos a los 90 días; 1m a los 30; 1h al año
+    assert "lecturas" not in resumen["filas"]
+    assert resumen["filas"] == {"eventos": 1, "rollup_1m": 2, "rollup_1h": 1}
+    assert _contar(Session, select(func.count(Lectura.id))) == 3
+    assert _contar(Session, select(func.count(Evento.id))) == 2
+    assert (_rollups(Session, 60), _rollups(Session, 3600), _rollups(Session, 86400)) == (1, 2, 3)
+    assert resumen["vacuum_incremental"] is True    # la DB nueva se creó con auto_vacuum=INCREMENTAL
+
+
+def test_borra_en_chunks_y_acumula(Session, datos, monkeypatch):
+    monkeypatch.setattr(config, "retencion_lecturas_dias", 7)
+    with Session() as db:
+        dev = db.scalar(select(Lectura.device_id))
+        db.add_all([Lectura(device_id=dev, fecha_hora=_hace(10 + i), temperatura=20, humedad=50,
+                            humedad_suelo=40, nivel_de_agua=80) for i in range(10)])
+        db.commit()
+    motor = MotorRetencion(session_factory=Session, chunk=3, pausa_s=0)
+
+    assert motor.ejecutar()["filas"]["lecturas"] == 12
+    assert _contar(Session, select(func.count(Lectura.id))) == 1
+    assert motor.ejecutar()["filas"]["lecturas"] == 0
+    m = motor.metricas()
+    assert m["pasadas"] == 2
+    assert m["filas_borradas"]["lecturas"] == 12
+    assert m["politica_dias"]["lecturas"] == 7
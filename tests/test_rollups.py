@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.api.v1.lecturas import router
+from app.core.config import config
+from app.db.models import Lectura, LecturaRollup
+from app.servicios.devices import create_device
+from app.servicios.rollups import (RESOLUCIONES, acumular_lecturas, backfill, elegir_resolucion, rango_sin_rollups,
+                                   recompactar)
+
+from tests.conftest import T0, en
+
+
+@pytest.fixture
+def device_id(Session) -> int:
+    with Session() as db:
+        return create_device(db, "esp-a").id
+
+
+def _lote(Session, device_id: int, filas: list[tuple[float, float]], rollups: bool = True):
+    """(segundo, temperatura) en una transacción, con sus rollups como en la ingesta."""
+    with Session() as db:
+        lecturas = [Lectura(device_id=device_id, fecha_hora=en(s), temperatura=t, humedad=50, humedad_suelo=40,
+                            nivel_de_agua=80) for s, t in filas]
+        db.add_all(lecturas)
+        db.flush()
+        if rollups:
+            acumular_lecturas(db, lecturas)
+        db.commit()
+
+
+def _rollups(Session) -> dict[tuple[str, int], tuple]:
+    """(resolución, segundos desde T0 del bucket) -> (n, min, max, promedio) de temperatura."""
+    nombres = {v: k for k, v in RESOLUCIONES.items()}
+    with Session() as db:
+        return {(nombres[r.resolucion], int((r.bucket.replace(tzinfo=T0.tzinfo) - T0).total_seconds())):
+                (r.n, r.temp_min, r.temp_max, round(r.temp_sum / r.n, 6))
+                for r in db.scalars(select(LecturaRollup))}
+
+
+def test_agregados_por_resolucion(Session, device_id):
+    # T0 es 12:00 UTC: el bucket diario empieza 12 h antes
+    _lote(Session, device_id, [(0, 20.0), (30, 22.0), (90, 18.0)])
+    _lote(Session, device_id, [(45, 30.0), (3600, 10.0)])      # otro lote suma al mismo bucket
+    assert _rollups(Session) == {
+        ("1m", 0): (3, 20.0, 30.0, 24.0),
+        ("1m", 60): (1, 18.0, 18.0, 18.0),
+        ("1m", 3600): (1, 10.0, 10.0, 10.0),
+        ("1h", 0): (4, 18.0, 30.0, 22.5),
+        ("1h", 3600): (1, 10.0, 10.0, 10.0),
+        ("1d", -12 * 3600): (5, 10.0, 30.0, 20.0),
+    }
+
+
+def test_recompactar_da_lo_mismo(Session, device_id):
+    _lote(Session, device_id, [(0, 20.0), (30, 22.0), (90, 18.0)])
+    _lote(Session, device_id, [(45, 30.0), (3600, 10.0)])
+    incremental = _rollups(Session)
+    with Session() as db:
+        db.execute(delete(Lectura).where(Lectura.temperatura == 30.0))   # p. ej. una lectura corregida
+        db.commit()
+        assert recompactar(db, en(0), en(7200)) == 4
+    despues = _rollups(Session)
+    assert despues[("1m", 0)] == (2, 20.0, 22.0, 21.0)
+    assert despues[("1d", -12 * 3600)] == (4, 10.0, 22.0, 17.5)
+    assert set(despues) == set(incremental)
+
+
+def test_backfill_aunque_la_ingesta_llegue_primero(Session, device_id):
+    dia = 86400
+    _lote(Session, device_id, [(-3 * dia, 15.0), (-dia, 16.0), (-60, 17.0)], rollups=False)   # historia previa
+    with Session() as db:
+        assert rango_sin_rollups(db) == (en(-3 * dia), en(-60) + timedelta(seconds=1))
+    _lote(Session, device_id, [(0, 20.0)])          # telemetría que llegó antes que el backfill
+    with Session() as db:
+        rango = rango_sin_rollups(db)
+    # hasta el final del día del primer rollup: sus lecturas previas al arranque también
+    assert rango == (en(-3 * dia), en(-12 * 3600 + dia))
+    assert backfill(rango, Session) == 4
+    diarios = {k: v for k, v in _rollups(Session).items() if k[0] == "1d"}
+    assert [v[0] for _, v in sorted(diarios.items())] == [1, 1, 2]
+    with Session() as db:
+        assert rango_sin_rollups(db) is None
+
+
+@pytest.mark.parametrize("horas, ancho, esperada", [
+    (1, 360, "raw"), (6, 360, "1m"), (24 * 30, 360, "1h"), (24 * 365, 360, "1d"), (24 * 365, 10000, "1m"),
+])
+def test_elegir_resolucion(horas, ancho, esperada):
+    assert elegir_resolucion(en(0), en(horas * 3600), ancho) == esperada
+
+
+def _serie(c, desde: float, hasta: float, **params):
+    return c.get("/api/v1/lecturas/series", params={"esp_id": "esp-a", "desde": en(desde).isoformat(),
+                                                    "hasta": en(hasta).isoformat(), **params})
+
+
+def test_serie_elige_la_resolucion_por_el_rango(api, Session, device_id):
+    _lote(Session, device_id, [(s, 20.0 + s / 60) for s in range(0, 3 * 3600, 30)])
+    c = api(router)
+    r = _serie(c, 0, 600, width=100).json()          # 10 min: menos de 100 minutos, crudo
+    assert r["resolucion"] == "raw" and len(r["puntos"]) == 21
+    r = _serie(c, 0, 3 * 3600, width=100).json()     # 3 h en 1m ya dan 100 puntos
+    assert r["resolucion"] == "1m" and len(r["puntos"]) == 180
+    p = r["puntos"][1]
+    assert (p["n"], p["temperatura_min"], p["temperatura_max"], p["temperatura"]) == (2, 21.0, 21.5, 21.25)
+    r = _serie(c, 0, 3 * 3600, resolution="1h").json()
+    assert [p["n"] for p in r["puntos"]] == [120, 120, 120]
+
+
+def test_serie_cruda_con_tope(api, Session, device_id, monkeypatch):
+    monkeypatch.setattr(config, "serie_max_crudas", 10)
+    _lote(Session, device_id, [(s, 20.0) for s in range(0, 600, 30)])
+    c = api(router)
+    r = _serie(c, 0, 600, resolution="raw")
+    assert r.status_code == 400 and "10 lecturas" in r.json()["detail"]
+    r = _serie(c, 0, 600, width=100).json()          # auto: pasa a 1m en vez de cortar la serie
+    assert r["resolucion"] == "1m" and sum(p["n"] for p in r["puntos"]) == 20
+    assert _serie(c, 0, 240, resolution="raw").json()["resolucion"] == "raw"
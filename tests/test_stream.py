@@ -0,0 +1,88 @@
+import asyncio
+import json
+import threading
+
+from app.servicios.stream import HubTelemetria
+
+
+def _correr(prueba):
+    """Corre `prueba(hub)` en un event loop propio, como una conexión SSE."""
+    return asyncio.run(prueba(HubTelemetria()))
+
+
+def _valores(eventos: list[tuple[str, str]]) -> list[int]:
+    return [json.loads(data)["n"] for _, data in eventos]
+
+
+def test_cliente_lento_conserva_los_mas_nuevos():
+    async def prueba(hub):
+        lento = hub.suscribir(maxlen=4)
+        rapido = hub.suscribir(maxlen=100)
+        for n in range(10):
+            hub.publicar("esp-a", "lectura", {"n": n})
+
+        assert _valores(await lento.siguiente(timeout=1)) == [6, 7, 8, 9]
+        assert lento.descartados == 6
+        assert _valores(await rapido.siguiente(timeout=1)) == list(range(10))
+        assert rapido.descartados == 0
+        m = hub.metricas()
+        assert (m["publicados"], m["entregados"], m["descartados"], m["clientes"]) == (10, 20, 6, 2)
+
+        # ya vaciado, vuelve a juntar hasta su tope
+        hub.publicar("esp-a", "lectura", {"n": 10})
+        assert _valores(await lento.siguiente(timeout=1)) == [10]
+        assert lento.descartados == 6
+
+    _correr(prueba)
+
+
+def test_suscribir_filtrar_y_desuscribir():
+    async def prueba(hub):
+        todos = hub.suscribir()
+        solo_b = hub.suscribir("esp-b")
+        hub.publicar("esp-a", "lectura", {"n": 1})
+        hub.publicar("esp-b", "mecanismos", {"n": 2})
+        assert await todos.siguiente(timeout=1) == [("lectura", '{"n":1}'), ("mecanismos", '{"n":2}')]
+        assert await solo_b.siguiente(timeout=1) == [("mecanismos", '{"n":2}')]
+        assert await solo_b.siguiente(timeout=0.01) == []        # sin eventos: vence el timeout
+
+        hub.desuscribir(solo_b)
+        hub.desuscribir(solo_b)                                  # dos veces no rompe nada
+        assert hub.metricas()["clientes"] == 1
+        hub.publicar("esp-b", "lectura", {"n": 3})
+        assert not solo_b.buffer
+        assert _valores(await todos.siguiente(timeout=1)) == [3]
+
+        hub.desuscribir(todos)
+        assert hub.metricas()["clientes"] == 0
+        hub.publicar("esp-a", "lectura", {"n": 4})
+        assert hub.metricas()["entregados"] == 4
+
+    _correr(prueba)
+
+
+def test_publicar_desde_otro_hilo_despierta_al_cliente():
+    async def prueba(hub):
+        s = hub.suscribir("esp-a")
+        hilo = threading.Timer(0.05, hub.publicar, args=("esp-a", "lectura", {"n": 1}))
+        hilo.start()
+        try:
+            assert _valores(await s.siguiente(timeout=5)) == [1]
+        finally:
+            hilo.join()
+
+    _correr(prueba)
+
+
+def test_al_publicar_reenvia_lo_local_y_difundir_no():
+    reenviados = []
+
+    async def prueba(hub):
+        hub.al_publicar = lambda esp_id, tipo, data: reenviados.append((esp_id, tipo, data))
+        s = hub.suscribir()
+        hub.publicar("esp-a", "lectura", {"n": 1})
+        hub.difundir("esp-b", "lectura", '{"n":2}')              # llegó de otro proceso
+        assert _valores(await s.siguiente(timeout=1)) == [1, 2]
+
+    _correr(prueba)
+    assert reenviados == [("esp-a", "lectura", '{"n":1}')]
@@ -0,0 +1,78 @@
+import io
+import json
+from datetime import timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.api.v1.lecturas import router
+from app.db.models import Device, Lectura
+from app.servicios.devices import create_device
+from app.servicios import transferencia
+from app.servicios.transferencia import importar_lecturas
+
+from tests.conftest import en
+
+
+def _ndjson(*filas: dict) -> io.BytesIO:
+    return io.BytesIO("".join(json.dumps(f) + "\n" for f in filas).encode())
+
+
+def _fila(fecha_hora: str, temperatura: float = 20.0) -> dict:
+    return {"fecha_hora": fecha_hora, "temperatura": temperatura, "humedad": 50.0, "humedad_suelo": 40.0,
+            "nivel_de_agua": 80.0}
+
+
+@pytest.fixture
+def device(Session, monkeypatch):
+    """esp-a registrado; /import y /export con las sesiones de la prueba."""
+    monkeypatch.setattr(transferencia, "SessionLocal", Session)
+    monkeypatch.setattr(transferencia, "SessionLectura", Session)
+    with Session() as db:
+        create_device(db, "esp-a")
+
+
+def test_importar_con_zona_guarda_utc(Session, device):
+    f = _ndjson(_fila("2026-03-01T09:00:00-03:00"), _fila("2026-03-01T12:01:00"), _fila("2026-03-01T12:02:00Z"))
+    r = importar_lecturas(f, "esp-a", "ndjson", session_factory=Session)
+    assert (r["filas"], r["desde"], r["hasta"]) == (3, en(0), en(120))
+    with Session() as db:
+        guardadas = db.scalars(select(Lectura.fecha_hora).order_by(Lectura.id)).all()
+    assert [t.replace(tzinfo=timezone.utc) for t in guardadas] == [en(0), en(60), en(120)]
+
+
+def test_importar_corta_en_un_valor_no_finito(Session, device):
+    f = _ndjson(_fila("2026-03-01T12:00:00"), _fila("2026-03-01T12:01:00", float("nan")))
+    with pytest.raises(ValueError, match="temperatura no finito"):
+        importar_lecturas(f, "esp-a", "ndjson", session_factory=Session, lote=1)
+    with Session() as db:
+        assert len(db.scalars(select(Lectura.id)).all()) == 1
+
+
+def test_importar_a_un_device_desconocido(api, Session, device):
+    r = api(router).post("/api/v1/lecturas/import", params={"esp_id": "esp-aa", "format": "ndjson"},
+                         content=_ndjson(_fila("2026-03-01T12:00:00")).getvalue())
+    assert r.status_code == 404
+    with Session() as db:
+        assert db.scalars(select(Device.esp_id)).all() == ["esp-a"]
+        assert db.scalars(select(Lectura.id)).all() == []
+
+
+@pytest.mark.parametrize("formato", ["parquet", "arrow"])
+def test_exportar_e_importar_columnar(api, Session, device, formato):
+    pytest.importorskip("pyarrow")
+    c = api(router)
+    filas = [_fila(f"2026-03-01T12:0{i}:00Z", 20.0 + i) for i in range(3)]
+    assert c.post("/api/v1/lecturas/import", params={"esp_id": "esp-a", "format": "ndjson"},
+                  content=_ndjson(*filas).getvalue()).status_code == 201
+    with Session() as db:
+        create_device(db, "esp-b")
+    r = c.get("/api/v1/lecturas/export", params={"esp_id": "esp-a", "desde": "2026-03-01", "hasta": "2026-03-01",
+                                                 "format": formato})
+    assert r.status_code == 200
+    r = c.post("/api/v1/lecturas/import", params={"esp_id": "esp-b", "format": formato}, content=r.content)
+    assert r.status_code == 201 and r.json()["filas"] == 3
+    with Session() as db:
+        copia = db.execute(select(Lectura.fecha_hora, Lectura.temperatura).join(Device)
+                           .where(Device.esp_id == "esp-b").order_by(Lectura.fecha_hora)).all()
+    assert [(f.replace(tzinfo=timezone.utc), t) for f, t in copia] == [(en(60 * i), 20.0 + i) for i in range(3)]